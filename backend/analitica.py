@@ -0,0 +1,514 @@
+"""
+Motore analitico colonnare in memoria per le statistiche sulle transazioni.
+
+Invece di rieseguire GROUP BY su 'transazioni' ad ogni richiesta, il motore
+tiene in memoria dei cubi giornalieri: array NumPy ordinati per giorno con
+totali e conteggi di entrate e uscite. Il cubo completo ha una riga per
+ogni (giorno, conto, categoria); accanto ci sono i suoi riepiloghi per
+(giorno, conto), (giorno, categoria) e per solo giorno, e ogni
+interrogazione usa il più piccolo che contiene le dimensioni richieste.
+
+Un intervallo di date è una fetta contigua degli array (trovata con una
+ricerca binaria) e i raggruppamenti per giorno, settimana, mese o anno sono
+operazioni vettoriali: il costo dipende dal numero di righe del cubo nel
+periodo, non dal numero di transazioni.
+
+I cubi vengono caricati al primo uso con una sola query aggregata e poi
+tenuti aggiornati in modo incrementale all'inizio di ogni interrogazione,
+leggendo nella stessa transazione (quindi dallo stesso snapshot):
+- le transazioni nuove, per id (AUTOINCREMENT, quindi sempre crescente);
+- le eliminazioni e modifiche registrate dai trigger in 'rettifiche_analisi',
+  per numero progressivo.
+Tutto passa dal database, qualunque processo o percorso abbia scritto (API,
+import, investimenti, script): ogni processo del server ha i propri cubi e
+li tiene allineati da solo. Le rettifiche più vecchie di un giorno vengono
+eliminate; un cubo rimasto indietro oltre quel limite viene ricaricato.
+
+Gli importi restano in centesimi interi fino alla risposta.
+"""
+import threading
+from datetime import date
+
+import numpy as np
+
+import queries
+
+PERIODI = ('giorno', 'settimana', 'mese', 'anno')
+
+# Dimensioni oltre al giorno; i cubi ne contengono un sottoinsieme
+DIMENSIONI = ('conto', 'categoria')
+
+# Limite ai periodi di una risposta (es. 20 anni giorno per giorno sono troppi)
+MAX_PERIODI = 5000
+
+PERCENTILI = (50, 90, 99)
+
+EPOCA = date(1970, 1, 1)
+
+# La chiave di una riga impacchetta giorno, conto e categoria in un intero
+# a 64 bit; il giorno occupa i bit alti, quindi l'ordine delle chiavi è
+# anche l'ordine per giorno. Limiti: conto_id < 2^22, categorie < 2^20
+_BIT_GIORNO = 42
+_BIT_CONTO = 20
+_MASCHERA_CONTO = (1 << (_BIT_GIORNO - _BIT_CONTO)) - 1
+_MASCHERA_CATEGORIA = (1 << _BIT_CONTO) - 1
+
+# Colonne di un cubo: le prime cinque identificano la riga, le altre sono i totali
+COLONNE = {
+    'chiave': np.int64,
+    'giorno': np.int32,
+    'mese': np.int32,
+    'conto': np.int32,
+    'categoria': np.int32,
+    'entrate': np.int64,
+    'uscite': np.int64,
+    'n_entrate': np.int64,
+    'n_uscite': np.int64,
+}
+TOTALI = ('entrate', 'uscite', 'n_entrate', 'n_uscite')
+
+
+def giorno_da_data(valore):
+    """Numero di giorni dal 1970-01-01 di una data"""
+    return (valore - EPOCA).days
+
+
+def _mesi(giorni):
+    """Mesi dal gennaio 1970 dei giorni indicati (array)"""
+    return np.asarray(giorni).astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+
+
+def _periodi(giorni, mesi, periodo):
+    """Indice del periodo (giorno, settimana, mese o anno) di ogni riga"""
+    if periodo == 'giorno':
+        return giorni.astype(np.int64)
+    if periodo == 'settimana':
+        # Il 1970-01-01 è un giovedì: +3 fa iniziare le settimane di lunedì
+        return (giorni.astype(np.int64) + 3) // 7
+    if periodo == 'mese':
+        return mesi.astype(np.int64)
+    return mesi.astype(np.int64) // 12
+
+
+def _etichette(primo, ultimo, periodo):
+    """Etichette leggibili dei periodi da 'primo' a 'ultimo' inclusi"""
+    indici = np.arange(primo, ultimo + 1)
+    if periodo == 'giorno':
+        return indici.astype('datetime64[D]').astype(str).tolist()
+    if periodo == 'settimana':
+        # Data del lunedì che apre la settimana
+        return (indici * 7 - 3).astype('datetime64[D]').astype(str).tolist()
+    if periodo == 'mese':
+        return indici.astype('datetime64[M]').astype(str).tolist()
+    return (indici + 1970).astype(str).tolist()
+
+
+def _somma(valori, gruppi, lunghezza):
+    """
+    Somma dei valori per gruppo. bincount lavora in float64, che rappresenta
+    esattamente gli interi fino a 2^53: somme di centesimi molto oltre ogni
+    totale realistico, quindi il ritorno a interi non perde nulla.
+    """
+    return np.rint(np.bincount(gruppi, weights=valori, minlength=lunghezza)).astype(np.int64)
+
+
+def _media_mobile(valori, finestra):
+    """Media degli ultimi 'finestra' valori (meno all'inizio della serie)"""
+    cumulata = np.concatenate(([0], np.cumsum(valori)))
+    fine = np.arange(1, len(valori) + 1)
+    inizio = np.maximum(fine - finestra, 0)
+    return (cumulata[fine] - cumulata[inizio]) / (fine - inizio)
+
+
+def _euro(valori):
+    """Array di centesimi -> lista di euro, arrotondati al centesimo"""
+    return np.round(np.asarray(valori) / 100, 2).tolist()
+
+
+def _distribuzione(valori):
+    """Media e percentili (in euro) dei totali per periodo"""
+    if len(valori) == 0:
+        return {'media': 0.0, **{f'p{p}': 0.0 for p in PERCENTILI}}
+    percentili = np.percentile(valori, PERCENTILI)
+    return {
+        'media': round(float(np.mean(valori)) / 100, 2),
+        **{f'p{p}': round(float(v) / 100, 2) for p, v in zip(PERCENTILI, percentili)}
+    }
+
+
+def _ripartizione(sel, codici, lunghezza):
+    """
+    Totali per codice (categoria o conto) delle righe selezionate: restituisce
+    i codici con transazioni, dalla spesa maggiore, e i relativi totali
+    """
+    totali = {
+        'entrate': _somma(sel['entrate'], codici, lunghezza),
+        'uscite': -_somma(sel['uscite'], codici, lunghezza),
+        'count': _somma(sel['n_entrate'] + sel['n_uscite'], codici, lunghezza),
+    }
+    indici = np.flatnonzero(totali['count'])
+    indici = indici[np.argsort(-totali['uscite'][indici], kind='stable')]
+    return indici, {nome: valori[indici] for nome, valori in totali.items()}
+
+
+class _Cubo:
+    """Totali giornalieri per le dimensioni indicate (sottoinsieme di DIMENSIONI)"""
+
+    def __init__(self, dimensioni):
+        self.dimensioni = dimensioni
+        self.colonne = {nome: np.empty(0, dtype=tipo) for nome, tipo in COLONNE.items()}
+
+    def applica(self, giorni, conti, categorie, variazioni):
+        """
+        Somma le variazioni per transazione (array di TOTALI) alle righe del cubo.
+        Le combinazioni già presenti vengono aggiornate sul posto, quelle
+        nuove inserite nella posizione che mantiene l'ordine delle chiavi.
+        """
+        chiavi = giorni << _BIT_GIORNO
+        if 'conto' in self.dimensioni:
+            chiavi = chiavi | (conti << _BIT_CONTO)
+        if 'categoria' in self.dimensioni:
+            chiavi = chiavi | categorie
+        uniche, gruppi = np.unique(chiavi, return_inverse=True)
+        totali = {nome: _somma(valori, gruppi, len(uniche)) for nome, valori in variazioni.items()}
+
+        colonne = self.colonne
+        posizioni = np.searchsorted(colonne['chiave'], uniche)
+        presenti = posizioni < len(colonne['chiave'])
+        presenti[presenti] = colonne['chiave'][posizioni[presenti]] == uniche[presenti]
+
+        # Le chiavi sono uniche, quindi l'indicizzazione non ripete posizioni
+        for nome in TOTALI:
+            colonne[nome][posizioni[presenti]] += totali[nome][presenti]
+
+        nuove = ~presenti
+        if nuove.any():
+            chiavi_nuove = uniche[nuove]
+            giorni_nuovi = chiavi_nuove >> _BIT_GIORNO
+            valori = {
+                'chiave': chiavi_nuove,
+                'giorno': giorni_nuovi,
+                'mese': _mesi(giorni_nuovi),
+                'conto': (chiavi_nuove >> _BIT_CONTO) & _MASCHERA_CONTO,
+                'categoria': chiavi_nuove & _MASCHERA_CATEGORIA,
+                **{nome: totali[nome][nuove] for nome in TOTALI},
+            }
+            # Un solo np.insert per colonna: O(righe del cubo) per lotto
+            for nome in COLONNE:
+                colonne[nome] = np.insert(colonne[nome], posizioni[nuove], valori[nome])
+
+    def selezione(self, da, a, conto_id=None, codice_categoria=None):
+        """Righe tra i giorni 'da' e 'a' inclusi, filtrate per conto e categoria"""
+        colonne = self.colonne
+        inizio = np.searchsorted(colonne['chiave'], da << _BIT_GIORNO)
+        fine = np.searchsorted(colonne['chiave'], (a + 1) << _BIT_GIORNO)
+        selezione = {nome: valori[inizio:fine] for nome, valori in colonne.items()}
+
+        maschera = None
+        if conto_id is not None:
+            maschera = selezione['conto'] == conto_id
+        if codice_categoria is not None:
+            uguale = selezione['categoria'] == codice_categoria
+            maschera = uguale if maschera is None else maschera & uguale
+        if maschera is not None:
+            selezione = {nome: valori[maschera] for nome, valori in selezione.items()}
+        return selezione
+
+
+class MotoreAnalitico:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._categorie = []
+        self._codici = {}
+        self._cubi = self._nuovi_cubi()
+        # None finché i cubi non sono stati caricati
+        self._ultimo_id = None
+        self._ultima_rettifica = 0
+
+    @staticmethod
+    def _nuovi_cubi():
+        return {
+            dimensioni: _Cubo(dimensioni)
+            for dimensioni in ((), ('conto',), ('categoria',), DIMENSIONI)
+        }
+
+    def _cubo(self, *dimensioni):
+        """Il cubo più piccolo che contiene le dimensioni indicate"""
+        return self._cubi[tuple(d for d in DIMENSIONI if d in dimensioni)]
+
+    def _codice(self, categoria):
+        """Codice intero della categoria (assegnato al primo incontro)"""
+        codice = self._codici.get(categoria)
+        if codice is None:
+            codice = self._codici[categoria] = len(self._categorie)
+            self._categorie.append(categoria)
+        return codice
+
+    def sincronizza(self, conn):
+        """
+        Porta i cubi allo stato del database: al primo uso li carica con
+        una query aggregata, poi applica solo le transazioni con id nuovo e
+        le rettifiche successive all'ultima applicata.
+        """
+        with self.lock:
+            # Le letture devono vedere lo stesso snapshot: se il chiamante non
+            # ha già aperto una transazione la apre qui (solo lettura)
+            propria = not conn.in_transaction
+            if propria:
+                conn.execute('BEGIN')
+            try:
+                self._sincronizza(conn)
+            finally:
+                if propria:
+                    conn.rollback()
+
+    def _sincronizza(self, conn):
+        ultima, prima = conn.execute(queries.ANALISI_ULTIMA_RETTIFICA).fetchone()
+        if (self._ultimo_id is not None and ultima > self._ultima_rettifica
+                and (prima is None or prima > self._ultima_rettifica + 1)):
+            # Rettifiche già eliminate prima che questo processo le leggesse
+            self._ultimo_id = None
+
+        if self._ultimo_id is None:
+            ultimo, = conn.execute('SELECT COALESCE(MAX(id), 0) FROM transazioni').fetchone()
+            self._cubi = self._nuovi_cubi()
+            self._applica(conn.execute(queries.ANALISI_CUBO, (ultimo,)).fetchall())
+            self._ultimo_id = ultimo
+            self._ultima_rettifica = ultima
+            return
+
+        # Le rettifiche di transazioni non ancora lette (id nuovo) sono già
+        # comprese nelle righe nuove, che riflettono lo stato attuale
+        if ultima > self._ultima_rettifica:
+            self._applica(conn.execute(
+                queries.ANALISI_RETTIFICHE, (self._ultima_rettifica, self._ultimo_id)
+            ).fetchall())
+            self._ultima_rettifica = ultima
+
+        righe = conn.execute(queries.ANALISI_NUOVE, (self._ultimo_id,)).fetchall()
+        if righe:
+            self._applica(righe)
+            self._ultimo_id = righe[-1]['id']
+
+    def _applica(self, righe):
+        """
+        Somma ai cubi righe con colonne giorno, conto_id, categoria, tipo,
+        importo, conteggio (negativi per le rettifiche che tolgono una riga)
+        """
+        # Date non interpretabili e tipi diversi da entrata/uscita restano
+        # fuori, come nelle query di aggregazione SQL
+        righe = [r for r in righe if r[0] is not None and r[3] in ('entrata', 'uscita')]
+        if not righe:
+            return
+
+        n = len(righe)
+        giorni = np.fromiter((r[0] for r in righe), np.int64, n)
+        conti = np.fromiter((r[1] for r in righe), np.int64, n)
+        categorie = np.fromiter((self._codice(r[2]) for r in righe), np.int64, n)
+        entrata = np.fromiter((r[3] == 'entrata' for r in righe), bool, n)
+        importi = np.fromiter((r[4] for r in righe), np.int64, n)
+        conteggi = np.fromiter((r[5] for r in righe), np.int64, n)
+
+        variazioni = {
+            'entrate': np.where(entrata, importi, 0),
+            'uscite': np.where(entrata, 0, importi),
+            'n_entrate': np.where(entrata, conteggi, 0),
+            'n_uscite': np.where(entrata, 0, conteggi),
+        }
+        for cubo in self._cubi.values():
+            cubo.applica(giorni, conti, categorie, variazioni)
+
+    def report(self, da, a, periodo='mese', conto_id=None, categoria=None, finestra=3):
+        """
+        Analisi delle transazioni tra le date 'da' e 'a' (incluse):
+        serie per periodo senza buchi, con media mobile su 'finestra' periodi,
+        media e percentili dei totali per periodo e ripartizione per
+        categoria e per conto. Solleva ValueError su parametri non validi.
+        """
+        if periodo not in PERIODI:
+            raise ValueError(f'Periodo non valido: {periodo}')
+        if da > a:
+            raise ValueError('data_da successiva a data_a')
+
+        giorno_da, giorno_a = giorno_da_data(da), giorno_da_data(a)
+        estremi = np.array([giorno_da, giorno_a])
+        primo, ultimo = (int(v) for v in _periodi(estremi, _mesi(estremi), periodo))
+        lunghezza = ultimo - primo + 1
+        if lunghezza > MAX_PERIODI:
+            raise ValueError(f'Troppi periodi richiesti ({lunghezza}, massimo {MAX_PERIODI})')
+
+        filtri = [d for d, valore in zip(DIMENSIONI, (conto_id, categoria)) if valore is not None]
+
+        # Il calcolo avviene sotto lock: le fette dei cubi sono viste su
+        # array che gli aggiornamenti modificano sul posto
+        with self.lock:
+            codice = self._codici.get(categoria, -1) if categoria is not None else None
+
+            def selezione(*dimensioni):
+                cubo = self._cubo(*filtri, *dimensioni)
+                return cubo.selezione(giorno_da, giorno_a, conto_id, codice)
+
+            # --- Serie per periodo ---
+            sel = selezione()
+            gruppi = _periodi(sel['giorno'], sel['mese'], periodo) - primo
+            entrate = _somma(sel['entrate'], gruppi, lunghezza)
+            uscite = -_somma(sel['uscite'], gruppi, lunghezza)
+            conteggi = _somma(sel['n_entrate'] + sel['n_uscite'], gruppi, lunghezza)
+
+            # --- Ripartizioni sull'intero intervallo ---
+            sel = selezione('categoria')
+            indici_categorie, per_categoria = _ripartizione(
+                sel, sel['categoria'].astype(np.int64), len(self._categorie)
+            )
+            nomi_categorie = [self._categorie[i] for i in indici_categorie.tolist()]
+
+            sel = selezione('conto')
+            id_conti, codici_conti = np.unique(sel['conto'], return_inverse=True)
+            indici_conti, per_conto = _ripartizione(sel, codici_conti, len(id_conti))
+            id_conti = id_conti[indici_conti].tolist()
+
+        serie = [
+            {
+                'periodo': etichetta,
+                'entrate': e,
+                'uscite': u,
+                'netto': round(e - u, 2),
+                'count': c,
+                'media_mobile_entrate': me,
+                'media_mobile_uscite': mu,
+            }
+            for etichetta, e, u, c, me, mu in zip(
+                _etichette(primo, ultimo, periodo), _euro(entrate), _euro(uscite), conteggi.tolist(),
+                _euro(_media_mobile(entrate, finestra)), _euro(_media_mobile(uscite, finestra))
+            )
+        ]
+
+        return {
+            'periodo': periodo,
+            'data_da': da.isoformat(),
+            'data_a': a.isoformat(),
+            'serie': serie,
+            'statistiche': {
+                'entrate': _distribuzione(entrate),
+                'uscite': _distribuzione(uscite),
+            },
+            'categorie': [
+                {'categoria': nome, 'entrate': e, 'uscite': u, 'count': c}
+                for nome, e, u, c in zip(nomi_categorie, _euro(per_categoria['entrate']),
+                                         _euro(per_categoria['uscite']), per_categoria['count'].tolist())
+            ],
+            'conti': [
+                {'conto_id': conto, 'entrate': e, 'uscite': u, 'count': c}
+                for conto, e, u, c in zip(id_conti, _euro(per_conto['entrate']),
+                                          _euro(per_conto['uscite']), per_conto['count'].tolist())
+            ],
+        }
+
+    def spese_per_categoria(self, da, a):
+        """
+        Transazioni di tipo 'uscita' tra le date 'da' e 'a' (incluse; per le
+        statistiche il mese corrente) sommate per categoria: lista di
+        (categoria, totale negativo in centesimi, numero), dalla spesa
+        maggiore, solo per le categorie con uscite.
+        """
+        with self.lock:
+            sel = self._cubo('categoria').selezione(giorno_da_data(da), giorno_da_data(a))
+            codici = sel['categoria'].astype(np.int64)
+            totali = _somma(sel['uscite'], codici, len(self._categorie))
+            conteggi = _somma(sel['n_uscite'], codici, len(self._categorie))
+            indici = np.flatnonzero(conteggi)
+            indici = indici[np.argsort(totali[indici], kind='stable')]
+            return [(self._categorie[i], int(totali[i]), int(conteggi[i])) for i in indici.tolist()]
+
+    def andamento_mensile(self, da):
+        """
+        Entrate e uscite (positive, in centesimi) per mese dalla data 'da' in
+        poi, in ordine di mese e solo per i mesi con transazioni: lista di
+        ('YYYY-MM', entrate, uscite).
+        """
+        with self.lock:
+            giorni = self._cubo().colonne['giorno']
+            if len(giorni) == 0 or giorni[-1] < giorno_da_data(da):
+                return []
+            sel = self._cubo().selezione(giorno_da_data(da), int(giorni[-1]))
+            mesi, gruppi = np.unique(sel['mese'], return_inverse=True)
+            entrate = _somma(sel['entrate'], gruppi, len(mesi))
+            uscite = -_somma(sel['uscite'], gruppi, len(mesi))
+            conteggi = _somma(sel['n_entrate'] + sel['n_uscite'], gruppi, len(mesi))
+
+        etichette = mesi.astype('datetime64[M]').astype(str).tolist()
+        return [
+            (etichetta, int(e), int(u))
+            for etichetta, e, u, c in zip(etichette, entrate, uscite, conteggi)
+            if c
+        ]
+
+    def flussi_mensili(self, richieste, primo_mese, ultimo_mese):
+        """
+        Entrate e uscite (uscite negative, in centesimi) per mese, da
+        'primo_mese' a 'ultimo_mese' inclusi (mesi dal gennaio 1970), per
+        ogni richiesta (conto_id, categoria), dove None vale per tutti.
+        Restituisce due matrici richieste × mesi. Le richieste con le stesse
+        dimensioni sono risolte insieme, con un solo raggruppamento sul cubo.
+        """
+        lunghezza = ultimo_mese - primo_mese + 1
+        entrate = np.zeros((len(richieste), lunghezza), dtype=np.int64)
+        uscite = np.zeros((len(richieste), lunghezza), dtype=np.int64)
+        giorno_da = int(np.array(primo_mese).astype('datetime64[M]').astype('datetime64[D]').astype(np.int64))
+        giorno_a = int(np.array(ultimo_mese + 1).astype('datetime64[M]').astype('datetime64[D]').astype(np.int64)) - 1
+
+        gruppi = {}
+        for indice, (conto_id, categoria) in enumerate(richieste):
+            dimensioni = tuple(d for d, valore in zip(DIMENSIONI, (conto_id, categoria)) if valore is not None)
+            gruppi.setdefault(dimensioni, []).append(indice)
+
+        with self.lock:
+            for dimensioni, indici in gruppi.items():
+                sel = self._cubo(*dimensioni).selezione(giorno_da, giorno_a)
+                # Chiave della riga sulle sole dimensioni del gruppo (conto e/o categoria)
+                chiavi = np.zeros(len(sel['giorno']), dtype=np.int64)
+                cercate = np.zeros(len(indici), dtype=np.int64)
+                if 'conto' in dimensioni:
+                    chiavi |= sel['conto'].astype(np.int64) << _BIT_CONTO
+                    cercate |= np.array([richieste[i][0] for i in indici], dtype=np.int64) << _BIT_CONTO
+                if 'categoria' in dimensioni:
+                    chiavi |= sel['categoria'].astype(np.int64)
+                    # Una categoria mai vista non trova righe
+                    cercate |= np.array([self._codici.get(richieste[i][1], _MASCHERA_CATEGORIA)
+                                         for i in indici], dtype=np.int64)
+
+                uniche, righe = np.unique(chiavi, return_inverse=True)
+                celle = righe * lunghezza + (sel['mese'].astype(np.int64) - primo_mese)
+                totale = len(uniche) * lunghezza
+                per_chiave = {
+                    nome: _somma(sel[nome], celle, totale).reshape(len(uniche), lunghezza)
+                    for nome in ('entrate', 'uscite')
+                }
+                posizioni = np.searchsorted(uniche, cercate)
+                trovate = posizioni < len(uniche)
+                trovate[trovate] = uniche[posizioni[trovate]] == cercate[trovate]
+                destinazione = np.array(indici)[trovate]
+                entrate[destinazione] = per_chiave['entrate'][posizioni[trovate]]
+                uscite[destinazione] = per_chiave['uscite'][posizioni[trovate]]
+        return entrate, uscite
+
+    def stats(self):
+        """Dimensioni dei cubi per il monitoraggio"""
+        with self.lock:
+            return {
+                'caricato': self._ultimo_id is not None,
+                'righe': len(self._cubo(*DIMENSIONI).colonne['chiave']),
+                'categorie': len(self._categorie),
+                'ultimo_id': self._ultimo_id,
+                'ultima_rettifica': self._ultima_rettifica,
+            }
+
+
+def elimina_rettifiche(conn, ore=24):
+    """
+    Elimina le rettifiche registrate da più di 'ore' ore (da eseguire con
+    Database.scrivi). Restituisce il numero di righe eliminate.
+    """
+    return conn.execute(
+        "DELETE FROM rettifiche_analisi WHERE registrata < datetime('now', ?)", (f'-{int(ore)} hours',)
+    ).rowcount
@@ -1,10 +1,35 @@
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import FastAPI, HTTPException, Query, Depends, Body, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
 from typing import Optional
+import asyncio
+import base64
+import json
+import logging
+import os
+import socket
+import time
 from database import Database
-from models import Conto, Transazione, Investimento, Obiettivo
-from datetime import datetime
+from models import (AvvisoBudget, Conto, Transazione, Investimento, Obiettivo, RegolaCategoria, Ricorrenza,
+                    codifica_json, serializza_righe, in_centesimi, in_euro, MAX_CENTESIMI)
+import queries
+import budget
+import export
+import importer
+import registro
+import ricorrenze
+from cache import CacheRisposte
+from eventi import BusEventi
+import inoltro
+from analitica import MotoreAnalitico, PERIODI, elimina_rettifiche
+from metriche import Metriche, MiddlewareProfilazione
+from replica import Replica
+from categorizzazione import Categorizzatore, valida_regola
+from previsioni import MESI_STORICO, MotorePrevisioni, flusso_obiettivo, richiesta_flussi
+from valutazione import (FornitorePrezziCSV, MotoreValutazione, MAX_RIGHE_EVENTO,
+                         importa_prezzi, rivaluta, ultimo_prezzo)
+from datetime import date, datetime, timedelta, timezone
 
 app = FastAPI()
 
@@ -18,11 +43,281 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Inizializza la connessione al database
-db = Database()
+# Profilazione di richieste e query (FINANCE_PROFILAZIONE=0 per disattivarla).
+# Le query più lente della soglia vengono registrate nel log 'financehub.query_lente'
+metriche = Metriche(
+    attiva=os.environ.get('FINANCE_PROFILAZIONE', '1') != '0',
+    soglia_query_lenta=float(os.environ.get('FINANCE_SOGLIA_QUERY_LENTA_MS', '200')) / 1000
+)
+if metriche.attiva:
+    app.add_middleware(MiddlewareProfilazione, metriche=metriche)
+
+# Ruolo del processo (FINANCE_RUOLO, impostato da server.py):
+# - completo: un solo processo che fa tutto (default);
+# - scrittura: esegue le scritture inoltrate dai lettori, su un socket Unix;
+# - lettura: serve le letture e inoltra le scritture (vedi inoltro.py).
+RUOLI = ('completo', 'scrittura', 'lettura')
+RUOLO = os.environ.get('FINANCE_RUOLO', 'completo')
+if RUOLO not in RUOLI:
+    raise RuntimeError(f'FINANCE_RUOLO non valido: {RUOLO} (ammessi: {", ".join(RUOLI)})')
+
+# Pool di connessioni condiviso da tutte le richieste del processo. Il percorso
+# del file può essere cambiato con la variabile d'ambiente FINANCE_DB;
+# FINANCE_MAX_GRUPPO_SCRITTURA=1 disattiva il commit di gruppo.
+# Nessuna connessione viene aperta all'import: lo schema è preparato all'avvio
+db = Database(
+    os.environ.get('FINANCE_DB', 'finance.db'),
+    metriche=metriche if metriche.attiva else None,
+    max_gruppo_scrittura=int(os.environ.get('FINANCE_MAX_GRUPPO_SCRITTURA', '64')),
+    inizializza=False,
+    sola_lettura=RUOLO == 'lettura'
+)
+
+# Eventi di modifica trasmessi ai client aperti su /api/eventi (vedi eventi.py)
+eventi = BusEventi()
+
+# Cache delle risposte di lettura, invalidata dagli endpoint che scrivono.
+# Il processo scrittore trasmette le invalidazioni ai lettori
+def notifica_invalidazione(tabelle):
+    inoltro.registra_invalidazione(tabelle)
+    eventi.pubblica('invalida', {'tabelle': list(tabelle)})
+
+cache = CacheRisposte(metriche=metriche, al_cambio=notifica_invalidazione if RUOLO == 'scrittura' else None)
+
+if RUOLO == 'scrittura':
+    app.add_middleware(inoltro.MiddlewareScrittore)
+elif RUOLO == 'lettura':
+    # Aggiunto per ultimo, quindi esterno a tutti gli altri: le scritture
+    # inoltrate sono profilate dal processo scrittore
+    scrittore = inoltro.client_scrittore(os.environ['FINANCE_SCRITTORE'])
+    app.add_middleware(inoltro.MiddlewareInoltro, client=scrittore, cache=cache)
+
+# Cubo colonnare delle transazioni del database principale (vedi analitica.py):
+# statistiche e grafico senza replica, bootstrap e previsioni
+analisi = MotoreAnalitico()
+
+# Serie di valore del portafoglio sullo storico dei prezzi (vedi valutazione.py)
+valutazione = MotoreValutazione()
+
+# Regole compilate e modello appreso per categorizzare le transazioni (vedi categorizzazione.py)
+categorie = Categorizzatore()
+
+# Previsioni Monte Carlo del completamento degli obiettivi (vedi previsioni.py)
+previsioni = MotorePrevisioni()
+
+# File CSV dei prezzi (simbolo,data,prezzo), se indicato da FINANCE_PREZZI:
+# riletto ogni FINANCE_INTERVALLO_PREZZI_S secondi, se è cambiato
+fornitore_prezzi = FornitorePrezziCSV(os.environ['FINANCE_PREZZI']) if os.environ.get('FINANCE_PREZZI') else None
+INTERVALLO_PREZZI = float(os.environ.get('FINANCE_INTERVALLO_PREZZI_S', '300'))
+log_valutazione = logging.getLogger('financehub.valutazione')
+
+# Copia di sola lettura da cui statistiche, grafico e analisi leggono (vedi
+# replica.py), attiva se FINANCE_REPLICA indica il percorso del file. La
+# aggiorna il processo che scrive; i processi di lettura la leggono soltanto
+replica = None
+if os.environ.get('FINANCE_REPLICA'):
+    replica = Replica(
+        db, os.environ['FINANCE_REPLICA'],
+        intervallo=float(os.environ.get('FINANCE_REPLICA_INTERVALLO_S', '60')),
+        max_scritture=int(os.environ.get('FINANCE_REPLICA_SCRITTURE', '1000')),
+        ritardo_max=float(os.environ.get('FINANCE_REPLICA_RITARDO_MAX_S', '300')),
+        al_cambio=lambda: cache.invalida('replica')
+    )
+
+# Cubo caricato dalla replica: i suoi dati sono quelli dell'istantanea
+# riportata in X-Dati-Al, e il cubo del database principale non lo raggiunge
+analisi_replica = MotoreAnalitico() if replica else None
+
+# Ogni quanto cercare le ricorrenze scadute (secondi). Il lease dura tre
+# giri: se il processo che lo detiene si ferma, un altro subentra
+INTERVALLO_RICORRENZE = float(os.environ.get('FINANCE_INTERVALLO_RICORRENZE_S', '60'))
+IDENTITA_PROCESSO = f'{socket.gethostname()}:{os.getpid()}'
+log_ricorrenze = logging.getLogger('financehub.ricorrenze')
+# Svegliata da una nuova ricorrenza, così le occorrenze già scadute non aspettano il giro
+sveglia_ricorrenze = asyncio.Event()
+stato_ricorrenze = {'esecuzioni': 0, 'transazioni_create': 0, 'ultima_esecuzione': None}
+
+# Ogni quanto creare i checkpoint dei saldi e riconciliare i conti (secondi)
+INTERVALLO_REGISTRO = float(os.environ.get('FINANCE_INTERVALLO_REGISTRO_S', '3600'))
+log_registro = logging.getLogger('financehub.registro')
+
+
+class RispostaJSON(JSONResponse):
+    """
+    Risposta JSON codificata direttamente con l'encoder compatto dei modelli.
+    Restituendola dall'endpoint si evita il passaggio di FastAPI su ogni riga
+    (jsonable_encoder), che sulle liste lunghe costa più della query.
+    """
+    def render(self, content):
+        with metriche.serializzazione():
+            return codifica_json(content)
+
+
+@app.on_event('startup')
+def prepara_database():
+    """
+    Un processo completo crea lo schema e applica le migrazioni; con più
+    processi lo fa server.py una volta sola, prima di avviarli, e qui si
+    verifica soltanto che il file sia aggiornato
+    """
+    if RUOLO == 'completo':
+        db.init_db()
+    else:
+        db.verifica_schema()
+
+
+@app.on_event('startup')
+async def prepara_analisi():
+    """Carica in background il cubo analitico, così la prima richiesta non lo aspetta"""
+    # Il processo scrittore non serve statistiche
+    if RUOLO != 'scrittura':
+        async def carica():
+            sorgente, motore, _ = await sorgente_analitica()
+            await sorgente.analizza(motore.sincronizza)
+        asyncio.get_running_loop().create_task(carica())
+
+
+@app.on_event('startup')
+async def prepara_categorizzazione():
+    """Compila le regole e addestra il modello in background prima della prima scrittura"""
+    # Le transazioni si categorizzano solo dove vengono scritte
+    if RUOLO != 'lettura':
+        asyncio.get_running_loop().create_task(db.analizza(categorie.sincronizza))
+
+
+@app.on_event('startup')
+async def avvia_replica():
+    """Aggiorna periodicamente la copia di sola lettura, se attiva"""
+    if replica and RUOLO != 'lettura':
+        asyncio.get_running_loop().create_task(replica.mantieni())
+
+
+@app.on_event('startup')
+async def avvia_inoltro_eventi():
+    """Nei processi di lettura segue gli eventi e le invalidazioni dello scrittore"""
+    if RUOLO == 'lettura':
+        asyncio.get_running_loop().create_task(inoltro.segui_eventi(scrittore, eventi, cache))
+
+
+async def manutenzione_registro():
+    """
+    Crea periodicamente i checkpoint dei saldi, elimina le rettifiche del
+    motore analitico già lette e segnala i conti non riconciliati
+    """
+    while True:
+        try:
+            creati = await db.scrivi(registro.crea_checkpoint)
+            await db.scrivi(elimina_rettifiche)
+            esito = await db.analizza(registro.riconcilia)
+            if creati:
+                log_registro.info('Creati %d checkpoint dei saldi', creati)
+            for conto in esito['conti']:
+                log_registro.warning('Saldo non riconciliato: %s', conto)
+            for checkpoint in esito['checkpoint']:
+                log_registro.warning('Checkpoint non coerente: %s', checkpoint)
+        except Exception:
+            log_registro.exception('Manutenzione del registro dei saldi non riuscita')
+        await asyncio.sleep(INTERVALLO_REGISTRO)
+
+@app.on_event('startup')
+async def avvia_manutenzione_registro():
+    # La manutenzione scrive: la esegue un solo processo
+    if RUOLO != 'lettura':
+        asyncio.get_running_loop().create_task(manutenzione_registro())
+
+
+async def aggiorna_prezzi():
+    """Importa i prezzi dal file quando cambia e rivaluta gli investimenti quotati"""
+    while True:
+        try:
+            # Lettura e validazione del file fuori dal ciclo degli eventi
+            letti = await db.code['analisi'].esegui(fornitore_prezzi.leggi)
+            if letti is not None:
+                righe, errori = letti
+                for errore in errori[:10]:
+                    log_valutazione.warning('Prezzo scartato (%s riga %d): %s',
+                                            fornitore_prezzi.percorso, errore['riga'], errore['errore'])
+                cambiati = await applica_prezzi(righe)
+                log_valutazione.info('Letti %d prezzi da %s (%d cambiati, %d scartati)',
+                                     len(righe), fornitore_prezzi.percorso, cambiati, len(errori))
+        except Exception:
+            log_valutazione.exception('Aggiornamento dei prezzi da %s non riuscito', fornitore_prezzi.percorso)
+        await asyncio.sleep(INTERVALLO_PREZZI)
+
+@app.on_event('startup')
+async def avvia_aggiornamento_prezzi():
+    # Scrive nel database: lo esegue un solo processo
+    if fornitore_prezzi and RUOLO != 'lettura':
+        asyncio.get_running_loop().create_task(aggiorna_prezzi())
+
+
+def esegui_ricorrenze(conn):
+    """Crea le occorrenze scadute se questo processo detiene il lease; None se non lo detiene"""
+    durata = 3 * INTERVALLO_RICORRENZE
+    if not ricorrenze.acquisisci_lease(conn, ricorrenze.LEASE_RICORRENZE, IDENTITA_PROCESSO, durata, time.time()):
+        return None, None, []
+    oggi, = conn.execute(queries.OGGI).fetchone()
+    ultimo_avviso = budget.ultimo_avviso(conn)
+    esito = ricorrenze.materializza(conn, oggi, categorizza=categorie.categorizza)
+    evento = None
+    if esito['importate']:
+        evento = {'importate': esito['importate'], **totali_evento(conn, *esito['variazioni_saldo'])}
+    return esito, evento, budget.avvisi_dopo(conn, ultimo_avviso)
+
+async def pianifica_ricorrenze():
+    """
+    Ogni INTERVALLO_RICORRENZE secondi cerca le ricorrenze scadute con una
+    lettura sull'indice di 'prossima' e, solo se ce ne sono, le esegue
+    tutte in una transazione di scrittura
+    """
+    while True:
+        try:
+            scadute = await db.leggi(lambda conn: conn.execute(queries.RICORRENZE_SCADUTE).fetchone())
+            if scadute:
+                esito, evento, avvisi = await db.scrivi(esegui_ricorrenze)
+                if esito is not None:
+                    stato_ricorrenze['esecuzioni'] += 1
+                    stato_ricorrenze['transazioni_create'] += esito['importate']
+                    stato_ricorrenze['ultima_esecuzione'] = datetime.now().isoformat(timespec='seconds')
+                    for errore in esito['errori'][:10]:
+                        log_ricorrenze.warning('Occorrenza scartata: %s', errore['errore'])
+                    if evento:
+                        log_ricorrenze.info('Create %d transazioni da %d ricorrenze',
+                                            esito['importate'], esito['ricorrenze'])
+                        cache.invalida('transazioni', 'conti', 'ricorrenze')
+                        eventi.pubblica('transazioni_importate', evento)
+                        pubblica_avvisi_budget(avvisi)
+                    else:
+                        cache.invalida('ricorrenze')
+        except Exception:
+            log_ricorrenze.exception('Esecuzione delle ricorrenze non riuscita')
+        try:
+            await asyncio.wait_for(sveglia_ricorrenze.wait(), timeout=INTERVALLO_RICORRENZE)
+        except asyncio.TimeoutError:
+            pass
+        sveglia_ricorrenze.clear()
+
+@app.on_event('startup')
+async def avvia_ricorrenze():
+    # Scrive nel database: non nei processi di lettura. Tra più processi
+    # che scrivono (più worker 'completo') il lavoro lo fa chi ha il lease
+    if RUOLO != 'lettura':
+        asyncio.get_running_loop().create_task(pianifica_ricorrenze())
+
+
+@app.on_event('shutdown')
+async def chiudi_database():
+    """Chiude i flussi di eventi e le connessioni del pool allo spegnimento del server"""
+    eventi.chiudi()
+    if RUOLO == 'lettura':
+        await scrittore.aclose()
+    if replica:
+        replica.close()
+    db.close()
 
 
 # --- Modelli Pydantic per validazione dati ---
+# Gli importi arrivano in euro e vengono convertiti in centesimi negli endpoint
 
 class ContoCreate(BaseModel):
     nome: str
@@ -32,7 +327,8 @@ class ContoCreate(BaseModel):
 class TransazioneCreate(BaseModel):
     conto_id: int
     tipo: str
-    categoria: str
+    # Se manca viene proposta dalle regole di categorizzazione
+    categoria: Optional[str] = None
     importo: float
     descrizione: str = ""
     data: Optional[str] = None
@@ -43,274 +339,620 @@ class InvestimentoCreate(BaseModel):
     tipo: str
     importo_iniziale: float
     valore_attuale: float
+    # Investimenti quotati: il valore attuale segue il prezzo del simbolo
+    simbolo: Optional[str] = None
+    quantita: Optional[float] = None
 
 class ObiettivoCreate(BaseModel):
     titolo: str
     descrizione: str = ""
     importo_target: float
     importo_attuale: float = 0
+    # Se indicati l'importo attuale segue il saldo del conto o le
+    # transazioni della categoria (vedi database.OBIETTIVI_COLLEGATI_SCHEMA)
+    conto_id: Optional[int] = None
+    categoria: Optional[str] = None
 
 class ObiettivoUpdate(BaseModel):
     importo_attuale: float
 
+class RicorrenzaCreate(BaseModel):
+    conto_id: int
+    tipo: str
+    # Se manca viene proposta dalle regole di categorizzazione a ogni occorrenza
+    categoria: Optional[str] = None
+    importo: float
+    descrizione: str = ""
+    frequenza: str
+    intervallo: int = 1
+    # Default: oggi (UTC, come date('now') di SQLite)
+    data_inizio: Optional[str] = None
+    data_fine: Optional[str] = None
+    max_occorrenze: Optional[int] = None
+
+class BudgetCreate(BaseModel):
+    nome: Optional[str] = None
+    # Almeno uno dei due restringe le uscite contate; senza, tutte le uscite
+    conto_id: Optional[int] = None
+    categoria: Optional[str] = None
+    periodo: str = 'mensile'
+    limite: float
+    # Percentuale del limite oltre la quale parte un avviso
+    soglia: int = budget.SOGLIA_PREDEFINITA
+
+class BudgetUpdate(BaseModel):
+    limite: Optional[float] = None
+    soglia: Optional[int] = None
+
+class RegolaCreate(BaseModel):
+    tipo: str
+    categoria: str
+    modello: Optional[str] = None
+    importo_min: Optional[float] = None
+    importo_max: Optional[float] = None
+    priorita: int = 0
+
+class RigaProva(BaseModel):
+    descrizione: str = ""
+    importo: float
+
+class ProvaRegole(BaseModel):
+    transazioni: list[RigaProva]
+
+def centesimi_richiesta(euro, nome):
+    """Importo in euro di una richiesta -> centesimi (400 se non valido o fuori dai limiti)"""
+    try:
+        return in_centesimi(euro)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f'{nome}: {e}')
+
 
 # --- DASHBOARD ---
 
-@app.get('/api/dashboard')
-def get_dashboard():
-    """Restituisce i dati aggregati per la dashboard principale"""
-    conn = db.get_connection()
-    cursor = conn.cursor()
-    
-    # Saldo totale di tutti i conti
-    cursor.execute('SELECT SUM(saldo) as totale FROM conti')
-    saldo_totale = cursor.fetchone()['totale'] or 0
-    
-    # Variazione del mese corrente (entrate - uscite)
-    cursor.execute('''
-        SELECT SUM(importo) as variazione 
-        FROM transazioni 
-        WHERE strftime('%Y-%m', data) = strftime('%Y-%m', 'now')
-    ''')
-    variazione_mensile = cursor.fetchone()['variazione'] or 0
-    
-    # Totale investimenti e rendimento
-    cursor.execute('SELECT SUM(valore_attuale) as totale FROM investimenti')
-    totale_investimenti = cursor.fetchone()['totale'] or 0
-    
-    cursor.execute('SELECT SUM(rendimento) as totale FROM investimenti')
-    rendimento_investimenti = cursor.fetchone()['totale'] or 0
-    
-    # Calcola solo le uscite del mese corrente
-    cursor.execute('''
-        SELECT SUM(importo) as totale 
-        FROM transazioni 
-        WHERE tipo = 'uscita' AND strftime('%Y-%m', data) = strftime('%Y-%m', 'now')
-    ''')
-    spese_mensili = abs(cursor.fetchone()['totale'] or 0)
-    
-    # Conta obiettivi totali e completati
-    cursor.execute('SELECT COUNT(*) as totale FROM obiettivi')
-    totale_obiettivi = cursor.fetchone()['totale']
-    
-    cursor.execute('SELECT COUNT(*) as completati FROM obiettivi WHERE completato = 1')
-    obiettivi_completati = cursor.fetchone()['completati']
-    
-    conn.close()
+def leggi_dashboard(conn):
+    """Totali della dashboard principale (condivisa con /api/bootstrap)"""
+    # Tutti i totali sono mantenuti dai trigger nelle tabelle di riepilogo
+    riepilogo = conn.execute(queries.DASHBOARD).fetchone()
     
     return {
-        'saldo_totale': round(saldo_totale, 2),
-        'variazione_mensile': round(variazione_mensile, 2),
+        'saldo_totale': in_euro(riepilogo['saldo_totale']),
+        'variazione_mensile': in_euro(riepilogo['variazione_mensile']),
         'investimenti': {
-            'totale': round(totale_investimenti, 2),
-            'rendimento': round(rendimento_investimenti, 2)
+            'totale': in_euro(riepilogo['investimenti_totale']),
+            'rendimento': in_euro(riepilogo['investimenti_rendimento'])
         },
-        'spese_mensili': round(spese_mensili, 2),
+        'spese_mensili': in_euro(abs(riepilogo['spese_mensili'])),
         'obiettivi': {
-            'totale': totale_obiettivi,
-            'completati': obiettivi_completati
+            'totale': riepilogo['obiettivi_totale'],
+            'completati': riepilogo['obiettivi_completati']
         }
     }
 
+@app.get('/api/dashboard')
+async def get_dashboard():
+    """Restituisce i dati aggregati per la dashboard principale"""
+    return await db.leggi(leggi_dashboard)
+
+
+# --- EVENTI ---
+
+def riga_evento(conn, tabella, modello, id):
+    """Riga appena scritta, nello stesso formato degli endpoint di lettura"""
+    riga = conn.execute(f'SELECT * FROM {tabella} WHERE id = ?', (id,)).fetchone()
+    return modello.riga_in_dict(riga) if riga else None
+
+def totali_evento(conn, *conti):
+    """
+    Nuovi saldi dei conti indicati e totali della dashboard, letti nella
+    transazione di scrittura: l'evento descrive esattamente lo stato confermato
+    """
+    saldi = [
+        {'id': riga['id'], 'saldo': in_euro(riga['saldo'])}
+        for riga in conn.execute(
+            f'SELECT id, saldo FROM conti WHERE id IN ({",".join("?" * len(conti))})', conti
+        )
+    ] if conti else []
+    return {'conti': saldi, 'dashboard': leggi_dashboard(conn)}
+
+def pubblica_avvisi_budget(avvisi):
+    """Un evento per ogni avviso di budget registrato dai trigger durante la scrittura"""
+    for avviso in avvisi:
+        eventi.pubblica('avviso_budget', avviso)
+
+@app.get('/api/eventi')
+async def get_eventi(request: Request):
+    """
+    Flusso Server-Sent Events delle modifiche (righe nuove o eliminate, saldi
+    e totali della dashboard). Con l'header Last-Event-ID il client riceve
+    gli eventi persi durante la riconnessione, oppure 'ricarica'.
+    """
+    return StreamingResponse(
+        eventi.flusso(request.headers.get('last-event-id')),
+        media_type='text/event-stream',
+        # Niente buffering nei proxy (nginx), altrimenti gli eventi arrivano a blocchi
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 
 # --- ENDPOINT CONTI ---
 
+def leggi_conti(conn):
+    """Righe di tutti i conti, dal più recente"""
+    return conn.execute('SELECT * FROM conti ORDER BY created_at DESC').fetchall()
+
 @app.get('/api/conti')
-def get_conti():
+async def get_conti(request: Request):
     """Ottiene la lista di tutti i conti"""
-    conn = db.get_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM conti ORDER BY created_at DESC')
-    rows = cursor.fetchall()
-    conn.close()
+    async def carica():
+        rows = await db.leggi(leggi_conti)
+        with metriche.serializzazione():
+            return serializza_righe(rows, Conto)
     
-    conti = [Conto.from_row(row).to_dict() for row in rows]
-    return conti
+    return await cache.risposta(request, ('conti',), carica)
 
 @app.get('/api/conti/{conto_id}')
-def get_conto(conto_id: int):
+async def get_conto(conto_id: int):
     """Ottiene un singolo conto tramite ID"""
-    conn = db.get_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM conti WHERE id = ?', (conto_id,))
-    row = cursor.fetchone()
-    conn.close()
+    def esegui(conn):
+        cursor = conn.cursor()
+        cursor.execute('SELECT * FROM conti WHERE id = ?', (conto_id,))
+        return cursor.fetchone()
+    
+    row = await db.leggi(esegui)
     
     if row:
         return Conto.from_row(row).to_dict()
     raise HTTPException(status_code=404, detail='Conto non trovato')
 
+def _data_parametro(valore, nome):
+    """Converte una data YYYY-MM-DD passata in query string (400 se non valida)"""
+    try:
+        return date.fromisoformat(valore)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f'{nome} non valida (formato YYYY-MM-DD)')
+
+@app.get('/api/conti/{conto_id}/saldo')
+async def get_saldo_storico(
+    request: Request,
+    conto_id: int,
+    data: Optional[str] = Query(None, description='Giorno (YYYY-MM-DD), default oggi')
+):
+    """Saldo del conto alla fine del giorno indicato, dal registro storico"""
+    giorno = _data_parametro(data, 'data').isoformat() if data else None
+    
+    def esegui(conn):
+        fine = giorno or conn.execute(queries.DATE_CORRENTI).fetchone()['oggi']
+        return fine, registro.saldo_al(conn, conto_id, fine)
+    
+    async def carica():
+        fine, saldo = await db.leggi(esegui)
+        if saldo is None:
+            raise HTTPException(status_code=404, detail='Conto non trovato')
+        return {'conto_id': conto_id, 'data': fine, 'saldo': in_euro(saldo)}
+    
+    return await cache.risposta(request, ('transazioni', 'conti'), carica)
+
+@app.get('/api/conti/{conto_id}/saldi')
+async def get_andamento_saldo(
+    request: Request,
+    conto_id: int,
+    data_da: Optional[str] = Query(None, description='Data iniziale (YYYY-MM-DD), default 30 giorni fa'),
+    data_a: Optional[str] = Query(None, description='Data finale inclusa (YYYY-MM-DD), default oggi')
+):
+    """Andamento del saldo: saldo di partenza e saldo a fine giornata di ogni giorno con movimenti"""
+    da = _data_parametro(data_da, 'data_da') if data_da else None
+    a = _data_parametro(data_a, 'data_a') if data_a else None
+    if da and a and da > a:
+        raise HTTPException(status_code=400, detail='data_da successiva a data_a')
+    
+    def esegui(conn):
+        fine = a or date.fromisoformat(conn.execute(queries.DATE_CORRENTI).fetchone()['oggi'])
+        inizio = da or fine - timedelta(days=30)
+        return inizio, fine, registro.andamento_saldo(conn, conto_id, inizio.isoformat(), fine.isoformat())
+    
+    async def carica():
+        inizio, fine, andamento = await db.leggi(esegui)
+        if andamento is None:
+            raise HTTPException(status_code=404, detail='Conto non trovato')
+        saldo_iniziale, punti = andamento
+        return {
+            'conto_id': conto_id,
+            'data_da': inizio.isoformat(),
+            'data_a': fine.isoformat(),
+            'saldo_iniziale': in_euro(saldo_iniziale),
+            'saldi': [
+                {'data': giorno, 'variazione': in_euro(variazione), 'saldo': in_euro(saldo)}
+                for giorno, variazione, saldo in punti
+            ]
+        }
+    
+    return await cache.risposta(request, ('transazioni', 'conti'), carica)
+
 @app.post('/api/conti', status_code=201)
-def create_conto(conto: ContoCreate):
+async def create_conto(conto: ContoCreate):
     """Crea un nuovo conto bancario"""
-    conn = db.get_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO conti (nome, tipo, saldo) 
-        VALUES (?, ?, ?)
-    ''', (conto.nome, conto.tipo, conto.saldo))
-    conn.commit()
+    def esegui(conn):
+        cursor = conn.cursor()
+        # Il saldo di apertura è anche il punto di partenza del registro storico
+        saldo = centesimi_richiesta(conto.saldo, 'saldo')
+        cursor.execute('''
+            INSERT INTO conti (nome, tipo, saldo, saldo_iniziale) 
+            VALUES (?, ?, ?, ?)
+        ''', (conto.nome, conto.tipo, saldo, saldo))
+        
+        return {'conto': riga_evento(conn, 'conti', Conto, cursor.lastrowid), **totali_evento(conn)}
     
-    conto_id = cursor.lastrowid
-    conn.close()
+    evento = await db.scrivi(esegui)
+    cache.invalida('conti')
+    eventi.pubblica('conto_creato', evento)
     
-    return {'id': conto_id, 'message': 'Conto creato con successo'}
+    return {'id': evento['conto']['id'], 'message': 'Conto creato con successo'}
 
 @app.delete('/api/conti/{conto_id}')
-def delete_conto(conto_id: int):
+async def delete_conto(conto_id: int):
     """Elimina un conto (solo se non ha transazioni associate)"""
-    conn = db.get_connection()
-    cursor = conn.cursor()
-    
-    # Verifica se ci sono transazioni collegate a questo conto
-    cursor.execute('SELECT COUNT(*) as count FROM transazioni WHERE conto_id = ?', (conto_id,))
-    transazioni_count = cursor.fetchone()['count']
-    
-    if transazioni_count > 0:
-        conn.close()
-        raise HTTPException(
-            status_code=400, 
-            detail='Impossibile eliminare: il conto ha transazioni associate'
-        )
-    
-    cursor.execute('DELETE FROM conti WHERE id = ?', (conto_id,))
-    conn.commit()
+    def esegui(conn):
+        cursor = conn.cursor()
+        
+        # Verifica se ci sono transazioni collegate a questo conto
+        cursor.execute('SELECT COUNT(*) as count FROM transazioni WHERE conto_id = ?', (conto_id,))
+        transazioni_count = cursor.fetchone()['count']
+        
+        if transazioni_count > 0:
+            raise HTTPException(
+                status_code=400, 
+                detail='Impossibile eliminare: il conto ha transazioni associate'
+            )
+        
+        cursor.execute('DELETE FROM conti WHERE id = ?', (conto_id,))
+        rows_affected = cursor.rowcount
+        # Le ricorrenze del conto non avrebbero più dove scrivere
+        cursor.execute('DELETE FROM ricorrenze WHERE conto_id = ?', (conto_id,))
+        # Gli obiettivi collegati al conto restano, senza collegamento al conto
+        cursor.execute('UPDATE obiettivi SET conto_id = NULL WHERE conto_id = ?', (conto_id,))
+        # I budget del conto non avrebbero più spese da contare
+        for riga in cursor.execute('SELECT id FROM budget WHERE conto_id = ?', (conto_id,)).fetchall():
+            budget.elimina_budget(conn, riga['id'])
+        
+        return rows_affected, totali_evento(conn)
     
-    rows_affected = cursor.rowcount
-    conn.close()
+    rows_affected, evento = await db.scrivi(esegui)
+    cache.invalida('conti', 'ricorrenze', 'obiettivi', 'budget')
     
     if rows_affected > 0:
+        eventi.pubblica('conto_eliminato', {'id': conto_id, **evento})
         return {'message': 'Conto eliminato con successo'}
     raise HTTPException(status_code=404, detail='Conto non trovato')
 
 
 # --- ENDPOINT TRANSAZIONI ---
 
-@app.get('/api/transazioni')
-def get_transazioni(limit: int = Query(50)):
-    """Ottiene tutte le transazioni (con limite opzionale)"""
-    conn = db.get_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM transazioni ORDER BY data DESC LIMIT ?', (limit,))
-    rows = cursor.fetchall()
-    conn.close()
+def filtri_transazioni(
+    conto_id: Optional[int] = None,
+    data_da: Optional[str] = Query(None, description='Data iniziale (YYYY-MM-DD)'),
+    data_a: Optional[str] = Query(None, description='Data finale inclusa (YYYY-MM-DD)'),
+    categoria: Optional[str] = None,
+    tipo: Optional[str] = None,
+    importo_min: Optional[float] = None,
+    importo_max: Optional[float] = None
+):
+    """Raccoglie i filtri opzionali sulle transazioni passati in query string (importi in euro)"""
+    return {
+        'conto_id': conto_id,
+        'data_da': data_da,
+        'data_a': data_a,
+        'categoria': categoria,
+        'tipo': tipo,
+        'importo_min': centesimi_richiesta(importo_min, 'importo_min') if importo_min is not None else None,
+        'importo_max': centesimi_richiesta(importo_max, 'importo_max') if importo_max is not None else None
+    }
+
+def codifica_cursore(data, id):
+    """Codifica la posizione (data, id) in un cursore opaco per il client"""
+    return base64.urlsafe_b64encode(json.dumps([data, id]).encode()).decode()
+
+def decodifica_cursore(cursore):
+    """Decodifica un cursore generato da codifica_cursore"""
+    try:
+        data, id = json.loads(base64.urlsafe_b64decode(cursore.encode()))
+        return str(data), int(id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail='Cursore non valido')
+
+def leggi_pagina_transazioni(conn, filtri, posizione, limit):
+    """Legge una pagina di transazioni e calcola il cursore della pagina successiva"""
+    # Legge una riga in più per sapere se esiste una pagina successiva
+    sql, params = queries.pagina_transazioni(filtri, posizione, limit + 1)
+    rows = conn.execute(sql, params).fetchall()
     
-    transazioni = [Transazione.from_row(row).to_dict() for row in rows]
-    return transazioni
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = codifica_cursore(rows[-1]['data'], rows[-1]['id'])
+    
+    return {
+        'transazioni': [Transazione.riga_in_dict(row) for row in rows],
+        'next_cursor': next_cursor
+    }
+
+async def pagina_transazioni(filtri, cursore, limit):
+    """Risposta JSON di una pagina di transazioni a partire dal cursore del client"""
+    posizione = decodifica_cursore(cursore) if cursore else None
+    return RispostaJSON(await db.leggi(leggi_pagina_transazioni, filtri, posizione, limit))
+
+@app.get('/api/transazioni')
+async def get_transazioni(
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    filtri: dict = Depends(filtri_transazioni)
+):
+    """Ottiene le transazioni più recenti, filtrate e paginate tramite cursore"""
+    return await pagina_transazioni(filtri, cursor, limit)
 
 @app.get('/api/transazioni/conto/{conto_id}')
-def get_transazioni_conto(conto_id: int):
-    """Ottiene tutte le transazioni di un conto specifico"""
-    conn = db.get_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        'SELECT * FROM transazioni WHERE conto_id = ? ORDER BY data DESC', 
-        (conto_id,)
-    )
-    rows = cursor.fetchall()
-    conn.close()
+async def get_transazioni_conto(
+    conto_id: int,
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    filtri: dict = Depends(filtri_transazioni)
+):
+    """Ottiene le transazioni di un conto specifico, paginate tramite cursore"""
+    filtri['conto_id'] = conto_id
+    return await pagina_transazioni(filtri, cursor, limit)
+
+def leggi_ricerca_transazioni(conn, espressione, filtri, ordine, posizione, limit):
+    """Legge una pagina di risultati della ricerca e calcola il cursore della successiva"""
+    sql, params = queries.ricerca_transazioni(espressione, filtri, ordine, posizione, limit + 1)
+    rows = conn.execute(sql, params).fetchall()
+    
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        chiave = 'rilevanza' if ordine == 'rilevanza' else 'data'
+        next_cursor = codifica_cursore(rows[-1][chiave], rows[-1]['id'])
+    
+    return {
+        'transazioni': [Transazione.riga_in_dict(row) for row in rows],
+        'next_cursor': next_cursor
+    }
+
+@app.get('/api/transazioni/search')
+async def search_transazioni(
+    q: str = Query(..., max_length=200, description='Parole da cercare in descrizione e categoria (anche iniziali)'),
+    ordine: str = Query('rilevanza', pattern='^(rilevanza|data)$'),
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    filtri: dict = Depends(filtri_transazioni)
+):
+    """Cerca le transazioni per testo (indice full-text), con i filtri dell'elenco e paginazione tramite cursore"""
+    espressione = queries.espressione_ricerca(q)
+    if espressione is None:
+        raise HTTPException(status_code=400, detail='Indicare almeno una parola da cercare')
+    
+    posizione = decodifica_cursore(cursor) if cursor else None
+    if posizione and ordine == 'rilevanza':
+        # Nel cursore della ricerca per rilevanza c'è il punteggio bm25
+        try:
+            posizione = (float(posizione[0]), posizione[1])
+        except ValueError:
+            raise HTTPException(status_code=400, detail='Cursore non valido')
+    
+    return RispostaJSON(await db.leggi(leggi_ricerca_transazioni, espressione, filtri, ordine, posizione, limit))
+
+@app.get('/api/transazioni/export')
+def export_transazioni(
+    formato: str = Query('ndjson', pattern='^(ndjson|csv)$'),
+    gzip: bool = False,
+    filtri: dict = Depends(filtri_transazioni)
+):
+    """Esporta in streaming le transazioni filtrate in formato NDJSON o CSV"""
+    sql, params = queries.esporta_transazioni(filtri, export.COLONNE_SQL)
+    media_type, estensione = export.FORMATI[formato]
+    
+    def genera():
+        # La connessione resta in uso solo per la durata dello streaming
+        with db.connection() as conn:
+            cursor = conn.execute(sql, params)
+            yield from export.GENERATORI[formato](cursor)
+    
+    contenuto = genera()
+    nome_file = f'transazioni.{estensione}'
+    if gzip:
+        contenuto = export.comprimi_gzip(contenuto)
+        media_type = 'application/gzip'
+        nome_file += '.gz'
     
-    transazioni = [Transazione.from_row(row).to_dict() for row in rows]
-    return transazioni
+    return StreamingResponse(
+        contenuto,
+        media_type=media_type,
+        headers={'Content-Disposition': f'attachment; filename="{nome_file}"'}
+    )
 
 @app.post('/api/transazioni', status_code=201)
-def create_transazione(transazione: TransazioneCreate):
+async def create_transazione(transazione: TransazioneCreate):
     """Crea una nuova transazione e aggiorna il saldo del conto"""
-    conn = db.get_connection()
-    cursor = conn.cursor()
-    
-    # Inserisce la transazione nel database
-    cursor.execute('''
-        INSERT INTO transazioni (conto_id, tipo, categoria, importo, descrizione, data) 
-        VALUES (?, ?, ?, ?, ?, ?)
-    ''', (
-        transazione.conto_id,
-        transazione.tipo,
-        transazione.categoria,
-        transazione.importo,
-        transazione.descrizione,
-        transazione.data or datetime.now().isoformat()
-    ))
-    
-    # Aggiorna automaticamente il saldo del conto
-    # L'importo è già negativo per le uscite, quindi basta sommarlo
-    cursor.execute('''
-        UPDATE conti 
-        SET saldo = saldo + ? 
-        WHERE id = ?
-    ''', (transazione.importo, transazione.conto_id))
-    
-    conn.commit()
-    transazione_id = cursor.lastrowid
-    conn.close()
-    
-    return {'id': transazione_id, 'message': 'Transazione creata con successo'}
+    importo = centesimi_richiesta(transazione.importo, 'importo')
+    
+    def esegui(conn):
+        cursor = conn.cursor()
+        
+        categoria = transazione.categoria
+        if not categoria:
+            proposta, = categorie.categorizza(conn, [(transazione.descrizione, importo)])
+            categoria = proposta or importer.CATEGORIA_PREDEFINITA
+        ultimo_avviso = budget.ultimo_avviso(conn)
+        
+        # Inserisce la transazione nel database
+        cursor.execute('''
+            INSERT INTO transazioni (conto_id, tipo, categoria, importo, descrizione, data) 
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (
+            transazione.conto_id,
+            transazione.tipo,
+            categoria,
+            importo,
+            transazione.descrizione,
+            transazione.data or datetime.now().isoformat()
+        ))
+        
+        # Aggiorna automaticamente il saldo del conto
+        # L'importo è già negativo per le uscite, quindi basta sommarlo
+        cursor.execute('''
+            UPDATE conti 
+            SET saldo = saldo + ? 
+            WHERE id = ?
+        ''', (importo, transazione.conto_id))
+        
+        return {
+            'transazione': riga_evento(conn, 'transazioni', Transazione, cursor.lastrowid),
+            **totali_evento(conn, transazione.conto_id)
+        }, budget.avvisi_dopo(conn, ultimo_avviso)
+    
+    evento, avvisi = await db.scrivi(esegui)
+    cache.invalida('transazioni', 'conti')
+    eventi.pubblica('transazione_creata', evento)
+    pubblica_avvisi_budget(avvisi)
+    
+    return {'id': evento['transazione']['id'], 'message': 'Transazione creata con successo'}
+
+def importa_con_evento(conn, righe):
+    """
+    Importa le righe e prepara l'evento con il numero di transazioni
+    importate e i nuovi saldi. Le righe non vengono inviate (possono essere
+    migliaia): il client rilegge la lista se gli serve. Restituisce anche
+    gli avvisi di budget causati dall'importazione
+    """
+    ultimo_avviso = budget.ultimo_avviso(conn)
+    risultato = importer.importa(conn, righe, categorizza=categorie.categorizza)
+    evento = {'importate': risultato['importate'], **totali_evento(conn, *risultato['variazioni_saldo'])}
+    return risultato, evento, budget.avvisi_dopo(conn, ultimo_avviso)
+
+@app.post('/api/transazioni/import')
+async def import_transazioni(righe: list = Body(...)):
+    """
+    Importa un lotto di transazioni in un'unica operazione.
+    Le righe non valide vengono segnalate senza bloccare le altre.
+    """
+    risultato, evento, avvisi = await db.scrivi(importa_con_evento, righe)
+    cache.invalida('transazioni', 'conti')
+    if risultato['importate']:
+        eventi.pubblica('transazioni_importate', evento)
+        pubblica_avvisi_budget(avvisi)
+    return risultato
+
+@app.post('/api/transazioni/import/file')
+async def import_transazioni_file(
+    request: Request,
+    formato: str = Query('csv', pattern='^(csv|ofx)$'),
+    conto_id: Optional[int] = None
+):
+    """Importa un estratto conto inviato come corpo della richiesta (CSV o OFX)"""
+    if formato == 'ofx' and conto_id is None:
+        raise HTTPException(status_code=400, detail='conto_id obbligatorio per i file OFX')
+    
+    testo = (await request.body()).decode('utf-8-sig', errors='replace')
+    righe = importer.LETTORI_FILE[formato](testo, conto_id)
+    risultato, evento, avvisi = await db.scrivi(importa_con_evento, righe)
+    cache.invalida('transazioni', 'conti')
+    if risultato['importate']:
+        eventi.pubblica('transazioni_importate', evento)
+        pubblica_avvisi_budget(avvisi)
+    return risultato
 
 @app.delete('/api/transazioni/{transazione_id}')
-def delete_transazione(transazione_id: int):
+async def delete_transazione(transazione_id: int):
     """Elimina una transazione"""
-    conn = db.get_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute('DELETE FROM transazioni WHERE id = ?', (transazione_id,))
-    conn.commit()
+    def esegui(conn):
+        cursor = conn.cursor()
+        
+        riga = cursor.execute(
+            'SELECT conto_id, importo FROM transazioni WHERE id = ?', (transazione_id,)
+        ).fetchone()
+        cursor.execute('DELETE FROM transazioni WHERE id = ?', (transazione_id,))
+        eliminate = cursor.rowcount
+        if riga:
+            # Annulla l'effetto della transazione sul saldo del conto
+            cursor.execute(
+                'UPDATE conti SET saldo = saldo - ? WHERE id = ?', (riga['importo'], riga['conto_id'])
+            )
+            return eliminate, totali_evento(conn, riga['conto_id'])
+        
+        return eliminate, None
     
-    rows_affected = cursor.rowcount
-    conn.close()
+    rows_affected, evento = await db.scrivi(esegui)
+    cache.invalida('transazioni', 'conti')
     
     if rows_affected > 0:
+        eventi.pubblica('transazione_eliminata', {'id': transazione_id, **evento})
         return {'message': 'Transazione eliminata con successo'}
     raise HTTPException(status_code=404, detail='Transazione non trovata')
 
-@app.get('/api/transazioni/stats')
-def get_transazioni_stats():
-    """Calcola statistiche sulle spese per categoria (mese corrente)"""
-    conn = db.get_connection()
-    cursor = conn.cursor()
-    
-    # Raggruppa le uscite del mese per categoria
-    cursor.execute('''
-        SELECT categoria, SUM(importo) as totale, COUNT(*) as count
-        FROM transazioni
-        WHERE tipo = 'uscita' AND strftime('%Y-%m', data) = strftime('%Y-%m', 'now')
-        GROUP BY categoria
-        ORDER BY totale ASC
-    ''')
+def leggi_stats(conn, motore=analisi):
+    """Spese del mese corrente per categoria, dal cubo 'motore' sincronizzato su conn"""
+    motore.sincronizza(conn)
+    date_correnti = conn.execute(queries.DATE_CORRENTI).fetchone()
     
-    rows = cursor.fetchall()
-    conn.close()
+    # Raggruppa le uscite del mese per categoria (sul cubo in memoria)
+    rows = motore.spese_per_categoria(
+        date.fromisoformat(date_correnti['inizio_mese']),
+        date.fromisoformat(date_correnti['fine_mese'])
+    )
     
     # Converte gli importi negativi in positivi per la visualizzazione
-    stats = [
+    return [
         {
-            'categoria': row['categoria'], 
-            'totale': abs(row['totale']), 
-            'count': row['count']
+            'categoria': categoria, 
+            'totale': in_euro(abs(totale)), 
+            'count': count
         } 
-        for row in rows
+        for categoria, totale, count in rows
     ]
-    return stats
 
-@app.get('/api/transazioni/chart')
-def get_chart_data():
-    """Prepara i dati per il grafico dell'andamento finanziario (ultimi 6 mesi)"""
-    conn = db.get_connection()
-    cursor = conn.cursor()
-    
-    # Query per ottenere entrate e uscite aggregate per mese
-    cursor.execute('''
-        SELECT 
-            strftime('%Y-%m', data) as mese,
-            SUM(CASE WHEN tipo = 'entrata' THEN importo ELSE 0 END) as entrate,
-            SUM(CASE WHEN tipo = 'uscita' THEN ABS(importo) ELSE 0 END) as uscite
-        FROM transazioni
-        WHERE data >= date('now', '-6 months')
-        GROUP BY strftime('%Y-%m', data)
-        ORDER BY mese ASC
-    ''')
-    
-    rows = cursor.fetchall()
-    conn.close()
+async def sorgente_analitica():
+    """
+    Database da cui leggere le aggregazioni, cubo analitico sincronizzato su
+    quel database e istante dei dati: la replica col suo cubo, se attiva e
+    abbastanza recente, altrimenti il database principale (istante None
+    senza replica)
+    """
+    if replica is None:
+        return db, analisi, None
+    sorgente, istante = await replica.sorgente()
+    return sorgente, analisi_replica if sorgente is replica.copia else analisi, istante
+
+async def risposta_analitica(request, carica):
+    """
+    Risposta (dalla cache) di un'aggregazione: carica(sorgente, motore) legge
+    dalla replica e dal suo cubo, se attiva e abbastanza recente, altrimenti
+    dal database principale. Con la replica attiva X-Dati-Al indica l'istante
+    dei dati usati e X-Ritardo-Max il ritardo massimo ammesso in secondi.
+    """
+    sorgente, motore, istante = await sorgente_analitica()
+    if replica is None:
+        return await cache.risposta(request, ('transazioni',), lambda: carica(sorgente, motore))
+    
+    intestazioni = {
+        'X-Dati-Al': datetime.fromtimestamp(istante, timezone.utc).isoformat(timespec='seconds'),
+        'X-Ritardo-Max': f'{replica.ritardo_max:g}'
+    }
+    return await cache.risposta(request, ('transazioni', 'replica'), lambda: carica(sorgente, motore), intestazioni)
+
+@app.get('/api/transazioni/stats')
+async def get_transazioni_stats(request: Request):
+    """Calcola statistiche sulle spese per categoria (mese corrente)"""
+    async def carica(sorgente, motore):
+        # La sincronizzazione del cubo può leggere molte righe: coda di analisi
+        return await sorgente.analizza(leggi_stats, motore)
+    
+    return await risposta_analitica(request, carica)
+
+def leggi_chart(conn, motore=analisi):
+    """Entrate e uscite degli ultimi 6 mesi, dal cubo 'motore' sincronizzato su conn"""
+    motore.sincronizza(conn)
+    date_correnti = conn.execute(queries.DATE_CORRENTI).fetchone()
+    
+    # Entrate e uscite aggregate per mese (sul cubo in memoria)
+    rows = motore.andamento_mensile(date.fromisoformat(date_correnti['sei_mesi_fa']))
     
     # Formatta i dati per il frontend
     mesi = []
@@ -320,14 +962,14 @@ def get_chart_data():
     mesi_nomi = ['Gen', 'Feb', 'Mar', 'Apr', 'Mag', 'Giu', 
                  'Lug', 'Ago', 'Set', 'Ott', 'Nov', 'Dic']
     
-    for row in rows:
+    for mese, totale_entrate, totale_uscite in rows:
         # Converte YYYY-MM in nome mese abbreviato
-        anno, mese_num = row['mese'].split('-')
+        anno, mese_num = mese.split('-')
         mese_nome = mesi_nomi[int(mese_num) - 1]
         
         mesi.append(mese_nome)
-        entrate.append(round(row['entrate'], 2))
-        uscite.append(round(row['uscite'], 2))
+        entrate.append(in_euro(totale_entrate))
+        uscite.append(in_euro(totale_uscite))
     
     return {
         'mesi': mesi,
@@ -335,172 +977,898 @@ def get_chart_data():
         'uscite': uscite
     }
 
+@app.get('/api/transazioni/chart')
+async def get_chart_data(request: Request):
+    """Prepara i dati per il grafico dell'andamento finanziario (ultimi 6 mesi)"""
+    async def carica(sorgente, motore):
+        return await sorgente.analizza(leggi_chart, motore)
+    
+    return await risposta_analitica(request, carica)
+
+
+# --- ENDPOINT ANALISI ---
+
+@app.get('/api/analytics')
+async def get_analytics(
+    request: Request,
+    periodo: str = Query('mese', pattern=f"^({'|'.join(PERIODI)})$"),
+    data_da: Optional[str] = Query(None, description='Data iniziale (YYYY-MM-DD), default 12 mesi fa'),
+    data_a: Optional[str] = Query(None, description='Data finale inclusa (YYYY-MM-DD), default oggi'),
+    conto_id: Optional[int] = None,
+    categoria: Optional[str] = None,
+    finestra: int = Query(3, ge=1, le=365, description='Periodi della media mobile')
+):
+    """
+    Analisi di entrate e uscite su un intervallo qualsiasi: serie per giorno,
+    settimana, mese o anno con media mobile e percentili, e ripartizione
+    per categoria e per conto
+    """
+    da = _data_parametro(data_da, 'data_da') if data_da else None
+    a = _data_parametro(data_a, 'data_a') if data_a else None
+    
+    def esegui(conn, motore):
+        motore.sincronizza(conn)
+        fine = a or date.fromisoformat(conn.execute(queries.DATE_CORRENTI).fetchone()['oggi'])
+        # Senza data iniziale: gli ultimi 12 mesi, dal primo giorno del mese
+        inizio = da or date(fine.year - (fine.month < 12), fine.month % 12 + 1, 1)
+        return motore.report(inizio, fine, periodo, conto_id, categoria, finestra)
+    
+    async def carica(sorgente, motore):
+        try:
+            return await sorgente.analizza(esegui, motore)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    
+    return await risposta_analitica(request, carica)
+
 
 # --- ENDPOINT INVESTIMENTI ---
 
+def leggi_investimenti(conn):
+    """Righe di tutti gli investimenti, dal più recente"""
+    return conn.execute('SELECT * FROM investimenti ORDER BY data_inizio DESC').fetchall()
+
 @app.get('/api/investimenti')
-def get_investimenti():
+async def get_investimenti(request: Request):
     """Ottiene la lista di tutti gli investimenti"""
-    conn = db.get_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM investimenti ORDER BY data_inizio DESC')
-    rows = cursor.fetchall()
-    conn.close()
+    async def carica():
+        rows = await db.leggi(leggi_investimenti)
+        with metriche.serializzazione():
+            return serializza_righe(rows, Investimento)
     
-    investimenti = [Investimento.from_row(row).to_dict() for row in rows]
-    return investimenti
+    return await cache.risposta(request, ('investimenti',), carica)
+
+@app.get('/api/investimenti/performance')
+async def get_investimenti_performance(
+    request: Request,
+    data_da: Optional[str] = Query(None, description='Data iniziale (YYYY-MM-DD), default il primo acquisto'),
+    data_a: Optional[str] = Query(None, description='Data finale inclusa (YYYY-MM-DD), default oggi')
+):
+    """
+    Rendimento del portafoglio sullo storico dei prezzi: valore iniziale e
+    finale, versamenti, rendimento ponderato per il tempo (TWR, %), tasso
+    interno di rendimento annuo (IRR, %) e ripartizione per tipo
+    """
+    da = _data_parametro(data_da, 'data_da') if data_da else None
+    a = _data_parametro(data_a, 'data_a') if data_a else None
+    
+    def esegui(conn):
+        valutazione.sincronizza(conn)
+        return valutazione.performance(da, a)
+    
+    async def carica():
+        try:
+            return await db.analizza(esegui)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    
+    return await cache.risposta(request, ('investimenti', 'prezzi'), carica)
+
+@app.get('/api/investimenti/performance/serie')
+async def get_investimenti_serie(
+    request: Request,
+    periodo: str = Query('giorno', pattern=f"^({'|'.join(PERIODI)})$"),
+    data_da: Optional[str] = Query(None, description='Data iniziale (YYYY-MM-DD), default il primo acquisto'),
+    data_a: Optional[str] = Query(None, description='Data finale inclusa (YYYY-MM-DD), default oggi')
+):
+    """Valore del portafoglio e capitale versato alla fine di ogni giorno, settimana, mese o anno"""
+    da = _data_parametro(data_da, 'data_da') if data_da else None
+    a = _data_parametro(data_a, 'data_a') if data_a else None
+    
+    def esegui(conn):
+        valutazione.sincronizza(conn)
+        return valutazione.serie(da, a, periodo)
+    
+    async def carica():
+        try:
+            return await db.analizza(esegui)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    
+    return await cache.risposta(request, ('investimenti', 'prezzi'), carica)
+
+async def applica_prezzi(righe):
+    """
+    Importa i prezzi e rivaluta gli investimenti quotati nella stessa
+    scrittura, poi avvisa i client. Restituisce il numero di prezzi cambiati
+    """
+    def esegui(conn):
+        cambiati = importa_prezzi(conn, righe)
+        rivalutati = rivaluta(conn) if cambiati else []
+        if not rivalutati:
+            return cambiati, None
+        # Con molti investimenti rivalutati i client rileggono la lista
+        investimenti = None
+        if len(rivalutati) <= MAX_RIGHE_EVENTO:
+            investimenti = [riga_evento(conn, 'investimenti', Investimento, id) for id in rivalutati]
+        return cambiati, {'investimenti': investimenti, **totali_evento(conn)}
+    
+    cambiati, evento = await db.scrivi(esegui)
+    if cambiati:
+        cache.invalida('prezzi', 'investimenti')
+    if evento:
+        eventi.pubblica('investimenti_rivalutati', evento)
+    return cambiati
 
 @app.post('/api/investimenti', status_code=201)
-def create_investimento(investimento: InvestimentoCreate):
+async def create_investimento(investimento: InvestimentoCreate):
     """Crea un nuovo investimento, preleva i fondi dal conto e registra la transazione"""
-    conn = db.get_connection()
-    cursor = conn.cursor()
-    
-    # Verifica che il conto esista
-    cursor.execute('SELECT saldo FROM conti WHERE id = ?', (investimento.conto_id,))
-    conto = cursor.fetchone()
-    
-    if not conto:
-        conn.close()
-        raise HTTPException(status_code=404, detail='Conto non trovato')
-    
-    # Verifica che ci siano fondi sufficienti
-    if conto['saldo'] < investimento.importo_iniziale:
-        conn.close()
-        raise HTTPException(
-            status_code=400, 
-            detail=f'Fondi insufficienti. Saldo disponibile: €{conto["saldo"]:.2f}'
-        )
+    importo_iniziale = centesimi_richiesta(investimento.importo_iniziale, 'importo_iniziale')
+    simbolo = investimento.simbolo.strip().upper() if investimento.simbolo else None
+    if (simbolo is None) != (investimento.quantita is None):
+        raise HTTPException(status_code=400, detail='simbolo e quantita vanno indicati insieme')
+    if investimento.quantita is not None and not investimento.quantita > 0:
+        raise HTTPException(status_code=400, detail='quantita deve essere positiva')
+    valore_iniziale = centesimi_richiesta(investimento.valore_attuale, 'valore_attuale')
+    
+    def esegui(conn):
+        cursor = conn.cursor()
+        
+        # Un investimento quotato vale subito all'ultimo prezzo noto, se c'è
+        valore_attuale = valore_iniziale
+        prezzo = ultimo_prezzo(conn, simbolo) if simbolo else None
+        if prezzo is not None:
+            valore_attuale = round(investimento.quantita * prezzo * 100)
+            if abs(valore_attuale) > MAX_CENTESIMI:
+                raise HTTPException(status_code=400, detail='quantita: valore dell\'investimento fuori dai limiti')
+        
+        # Preleva i fondi solo se bastano: controllo e aggiornamento sono una
+        # sola istruzione, quindi due investimenti contemporanei sullo stesso
+        # conto non possono superare entrambi il controllo del saldo
+        cursor.execute('''
+            UPDATE conti 
+            SET saldo = saldo - ? 
+            WHERE id = ? AND saldo >= ?
+        ''', (importo_iniziale, investimento.conto_id, importo_iniziale))
+        
+        if cursor.rowcount == 0:
+            cursor.execute('SELECT saldo FROM conti WHERE id = ?', (investimento.conto_id,))
+            conto = cursor.fetchone()
+            if not conto:
+                raise HTTPException(status_code=404, detail='Conto non trovato')
+            raise HTTPException(
+                status_code=400, 
+                detail=f'Fondi insufficienti. Saldo disponibile: €{in_euro(conto["saldo"]):.2f}'
+            )
+        
+        # Calcola il rendimento come differenza tra valore attuale e iniziale
+        rendimento = valore_attuale - importo_iniziale
+        
+        # Inserisce l'investimento
+        cursor.execute('''
+            INSERT INTO investimenti (conto_id, nome, tipo, importo_iniziale, valore_attuale, rendimento,
+                                      simbolo, quantita) 
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (
+            investimento.conto_id,
+            investimento.nome,
+            investimento.tipo,
+            importo_iniziale,
+            valore_attuale,
+            rendimento,
+            simbolo,
+            investimento.quantita
+        ))
+        investimento_id = cursor.lastrowid
+        
+        # Crea una transazione di uscita per registrare il movimento
+        cursor.execute('''
+            INSERT INTO transazioni (conto_id, tipo, categoria, importo, descrizione, data) 
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (
+            investimento.conto_id,
+            'uscita',
+            'Investimento',
+            -importo_iniziale,  # Importo negativo
+            f'Investimento in {investimento.nome}',
+            datetime.now().isoformat()
+        ))
+        
+        return {
+            'investimento': riga_evento(conn, 'investimenti', Investimento, investimento_id),
+            'transazione': riga_evento(conn, 'transazioni', Transazione, cursor.lastrowid),
+            **totali_evento(conn, investimento.conto_id)
+        }
     
-    # Calcola il rendimento come differenza tra valore attuale e iniziale
-    rendimento = investimento.valore_attuale - investimento.importo_iniziale
-    
-    # Inserisce l'investimento
-    cursor.execute('''
-        INSERT INTO investimenti (conto_id, nome, tipo, importo_iniziale, valore_attuale, rendimento) 
-        VALUES (?, ?, ?, ?, ?, ?)
-    ''', (
-        investimento.conto_id,
-        investimento.nome,
-        investimento.tipo,
-        investimento.importo_iniziale,
-        investimento.valore_attuale,
-        rendimento
-    ))
-    investimento_id = cursor.lastrowid
-    
-    # Crea una transazione di uscita per registrare il movimento
-    cursor.execute('''
-        INSERT INTO transazioni (conto_id, tipo, categoria, importo, descrizione, data) 
-        VALUES (?, ?, ?, ?, ?, ?)
-    ''', (
-        investimento.conto_id,
-        'uscita',
-        'Investimento',
-        -investimento.importo_iniziale,  # Importo negativo
-        f'Investimento in {investimento.nome}',
-        datetime.now().isoformat()
-    ))
-
-    # Aggiorna il saldo usando SOMMA ALGEBRICA (come le transazioni normali)
-    cursor.execute('''
-        UPDATE conti 
-        SET saldo = saldo + ? 
-        WHERE id = ?
-    ''', (-investimento.importo_iniziale, investimento.conto_id))  # Passa valore negativo
-    
-    conn.commit()
-    conn.close()
-    
-    return {'id': investimento_id, 'message': 'Investimento creato con successo'}
+    evento = await db.scrivi(esegui)
+    cache.invalida('investimenti', 'transazioni', 'conti')
+    eventi.pubblica('investimento_creato', evento)
+    
+    return {'id': evento['investimento']['id'], 'message': 'Investimento creato con successo'}
 
 @app.delete('/api/investimenti/{investimento_id}')
-def delete_investimento(investimento_id: int):
+async def delete_investimento(investimento_id: int):
     """Elimina un investimento"""
-    conn = db.get_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute('DELETE FROM investimenti WHERE id = ?', (investimento_id,))
-    conn.commit()
+    def esegui(conn):
+        cursor = conn.cursor()
+        
+        cursor.execute('DELETE FROM investimenti WHERE id = ?', (investimento_id,))
+        
+        return cursor.rowcount, totali_evento(conn)
     
-    rows_affected = cursor.rowcount
-    conn.close()
+    rows_affected, evento = await db.scrivi(esegui)
+    cache.invalida('investimenti')
     
     if rows_affected > 0:
+        eventi.pubblica('investimento_eliminato', {'id': investimento_id, **evento})
         return {'message': 'Investimento eliminato con successo'}
     raise HTTPException(status_code=404, detail='Investimento non trovato')
 
 
 # --- ENDPOINT OBIETTIVI ---
 
+def leggi_obiettivi(conn):
+    """Righe di tutti gli obiettivi, prima quelli da completare"""
+    return conn.execute('SELECT * FROM obiettivi ORDER BY completato, data_creazione DESC').fetchall()
+
+# Gli importi degli obiettivi collegati cambiano con transazioni e saldi dei conti
+TABELLE_OBIETTIVI = ('obiettivi', 'transazioni', 'conti')
+
 @app.get('/api/obiettivi')
-def get_obiettivi():
+async def get_obiettivi(request: Request):
     """Ottiene tutti gli obiettivi (ordinati per completamento)"""
-    conn = db.get_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM obiettivi ORDER BY completato, data_creazione DESC')
-    rows = cursor.fetchall()
-    conn.close()
+    async def carica():
+        rows = await db.leggi(leggi_obiettivi)
+        with metriche.serializzazione():
+            return serializza_righe(rows, Obiettivo)
     
-    obiettivi = [Obiettivo.from_row(row).to_dict() for row in rows]
-    return obiettivi
+    return await cache.risposta(request, TABELLE_OBIETTIVI, carica)
 
 @app.post('/api/obiettivi', status_code=201)
-def create_obiettivo(obiettivo: ObiettivoCreate):
-    """Crea un nuovo obiettivo di risparmio"""
-    conn = db.get_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO obiettivi (titolo, descrizione, importo_target, importo_attuale) 
-        VALUES (?, ?, ?, ?)
-    ''', (
-        obiettivo.titolo,
-        obiettivo.descrizione,
-        obiettivo.importo_target,
-        obiettivo.importo_attuale
-    ))
-    conn.commit()
-    
-    obiettivo_id = cursor.lastrowid
-    conn.close()
-    
-    return {'id': obiettivo_id, 'message': 'Obiettivo creato con successo'}
+async def create_obiettivo(obiettivo: ObiettivoCreate):
+    """
+    Crea un nuovo obiettivo di risparmio. Se è collegato a un conto o a una
+    categoria l'importo attuale parte dal saldo del conto o dalle transazioni
+    della categoria di oggi, e da lì in poi è aggiornato dal database
+    """
+    categoria = (obiettivo.categoria or '').strip() or None
+    importo_iniziale = centesimi_richiesta(obiettivo.importo_attuale, 'importo_attuale')
+    importo_target = centesimi_richiesta(obiettivo.importo_target, 'importo_target')
+    
+    def esegui(conn):
+        cursor = conn.cursor()
+        importo_attuale = importo_iniziale
+        if obiettivo.conto_id is not None:
+            conto = cursor.execute('SELECT saldo FROM conti WHERE id = ?', (obiettivo.conto_id,)).fetchone()
+            if not conto:
+                raise HTTPException(status_code=404, detail='Conto non trovato')
+            importo_attuale = conto['saldo']
+        if categoria is not None:
+            # Stesso criterio dei trigger: transazioni dal giorno di creazione
+            importo_attuale, = cursor.execute('''
+                SELECT COALESCE(SUM(abs(importo)), 0) FROM transazioni
+                WHERE categoria = ? AND (? IS NULL OR conto_id = ?) AND substr(data, 1, 10) >= date('now')
+            ''', (categoria, obiettivo.conto_id, obiettivo.conto_id)).fetchone()
+        cursor.execute('''
+            INSERT INTO obiettivi (titolo, descrizione, importo_target, importo_attuale,
+                                   completato, conto_id, categoria)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (
+            obiettivo.titolo,
+            obiettivo.descrizione,
+            importo_target,
+            importo_attuale,
+            # Solo per quelli collegati: gli altri si completano con l'aggiornamento
+            (obiettivo.conto_id is not None or categoria is not None) and importo_attuale >= importo_target,
+            obiettivo.conto_id,
+            categoria
+        ))
+        
+        return {'obiettivo': riga_evento(conn, 'obiettivi', Obiettivo, cursor.lastrowid), **totali_evento(conn)}
+    
+    evento = await db.scrivi(esegui)
+    cache.invalida('obiettivi')
+    eventi.pubblica('obiettivo_creato', evento)
+    
+    return {'id': evento['obiettivo']['id'], 'message': 'Obiettivo creato con successo'}
 
 @app.put('/api/obiettivi/{obiettivo_id}')
-def update_obiettivo(obiettivo_id: int, obiettivo: ObiettivoUpdate):
+async def update_obiettivo(obiettivo_id: int, obiettivo: ObiettivoUpdate):
     """Aggiorna l'importo di un obiettivo e segna come completato se raggiunto"""
-    conn = db.get_connection()
-    cursor = conn.cursor()
+    importo_attuale = centesimi_richiesta(obiettivo.importo_attuale, 'importo_attuale')
     
-    # Aggiorna l'importo e controlla automaticamente se è stato raggiunto il target
-    cursor.execute('''
-        UPDATE obiettivi 
-        SET importo_attuale = ?, 
-            completato = CASE WHEN ? >= importo_target THEN 1 ELSE 0 END
-        WHERE id = ?
-    ''', (obiettivo.importo_attuale, obiettivo.importo_attuale, obiettivo_id))
+    def esegui(conn):
+        cursor = conn.cursor()
+        collegato = cursor.execute(
+            'SELECT conto_id IS NOT NULL OR categoria IS NOT NULL FROM obiettivi WHERE id = ?', (obiettivo_id,)
+        ).fetchone()
+        if collegato and collegato[0]:
+            raise HTTPException(
+                status_code=400,
+                detail="L'importo di un obiettivo collegato a un conto o a una categoria è aggiornato automaticamente"
+            )
+        
+        # Aggiorna l'importo e controlla automaticamente se è stato raggiunto il target
+        cursor.execute('''
+            UPDATE obiettivi 
+            SET importo_attuale = ?, 
+                completato = CASE WHEN ? >= importo_target THEN 1 ELSE 0 END
+            WHERE id = ?
+        ''', (importo_attuale, importo_attuale, obiettivo_id))
+        
+        return {'obiettivo': riga_evento(conn, 'obiettivi', Obiettivo, obiettivo_id), **totali_evento(conn)}
     
-    conn.commit()
-    conn.close()
+    evento = await db.scrivi(esegui)
+    cache.invalida('obiettivi')
+    if evento['obiettivo']:
+        eventi.pubblica('obiettivo_aggiornato', evento)
     
     return {'message': 'Obiettivo aggiornato con successo'}
 
 @app.delete('/api/obiettivi/{obiettivo_id}')
-def delete_obiettivo(obiettivo_id: int):
+async def delete_obiettivo(obiettivo_id: int):
     """Elimina un obiettivo"""
-    conn = db.get_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute('DELETE FROM obiettivi WHERE id = ?', (obiettivo_id,))
-    conn.commit()
+    def esegui(conn):
+        cursor = conn.cursor()
+        
+        cursor.execute('DELETE FROM obiettivi WHERE id = ?', (obiettivo_id,))
+        
+        return cursor.rowcount, totali_evento(conn)
     
-    rows_affected = cursor.rowcount
-    conn.close()
+    rows_affected, evento = await db.scrivi(esegui)
+    cache.invalida('obiettivi')
     
     if rows_affected > 0:
+        eventi.pubblica('obiettivo_eliminato', {'id': obiettivo_id, **evento})
         return {'message': 'Obiettivo eliminato con successo'}
     raise HTTPException(status_code=404, detail='Obiettivo non trovato')
 
+def leggi_previsioni(conn, bande=()):
+    """
+    Obiettivi e previsione del loro completamento, dal cubo analitico
+    sincronizzato su conn: lo storico di tutti gli obiettivi è letto con una
+    sola chiamata e le simulazioni sono fatte a blocchi (vedi previsioni.py).
+    Le bande mensili solo per gli obiettivi con id in 'bande'
+    """
+    analisi.sincronizza(conn)
+    obiettivi = leggi_obiettivi(conn)
+    oggi = date.fromisoformat(conn.execute(queries.DATE_CORRENTI).fetchone()['oggi'])
+    mese_corrente = (oggi.year - 1970) * 12 + oggi.month - 1
+    # Solo mesi conclusi: quello in corso sottostimerebbe il flusso
+    entrate, uscite = analisi.flussi_mensili(
+        [richiesta_flussi(obiettivo) for obiettivo in obiettivi], mese_corrente - MESI_STORICO, mese_corrente - 1
+    )
+    flussi = [flusso_obiettivo(obiettivo, e, u) for obiettivo, e, u in zip(obiettivi, entrate, uscite)]
+    return obiettivi, previsioni.prevedi(obiettivi, flussi, mese_corrente, bande)
+
+@app.get('/api/obiettivi/previsioni')
+async def get_previsioni_obiettivi(request: Request):
+    """
+    Previsione del completamento di tutti gli obiettivi: mese di
+    completamento al 10°, 50° e 90° percentile e probabilità di arrivarci
+    entro l'orizzonte, da una simulazione Monte Carlo sullo storico mensile
+    """
+    async def carica():
+        obiettivi, risultati = await db.analizza(leggi_previsioni)
+        return [MotorePrevisioni.in_risposta(obiettivo, risultati[obiettivo['id']]) for obiettivo in obiettivi]
+    
+    return await cache.risposta(request, TABELLE_OBIETTIVI, carica)
+
+@app.get('/api/obiettivi/{obiettivo_id}/previsione')
+async def get_previsione_obiettivo(request: Request, obiettivo_id: int):
+    """Previsione di un obiettivo con le bande mensili (percentili) dell'importo previsto"""
+    async def carica():
+        obiettivi, risultati = await db.analizza(lambda conn: leggi_previsioni(conn, {obiettivo_id}))
+        for obiettivo in obiettivi:
+            if obiettivo['id'] == obiettivo_id:
+                return MotorePrevisioni.in_risposta(obiettivo, risultati[obiettivo_id], bande=True)
+        raise HTTPException(status_code=404, detail='Obiettivo non trovato')
+    
+    return await cache.risposta(request, TABELLE_OBIETTIVI, carica)
+
+
+# --- ENDPOINT RICORRENZE ---
+
+def leggi_ricorrenze(conn):
+    """Righe di tutte le ricorrenze, prima quelle con l'occorrenza più vicina (le finite in fondo)"""
+    return conn.execute(
+        'SELECT * FROM ricorrenze ORDER BY prossima IS NULL, prossima, id'
+    ).fetchall()
+
+@app.get('/api/ricorrenze')
+async def get_ricorrenze(request: Request):
+    """Ottiene tutte le transazioni ricorrenti con la data della prossima occorrenza"""
+    async def carica():
+        rows = await db.leggi(leggi_ricorrenze)
+        with metriche.serializzazione():
+            return serializza_righe(rows, Ricorrenza)
+    
+    return await cache.risposta(request, ('ricorrenze',), carica)
+
+@app.post('/api/ricorrenze', status_code=201)
+async def create_ricorrenza(ricorrenza: RicorrenzaCreate):
+    """
+    Crea una transazione ricorrente. Le occorrenze già scadute (data_inizio
+    nel passato o oggi) vengono create subito dal pianificatore
+    """
+    dati = ricorrenza.dict()
+    dati['importo'] = centesimi_richiesta(dati['importo'], 'importo')
+    dati['data_inizio'] = dati['data_inizio'] or datetime.now(timezone.utc).date().isoformat()
+    try:
+        dati = ricorrenze.valida_ricorrenza(dati)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    def esegui(conn):
+        cursor = conn.cursor()
+        if not cursor.execute('SELECT 1 FROM conti WHERE id = ?', (dati['conto_id'],)).fetchone():
+            raise HTTPException(status_code=404, detail='Conto non trovato')
+        cursor.execute('''
+            INSERT INTO ricorrenze (conto_id, tipo, categoria, importo, descrizione, frequenza,
+                                    intervallo, data_inizio, data_fine, max_occorrenze, prossima)
+            VALUES (:conto_id, :tipo, :categoria, :importo, :descrizione, :frequenza,
+                    :intervallo, :data_inizio, :data_fine, :max_occorrenze, :prossima)
+        ''', dati)
+        return cursor.lastrowid
+    
+    ricorrenza_id = await db.scrivi(esegui)
+    cache.invalida('ricorrenze')
+    sveglia_ricorrenze.set()
+    
+    return {'id': ricorrenza_id, 'prossima': dati['prossima'], 'message': 'Ricorrenza creata con successo'}
+
+@app.delete('/api/ricorrenze/{ricorrenza_id}')
+async def delete_ricorrenza(ricorrenza_id: int):
+    """Elimina una ricorrenza (le transazioni già create restano)"""
+    def esegui(conn):
+        cursor = conn.cursor()
+        cursor.execute('DELETE FROM ricorrenze WHERE id = ?', (ricorrenza_id,))
+        return cursor.rowcount
+    
+    rows_affected = await db.scrivi(esegui)
+    cache.invalida('ricorrenze')
+    
+    if rows_affected > 0:
+        return {'message': 'Ricorrenza eliminata con successo'}
+    raise HTTPException(status_code=404, detail='Ricorrenza non trovata')
+
+
+# --- ENDPOINT BUDGET ---
+
+# La spesa dei budget cambia con le transazioni (contatori dei trigger)
+TABELLE_BUDGET = ('budget', 'transazioni')
+
+@app.get('/api/budget')
+async def get_budget(request: Request):
+    """
+    Tutti i budget con spesa, residuo e percentuale del periodo corrente,
+    letti dai contatori per periodo (una lettura per budget)
+    """
+    async def carica():
+        rows = await db.leggi(lambda conn: conn.execute(queries.BUDGET_STATO + ' ORDER BY b.id').fetchall())
+        return [budget.stato(row) for row in rows]
+    
+    return await cache.risposta(request, TABELLE_BUDGET, carica)
+
+@app.get('/api/budget/avvisi')
+async def get_avvisi_budget(request: Request, limit: int = Query(50, ge=1, le=1000)):
+    """Ultimi avvisi di soglia e di superamento dei budget, dal più recente"""
+    async def carica():
+        rows = await db.leggi(
+            lambda conn: conn.execute('SELECT * FROM avvisi_budget ORDER BY id DESC LIMIT ?', (limit,)).fetchall()
+        )
+        return serializza_righe(rows, AvvisoBudget)
+    
+    return await cache.risposta(request, TABELLE_BUDGET, carica)
+
+@app.get('/api/budget/{budget_id}')
+async def get_budget_singolo(request: Request, budget_id: int):
+    """Un budget con la spesa del periodo corrente"""
+    async def carica():
+        row = await db.leggi(
+            lambda conn: conn.execute(queries.BUDGET_STATO + ' WHERE b.id = ?', (budget_id,)).fetchone()
+        )
+        if not row:
+            raise HTTPException(status_code=404, detail='Budget non trovato')
+        return budget.stato(row)
+    
+    return await cache.risposta(request, TABELLE_BUDGET, carica)
+
+@app.post('/api/budget', status_code=201)
+async def create_budget(nuovo: BudgetCreate):
+    """
+    Crea un budget. I contatori vengono calcolati una volta dalle uscite già
+    registrate; se il periodo corrente è già oltre la soglia parte subito l'avviso
+    """
+    dati = nuovo.dict()
+    dati['limite'] = centesimi_richiesta(dati['limite'], 'limite')
+    try:
+        dati = budget.valida_budget(dati)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    def esegui(conn):
+        if dati['conto_id'] is not None and not conn.execute(
+            'SELECT 1 FROM conti WHERE id = ?', (dati['conto_id'],)
+        ).fetchone():
+            raise HTTPException(status_code=404, detail='Conto non trovato')
+        ultimo_avviso = budget.ultimo_avviso(conn)
+        budget_id = budget.crea_budget(conn, dati)
+        return budget_id, budget.avvisi_dopo(conn, ultimo_avviso)
+    
+    budget_id, avvisi = await db.scrivi(esegui)
+    cache.invalida('budget')
+    pubblica_avvisi_budget(avvisi)
+    
+    return {'id': budget_id, 'message': 'Budget creato con successo'}
+
+@app.put('/api/budget/{budget_id}')
+async def update_budget(budget_id: int, modifica: BudgetUpdate):
+    """Cambia limite e/o soglia di avviso di un budget (i contatori restano validi)"""
+    limite = centesimi_richiesta(modifica.limite, 'limite') if modifica.limite is not None else None
+    if limite is not None and limite <= 0:
+        raise HTTPException(status_code=400, detail='limite deve essere maggiore di zero')
+    if modifica.soglia is not None and not 1 <= modifica.soglia <= 100:
+        raise HTTPException(status_code=400, detail='soglia deve essere una percentuale tra 1 e 100')
+    
+    def esegui(conn):
+        return conn.execute(
+            'UPDATE budget SET limite = COALESCE(?, limite), soglia = COALESCE(?, soglia) WHERE id = ?',
+            (limite, modifica.soglia, budget_id)
+        ).rowcount
+    
+    rows_affected = await db.scrivi(esegui)
+    cache.invalida('budget')
+    
+    if rows_affected > 0:
+        return {'message': 'Budget aggiornato con successo'}
+    raise HTTPException(status_code=404, detail='Budget non trovato')
+
+@app.delete('/api/budget/{budget_id}')
+async def delete_budget(budget_id: int):
+    """Elimina un budget con i suoi contatori e avvisi"""
+    rows_affected = await db.scrivi(budget.elimina_budget, budget_id)
+    cache.invalida('budget')
+    
+    if rows_affected > 0:
+        return {'message': 'Budget eliminato con successo'}
+    raise HTTPException(status_code=404, detail='Budget non trovato')
+
+
+# --- ENDPOINT REGOLE DI CATEGORIZZAZIONE ---
+
+# Righe al massimo per una prova delle regole
+MAX_RIGHE_PROVA = 100000
+
+def regola_valida(regola):
+    """Campi della regola pronti per il database (importi in centesimi), 400 se non valida"""
+    dati = regola.dict()
+    for campo in ('importo_min', 'importo_max'):
+        if dati[campo] is not None:
+            dati[campo] = centesimi_richiesta(dati[campo], campo)
+    try:
+        return valida_regola(dati)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get('/api/regole')
+async def get_regole(request: Request):
+    """Ottiene le regole di categorizzazione nell'ordine in cui vengono applicate"""
+    async def carica():
+        rows = await db.leggi(lambda conn: conn.execute(queries.REGOLE_CATEGORIE).fetchall())
+        with metriche.serializzazione():
+            return serializza_righe(rows, RegolaCategoria)
+    
+    return await cache.risposta(request, ('regole_categorie',), carica)
+
+@app.post('/api/regole', status_code=201)
+async def create_regola(regola: RegolaCreate):
+    """Crea una regola di categorizzazione"""
+    dati = regola_valida(regola)
+    
+    def esegui(conn):
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT INTO regole_categorie (tipo, modello, importo_min, importo_max, categoria, priorita)
+            VALUES (:tipo, :modello, :importo_min, :importo_max, :categoria, :priorita)
+        ''', dati)
+        return cursor.lastrowid
+    
+    regola_id = await db.scrivi(esegui)
+    cache.invalida('regole_categorie')
+    
+    return {'id': regola_id, 'message': 'Regola creata con successo'}
+
+@app.put('/api/regole/{regola_id}')
+async def update_regola(regola_id: int, regola: RegolaCreate):
+    """Sostituisce una regola di categorizzazione"""
+    dati = regola_valida(regola)
+    
+    def esegui(conn):
+        cursor = conn.cursor()
+        cursor.execute('''
+            UPDATE regole_categorie
+            SET tipo = :tipo, modello = :modello, importo_min = :importo_min,
+                importo_max = :importo_max, categoria = :categoria, priorita = :priorita
+            WHERE id = :id
+        ''', {**dati, 'id': regola_id})
+        return cursor.rowcount
+    
+    rows_affected = await db.scrivi(esegui)
+    cache.invalida('regole_categorie')
+    
+    if rows_affected > 0:
+        return {'message': 'Regola aggiornata con successo'}
+    raise HTTPException(status_code=404, detail='Regola non trovata')
+
+@app.delete('/api/regole/{regola_id}')
+async def delete_regola(regola_id: int):
+    """Elimina una regola di categorizzazione"""
+    def esegui(conn):
+        cursor = conn.cursor()
+        cursor.execute('DELETE FROM regole_categorie WHERE id = ?', (regola_id,))
+        return cursor.rowcount
+    
+    rows_affected = await db.scrivi(esegui)
+    cache.invalida('regole_categorie')
+    
+    if rows_affected > 0:
+        return {'message': 'Regola eliminata con successo'}
+    raise HTTPException(status_code=404, detail='Regola non trovata')
+
+@app.post('/api/regole/prova')
+async def prova_regole(prova: ProvaRegole):
+    """
+    Categorizza le righe indicate con le regole salvate e il modello appreso,
+    senza scrivere nulla: per ogni riga categoria, regola applicata e confidenza
+    """
+    if len(prova.transazioni) > MAX_RIGHE_PROVA:
+        raise HTTPException(status_code=400, detail=f'Al massimo {MAX_RIGHE_PROVA} righe per prova')
+    righe = [(riga.descrizione, centesimi_richiesta(riga.importo, 'importo')) for riga in prova.transazioni]
+    
+    def esegui(conn):
+        categorie.sincronizza(conn)
+        inizio = time.perf_counter()
+        esiti = categorie.classifica(righe)
+        return esiti, time.perf_counter() - inizio
+    
+    # La classificazione di molte righe non deve fermare il ciclo degli eventi
+    esiti, durata = await db.analizza(esegui)
+    risultati = [
+        {
+            'categoria': categoria,
+            'origine': 'regola' if regola_id is not None else 'modello' if categoria else None,
+            'regola_id': regola_id,
+            'confidenza': confidenza
+        }
+        for categoria, regola_id, confidenza in esiti
+    ]
+    return RispostaJSON({
+        'risultati': risultati,
+        'categorizzate': sum(1 for r in risultati if r['categoria']),
+        'durata_ms': round(durata * 1000, 3)
+    })
+
+
+# --- BOOTSTRAP ---
+
+# Sezioni di /api/bootstrap: funzione di lettura (connessione, limite
+# delle transazioni -> dati della risposta), tabelle da cui dipende il
+# risultato (per la cache) e campi selezionabili. Per 'transazioni' i campi
+# si riferiscono alle righe della pagina ('elenco').
+SEZIONI_BOOTSTRAP = {
+    'dashboard': {
+        'leggi': lambda conn, limit: leggi_dashboard(conn),
+        'tabelle': ('conti', 'transazioni', 'investimenti', 'obiettivi'),
+        'campi': ('saldo_totale', 'variazione_mensile', 'investimenti', 'spese_mensili', 'obiettivi'),
+    },
+    'conti': {
+        'leggi': lambda conn, limit: [Conto.riga_in_dict(row) for row in leggi_conti(conn)],
+        'tabelle': ('conti',),
+        'campi': tuple(Conto().to_dict()),
+    },
+    'transazioni': {
+        'leggi': lambda conn, limit: leggi_pagina_transazioni(conn, {}, None, limit),
+        'tabelle': ('transazioni',),
+        'campi': tuple(Transazione().to_dict()),
+        'elenco': 'transazioni',
+    },
+    'investimenti': {
+        'leggi': lambda conn, limit: [Investimento.riga_in_dict(row) for row in leggi_investimenti(conn)],
+        'tabelle': ('investimenti',),
+        'campi': tuple(Investimento().to_dict()),
+    },
+    'obiettivi': {
+        'leggi': lambda conn, limit: [Obiettivo.riga_in_dict(row) for row in leggi_obiettivi(conn)],
+        'tabelle': TABELLE_OBIETTIVI,
+        'campi': tuple(Obiettivo().to_dict()),
+    },
+    'stats': {
+        'leggi': lambda conn, limit: leggi_stats(conn),
+        'tabelle': ('transazioni',),
+        'campi': ('categoria', 'totale', 'count'),
+    },
+    'chart': {
+        'leggi': lambda conn, limit: leggi_chart(conn),
+        'tabelle': ('transazioni',),
+        'campi': ('mesi', 'entrate', 'uscite'),
+    },
+}
+
+def _seleziona_campi(dati, campi):
+    """Tiene solo i campi indicati di un oggetto o di ogni oggetto di una lista"""
+    if isinstance(dati, list):
+        return [{campo: voce[campo] for campo in campi} for voce in dati]
+    return {campo: dati[campo] for campo in campi}
+
+@app.get('/api/bootstrap')
+async def get_bootstrap(
+    request: Request,
+    sezioni: str = Query(','.join(SEZIONI_BOOTSTRAP), description='Sezioni richieste, separate da virgola'),
+    campi: Optional[str] = Query(None, description="Campi da restituire come 'sezione.campo', separati da virgola"),
+    limit: int = Query(50, ge=1, le=500, description='Transazioni della prima pagina')
+):
+    """
+    Dati iniziali del frontend in una sola richiesta: le sezioni richieste
+    (stesso formato degli endpoint dedicati) lette con una sola connessione
+    e dentro una sola transazione di lettura, quindi coerenti tra loro.
+    """
+    nomi = list(dict.fromkeys(nome.strip() for nome in sezioni.split(',') if nome.strip()))
+    sconosciute = [nome for nome in nomi if nome not in SEZIONI_BOOTSTRAP]
+    if not nomi or sconosciute:
+        raise HTTPException(status_code=400, detail=f"Sezioni non valide: {', '.join(sconosciute) or sezioni}")
+    
+    # Campi per sezione: 'transazioni.importo,conti.nome' -> {'transazioni': ['importo'], ...}
+    selezione = {}
+    for voce in (campi or '').split(','):
+        if not voce.strip():
+            continue
+        nome, _, campo = voce.strip().partition('.')
+        if nome not in nomi or campo not in SEZIONI_BOOTSTRAP[nome]['campi']:
+            raise HTTPException(status_code=400, detail=f"Campo non valido: '{voce.strip()}'")
+        selezione.setdefault(nome, []).append(campo)
+    
+    def esegui(conn):
+        # Una transazione di lettura esplicita: in WAL tutte le query vedono
+        # lo stesso snapshot, anche se nel frattempo arrivano scritture
+        conn.execute('BEGIN')
+        try:
+            risultato = {}
+            for nome in nomi:
+                sezione = SEZIONI_BOOTSTRAP[nome]
+                dati = sezione['leggi'](conn, limit)
+                if nome in selezione:
+                    elenco = sezione.get('elenco')
+                    if elenco:
+                        dati = {**dati, elenco: _seleziona_campi(dati[elenco], selezione[nome])}
+                    else:
+                        dati = _seleziona_campi(dati, selezione[nome])
+                risultato[nome] = dati
+            return risultato
+        finally:
+            conn.rollback()
+    
+    async def carica():
+        # Statistiche e grafico sincronizzano il cubo analitico: coda di analisi
+        if 'stats' in nomi or 'chart' in nomi:
+            return await db.analizza(esegui)
+        return await db.leggi(esegui)
+    
+    tabelle = sorted({tabella for nome in nomi for tabella in SEZIONI_BOOTSTRAP[nome]['tabelle']})
+    return await cache.risposta(request, tabelle, carica)
+
+
+# --- ENDPOINT SISTEMA ---
+
+@app.get('/api/sistema/pool')
+async def get_pool_stats():
+    """Restituisce le metriche del pool di connessioni e delle code di esecuzione"""
+    return {**db.pool.stats(), 'code': db.code_stats()}
+
+@app.get('/api/sistema/cache')
+async def get_cache_stats():
+    """Restituisce i contatori della cache delle risposte (hit, miss, 304)"""
+    return cache.stats()
+
+@app.get('/api/sistema/eventi')
+async def get_eventi_stats():
+    """Restituisce i contatori del bus degli eventi (client collegati, eventi inviati)"""
+    return eventi.stats()
+
+@app.get('/api/sistema/categorizzazione')
+async def get_categorizzazione_stats():
+    """Restituisce le dimensioni dell'indice delle regole e del modello appreso"""
+    return categorie.stats()
+
+@app.get('/api/sistema/previsioni')
+async def get_previsioni_stats():
+    """Restituisce i contatori delle previsioni (simulate o riusate dalla memoria)"""
+    return previsioni.stats()
+
+@app.get('/api/sistema/ricorrenze')
+async def get_ricorrenze_stats():
+    """Restituisce il detentore del lease, le ricorrenze scadute e i contatori del pianificatore"""
+    def leggi(conn):
+        lease = conn.execute(
+            'SELECT proprietario, scadenza FROM lease WHERE nome = ?', (ricorrenze.LEASE_RICORRENZE,)
+        ).fetchone()
+        scadute, = conn.execute(queries.RICORRENZE_CONTA_SCADUTE).fetchone()
+        attive, = conn.execute('SELECT COUNT(*) FROM ricorrenze WHERE prossima IS NOT NULL').fetchone()
+        return lease, scadute, attive
+    
+    lease, scadute, attive = await db.leggi(leggi)
+    return {
+        'processo': IDENTITA_PROCESSO,
+        'lease': {
+            'proprietario': lease['proprietario'],
+            'scadenza': datetime.fromtimestamp(lease['scadenza'], timezone.utc).isoformat(timespec='seconds')
+        } if lease else None,
+        'attive': attive,
+        'scadute': scadute,
+        'intervallo_secondi': INTERVALLO_RICORRENZE,
+        **stato_ricorrenze
+    }
+
+@app.get('/api/sistema/replica')
+async def get_replica_stats():
+    """Restituisce lo stato della copia di sola lettura (ritardo, aggiornamenti, letture)"""
+    if replica is None:
+        raise HTTPException(status_code=404, detail='Replica non attiva (FINANCE_REPLICA)')
+    return {**replica.stats(), 'cubo': analisi_replica.stats()}
+
+@app.get('/api/sistema/riconciliazione')
+async def get_riconciliazione():
+    """Confronta i saldi dei conti con il registro storico e le transazioni (importi in euro)"""
+    esito = await db.analizza(registro.riconcilia)
+    campi_importo = ('saldo', 'saldo_registro', 'saldo_transazioni', 'memorizzato', 'atteso')
+    return {
+        sezione: [
+            {campo: in_euro(valore) if campo in campi_importo else valore for campo, valore in voce.items()}
+            for voce in voci
+        ]
+        for sezione, voci in esito.items()
+    }
+
+@app.get('/metrics', response_class=PlainTextResponse)
+async def get_metrics():
+    """Metriche di richieste, query, pool e cache nel formato di Prometheus"""
+    pool = db.pool.stats()
+    stats_cache = cache.stats()
+    valori = {
+        'financehub_pool_connessioni_aperte': ('gauge', 'Connessioni SQLite aperte dal pool', pool['connessioni_aperte']),
+        'financehub_pool_connessioni_in_uso': ('gauge', 'Connessioni prestate in questo momento', pool['connessioni_in_uso']),
+        'financehub_pool_timeout_totale': ('counter', 'Richieste di connessione scadute', pool['timeout']),
+        'financehub_cache_hit_totale': ('counter', 'Risposte servite dalla cache', stats_cache['hit']),
+        'financehub_cache_miss_totale': ('counter', 'Risposte calcolate perché assenti o scadute in cache', stats_cache['miss']),
+        'financehub_cache_voci': ('gauge', 'Voci presenti nella cache delle risposte', stats_cache['voci']),
+    }
+    valori['financehub_analisi_righe_cubo'] = ('gauge', 'Righe (giorno, conto, categoria) del cubo analitico', analisi.stats()['righe'])
+    for nome, coda in db.code_stats().items():
+        valori[f'financehub_coda_{nome}_in_corso'] = ('gauge', f'Lavori in corso o in attesa sulla coda {nome}', coda['in_corso'])
+    scrittura = db.code_stats()['scrittura']
+    valori['financehub_scrittura_gruppi_totale'] = ('counter', 'Transazioni di scrittura confermate (commit di gruppo)', scrittura['gruppi'])
+    valori['financehub_scrittura_ritentativi_totale'] = ('counter', 'Ritentativi per database occupato', scrittura['ritentativi'])
+    stats_eventi = eventi.stats()
+    valori['financehub_eventi_abbonati'] = ('gauge', 'Client collegati al flusso /api/eventi', stats_eventi['abbonati'])
+    valori['financehub_eventi_pubblicati_totale'] = ('counter', 'Eventi di modifica pubblicati', stats_eventi['pubblicati'])
+    valori['financehub_eventi_ricariche_totale'] = ('counter', "Client a cui è stato chiesto di rileggere i dati", stats_eventi['ricariche'])
+    if replica:
+        stats_replica = replica.stats()
+        valori['financehub_replica_ritardo_secondi'] = ('gauge', 'Età della copia di sola lettura', stats_replica['ritardo_secondi'] or 0)
+        valori['financehub_replica_aggiornamenti_totale'] = ('counter', 'Copie del database eseguite', stats_replica['aggiornamenti'])
+        valori['financehub_replica_righe_cubo'] = ('gauge', 'Righe del cubo analitico caricato dalla replica', analisi_replica.stats()['righe'])
+    return PlainTextResponse(metriche.esporta(valori), media_type='text/plain; version=0.0.4')
+
 
 # --- AVVIO SERVER ---
 
@@ -508,4 +1876,5 @@ if __name__ == '__main__':
     import uvicorn
     print("Server FastAPI avviato su http://localhost:5000")
     print("Documentazione API disponibile su: http://localhost:5000/docs")
-    uvicorn.run(app, host="0.0.0.0", port=5000)
\ No newline at end of file
+    # I flussi di /api/eventi restano aperti: allo spegnimento non si aspettano oltre 5 secondi
+    uvicorn.run(app, host="0.0.0.0", port=5000, timeout_graceful_shutdown=5)
\ No newline at end of file
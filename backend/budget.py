@@ -0,0 +1,92 @@
+"""
+Budget di spesa per categoria e/o conto, mensili o settimanali.
+
+La spesa di ogni budget non viene ricalcolata dalle transazioni: la tabella
+'budget_spese' ha un contatore per (budget, primo giorno del periodo),
+aggiornato dai trigger su 'transazioni' nella stessa transazione di ogni
+scrittura (creazione, eliminazione, importazione, ricorrenze). Lo stato di
+tutti i budget è una lettura per budget sulla chiave primaria dei
+contatori, qualunque sia il numero di transazioni. Solo alla creazione di
+un budget i contatori vengono riempiti una volta dalle uscite esistenti.
+
+Quando il contatore del periodo corrente raggiunge la soglia di avviso
+(percentuale del limite) o supera il limite, i trigger aggiungono una riga
+ad 'avvisi_budget'. Chi scrive legge gli avvisi nuovi con avvisi_dopo e li
+pubblica come eventi: nessun controllo ripercorre lo storico.
+
+I periodi settimanali iniziano il lunedì. Gli importi sono in centesimi.
+"""
+import queries
+from models import AvvisoBudget, Budget, in_euro
+
+PERIODI_BUDGET = ('settimanale', 'mensile')
+
+SOGLIA_PREDEFINITA = 80
+
+
+def valida_budget(budget):
+    """
+    Normalizza i campi di un nuovo budget (limite in centesimi).
+    Solleva ValueError con il messaggio per il client se non è valido.
+    """
+    if budget['periodo'] not in PERIODI_BUDGET:
+        raise ValueError(f"periodo non valido: '{budget['periodo']}' (ammessi: {', '.join(PERIODI_BUDGET)})")
+    if budget['limite'] <= 0:
+        raise ValueError('limite deve essere maggiore di zero')
+    if not 1 <= budget['soglia'] <= 100:
+        raise ValueError('soglia deve essere una percentuale tra 1 e 100')
+    budget['categoria'] = (budget['categoria'] or '').strip() or None
+    budget['nome'] = (budget['nome'] or '').strip() or budget['categoria'] or 'Budget'
+    return budget
+
+
+def crea_budget(conn, budget):
+    """
+    Inserisce il budget e ne calcola i contatori dalle uscite già
+    registrate. Va eseguita dentro una transazione di scrittura.
+    Restituisce l'id del budget.
+    """
+    id = conn.execute('''
+        INSERT INTO budget (nome, conto_id, categoria, periodo, limite, soglia)
+        VALUES (:nome, :conto_id, :categoria, :periodo, :limite, :soglia)
+    ''', budget).lastrowid
+    conn.execute(queries.BUDGET_SPESE_INIZIALI, (id,))
+    return id
+
+
+def elimina_budget(conn, id):
+    """Elimina il budget con i suoi contatori e avvisi; restituisce le righe di budget eliminate"""
+    eliminati = conn.execute('DELETE FROM budget WHERE id = ?', (id,)).rowcount
+    conn.execute('DELETE FROM budget_spese WHERE budget_id = ?', (id,))
+    conn.execute('DELETE FROM avvisi_budget WHERE budget_id = ?', (id,))
+    return eliminati
+
+
+def stato(riga):
+    """Riga di queries.BUDGET_STATO -> budget con spesa e residuo del periodo corrente (euro)"""
+    limite, speso = riga['limite'], riga['speso']
+    return {
+        **Budget.riga_in_dict(riga),
+        'inizio': riga['inizio'],
+        'fine': riga['fine'],
+        'speso': in_euro(speso),
+        'rimanente': in_euro(limite - speso),
+        'percentuale': round(speso * 100 / limite, 2),
+        'stato': 'superato' if speso > limite else 'soglia' if speso * 100 >= limite * riga['soglia'] else 'ok',
+    }
+
+
+def ultimo_avviso(conn):
+    """Id dell'ultimo avviso registrato (0 se nessuno), da leggere prima di scrivere"""
+    return conn.execute(queries.ULTIMO_AVVISO_BUDGET).fetchone()[0]
+
+
+def avvisi_dopo(conn, id):
+    """Avvisi registrati dopo l'avviso 'id', con il nome del budget"""
+    return [
+        {**AvvisoBudget.riga_in_dict(riga), 'nome': riga['nome']}
+        for riga in conn.execute('''
+            SELECT a.*, b.nome FROM avvisi_budget AS a JOIN budget AS b ON b.id = a.budget_id
+            WHERE a.id > ? ORDER BY a.id
+        ''', (id,))
+    ]
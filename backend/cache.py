@@ -0,0 +1,132 @@
+"""
+Cache in memoria delle risposte degli endpoint di lettura.
+
+Ogni voce ricorda la "versione" delle tabelle da cui è stata calcolata.
+Gli endpoint che scrivono incrementano la versione delle tabelle toccate
+(invalida), quindi una voce è valida solo finché nessuna delle sue tabelle
+è cambiata e non è scaduto il TTL. Le risposte hanno un ETag: se il client
+manda If-None-Match con lo stesso valore riceve 304 senza corpo.
+
+La cache è del singolo processo: con più processi (vedi server.py) quello
+che scrive notifica le invalidazioni agli altri tramite 'al_cambio'.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from fastapi import Response
+
+from models import codifica_json
+
+
+class CacheRisposte:
+    def __init__(self, max_voci=512, ttl=60.0, metriche=None, al_cambio=None):
+        self.max_voci = max_voci
+        self.ttl = ttl
+        self.metriche = metriche
+        # Se indicata, chiamata con le tabelle ad ogni invalidazione
+        self.al_cambio = al_cambio
+        self._voci = OrderedDict()
+        self._versioni = {}
+        self._lock = threading.Lock()
+
+        # Contatori per il monitoraggio
+        self.hit = 0
+        self.miss = 0
+        self.non_modificate = 0
+        self.invalidazioni = 0
+
+    def invalida(self, *tabelle):
+        """Segnala che le tabelle indicate sono cambiate (da chiamare dopo il commit)"""
+        with self._lock:
+            for tabella in tabelle:
+                self._versioni[tabella] = self._versioni.get(tabella, 0) + 1
+            self.invalidazioni += 1
+        if self.al_cambio:
+            self.al_cambio(tabelle)
+
+    def svuota(self):
+        """Scarta tutte le voci (quando non si sa quali tabelle siano cambiate)"""
+        with self._lock:
+            self._voci.clear()
+            self.invalidazioni += 1
+
+    def _versione(self, tabelle):
+        return tuple(self._versioni.get(tabella, 0) for tabella in tabelle)
+
+    @staticmethod
+    def _chiave(request):
+        # Percorso più parametri in ordine, così ?a=1&b=2 e ?b=2&a=1 coincidono
+        return (request.url.path, tuple(sorted(request.query_params.multi_items())))
+
+    def _rispondi(self, request, corpo, etag, intestazioni=None):
+        headers = {'ETag': etag, 'Cache-Control': 'no-cache', **(intestazioni or {})}
+        if request.headers.get('if-none-match') == etag:
+            with self._lock:
+                self.non_modificate += 1
+            return Response(status_code=304, headers=headers)
+        return Response(content=corpo, media_type='application/json', headers=headers)
+
+    async def risposta(self, request, tabelle, carica, intestazioni=None):
+        """
+        Restituisce la risposta in cache per questa richiesta oppure la calcola
+        con 'carica' (coroutine senza argomenti) e la memorizza.
+        'carica' può restituire dati da codificare oppure JSON già pronto (bytes).
+        'tabelle' sono le tabelle da cui dipende il risultato.
+        'intestazioni' sono header aggiuntivi che descrivono i dati calcolati
+        ora: vengono memorizzati con la voce e restituiti quando è riusata.
+        """
+        chiave = self._chiave(request)
+        adesso = time.monotonic()
+
+        with self._lock:
+            # La versione va letta prima di caricare i dati: se una scrittura
+            # arriva durante il caricamento la voce nasce già scaduta
+            versione = self._versione(tabelle)
+            voce = self._voci.get(chiave)
+            valida = voce and voce['versione'] == versione and adesso - voce['creata'] < self.ttl
+            if valida:
+                self._voci.move_to_end(chiave)
+                self.hit += 1
+            else:
+                self.miss += 1
+
+        if valida:
+            return self._rispondi(request, voce['corpo'], voce['etag'], voce['intestazioni'])
+
+        dati = await carica()
+        if isinstance(dati, bytes):
+            corpo = dati
+        elif self.metriche:
+            with self.metriche.serializzazione():
+                corpo = codifica_json(dati)
+        else:
+            corpo = codifica_json(dati)
+        etag = '"' + hashlib.blake2b(corpo, digest_size=12).hexdigest() + '"'
+
+        with self._lock:
+            self._voci[chiave] = {
+                'versione': versione, 'creata': adesso, 'corpo': corpo, 'etag': etag, 'intestazioni': intestazioni
+            }
+            self._voci.move_to_end(chiave)
+            # Rimuove le voci usate meno di recente oltre il limite
+            while len(self._voci) > self.max_voci:
+                self._voci.popitem(last=False)
+
+        return self._rispondi(request, corpo, etag, intestazioni)
+
+    def stats(self):
+        with self._lock:
+            richieste = self.hit + self.miss
+            return {
+                'voci': len(self._voci),
+                'max_voci': self.max_voci,
+                'ttl_secondi': self.ttl,
+                'hit': self.hit,
+                'miss': self.miss,
+                'hit_ratio': round(self.hit / richieste, 4) if richieste else 0,
+                'non_modificate_304': self.non_modificate,
+                'invalidazioni': self.invalidazioni,
+                'versioni_tabelle': dict(self._versioni)
+            }
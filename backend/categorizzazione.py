@@ -0,0 +1,284 @@
+"""
+Categorizzazione automatica delle transazioni.
+
+Quando una transazione arriva senza categoria (creazione senza 'categoria',
+importazione di estratti conto) la categoria viene proposta da:
+1. le regole della tabella 'regole_categorie', in ordine di priorità:
+   - 'testo': il testo compare nella descrizione (maiuscole indifferenti);
+   - 'regex': l'espressione regolare trova una corrispondenza;
+   - 'importo': l'importo cade nell'intervallo [importo_min, importo_max].
+   Le regole di testo e regex possono avere anche un intervallo di importo;
+2. se nessuna regola si applica, un modello appreso dalle transazioni già
+   categorizzate: per ogni parola la categoria più frequente e la sua
+   frequenza, separatamente per entrate e uscite. Le parole della
+   descrizione votano e la categoria vince se raccoglie almeno
+   SOGLIA_CONFIDENZA dei voti.
+
+Le regole sono compilate in un indice unico, ricostruito solo quando cambia
+il contatore in 'versioni_categorie' (aggiornato dai trigger):
+- tutti i testi formano una sola espressione regolare a trie (prefissi in
+  comune fusi), scorsa una volta sulla descrizione: a ogni posizione trova
+  il testo più lungo che inizia lì, e quindi anche quelli più corti che ne
+  sono prefisso. Il costo per riga dipende dalla lunghezza della
+  descrizione, non dal numero di regole;
+- le regex sono unite in un'alternativa che fa da filtro: le singole
+  espressioni vengono provate solo sulle descrizioni in cui l'alternativa
+  trova qualcosa.
+Il modello si aggiorna leggendo solo le transazioni con id nuovo; le
+eliminazioni non tolgono i conteggi fino al riavvio del processo.
+
+Gli importi sono in centesimi, con il segno memorizzato (uscite negative).
+"""
+import math
+import re
+import threading
+from collections import Counter, defaultdict
+
+import queries
+from importer import CATEGORIA_PREDEFINITA
+
+TIPI_REGOLA = ('testo', 'regex', 'importo')
+
+# Parole usate dal modello: almeno 3 lettere (numeri e codici esclusi)
+PAROLA = re.compile(r'[^\W\d_]{3,}')
+
+# Una parola vota solo se compare in almeno MIN_OCCORRENZE transazioni e la
+# sua categoria più frequente supera MIN_FREQUENZA: le parole generiche
+# ('pagamento', 'carta') non spostano il risultato
+MIN_OCCORRENZE = 3
+MIN_FREQUENZA = 0.5
+SOGLIA_CONFIDENZA = 0.6
+
+MAX_LUNGHEZZA_MODELLO = 200
+
+
+def valida_regola(regola):
+    """
+    Normalizza i campi di una regola (importi in centesimi).
+    Solleva ValueError con il messaggio per il client se non è valida.
+    """
+    tipo = regola.get('tipo')
+    if tipo not in TIPI_REGOLA:
+        raise ValueError(f"tipo non valido: '{tipo}' (ammessi: {', '.join(TIPI_REGOLA)})")
+    categoria = (regola.get('categoria') or '').strip()
+    if not categoria:
+        raise ValueError('categoria obbligatoria')
+
+    modello = regola.get('modello') or None
+    importo_min = regola.get('importo_min')
+    importo_max = regola.get('importo_max')
+    if tipo == 'importo':
+        modello = None
+        if importo_min is None and importo_max is None:
+            raise ValueError('Le regole di tipo importo richiedono importo_min o importo_max')
+    elif modello is None or not modello.strip():
+        raise ValueError(f'Le regole di tipo {tipo} richiedono il modello')
+    elif len(modello) > MAX_LUNGHEZZA_MODELLO:
+        raise ValueError(f'modello troppo lungo (massimo {MAX_LUNGHEZZA_MODELLO} caratteri)')
+    elif tipo == 'testo':
+        modello = modello.strip()
+    else:
+        try:
+            compilata = re.compile(f'(?:{modello})', re.IGNORECASE)
+        except re.error as e:
+            raise ValueError(f'Espressione regolare non valida: {e}')
+        # Nell'alternativa comune gruppi con nome e riferimenti cambierebbero significato
+        if compilata.groupindex or re.search(r'\\[1-9]|\(\?P=', modello):
+            raise ValueError('Le espressioni regolari non possono usare gruppi con nome o riferimenti')
+    if importo_min is not None and importo_max is not None and importo_min > importo_max:
+        raise ValueError('importo_min non può superare importo_max')
+
+    return {
+        'tipo': tipo,
+        'categoria': categoria,
+        'modello': modello,
+        'importo_min': importo_min,
+        'importo_max': importo_max,
+        'priorita': int(regola.get('priorita') or 0),
+    }
+
+
+def _regex_trie(parole):
+    """Espressione regolare che riconosce le parole, con i prefissi comuni fusi"""
+    radice = {}
+    for parola in parole:
+        nodo = radice
+        for carattere in parola:
+            nodo = nodo.setdefault(carattere, {})
+        nodo[''] = True
+
+    def espressione(nodo):
+        finale = '' in nodo
+        rami = [re.escape(c) + espressione(figlio) for c, figlio in sorted(nodo.items()) if c]
+        if not rami:
+            return ''
+        corpo = rami[0] if len(rami) == 1 else '(?:' + '|'.join(rami) + ')'
+        # Se una parola finisce qui il seguito è facoltativo ma viene provato
+        # prima: a ogni posizione la corrispondenza è la parola più lunga
+        return f'(?:{corpo})?' if finale else corpo
+
+    return espressione(radice)
+
+
+class IndiceRegole:
+    """Regole compilate: trie dei testi, filtro delle regex e regole di solo importo"""
+
+    def __init__(self, regole):
+        # Priorità più alta prima, a parità la regola più vecchia
+        regole = sorted(regole, key=lambda r: (-r['priorita'], r['id']))
+        self.regole = regole
+        testi = defaultdict(list)
+        self.regex = []
+        self.importi = []
+        for rango, regola in enumerate(regole):
+            if regola['tipo'] == 'testo':
+                testi[regola['modello'].casefold()].append(rango)
+            elif regola['tipo'] == 'regex':
+                self.regex.append((rango, re.compile(regola['modello'], re.IGNORECASE)))
+            else:
+                self.importi.append(rango)
+
+        # Per ogni testo, le regole di tutti i testi che ne sono prefisso
+        # (trovati alla stessa posizione), in ordine di rango
+        self.prefissi = {
+            testo: sorted(r for i in range(1, len(testo) + 1) for r in testi.get(testo[:i], ()))
+            for testo in testi
+        }
+        self.scansione = None
+        if testi:
+            # Il lookahead fa provare ogni posizione, anche dentro un testo già trovato
+            self.scansione = re.compile(f'(?=({_regex_trie(testi)}))')
+        self.filtro_regex = None
+        if self.regex:
+            self.filtro_regex = re.compile(
+                '|'.join(f'(?:{regole[r]["modello"]})' for r, _ in self.regex), re.IGNORECASE
+            )
+
+    def _importo_valido(self, rango, importo):
+        regola = self.regole[rango]
+        return ((regola['importo_min'] is None or importo >= regola['importo_min'])
+                and (regola['importo_max'] is None or importo <= regola['importo_max']))
+
+    def applica(self, descrizione, importo):
+        """Rango della prima regola che si applica, oppure None"""
+        migliore = len(self.regole)
+        testo = descrizione.casefold()
+        if self.scansione is not None:
+            trovati = set()
+            for corrispondenza in self.scansione.finditer(testo):
+                trovati.update(self.prefissi[corrispondenza.group(1)])
+            for rango in sorted(trovati):
+                if self._importo_valido(rango, importo):
+                    migliore = rango
+                    break
+        if self.filtro_regex is not None and self.filtro_regex.search(descrizione):
+            for rango, espressione in self.regex:
+                if rango >= migliore:
+                    break
+                if espressione.search(descrizione) and self._importo_valido(rango, importo):
+                    migliore = rango
+                    break
+        for rango in self.importi:
+            if rango >= migliore:
+                break
+            if self._importo_valido(rango, importo):
+                migliore = rango
+                break
+        return migliore if migliore < len(self.regole) else None
+
+
+class Categorizzatore:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._versione_regole = None
+        self._indice = IndiceRegole([])
+        # Conteggi (uscita, parola) -> categoria -> transazioni, e il voto
+        # (categoria, frequenza) che ne deriva per le parole abbastanza frequenti
+        self._conteggi = defaultdict(Counter)
+        self._voti = {}
+        self._ultimo_id = 0
+
+    def sincronizza(self, conn):
+        """Ricompila le regole se sono cambiate e aggiunge al modello le transazioni nuove"""
+        with self.lock:
+            propria = not conn.in_transaction
+            if propria:
+                conn.execute('BEGIN')
+            try:
+                versione, = conn.execute(queries.CATEGORIE_VERSIONE).fetchone()
+                if versione != self._versione_regole:
+                    self._indice = IndiceRegole([dict(r) for r in conn.execute(queries.REGOLE_CATEGORIE)])
+                    self._versione_regole = versione
+                self._addestra(conn.execute(queries.CATEGORIE_ADDESTRAMENTO, (self._ultimo_id, CATEGORIA_PREDEFINITA)))
+            finally:
+                if propria:
+                    conn.rollback()
+
+    def _addestra(self, righe):
+        toccate = set()
+        for id, importo, descrizione, categoria in righe:
+            self._ultimo_id = id
+            uscita = importo < 0
+            for parola in set(PAROLA.findall(descrizione.casefold())):
+                chiave = (uscita, parola)
+                self._conteggi[chiave][categoria] += 1
+                toccate.add(chiave)
+        for chiave in toccate:
+            conteggi = self._conteggi[chiave]
+            totale = sum(conteggi.values())
+            categoria, n = conteggi.most_common(1)[0]
+            if totale >= MIN_OCCORRENZE and n / totale > MIN_FREQUENZA:
+                # Le parole viste più spesso pesano un po' di più
+                self._voti[chiave] = (categoria, n / totale * math.log(1 + totale))
+            else:
+                self._voti.pop(chiave, None)
+
+    def _prevedi(self, descrizione, importo):
+        uscita = importo < 0
+        punteggi = defaultdict(float)
+        for parola in set(PAROLA.findall(descrizione.casefold())):
+            voto = self._voti.get((uscita, parola))
+            if voto:
+                punteggi[voto[0]] += voto[1]
+        if not punteggi:
+            return None, 0.0
+        categoria = max(punteggi, key=punteggi.get)
+        return categoria, punteggi[categoria] / sum(punteggi.values())
+
+    def classifica(self, righe):
+        """
+        Categoria proposta per ogni coppia (descrizione, importo) dello stesso
+        ordine: tuple (categoria, id della regola, confidenza), con categoria
+        None se né le regole né il modello sono abbastanza sicuri.
+        Usa lo stato dell'ultima sincronizza.
+        """
+        indice = self._indice
+        regole = indice.regole
+        risultati = []
+        for descrizione, importo in righe:
+            descrizione = descrizione or ''
+            rango = indice.applica(descrizione, importo)
+            if rango is not None:
+                risultati.append((regole[rango]['categoria'], regole[rango]['id'], 1.0))
+                continue
+            categoria, confidenza = self._prevedi(descrizione, importo)
+            if confidenza < SOGLIA_CONFIDENZA:
+                categoria = None
+            risultati.append((categoria, None, round(confidenza, 3)))
+        return risultati
+
+    def categorizza(self, conn, righe):
+        """sincronizza e classifica, restituendo solo le categorie"""
+        self.sincronizza(conn)
+        return [categoria for categoria, _, _ in self.classifica(righe)]
+
+    def stats(self):
+        indice = self._indice
+        return {
+            'regole': len(indice.regole),
+            'testi': len(indice.prefissi),
+            'regole_regex': len(indice.regex),
+            'regole_importo': len(indice.importi),
+            'parole_modello': len(self._voti),
+            'ultimo_id': self._ultimo_id,
+        }
@@ -1,22 +1,1217 @@
+import asyncio
+import contextvars
+import logging
+import queue
+import random
+import re
 import sqlite3
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
 
-class Database:
-    def __init__(self, db_name='finance.db'):
+import queries
+from metriche import ConnessioneTracciata
+
+log_database = logging.getLogger('financehub.database')
+
+
+class PoolTimeoutError(sqlite3.OperationalError):
+    """Sollevata quando nessuna connessione del pool si libera entro il timeout"""
+
+
+def _database_occupato(errore):
+    """True se SQLite ha rifiutato l'operazione perché un altro scrittore ha il lock"""
+    return isinstance(errore, sqlite3.OperationalError) and 'locked' in str(errore)
+
+
+class ConnectionPool:
+    """
+    Pool limitato di connessioni SQLite a lunga durata.
+    Le connessioni vengono create al bisogno fino a 'size' e poi riutilizzate,
+    evitando di riaprire il file e rileggere lo schema ad ogni richiesta.
+    """
+    def __init__(self, db_name, size=10, timeout=30.0, busy_timeout=5000,
+                 cache_size_kb=16384, mmap_size=268435456, sola_lettura=False):
         self.db_name = db_name
-        self.init_db()
+        self.sola_lettura = sola_lettura
+        self.size = size
+        self.timeout = timeout
+        self.busy_timeout = busy_timeout
+        self.cache_size_kb = cache_size_kb
+        self.mmap_size = mmap_size
+        
+        # LIFO: la connessione usata più di recente ha la cache più "calda"
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._lock = threading.Lock()
+        self._all = []
+        
+        # Metriche del pool
+        self._acquisizioni = 0
+        self._attesa_totale = 0.0
+        self._attesa_max = 0.0
+        self._timeout_count = 0
     
-    def get_connection(self):
-        """Crea una nuova connessione al database SQLite"""
-        conn = sqlite3.connect(self.db_name)
+    def _create_connection(self):
+        """Apre una nuova connessione configurata con WAL e PRAGMA di tuning"""
+        # check_same_thread=False: la connessione può passare da un thread all'altro,
+        # ma il pool garantisce che sia usata da un solo thread alla volta
+        conn = sqlite3.connect(
+            self.db_name,
+            timeout=self.busy_timeout / 1000,
+            check_same_thread=False
+        )
         # Row factory permette di accedere alle colonne per nome invece che per indice
         conn.row_factory = sqlite3.Row
+        
+        # WAL: i lettori non bloccano lo scrittore e viceversa
+        conn.execute('PRAGMA journal_mode = WAL')
+        # In modalità WAL, NORMAL è sicuro contro la corruzione e molto più veloce di FULL
+        conn.execute('PRAGMA synchronous = NORMAL')
+        # Valore negativo = dimensione in KiB
+        conn.execute(f'PRAGMA cache_size = -{int(self.cache_size_kb)}')
+        conn.execute(f'PRAGMA mmap_size = {int(self.mmap_size)}')
+        conn.execute(f'PRAGMA busy_timeout = {int(self.busy_timeout)}')
+        conn.execute('PRAGMA temp_store = MEMORY')
+        # Processi di sola lettura: una scrittura per errore fallisce subito
+        # invece di contendere il lock al processo scrittore
+        if self.sola_lettura:
+            conn.execute('PRAGMA query_only = ON')
+        return conn
+    
+    def acquire(self):
+        """Preleva una connessione dal pool, creandola se il limite lo consente"""
+        start = time.perf_counter()
+        conn = None
+        
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                if len(self._all) < self.size:
+                    conn = self._create_connection()
+                    self._all.append(conn)
+        
+        if conn is None:
+            # Pool esaurito: attende che un'altra richiesta rilasci una connessione
+            try:
+                conn = self._idle.get(timeout=self.timeout)
+            except queue.Empty:
+                with self._lock:
+                    self._timeout_count += 1
+                raise PoolTimeoutError('Nessuna connessione al database disponibile')
+        
+        attesa = time.perf_counter() - start
+        with self._lock:
+            self._acquisizioni += 1
+            self._attesa_totale += attesa
+            self._attesa_max = max(self._attesa_max, attesa)
         return conn
     
+    def release(self, conn):
+        """Restituisce una connessione al pool annullando eventuali transazioni aperte"""
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put_nowait(conn)
+    
+    def close_all(self):
+        """Chiude tutte le connessioni (da usare allo spegnimento del server)"""
+        with self._lock:
+            for conn in self._all:
+                conn.close()
+            self._all = []
+            self._idle = queue.LifoQueue(maxsize=self.size)
+    
+    def stats(self):
+        """Restituisce le metriche di utilizzo del pool"""
+        with self._lock:
+            libere = self._idle.qsize()
+            return {
+                'dimensione_max': self.size,
+                'connessioni_aperte': len(self._all),
+                'connessioni_libere': libere,
+                'connessioni_in_uso': len(self._all) - libere,
+                'acquisizioni': self._acquisizioni,
+                'attesa_media_ms': round(self._attesa_totale / self._acquisizioni * 1000, 3) if self._acquisizioni else 0,
+                'attesa_max_ms': round(self._attesa_max * 1000, 3),
+                'timeout': self._timeout_count
+            }
+
+
+# Tabelle di riepilogo: i totali della dashboard sono mantenuti in modo incrementale
+# ad ogni scrittura, così la lettura della dashboard costa una sola riga
+RIEPILOGO_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS riepilogo (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        saldo_totale INTEGER NOT NULL DEFAULT 0,
+        investimenti_totale INTEGER NOT NULL DEFAULT 0,
+        investimenti_rendimento INTEGER NOT NULL DEFAULT 0,
+        obiettivi_totale INTEGER NOT NULL DEFAULT 0,
+        obiettivi_completati INTEGER NOT NULL DEFAULT 0
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS riepilogo_mensile (
+        mese TEXT PRIMARY KEY,
+        variazione INTEGER NOT NULL DEFAULT 0,
+        spese INTEGER NOT NULL DEFAULT 0
+    )
+    ''',
+]
+
+# Trigger che applicano ad ogni scrittura la differenza sui totali.
+# Stanno nel database così ogni percorso di scrittura (endpoint, import, script)
+# mantiene il riepilogo coerente senza codice aggiuntivo.
+RIEPILOGO_TRIGGER = [
+    # Saldo totale dei conti
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_conti_riepilogo_ins AFTER INSERT ON conti BEGIN
+        UPDATE riepilogo SET saldo_totale = saldo_totale + NEW.saldo WHERE id = 1;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_conti_riepilogo_upd AFTER UPDATE OF saldo ON conti BEGIN
+        UPDATE riepilogo SET saldo_totale = saldo_totale + NEW.saldo - OLD.saldo WHERE id = 1;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_conti_riepilogo_del AFTER DELETE ON conti BEGIN
+        UPDATE riepilogo SET saldo_totale = saldo_totale - OLD.saldo WHERE id = 1;
+    END
+    ''',
+    # Variazione e uscite per mese
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_transazioni_riepilogo_ins AFTER INSERT ON transazioni BEGIN
+        INSERT INTO riepilogo_mensile (mese, variazione, spese)
+        VALUES (substr(NEW.data, 1, 7), NEW.importo,
+                CASE WHEN NEW.tipo = 'uscita' THEN NEW.importo ELSE 0 END)
+        ON CONFLICT (mese) DO UPDATE SET
+            variazione = variazione + excluded.variazione,
+            spese = spese + excluded.spese;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_transazioni_riepilogo_del AFTER DELETE ON transazioni BEGIN
+        UPDATE riepilogo_mensile SET
+            variazione = variazione - OLD.importo,
+            spese = spese - CASE WHEN OLD.tipo = 'uscita' THEN OLD.importo ELSE 0 END
+        WHERE mese = substr(OLD.data, 1, 7);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_transazioni_riepilogo_upd
+    AFTER UPDATE OF importo, tipo, data ON transazioni BEGIN
+        UPDATE riepilogo_mensile SET
+            variazione = variazione - OLD.importo,
+            spese = spese - CASE WHEN OLD.tipo = 'uscita' THEN OLD.importo ELSE 0 END
+        WHERE mese = substr(OLD.data, 1, 7);
+        INSERT INTO riepilogo_mensile (mese, variazione, spese)
+        VALUES (substr(NEW.data, 1, 7), NEW.importo,
+                CASE WHEN NEW.tipo = 'uscita' THEN NEW.importo ELSE 0 END)
+        ON CONFLICT (mese) DO UPDATE SET
+            variazione = variazione + excluded.variazione,
+            spese = spese + excluded.spese;
+    END
+    ''',
+    # Valore e rendimento degli investimenti
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_investimenti_riepilogo_ins AFTER INSERT ON investimenti BEGIN
+        UPDATE riepilogo SET
+            investimenti_totale = investimenti_totale + NEW.valore_attuale,
+            investimenti_rendimento = investimenti_rendimento + NEW.rendimento
+        WHERE id = 1;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_investimenti_riepilogo_upd
+    AFTER UPDATE OF valore_attuale, rendimento ON investimenti BEGIN
+        UPDATE riepilogo SET
+            investimenti_totale = investimenti_totale + NEW.valore_attuale - OLD.valore_attuale,
+            investimenti_rendimento = investimenti_rendimento + NEW.rendimento - OLD.rendimento
+        WHERE id = 1;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_investimenti_riepilogo_del AFTER DELETE ON investimenti BEGIN
+        UPDATE riepilogo SET
+            investimenti_totale = investimenti_totale - OLD.valore_attuale,
+            investimenti_rendimento = investimenti_rendimento - OLD.rendimento
+        WHERE id = 1;
+    END
+    ''',
+    # Conteggio degli obiettivi totali e completati
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_obiettivi_riepilogo_ins AFTER INSERT ON obiettivi BEGIN
+        UPDATE riepilogo SET
+            obiettivi_totale = obiettivi_totale + 1,
+            obiettivi_completati = obiettivi_completati + (NEW.completato = 1)
+        WHERE id = 1;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_obiettivi_riepilogo_upd AFTER UPDATE OF completato ON obiettivi BEGIN
+        UPDATE riepilogo SET
+            obiettivi_completati = obiettivi_completati + (NEW.completato = 1) - (OLD.completato = 1)
+        WHERE id = 1;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_obiettivi_riepilogo_del AFTER DELETE ON obiettivi BEGIN
+        UPDATE riepilogo SET
+            obiettivi_totale = obiettivi_totale - 1,
+            obiettivi_completati = obiettivi_completati - (OLD.completato = 1)
+        WHERE id = 1;
+    END
+    ''',
+]
+
+# Popolamento delle tabelle di riepilogo a partire dai dati esistenti
+RIEPILOGO_RICALCOLO = [
+    f'''
+    INSERT INTO riepilogo (id, saldo_totale, investimenti_totale, investimenti_rendimento,
+                           obiettivi_totale, obiettivi_completati)
+    SELECT 1, * FROM ({queries.RIEPILOGO_CALCOLATO})
+    ''',
+    f'''
+    INSERT INTO riepilogo_mensile (mese, variazione, spese)
+    {queries.RIEPILOGO_MENSILE_CALCOLATO}
+    ''',
+]
+
+# Registro dei saldi: variazione netta per conto e giorno, mantenuta dai trigger,
+# più checkpoint periodici con la somma progressiva fino a fine mese (vedi registro.py).
+# Il saldo di un conto a una data è saldo_iniziale + ultimo checkpoint precedente
+# + variazioni dei giorni successivi: due ricerche sulle chiavi primarie.
+REGISTRO_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS saldi_giornalieri (
+        conto_id INTEGER NOT NULL,
+        giorno TEXT NOT NULL,
+        variazione INTEGER NOT NULL DEFAULT 0,
+        movimenti INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (conto_id, giorno)
+    ) WITHOUT ROWID
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS checkpoint_saldi (
+        conto_id INTEGER NOT NULL,
+        giorno TEXT NOT NULL,
+        saldo INTEGER NOT NULL,
+        PRIMARY KEY (conto_id, giorno)
+    ) WITHOUT ROWID
+    ''',
+]
+
+# Ogni transazione sposta la variazione del suo giorno e i checkpoint
+# successivi (di norma nessuno: solo le transazioni retrodatate li toccano)
+REGISTRO_TRIGGER = [
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_transazioni_registro_ins AFTER INSERT ON transazioni BEGIN
+        INSERT INTO saldi_giornalieri (conto_id, giorno, variazione, movimenti)
+        VALUES (NEW.conto_id, substr(NEW.data, 1, 10), NEW.importo, 1)
+        ON CONFLICT (conto_id, giorno) DO UPDATE SET
+            variazione = variazione + excluded.variazione,
+            movimenti = movimenti + 1;
+        UPDATE checkpoint_saldi SET saldo = saldo + NEW.importo
+        WHERE conto_id = NEW.conto_id AND giorno >= substr(NEW.data, 1, 10);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_transazioni_registro_del AFTER DELETE ON transazioni BEGIN
+        UPDATE saldi_giornalieri SET
+            variazione = variazione - OLD.importo,
+            movimenti = movimenti - 1
+        WHERE conto_id = OLD.conto_id AND giorno = substr(OLD.data, 1, 10);
+        DELETE FROM saldi_giornalieri
+        WHERE conto_id = OLD.conto_id AND giorno = substr(OLD.data, 1, 10) AND movimenti = 0;
+        UPDATE checkpoint_saldi SET saldo = saldo - OLD.importo
+        WHERE conto_id = OLD.conto_id AND giorno >= substr(OLD.data, 1, 10);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_transazioni_registro_upd
+    AFTER UPDATE OF importo, data, conto_id ON transazioni BEGIN
+        UPDATE saldi_giornalieri SET
+            variazione = variazione - OLD.importo,
+            movimenti = movimenti - 1
+        WHERE conto_id = OLD.conto_id AND giorno = substr(OLD.data, 1, 10);
+        DELETE FROM saldi_giornalieri
+        WHERE conto_id = OLD.conto_id AND giorno = substr(OLD.data, 1, 10) AND movimenti = 0;
+        UPDATE checkpoint_saldi SET saldo = saldo - OLD.importo
+        WHERE conto_id = OLD.conto_id AND giorno >= substr(OLD.data, 1, 10);
+        INSERT INTO saldi_giornalieri (conto_id, giorno, variazione, movimenti)
+        VALUES (NEW.conto_id, substr(NEW.data, 1, 10), NEW.importo, 1)
+        ON CONFLICT (conto_id, giorno) DO UPDATE SET
+            variazione = variazione + excluded.variazione,
+            movimenti = movimenti + 1;
+        UPDATE checkpoint_saldi SET saldo = saldo + NEW.importo
+        WHERE conto_id = NEW.conto_id AND giorno >= substr(NEW.data, 1, 10);
+    END
+    ''',
+]
+
+# Popolamento del registro a partire dalle transazioni esistenti
+REGISTRO_RICALCOLO = [
+    '''
+    INSERT INTO saldi_giornalieri (conto_id, giorno, variazione, movimenti)
+    SELECT conto_id, substr(data, 1, 10), SUM(importo), COUNT(*)
+    FROM transazioni
+    GROUP BY conto_id, substr(data, 1, 10)
+    ''',
+]
+
+# Eliminazioni e modifiche delle transazioni per il motore analitico: ogni
+# processo applica al proprio cubo in memoria le righe con 'seq' successivo
+# all'ultima già letta (vedi analitica.py), qualunque processo abbia scritto.
+# Una modifica è registrata come la vecchia riga tolta (segno -1) più la nuova
+RETTIFICHE_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS rettifiche_analisi (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        id INTEGER NOT NULL,
+        conto_id INTEGER NOT NULL,
+        categoria TEXT NOT NULL,
+        tipo TEXT NOT NULL,
+        importo INTEGER NOT NULL,
+        data TIMESTAMP,
+        segno INTEGER NOT NULL,
+        registrata TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_transazioni_analisi_del AFTER DELETE ON transazioni BEGIN
+        INSERT INTO rettifiche_analisi (id, conto_id, categoria, tipo, importo, data, segno)
+        VALUES (OLD.id, OLD.conto_id, OLD.categoria, OLD.tipo, OLD.importo, OLD.data, -1);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_transazioni_analisi_upd
+    AFTER UPDATE OF conto_id, categoria, tipo, importo, data ON transazioni BEGIN
+        INSERT INTO rettifiche_analisi (id, conto_id, categoria, tipo, importo, data, segno)
+        VALUES (OLD.id, OLD.conto_id, OLD.categoria, OLD.tipo, OLD.importo, OLD.data, -1),
+               (NEW.id, NEW.conto_id, NEW.categoria, NEW.tipo, NEW.importo, NEW.data, 1);
+    END
+    ''',
+]
+
+# Storico dei prezzi e investimenti quotati per la valutazione (vedi
+# valutazione.py). 'versioni_valutazione' dice ai motori di ogni processo
+# quando ricalcolare: gli investimenti la aggiornano con i trigger, gli
+# import dei prezzi una volta per import (importa_prezzi)
+VALUTAZIONE_SCHEMA = [
+    'ALTER TABLE investimenti ADD COLUMN simbolo TEXT',
+    'ALTER TABLE investimenti ADD COLUMN quantita REAL',
+    '''
+    CREATE TABLE IF NOT EXISTS prezzi (
+        simbolo TEXT NOT NULL,
+        giorno TEXT NOT NULL,
+        prezzo REAL NOT NULL,
+        PRIMARY KEY (simbolo, giorno)
+    ) WITHOUT ROWID
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS versioni_valutazione (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        prezzi INTEGER NOT NULL DEFAULT 0,
+        investimenti INTEGER NOT NULL DEFAULT 0
+    )
+    ''',
+    'INSERT OR IGNORE INTO versioni_valutazione (id) VALUES (1)',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_investimenti_valutazione_ins AFTER INSERT ON investimenti BEGIN
+        UPDATE versioni_valutazione SET investimenti = investimenti + 1 WHERE id = 1;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_investimenti_valutazione_upd AFTER UPDATE ON investimenti BEGIN
+        UPDATE versioni_valutazione SET investimenti = investimenti + 1 WHERE id = 1;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_investimenti_valutazione_del AFTER DELETE ON investimenti BEGIN
+        UPDATE versioni_valutazione SET investimenti = investimenti + 1 WHERE id = 1;
+    END
+    ''',
+]
+
+# Indice full-text di descrizione e categoria delle transazioni (vedi
+# /api/transazioni/search). La tabella FTS5 è a contenuto esterno: non
+# duplica il testo, che resta in 'transazioni', e i trigger ne aggiornano
+# solo l'indice. Gli accenti sono ignorati (caffè trova caffe) e i prefissi
+# di 2 e 3 caratteri hanno un indice proprio, così la ricerca mentre si
+# scrive non scorre tutti i termini
+RICERCA_SCHEMA = [
+    '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS transazioni_fts USING fts5(
+        descrizione, categoria,
+        content='transazioni', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_transazioni_fts_ins AFTER INSERT ON transazioni BEGIN
+        INSERT INTO transazioni_fts (rowid, descrizione, categoria)
+        VALUES (NEW.id, NEW.descrizione, NEW.categoria);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_transazioni_fts_del AFTER DELETE ON transazioni BEGIN
+        INSERT INTO transazioni_fts (transazioni_fts, rowid, descrizione, categoria)
+        VALUES ('delete', OLD.id, OLD.descrizione, OLD.categoria);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_transazioni_fts_upd
+    AFTER UPDATE OF descrizione, categoria ON transazioni BEGIN
+        INSERT INTO transazioni_fts (transazioni_fts, rowid, descrizione, categoria)
+        VALUES ('delete', OLD.id, OLD.descrizione, OLD.categoria);
+        INSERT INTO transazioni_fts (rowid, descrizione, categoria)
+        VALUES (NEW.id, NEW.descrizione, NEW.categoria);
+    END
+    ''',
+]
+RICERCA_RICOSTRUZIONE = "INSERT INTO transazioni_fts (transazioni_fts) VALUES ('rebuild')"
+
+# Regole per la categorizzazione automatica (vedi categorizzazione.py).
+# Il contatore in 'versioni_categorie' cambia a ogni modifica delle regole,
+# così ogni processo ricompila il proprio indice solo quando serve
+CATEGORIE_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS regole_categorie (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        tipo TEXT NOT NULL CHECK (tipo IN ('testo', 'regex', 'importo')),
+        modello TEXT,
+        importo_min INTEGER,
+        importo_max INTEGER,
+        categoria TEXT NOT NULL,
+        priorita INTEGER NOT NULL DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS versioni_categorie (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        regole INTEGER NOT NULL DEFAULT 0
+    )
+    ''',
+    'INSERT OR IGNORE INTO versioni_categorie (id) VALUES (1)',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_regole_categorie_ins AFTER INSERT ON regole_categorie BEGIN
+        UPDATE versioni_categorie SET regole = regole + 1 WHERE id = 1;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_regole_categorie_upd AFTER UPDATE ON regole_categorie BEGIN
+        UPDATE versioni_categorie SET regole = regole + 1 WHERE id = 1;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_regole_categorie_del AFTER DELETE ON regole_categorie BEGIN
+        UPDATE versioni_categorie SET regole = regole + 1 WHERE id = 1;
+    END
+    ''',
+]
+
+# Transazioni ricorrenti (vedi ricorrenze.py). L'indice parziale su
+# 'prossima' contiene solo le ricorrenze non finite: la ricerca di quelle
+# scadute legge solo le righe da eseguire. 'lease' assegna un lavoro
+# periodico a un solo processo alla volta
+RICORRENZE_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS ricorrenze (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        conto_id INTEGER NOT NULL,
+        tipo TEXT NOT NULL,
+        categoria TEXT,
+        importo INTEGER NOT NULL,
+        descrizione TEXT NOT NULL DEFAULT '',
+        frequenza TEXT NOT NULL CHECK (frequenza IN ('giornaliera', 'settimanale', 'mensile', 'annuale')),
+        intervallo INTEGER NOT NULL DEFAULT 1 CHECK (intervallo >= 1),
+        data_inizio TEXT NOT NULL,
+        data_fine TEXT,
+        max_occorrenze INTEGER,
+        eseguite INTEGER NOT NULL DEFAULT 0,
+        prossima TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (conto_id) REFERENCES conti (id)
+    )
+    ''',
+    '''
+    CREATE INDEX IF NOT EXISTS idx_ricorrenze_prossima
+    ON ricorrenze (prossima) WHERE prossima IS NOT NULL
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS lease (
+        nome TEXT PRIMARY KEY,
+        proprietario TEXT NOT NULL,
+        scadenza REAL NOT NULL
+    ) WITHOUT ROWID
+    ''',
+]
+
+# Obiettivi collegati a un conto o a una categoria: l'importo attuale non
+# viene più aggiornato a mano ma dai trigger, nella stessa transazione
+# della scrittura che lo cambia.
+# - collegato solo a un conto: l'importo attuale è il saldo del conto;
+# - collegato a una categoria (ed eventualmente a un conto): la somma in
+#   valore assoluto delle transazioni della categoria dalla creazione
+#   dell'obiettivo in poi.
+# Gli indici parziali contengono solo gli obiettivi collegati, così i
+# trigger sulle transazioni non leggono gli altri.
+_OBIETTIVI_CATEGORIA = '''
+        UPDATE obiettivi SET
+            importo_attuale = importo_attuale {segno} abs({riga}.importo),
+            completato = importo_attuale {segno} abs({riga}.importo) >= importo_target
+        WHERE categoria = {riga}.categoria
+          AND (conto_id IS NULL OR conto_id = {riga}.conto_id)
+          AND substr({riga}.data, 1, 10) >= substr(data_creazione, 1, 10);
+'''
+
+OBIETTIVI_COLLEGATI_SCHEMA = [
+    'ALTER TABLE obiettivi ADD COLUMN conto_id INTEGER',
+    'ALTER TABLE obiettivi ADD COLUMN categoria TEXT',
+    'CREATE INDEX IF NOT EXISTS idx_obiettivi_conto ON obiettivi (conto_id) WHERE conto_id IS NOT NULL',
+    'CREATE INDEX IF NOT EXISTS idx_obiettivi_categoria ON obiettivi (categoria) WHERE categoria IS NOT NULL',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_conti_obiettivi_upd AFTER UPDATE OF saldo ON conti BEGIN
+        UPDATE obiettivi SET
+            importo_attuale = NEW.saldo,
+            completato = NEW.saldo >= importo_target
+        WHERE conto_id = NEW.id AND categoria IS NULL;
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS trg_transazioni_obiettivi_ins AFTER INSERT ON transazioni BEGIN
+        {_OBIETTIVI_CATEGORIA.format(segno='+', riga='NEW')}
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS trg_transazioni_obiettivi_del AFTER DELETE ON transazioni BEGIN
+        {_OBIETTIVI_CATEGORIA.format(segno='-', riga='OLD')}
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS trg_transazioni_obiettivi_upd
+    AFTER UPDATE OF conto_id, categoria, importo, data ON transazioni BEGIN
+        {_OBIETTIVI_CATEGORIA.format(segno='-', riga='OLD')}
+        {_OBIETTIVI_CATEGORIA.format(segno='+', riga='NEW')}
+    END
+    ''',
+]
+
+# Budget per categoria e/o conto, mensili o settimanali (vedi budget.py).
+# 'budget_spese' ha un contatore per (budget, inizio del periodo) aggiornato
+# dai trigger sulle transazioni: la spesa del periodo di ogni budget si
+# legge sulla chiave primaria, senza sommare le transazioni. Quando un
+# contatore del periodo corrente supera la soglia di avviso o il limite
+# viene aggiunta una riga ad 'avvisi_budget', nella stessa transazione
+# della scrittura che l'ha causato.
+_BUDGET_SPESA = '''
+        INSERT INTO budget_spese (budget_id, inizio, speso)
+        SELECT id, {inizio}, {segno}{riga}.importo FROM budget
+        WHERE {riga}.tipo = 'uscita'
+          AND (categoria IS NULL OR categoria = {riga}.categoria)
+          AND (conto_id IS NULL OR conto_id = {riga}.conto_id)
+        ON CONFLICT (budget_id, inizio) DO UPDATE SET speso = speso + excluded.speso;
+'''
+
+_BUDGET_AVVISI = f'''
+        INSERT INTO avvisi_budget (budget_id, inizio, livello, speso, limite)
+        SELECT id, NEW.inizio, 'soglia', NEW.speso, limite FROM budget
+        WHERE id = NEW.budget_id AND soglia < 100
+          AND {{prima}} * 100 < limite * soglia AND NEW.speso * 100 >= limite * soglia
+          AND NEW.inizio = {queries.inizio_periodo("'now'")};
+        INSERT INTO avvisi_budget (budget_id, inizio, livello, speso, limite)
+        SELECT id, NEW.inizio, 'superato', NEW.speso, limite FROM budget
+        WHERE id = NEW.budget_id
+          AND {{prima}} <= limite AND NEW.speso > limite
+          AND NEW.inizio = {queries.inizio_periodo("'now'")};
+'''
+
+BUDGET_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS budget (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        nome TEXT NOT NULL,
+        conto_id INTEGER,
+        categoria TEXT,
+        periodo TEXT NOT NULL CHECK (periodo IN ('settimanale', 'mensile')),
+        limite INTEGER NOT NULL CHECK (limite > 0),
+        soglia INTEGER NOT NULL DEFAULT 80 CHECK (soglia BETWEEN 1 AND 100),
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (conto_id) REFERENCES conti (id)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS budget_spese (
+        budget_id INTEGER NOT NULL,
+        inizio TEXT NOT NULL,
+        speso INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (budget_id, inizio)
+    ) WITHOUT ROWID
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS avvisi_budget (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        budget_id INTEGER NOT NULL,
+        inizio TEXT NOT NULL,
+        livello TEXT NOT NULL CHECK (livello IN ('soglia', 'superato')),
+        speso INTEGER NOT NULL,
+        limite INTEGER NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_avvisi_budget_budget ON avvisi_budget (budget_id)',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS trg_transazioni_budget_ins AFTER INSERT ON transazioni BEGIN
+        {_BUDGET_SPESA.format(inizio=queries.inizio_periodo('NEW.data'), segno='-', riga='NEW')}
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS trg_transazioni_budget_del AFTER DELETE ON transazioni BEGIN
+        {_BUDGET_SPESA.format(inizio=queries.inizio_periodo('OLD.data'), segno='', riga='OLD')}
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS trg_transazioni_budget_upd
+    AFTER UPDATE OF conto_id, tipo, categoria, importo, data ON transazioni BEGIN
+        {_BUDGET_SPESA.format(inizio=queries.inizio_periodo('OLD.data'), segno='', riga='OLD')}
+        {_BUDGET_SPESA.format(inizio=queries.inizio_periodo('NEW.data'), segno='-', riga='NEW')}
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS trg_budget_spese_avvisi_ins AFTER INSERT ON budget_spese BEGIN
+        {_BUDGET_AVVISI.format(prima='0')}
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS trg_budget_spese_avvisi_upd AFTER UPDATE OF speso ON budget_spese BEGIN
+        {_BUDGET_AVVISI.format(prima='OLD.speso')}
+    END
+    ''',
+]
+
+# Tabelle con gli importi in centesimi interi (migrazione 5).
+# {tabella} viene sostituito con il nome della tabella da creare.
+TABELLE_CENTESIMI = {
+    'conti': (
+        '''
+        CREATE TABLE {tabella} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            nome TEXT NOT NULL,
+            tipo TEXT NOT NULL,
+            saldo INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        ['id', 'nome', 'tipo', 'saldo', 'created_at'],
+        ['saldo'],
+    ),
+    'transazioni': (
+        '''
+        CREATE TABLE {tabella} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            conto_id INTEGER NOT NULL,
+            tipo TEXT NOT NULL,
+            categoria TEXT NOT NULL,
+            importo INTEGER NOT NULL,
+            descrizione TEXT,
+            data TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            riferimento_esterno TEXT,
+            FOREIGN KEY (conto_id) REFERENCES conti (id)
+        )
+        ''',
+        ['id', 'conto_id', 'tipo', 'categoria', 'importo', 'descrizione', 'data', 'riferimento_esterno'],
+        ['importo'],
+    ),
+    'investimenti': (
+        '''
+        CREATE TABLE {tabella} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            conto_id INTEGER NOT NULL,
+            nome TEXT NOT NULL,
+            tipo TEXT NOT NULL,
+            importo_iniziale INTEGER NOT NULL,
+            valore_attuale INTEGER NOT NULL,
+            rendimento INTEGER NOT NULL,
+            data_inizio TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (conto_id) REFERENCES conti (id)
+        )
+        ''',
+        ['id', 'conto_id', 'nome', 'tipo', 'importo_iniziale', 'valore_attuale', 'rendimento', 'data_inizio'],
+        ['importo_iniziale', 'valore_attuale', 'rendimento'],
+    ),
+    'obiettivi': (
+        '''
+        CREATE TABLE {tabella} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            titolo TEXT NOT NULL,
+            descrizione TEXT,
+            importo_target INTEGER NOT NULL,
+            importo_attuale INTEGER DEFAULT 0,
+            completato BOOLEAN DEFAULT 0,
+            data_creazione TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        ['id', 'titolo', 'descrizione', 'importo_target', 'importo_attuale', 'completato', 'data_creazione'],
+        ['importo_target', 'importo_attuale'],
+    ),
+}
+
+
+def _ricostruisci_in_centesimi(tabella):
+    """
+    Istruzioni che ricostruiscono 'tabella' con gli importi in centesimi interi.
+    SQLite non permette di cambiare il tipo di una colonna: si crea una nuova
+    tabella, si copiano i dati convertiti e la si sostituisce alla vecchia,
+    conservando il contatore AUTOINCREMENT (gli id eliminati non vengono riusati).
+    """
+    definizione, colonne, importi = TABELLE_CENTESIMI[tabella]
+    nuova = f'{tabella}_nuova'
+    valori = ', '.join(
+        f'CAST(round({colonna} * 100) AS INTEGER)' if colonna in importi else colonna
+        for colonna in colonne
+    )
+    return [
+        definizione.format(tabella=nuova),
+        f"INSERT INTO {nuova} ({', '.join(colonne)}) SELECT {valori} FROM {tabella}",
+        f"DELETE FROM sqlite_sequence WHERE name = '{nuova}'",
+        f"INSERT INTO sqlite_sequence (name, seq) SELECT '{nuova}', seq FROM sqlite_sequence WHERE name = '{tabella}'",
+        f'DROP TABLE {tabella}',
+        f'ALTER TABLE {nuova} RENAME TO {tabella}',
+    ]
+
+
+# Indici delle migrazioni 1, 3 e 4, ricreati anche dopo la ricostruzione delle tabelle
+INDICI_PERIODO = [
+    'CREATE INDEX IF NOT EXISTS idx_transazioni_data ON transazioni (data, tipo, importo)',
+    'CREATE INDEX IF NOT EXISTS idx_transazioni_conto_data ON transazioni (conto_id, data)',
+    'CREATE INDEX IF NOT EXISTS idx_transazioni_tipo_data ON transazioni (tipo, data, categoria, importo)',
+    'CREATE INDEX IF NOT EXISTS idx_investimenti_conto ON investimenti (conto_id)',
+]
+INDICE_PAGINAZIONE = 'CREATE INDEX IF NOT EXISTS idx_transazioni_data_id ON transazioni (data, id)'
+INDICE_RIFERIMENTO = '''
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_transazioni_riferimento
+    ON transazioni (conto_id, riferimento_esterno)
+    WHERE riferimento_esterno IS NOT NULL
+'''
+
+# I trigger del riepilogo vanno eliminati prima di ricostruire le tabelle:
+# la RENAME verifica tutto lo schema e fallirebbe su trigger che puntano a tabelle rimosse
+RIEPILOGO_ELIMINAZIONE = [
+    f'DROP TRIGGER IF EXISTS {nome}'
+    for nome in re.findall(r'CREATE TRIGGER IF NOT EXISTS (\w+)', ''.join(RIEPILOGO_TRIGGER))
+] + [
+    'DROP TABLE IF EXISTS riepilogo',
+    'DROP TABLE IF EXISTS riepilogo_mensile',
+]
+
+# Migrazioni dello schema, applicate in ordine una sola volta.
+# La versione raggiunta è salvata in PRAGMA user_version: per aggiungere
+# una migrazione basta accodare una nuova lista di istruzioni SQL.
+MIGRAZIONI = [
+    # 1: indici per i filtri su data, conto e tipo delle transazioni.
+    # Includono 'importo' (e 'categoria') così le aggregazioni mensili
+    # vengono risolte leggendo solo l'indice, senza accedere alla tabella.
+    INDICI_PERIODO,
+    # 2: tabelle di riepilogo per la dashboard, mantenute dai trigger
+    RIEPILOGO_SCHEMA + RIEPILOGO_TRIGGER + RIEPILOGO_RICALCOLO,
+    # 3: indice sull'ordinamento (data, id) usato dalla paginazione keyset
+    [INDICE_PAGINAZIONE],
+    # 4: riferimento esterno (es. FITID della banca) per importazioni idempotenti
+    [
+        'ALTER TABLE transazioni ADD COLUMN riferimento_esterno TEXT',
+        INDICE_RIFERIMENTO,
+    ],
+    # 5: importi in centesimi interi (INTEGER) invece di euro in virgola mobile.
+    # Le somme diventano esatte e la conversione in euro avviene solo nelle risposte dell'API
+    RIEPILOGO_ELIMINAZIONE
+    + [sql for tabella in TABELLE_CENTESIMI for sql in _ricostruisci_in_centesimi(tabella)]
+    + INDICI_PERIODO + [INDICE_PAGINAZIONE, INDICE_RIFERIMENTO]
+    + RIEPILOGO_SCHEMA + RIEPILOGO_TRIGGER + RIEPILOGO_RICALCOLO,
+    # 6: registro dei saldi per le interrogazioni storiche. Il saldo iniziale
+    # dei conti esistenti è ricavato assumendo corretto il saldo attuale
+    [
+        'ALTER TABLE conti ADD COLUMN saldo_iniziale INTEGER NOT NULL DEFAULT 0',
+        '''
+        UPDATE conti SET saldo_iniziale = saldo - (
+            SELECT COALESCE(SUM(importo), 0) FROM transazioni WHERE conto_id = conti.id
+        )
+        ''',
+    ]
+    + REGISTRO_SCHEMA + REGISTRO_TRIGGER + REGISTRO_RICALCOLO,
+    # 7: registro delle eliminazioni e modifiche per i cubi analitici,
+    # così ogni processo del server vede anche quelle fatte dagli altri
+    RETTIFICHE_SCHEMA,
+    # 8: storico dei prezzi e simbolo/quantità degli investimenti quotati
+    VALUTAZIONE_SCHEMA,
+    # 9: ricerca full-text sulle transazioni, indicizzando quelle esistenti
+    RICERCA_SCHEMA + [RICERCA_RICOSTRUZIONE],
+    # 10: regole della categorizzazione automatica
+    CATEGORIE_SCHEMA,
+    # 11: transazioni ricorrenti e lease dei lavori periodici
+    RICORRENZE_SCHEMA,
+    # 12: obiettivi collegati a un conto o a una categoria
+    OBIETTIVI_COLLEGATI_SCHEMA,
+    # 13: budget con i contatori di spesa per periodo e gli avvisi
+    BUDGET_SCHEMA,
+]
+
+
+class CodaEsecuzione:
+    """
+    Thread dedicati a un tipo di lavoro sul database, con un limite alle
+    richieste in attesa: oltre il limite i chiamanti aspettano (backpressure)
+    invece di accumulare lavoro senza controllo.
+    """
+    def __init__(self, nome, thread, limite_attesa):
+        self.nome = nome
+        self.thread = thread
+        self.limite_attesa = limite_attesa
+        self._executor = ThreadPoolExecutor(max_workers=thread, thread_name_prefix=f'db-{nome}')
+        self._semaforo = None
+        self._in_corso = 0
+        self._completate = 0
+    
+    async def esegui(self, funzione, *args):
+        """Esegue funzione(*args) in uno dei thread della coda e ne attende il risultato"""
+        # Creato al primo uso, così appartiene all'event loop del server
+        if self._semaforo is None:
+            self._semaforo = asyncio.Semaphore(self.thread + self.limite_attesa)
+        
+        async with self._semaforo:
+            self._in_corso += 1
+            try:
+                loop = asyncio.get_running_loop()
+                # Il contesto viene copiato nel thread, così il lavoro sul database
+                # resta associato alla richiesta che l'ha generato (vedi metriche)
+                contesto = contextvars.copy_context()
+                return await loop.run_in_executor(self._executor, contesto.run, funzione, *args)
+            finally:
+                self._in_corso -= 1
+                self._completate += 1
+    
+    def chiudi(self):
+        self._executor.shutdown(wait=True)
+    
+    def stats(self):
+        return {
+            'thread': self.thread,
+            'limite_attesa': self.limite_attesa,
+            'in_corso': self._in_corso,
+            'completate': self._completate
+        }
+
+
+class CodaScrittura:
+    """
+    Unico thread di scrittura con commit di gruppo.
+    Le scritture arrivate mentre il thread era occupato vengono eseguite
+    insieme in una sola transazione BEGIN IMMEDIATE, ciascuna nel proprio
+    SAVEPOINT: un errore annulla solo la scrittura che l'ha causato, mentre
+    il COMMIT (e la scrittura del WAL) è uno solo per tutto il gruppo.
+    Con una sola scrittura in attesa il gruppo è di un elemento, quindi a
+    basso carico non si aggiunge latenza.
+    """
+    def __init__(self, database, limite_attesa, max_gruppo=64):
+        self.nome = 'scrittura'
+        self.thread = 1
+        self.limite_attesa = limite_attesa
+        self.max_gruppo = max_gruppo
+        self._database = database
+        self._richieste = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._semaforo = None
+        # Callback registrati dalla scrittura in esecuzione (vedi al_termine)
+        self._al_termine = None
+        self._in_corso = 0
+        self._completate = 0
+        self._gruppi = 0
+        self._gruppo_max = 0
+    
+    async def esegui(self, funzione, *args):
+        """Accoda funzione(conn, *args) e ne attende il risultato, dopo il commit del gruppo"""
+        if self._semaforo is None:
+            self._semaforo = asyncio.Semaphore(1 + self.limite_attesa)
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._ciclo, name='db-scrittura', daemon=True)
+                self._thread.start()
+        
+        async with self._semaforo:
+            self._in_corso += 1
+            try:
+                futuro = Future()
+                self._richieste.put((funzione, args, contextvars.copy_context(), futuro))
+                return await asyncio.wrap_future(futuro)
+            finally:
+                self._in_corso -= 1
+                self._completate += 1
+    
+    def al_termine(self, callback):
+        """
+        Registra callback(confermata) da chiamare sul thread di scrittura alla
+        fine della transazione della scrittura in corso: confermata=True dopo
+        il commit, False se la scrittura è stata annullata.
+        """
+        if self._al_termine is None or threading.current_thread() is not self._thread:
+            raise RuntimeError('al_termine va chiamato da una funzione eseguita con Database.scrivi')
+        self._al_termine.append(callback)
+    
+    def _ciclo(self):
+        while True:
+            richiesta = self._richieste.get()
+            if richiesta is None:
+                return
+            gruppo = [richiesta]
+            fermati = False
+            # Raccoglie senza attendere le altre scritture già in coda
+            while len(gruppo) < self.max_gruppo:
+                try:
+                    richiesta = self._richieste.get_nowait()
+                except queue.Empty:
+                    break
+                if richiesta is None:
+                    fermati = True
+                    break
+                gruppo.append(richiesta)
+            
+            self._esegui_gruppo(gruppo)
+            if fermati:
+                return
+    
+    def _esegui_gruppo(self, gruppo):
+        # Da qui le richieste non possono più essere annullate dal chiamante
+        gruppo = [r for r in gruppo if r[3].set_running_or_notify_cancel()]
+        if not gruppo:
+            return
+        riuscite = []
+        try:
+            with self._database.connection() as conn:
+                self._database.ritenta(conn.execute, 'BEGIN IMMEDIATE')
+                for funzione, args, contesto, futuro in gruppo:
+                    self._al_termine = []
+                    conn.execute('SAVEPOINT scrittura')
+                    try:
+                        risultato = contesto.run(funzione, conn, *args)
+                    except Exception as errore:
+                        conn.execute('ROLLBACK TO scrittura')
+                        conn.execute('RELEASE scrittura')
+                        callback, self._al_termine = self._al_termine, None
+                        self._notifica(callback, False)
+                        futuro.set_exception(errore)
+                    else:
+                        conn.execute('RELEASE scrittura')
+                        riuscite.append((futuro, risultato, self._al_termine))
+                        self._al_termine = None
+                self._database.ritenta(conn.commit)
+        except Exception as errore:
+            # Transazione del gruppo persa: falliscono anche le scritture riuscite
+            callback, self._al_termine = self._al_termine, None
+            self._notifica(callback or [], False)
+            for _, _, callback in riuscite:
+                self._notifica(callback, False)
+            for *_, futuro in gruppo:
+                if not futuro.done():
+                    futuro.set_exception(errore)
+            return
+        
+        for futuro, risultato, callback in riuscite:
+            self._notifica(callback, True)
+            futuro.set_result(risultato)
+        with self._lock:
+            self._gruppi += 1
+            self._gruppo_max = max(self._gruppo_max, len(gruppo))
+    
+    @staticmethod
+    def _notifica(callback, confermata):
+        for funzione in callback:
+            try:
+                funzione(confermata)
+            except Exception:
+                # Il thread di scrittura deve sopravvivere a un callback difettoso
+                log_database.exception('Callback di fine scrittura non riuscito')
+    
+    def chiudi(self):
+        """Attende le scritture già accodate e ferma il thread"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._richieste.put(None)
+            thread.join()
+    
+    def stats(self):
+        with self._lock:
+            return {
+                'thread': self.thread,
+                'limite_attesa': self.limite_attesa,
+                'in_corso': self._in_corso,
+                'completate': self._completate,
+                'gruppi': self._gruppi,
+                'scritture_per_gruppo': round(self._completate / self._gruppi, 2) if self._gruppi else 0,
+                'gruppo_max': self._gruppo_max,
+                'ritentativi': self._database.ritentativi
+            }
+
+
+class Database:
+    def __init__(self, db_name='finance.db', pool_size=10, pool_timeout=30.0,
+                 thread_lettura=4, thread_analisi=2, limite_attesa=256, metriche=None,
+                 max_gruppo_scrittura=64, tentativi_scrittura=5, inizializza=True,
+                 sola_lettura=False):
+        self.db_name = db_name
+        # Se indicato (metriche.Metriche) ogni istruzione SQL viene misurata
+        self.metriche = metriche
+        self.pool = ConnectionPool(db_name, size=pool_size, timeout=pool_timeout, sola_lettura=sola_lettura)
+        
+        # Tentativi per BEGIN IMMEDIATE e COMMIT quando un altro processo ha il
+        # lock di scrittura oltre il busy_timeout, con attesa esponenziale
+        self.tentativi_scrittura = tentativi_scrittura
+        self.ritentativi = 0
+        
+        # Code separate: le aggregazioni lente non occupano i thread delle
+        # letture puntuali, e un solo thread scrive così le scritture
+        # dell'applicazione non si contendono mai il lock di SQLite
+        self.code = {
+            'lettura': CodaEsecuzione('lettura', thread_lettura, limite_attesa),
+            'analisi': CodaEsecuzione('analisi', thread_analisi, limite_attesa),
+            'scrittura': CodaScrittura(self, limite_attesa, max_gruppo_scrittura),
+        }
+        # Con inizializza=False nessuna connessione viene aperta qui: lo schema
+        # va preparato con init_db (o manage.py migra) prima di usare il database
+        if inizializza:
+            self.init_db()
+    
+    @contextmanager
+    def connection(self):
+        """
+        Context manager che presta una connessione del pool e la restituisce al termine.
+        Le modifiche non confermate con commit() vengono annullate al rilascio.
+        """
+        if self.metriche is None:
+            conn = self.pool.acquire()
+            try:
+                yield conn
+            finally:
+                self.pool.release(conn)
+            return
+        
+        inizio = time.perf_counter()
+        conn = self.pool.acquire()
+        self.metriche.osserva_acquisizione(time.perf_counter() - inizio)
+        tracciata = ConnessioneTracciata(conn, self.metriche)
+        try:
+            yield tracciata
+        finally:
+            self.pool.release(tracciata.rilascia())
+    
+    def get_connection(self):
+        """Crea una nuova connessione al database SQLite (fuori dal pool)"""
+        return self.pool._create_connection()
+    
+    def _con_connessione(self, funzione, *args):
+        """Chiama funzione(conn, *args) con una connessione del pool"""
+        with self.connection() as conn:
+            return funzione(conn, *args)
+    
+    async def leggi(self, funzione, *args):
+        """Esegue una lettura veloce (funzione(conn, *args)) fuori dall'event loop"""
+        return await self.code['lettura'].esegui(self._con_connessione, funzione, *args)
+    
+    async def analizza(self, funzione, *args):
+        """Esegue un'aggregazione lenta sulla coda di analisi"""
+        return await self.code['analisi'].esegui(self._con_connessione, funzione, *args)
+    
+    async def scrivi(self, funzione, *args):
+        """
+        Esegue una scrittura (funzione(conn, *args)) sull'unico thread di scrittura.
+        La funzione non chiama commit(): la transazione è aperta e confermata
+        dalla coda, eventualmente insieme ad altre scritture (commit di gruppo).
+        Se solleva un'eccezione le sue modifiche vengono annullate.
+        """
+        return await self.code['scrittura'].esegui(funzione, *args)
+    
+    def al_termine(self, callback):
+        """Vedi CodaScrittura.al_termine"""
+        self.code['scrittura'].al_termine(callback)
+    
+    def ritenta(self, operazione, *args):
+        """
+        Esegue operazione(*args) ritentando con attesa esponenziale (più una
+        componente casuale) finché SQLite segnala il database occupato, fino
+        a tentativi_scrittura volte. Da usare per BEGIN IMMEDIATE e COMMIT.
+        """
+        for tentativo in range(self.tentativi_scrittura):
+            try:
+                return operazione(*args)
+            except sqlite3.OperationalError as errore:
+                if not _database_occupato(errore) or tentativo == self.tentativi_scrittura - 1:
+                    raise
+                self.ritentativi += 1
+                time.sleep(min(0.5, 0.01 * 2 ** tentativo) * random.uniform(0.5, 1.0))
+    
+    @contextmanager
+    def transazione(self):
+        """
+        Connessione con una transazione BEGIN IMMEDIATE, confermata all'uscita
+        e annullata in caso di eccezione. Per le scritture fuori dal server
+        (comandi di manutenzione, script): il lock di scrittura è preso subito,
+        quindi letture e aggiornamenti successivi non possono fallire a metà
+        per un altro scrittore.
+        """
+        with self.connection() as conn:
+            self.ritenta(conn.execute, 'BEGIN IMMEDIATE')
+            try:
+                yield conn
+            except BaseException:
+                conn.rollback()
+                raise
+            self.ritenta(conn.commit)
+    
+    def code_stats(self):
+        """Metriche delle code di esecuzione"""
+        return {nome: coda.stats() for nome, coda in self.code.items()}
+    
+    def close(self):
+        """Ferma le code di esecuzione e chiude tutte le connessioni del pool"""
+        for coda in self.code.values():
+            coda.chiudi()
+        self.pool.close_all()
+    
     def init_db(self):
-        """Inizializza il database creando le tabelle se non esistono"""
-        conn = self.get_connection()
+        """
+        Inizializza il database creando le tabelle se non esistono e applicando
+        le migrazioni mancanti. Più processi possono chiamarla insieme: ogni
+        passo prende il lock di scrittura e ricontrolla la versione dello schema.
+        """
+        with self.connection() as conn:
+            self._create_schema(conn)
+            self._apply_migrations(conn)
+        
+        # Decommentare questa riga per inserire dati di test al primo avvio
+        # self._insert_sample_data()
+    
+    def versione_schema(self):
+        """Restituisce (versione dello schema nel file, versione attesa dal codice)"""
+        with self.connection() as conn:
+            return conn.execute('PRAGMA user_version').fetchone()[0], len(MIGRAZIONI)
+    
+    def verifica_schema(self):
+        """Solleva RuntimeError se il file non ha tutte le migrazioni (senza applicarle)"""
+        versione, attesa = self.versione_schema()
+        if versione < attesa:
+            raise RuntimeError(
+                f'Schema di {self.db_name} alla versione {versione}, attesa {attesa}: '
+                'eseguire prima "python manage.py migra"'
+            )
+    
+    def _create_schema(self, conn):
+        """Crea le tabelle se non esistono"""
         cursor = conn.cursor()
+        self.ritenta(conn.execute, 'BEGIN IMMEDIATE')
         
         # Crea la tabella per i conti bancari
         cursor.execute('''
@@ -73,51 +1268,128 @@ class Database:
         ''')
         
         conn.commit()
-        conn.close()
+
+    def _apply_migrations(self, conn):
+        """Applica le migrazioni non ancora eseguite su questo file di database"""
+        iniziale = conn.execute('PRAGMA user_version').fetchone()[0]
         
-        # Decommentare questa riga per inserire dati di test al primo avvio
-        # self._insert_sample_data()
+        while True:
+            # Ogni migrazione è atomica: se un'istruzione fallisce il file resta alla
+            # versione precedente. La versione è riletta dopo aver preso il lock, così
+            # un processo avviato insieme a un altro non ripete le sue migrazioni
+            self.ritenta(conn.execute, 'BEGIN IMMEDIATE')
+            try:
+                versione = conn.execute('PRAGMA user_version').fetchone()[0]
+                if versione >= len(MIGRAZIONI):
+                    conn.rollback()
+                    break
+                for sql in MIGRAZIONI[versione]:
+                    conn.execute(sql)
+                # PRAGMA non accetta parametri, il numero è un intero generato qui
+                conn.execute(f'PRAGMA user_version = {versione + 1}')
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            log_database.info('Applicata la migrazione %d a %s', versione + 1, self.db_name)
+        
+        # Aggiorna le statistiche usate dal query planner per scegliere gli indici
+        if iniziale < len(MIGRAZIONI):
+            conn.execute('PRAGMA optimize')
+    
+    def explain(self, sql, params=()):
+        """Restituisce il piano di esecuzione (EXPLAIN QUERY PLAN) di una query"""
+        with self.connection() as conn:
+            rows = conn.execute(f'EXPLAIN QUERY PLAN {sql}', params).fetchall()
+        return [row['detail'] for row in rows]
+
+    def verifica_riepilogo(self, tolleranza=0):
+        """
+        Ricalcola i totali da zero e li confronta con le tabelle di riepilogo.
+        Restituisce la lista delle differenze trovate (vuota se non c'è deriva).
+        """
+        with self.connection() as conn:
+            return self._differenze_riepilogo(conn, tolleranza)
+    
+    def ricostruisci_riepilogo(self, tolleranza=0):
+        """Riscrive le tabelle di riepilogo da zero e restituisce la deriva corretta"""
+        with self.transazione() as conn:
+            differenze = self._differenze_riepilogo(conn, tolleranza)
+            
+            conn.execute('DELETE FROM riepilogo')
+            conn.execute('DELETE FROM riepilogo_mensile')
+            for sql in RIEPILOGO_RICALCOLO:
+                conn.execute(sql)
+        return differenze
+    
+    def _differenze_riepilogo(self, conn, tolleranza):
+        """Confronta valori memorizzati e ricalcolati, campo per campo e mese per mese"""
+        differenze = []
+        
+        atteso = conn.execute(queries.RIEPILOGO_CALCOLATO).fetchone()
+        memorizzato = conn.execute('SELECT * FROM riepilogo WHERE id = 1').fetchone()
+        for campo in atteso.keys():
+            valore = memorizzato[campo] if memorizzato else None
+            if valore is None or abs(valore - atteso[campo]) > tolleranza:
+                differenze.append({'campo': campo, 'memorizzato': valore, 'atteso': atteso[campo]})
+        
+        attesi = {row['mese']: row for row in conn.execute(queries.RIEPILOGO_MENSILE_CALCOLATO)}
+        memorizzati = {row['mese']: row for row in conn.execute('SELECT * FROM riepilogo_mensile')}
+        for mese in sorted(set(attesi) | set(memorizzati)):
+            for campo in ('variazione', 'spese'):
+                valore = memorizzati[mese][campo] if mese in memorizzati else 0
+                valore_atteso = attesi[mese][campo] if mese in attesi else 0
+                if abs(valore - valore_atteso) > tolleranza:
+                    differenze.append({
+                        'campo': f'{campo}[{mese}]',
+                        'memorizzato': valore,
+                        'atteso': valore_atteso
+                    })
+        return differenze
 
     def _insert_sample_data(self):
         """Inserisce dati di esempio nel database per testing"""
-        conn = self.get_connection()
+        with self.connection() as conn:
+            self._insert_sample_rows(conn)
+    
+    def _insert_sample_rows(self, conn):
+        """Inserisce le righe di esempio usando la connessione indicata (importi in centesimi)"""
         cursor = conn.cursor()
         
         # Verifica se il database è vuoto prima di inserire i dati
         cursor.execute('SELECT COUNT(*) as count FROM conti')
         if cursor.fetchone()['count'] == 0:
             
-            # Inserisce due conti di esempio
+            # Inserisce due conti di esempio: il saldo comprende già le
+            # transazioni qui sotto, il saldo iniziale è quello precedente
             cursor.execute('''
-                INSERT INTO conti (nome, tipo, saldo) VALUES
-                ('Conto Corrente Principale', 'Conto Corrente', 5420.50),
-                ('Conto Risparmio', 'Conto Risparmio', 12000.00)
+                INSERT INTO conti (nome, tipo, saldo, saldo_iniziale) VALUES
+                ('Conto Corrente Principale', 'Conto Corrente', 542050, 304590),
+                ('Conto Risparmio', 'Conto Risparmio', 1200000, 1150000)
             ''')
             
             # Inserisce alcune transazioni di esempio
             cursor.execute('''
                 INSERT INTO transazioni (conto_id, tipo, categoria, importo, descrizione, data) VALUES
-                (1, 'uscita', 'Shopping', -89.90, 'Abbigliamento', '2025-01-15 14:30:00'),
-                (1, 'uscita', 'Transport', -35.50, 'Rifornimento carburante', '2025-01-12 09:15:00'),
-                (1, 'entrata', 'Stipendio', 2500.00, 'Stipendio mensile', '2025-01-01 08:00:00'),
-                (2, 'entrata', 'Risparmio', 500.00, 'Trasferimento mensile', '2025-01-01 10:00:00')
+                (1, 'uscita', 'Shopping', -8990, 'Abbigliamento', '2025-01-15 14:30:00'),
+                (1, 'uscita', 'Transport', -3550, 'Rifornimento carburante', '2025-01-12 09:15:00'),
+                (1, 'entrata', 'Stipendio', 250000, 'Stipendio mensile', '2025-01-01 08:00:00'),
+                (2, 'entrata', 'Risparmio', 50000, 'Trasferimento mensile', '2025-01-01 10:00:00')
             ''')
             
             # Inserisce investimenti di esempio 
             cursor.execute('''
                 INSERT INTO investimenti (conto_id, nome, tipo, importo_iniziale, valore_attuale, rendimento) VALUES
-                (1, 'Portafoglio Azionario', 'Azioni', 15000.00, 19960.00, 4960.00),
-                (2, 'Fondo Pensione', 'Fondo', 8000.00, 8450.00, 450.00)
+                (1, 'Portafoglio Azionario', 'Azioni', 1500000, 1996000, 496000),
+                (2, 'Fondo Pensione', 'Fondo', 800000, 845000, 45000)
             ''')
             
             # Inserisce obiettivi di esempio (uno già completato)
             cursor.execute('''
                 INSERT INTO obiettivi (titolo, descrizione, importo_target, importo_attuale, completato) VALUES
-                ('Vacanza estiva', 'Viaggio in Grecia', 3000.00, 1200.00, 0),
-                ('Fondo emergenza', 'Riserva per imprevisti', 5000.00, 5000.00, 1),
-                ('Nuovo laptop', 'MacBook Pro', 2500.00, 800.00, 0)
+                ('Vacanza estiva', 'Viaggio in Grecia', 300000, 120000, 0),
+                ('Fondo emergenza', 'Riserva per imprevisti', 500000, 500000, 1),
+                ('Nuovo laptop', 'MacBook Pro', 250000, 80000, 0)
             ''')
             
             conn.commit()
-        
-        conn.close()
\ No newline at end of file
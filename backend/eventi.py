@@ -0,0 +1,191 @@
+"""
+Bus degli eventi di modifica, trasmessi ai client con Server-Sent Events.
+
+Gli endpoint che scrivono pubblicano, dopo il commit, un evento compatto:
+la riga creata o l'id di quella eliminata, il nuovo saldo del conto e i
+totali della dashboard letti nella stessa transazione. Così i client
+aggiornano i dati già caricati invece di rileggere le liste intere.
+
+Ogni evento viene codificato una sola volta nel formato SSE e lo stesso
+oggetto bytes finisce nella coda di ogni abbonato: il costo per client è un
+inserimento in coda e un invio sul socket, quindi un solo worker regge
+migliaia di dashboard aperte. Un abbonato che non legge abbastanza in
+fretta (coda piena) perde gli eventi in attesa e riceve 'ricarica'.
+
+Gli ultimi eventi restano in memoria: un client che si riconnette con
+Last-Event-ID riceve quelli persi nel frattempo; se non sono più
+disponibili (o l'id viene da un altro avvio del server) riceve 'ricarica'
+e deve rileggere i dati.
+
+Con più processi (vedi server.py e inoltro.py) gli eventi nascono nel
+processo scrittore: gli altri li ricevono dal suo flusso e li ripubblicano
+con lo stesso id, così un client può riconnettersi a un processo qualsiasi.
+"""
+import asyncio
+import threading
+import time
+from collections import deque
+
+from models import codifica_json
+
+# Evento che chiede al client di rileggere tutto: la sua copia dei dati
+# potrebbe aver perso degli aggiornamenti
+RICARICA = b'event: ricarica\ndata: {}\n\n'
+
+# Commento SSE inviato quando non ci sono eventi, per tenere aperta la
+# connessione attraverso proxy e bilanciatori
+KEEPALIVE = b': keepalive\n\n'
+
+
+class BusEventi:
+    def __init__(self, max_coda=256, storico=1024, keepalive=15.0, riconnessione_ms=3000):
+        self.max_coda = max_coda
+        self.keepalive = keepalive
+        self.riconnessione_ms = riconnessione_ms
+        # Gli id sono '<avvio>-<numero>': un Last-Event-ID di un avvio
+        # precedente non si confonde con quelli nuovi
+        self._avvio = format(int(time.time()), 'x')
+        self._ultimo = 0
+        # Numero più alto uscito dallo storico: chi si è fermato prima ha perso eventi.
+        # Gli eventi ripubblicati possono avere numeri non consecutivi
+        self._scartato = 0
+        self._storico = deque(maxlen=storico)
+        self._abbonati = set()
+        self._lock = threading.Lock()
+        self._chiuso = False
+
+        # Contatori per il monitoraggio
+        self.pubblicati = 0
+        self.consegnati = 0
+        self.ricariche = 0
+
+    def pubblica(self, tipo, dati):
+        """
+        Invia l'evento 'tipo' con i dati indicati a tutti gli abbonati.
+        Va chiamata dal ciclo asyncio (dagli endpoint, dopo il commit).
+        """
+        with self._lock:
+            self._ultimo += 1
+            numero = self._ultimo
+            messaggio = (
+                f'id: {self._avvio}-{numero}\nevent: {tipo}\ndata: '.encode()
+                + codifica_json(dati) + b'\n\n'
+            )
+            self._memorizza(numero, messaggio)
+            abbonati = list(self._abbonati)
+
+        for coda in abbonati:
+            self._accoda(coda, messaggio)
+
+    def ripubblica(self, id_evento, tipo, dati):
+        """
+        Invia agli abbonati un evento ricevuto dal processo scrittore, con il
+        suo id e i dati già codificati in JSON (bytes).
+        """
+        avvio, _, numero = id_evento.partition('-')
+        numero = int(numero)
+        messaggio = f'id: {id_evento}\nevent: {tipo}\ndata: '.encode() + dati + b'\n\n'
+        with self._lock:
+            if avvio != self._avvio:
+                # Primo evento ricevuto o scrittore riavviato: gli eventi
+                # precedenti non sono disponibili
+                self._avvio = avvio
+                self._storico.clear()
+                self._scartato = numero - 1
+            self._ultimo = numero
+            self._memorizza(numero, messaggio)
+            abbonati = list(self._abbonati)
+
+        for coda in abbonati:
+            self._accoda(coda, messaggio)
+
+    def ricarica(self):
+        """Chiede a tutti gli abbonati di rileggere i dati"""
+        with self._lock:
+            abbonati = list(self._abbonati)
+        for coda in abbonati:
+            while not coda.empty():
+                coda.get_nowait()
+            coda.put_nowait(RICARICA)
+            self.ricariche += 1
+
+    def _memorizza(self, numero, messaggio):
+        if len(self._storico) == self._storico.maxlen:
+            self._scartato = self._storico[0][0]
+        self._storico.append((numero, messaggio))
+        self.pubblicati += 1
+
+    def _accoda(self, coda, messaggio):
+        try:
+            coda.put_nowait(messaggio)
+            self.consegnati += 1
+        except asyncio.QueueFull:
+            # Client troppo lento: gli eventi in attesa non servono più,
+            # deve comunque rileggere i dati
+            while not coda.empty():
+                coda.get_nowait()
+            coda.put_nowait(RICARICA)
+            self.ricariche += 1
+
+    def _persi(self, ultimo_id):
+        """Eventi successivi a Last-Event-ID, oppure None se non sono più disponibili"""
+        avvio, _, numero = (ultimo_id or '').partition('-')
+        if avvio != self._avvio or not numero.isdigit() or int(numero) > self._ultimo:
+            return None
+        numero = int(numero)
+        if numero < self._scartato:
+            return None
+        return [messaggio for n, messaggio in self._storico if n > numero]
+
+    async def flusso(self, ultimo_id=None):
+        """
+        Generatore asincrono del flusso SSE di un client: prima gli eventi
+        persi dopo 'ultimo_id' (o 'ricarica'), poi quelli nuovi man mano
+        che vengono pubblicati. Finisce quando il client si disconnette o
+        il bus viene chiuso.
+        """
+        coda = asyncio.Queue(self.max_coda)
+        with self._lock:
+            persi = self._persi(ultimo_id) if ultimo_id else []
+            self._abbonati.add(coda)
+        try:
+            yield f'retry: {self.riconnessione_ms}\n\n'.encode()
+            if persi is None:
+                self.ricariche += 1
+                yield RICARICA
+            else:
+                for messaggio in persi:
+                    yield messaggio
+
+            while not self._chiuso:
+                try:
+                    messaggio = await asyncio.wait_for(coda.get(), self.keepalive)
+                except asyncio.TimeoutError:
+                    messaggio = KEEPALIVE
+                if messaggio is None:
+                    break
+                yield messaggio
+        finally:
+            with self._lock:
+                self._abbonati.discard(coda)
+
+    def chiudi(self):
+        """Termina tutti i flussi aperti (allo spegnimento del server)"""
+        with self._lock:
+            self._chiuso = True
+            abbonati = list(self._abbonati)
+        for coda in abbonati:
+            while not coda.empty():
+                coda.get_nowait()
+            coda.put_nowait(None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'abbonati': len(self._abbonati),
+                'pubblicati': self.pubblicati,
+                'consegnati': self.consegnati,
+                'ricariche': self.ricariche,
+                'storico': len(self._storico),
+                'ultimo_id': f'{self._avvio}-{self._ultimo}'
+            }
@@ -0,0 +1,76 @@
+"""
+Esportazione in streaming delle transazioni (NDJSON e CSV).
+
+Le righe vengono lette dal cursore SQLite a blocchi e serializzate una alla
+volta da generatori, quindi la memoria usata resta costante qualunque sia
+il numero di transazioni esportate.
+"""
+import csv
+import io
+import json
+import zlib
+
+# Righe lette dal cursore ad ogni giro (compromesso tra chiamate e memoria)
+DIMENSIONE_BLOCCO = 1000
+
+COLONNE = ['id', 'conto_id', 'tipo', 'categoria', 'importo', 'descrizione', 'data']
+
+# Espressioni SQL delle colonne: l'importo è salvato in centesimi e si esporta in euro
+COLONNE_SQL = ['id', 'conto_id', 'tipo', 'categoria', 'importo / 100.0', 'descrizione', 'data']
+
+FORMATI = {
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'csv': ('text/csv', 'csv'),
+}
+
+
+def leggi_blocchi(cursor):
+    """Itera sulle righe del cursore a blocchi di DIMENSIONE_BLOCCO"""
+    while True:
+        rows = cursor.fetchmany(DIMENSIONE_BLOCCO)
+        if not rows:
+            return
+        yield rows
+
+
+def genera_ndjson(cursor):
+    """Produce un oggetto JSON per riga, un blocco di righe alla volta"""
+    for rows in leggi_blocchi(cursor):
+        yield ''.join(
+            json.dumps(dict(zip(COLONNE, row)), ensure_ascii=False) + '\n'
+            for row in rows
+        ).encode('utf-8')
+
+
+def genera_csv(cursor):
+    """Produce l'intestazione e poi le righe CSV, riusando lo stesso buffer"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLONNE)
+
+    for rows in leggi_blocchi(cursor):
+        writer.writerows(rows)
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+
+    # Solo intestazione se non ci sono righe
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+def comprimi_gzip(chunks):
+    """Comprime al volo un flusso di byte in formato gzip"""
+    # wbits=31 produce un file .gz completo (header e checksum gzip)
+    compressore = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        dati = compressore.compress(chunk)
+        if dati:
+            yield dati
+    yield compressore.flush()
+
+
+GENERATORI = {
+    'ndjson': genera_ndjson,
+    'csv': genera_csv,
+}
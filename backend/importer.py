@@ -0,0 +1,228 @@
+"""
+Importazione massiva di transazioni (estratti conto in JSON, CSV o OFX).
+
+Tutte le righe valide di un lotto vengono inserite con una sola executemany
+all'interno della transazione di scrittura, e il saldo di ogni conto viene
+aggiornato una sola volta con la somma degli importi importati.
+Le righe con un 'riferimento_esterno' già presente vengono saltate, quindi
+reimportare lo stesso file non duplica i movimenti.
+"""
+import csv
+import io
+import re
+from collections import defaultdict
+from datetime import datetime
+
+from models import in_centesimi, in_euro
+
+TIPI_VALIDI = ('entrata', 'uscita')
+
+# Categoria assegnata quando il file non ne specifica una
+CATEGORIA_PREDEFINITA = 'Da categorizzare'
+
+# Numero massimo di parametri per una singola clausola IN (limite di SQLite)
+DIMENSIONE_IN = 500
+
+
+def valida_riga(riga, conti_esistenti):
+    """
+    Valida e normalizza una riga da importare.
+    Restituisce (transazione, None) se valida oppure (None, messaggio di errore).
+    """
+    if not isinstance(riga, dict):
+        return None, 'La riga deve essere un oggetto'
+
+    try:
+        conto_id = int(riga.get('conto_id'))
+    except (TypeError, ValueError):
+        return None, 'conto_id mancante o non valido'
+    if conto_id not in conti_esistenti:
+        return None, f'Conto {conto_id} non trovato'
+
+    # Gli importi dei file sono in euro: si salvano in centesimi interi
+    try:
+        importo = in_centesimi(riga.get('importo'))
+    except ValueError:
+        return None, 'importo mancante o non valido'
+
+    # Se il tipo non è indicato si ricava dal segno dell'importo
+    tipo = riga.get('tipo') or ('uscita' if importo < 0 else 'entrata')
+    if tipo not in TIPI_VALIDI:
+        return None, f"tipo non valido: '{tipo}'"
+    # Le uscite sono sempre memorizzate con importo negativo
+    if tipo == 'uscita' and importo > 0:
+        importo = -importo
+
+    data = riga.get('data') or datetime.now().isoformat()
+    try:
+        datetime.fromisoformat(str(data).replace('Z', '+00:00'))
+    except ValueError:
+        return None, f"data non valida: '{data}'"
+
+    riferimento = riga.get('riferimento_esterno')
+    return {
+        'conto_id': conto_id,
+        'tipo': tipo,
+        # Senza categoria la riga viene categorizzata da importa()
+        'categoria': riga.get('categoria') or None,
+        'importo': importo,
+        'descrizione': riga.get('descrizione') or '',
+        'data': str(data),
+        'riferimento_esterno': str(riferimento) if riferimento not in (None, '') else None
+    }, None
+
+
+def _riferimenti_esistenti(conn, conto_id, riferimenti):
+    """Restituisce i riferimenti esterni già importati per un conto"""
+    trovati = set()
+    riferimenti = list(riferimenti)
+    for i in range(0, len(riferimenti), DIMENSIONE_IN):
+        blocco = riferimenti[i:i + DIMENSIONE_IN]
+        segnaposti = ', '.join('?' * len(blocco))
+        rows = conn.execute(
+            f'SELECT riferimento_esterno FROM transazioni '
+            f'WHERE conto_id = ? AND riferimento_esterno IN ({segnaposti})',
+            [conto_id, *blocco]
+        )
+        trovati.update(row[0] for row in rows)
+    return trovati
+
+
+def importa(conn, righe, categorizza=None):
+    """
+    Valida e inserisce un lotto di righe.
+    Va eseguita dentro una transazione di scrittura (Database.scrivi o
+    Database.transazione, che prendono subito il lock con BEGIN IMMEDIATE):
+    il controllo dei duplicati e l'inserimento avvengono sulla stessa vista
+    del database, e un errore annulla l'intero lotto.
+    Restituisce il riepilogo con il numero di righe importate, i duplicati
+    saltati, gli errori per riga e la variazione di saldo applicata a ogni conto.
+    'categorizza' (connessione, lista di (descrizione, importo) -> categorie o
+    None) propone la categoria delle righe che non ne hanno una; quelle
+    rimaste senza ricevono CATEGORIA_PREDEFINITA.
+    """
+    conti_esistenti = {row[0] for row in conn.execute('SELECT id FROM conti')}
+
+    valide = []
+    errori = []
+    for numero, riga in enumerate(righe, start=1):
+        transazione, errore = valida_riga(riga, conti_esistenti)
+        if errore:
+            errori.append({'riga': numero, 'errore': errore})
+        else:
+            valide.append(transazione)
+
+    # Scarta i riferimenti già presenti nel database o ripetuti nel lotto
+    riferimenti_per_conto = defaultdict(set)
+    for t in valide:
+        if t['riferimento_esterno']:
+            riferimenti_per_conto[t['conto_id']].add(t['riferimento_esterno'])
+    visti = {
+        (conto_id, rif)
+        for conto_id, riferimenti in riferimenti_per_conto.items()
+        for rif in _riferimenti_esistenti(conn, conto_id, riferimenti)
+    }
+
+    da_inserire = []
+    duplicate = 0
+    for t in valide:
+        chiave = (t['conto_id'], t['riferimento_esterno'])
+        if t['riferimento_esterno'] and chiave in visti:
+            duplicate += 1
+            continue
+        visti.add(chiave)
+        da_inserire.append(t)
+
+    # Una sola passata del categorizzatore su tutte le righe senza categoria
+    senza_categoria = [t for t in da_inserire if t['categoria'] is None]
+    categorizzate = 0
+    if senza_categoria and categorizza is not None:
+        proposte = categorizza(conn, [(t['descrizione'], t['importo']) for t in senza_categoria])
+        for t, categoria in zip(senza_categoria, proposte):
+            if categoria:
+                t['categoria'] = categoria
+                categorizzate += 1
+    for t in senza_categoria:
+        if t['categoria'] is None:
+            t['categoria'] = CATEGORIA_PREDEFINITA
+
+    conn.executemany('''
+        INSERT INTO transazioni (conto_id, tipo, categoria, importo, descrizione, data, riferimento_esterno)
+        VALUES (:conto_id, :tipo, :categoria, :importo, :descrizione, :data, :riferimento_esterno)
+    ''', da_inserire)
+
+    # Un solo aggiornamento del saldo per conto, con la somma degli importi
+    variazioni = defaultdict(int)
+    for t in da_inserire:
+        variazioni[t['conto_id']] += t['importo']
+    conn.executemany(
+        'UPDATE conti SET saldo = saldo + ? WHERE id = ?',
+        [(delta, conto_id) for conto_id, delta in variazioni.items()]
+    )
+
+    return {
+        'importate': len(da_inserire),
+        'duplicate': duplicate,
+        'categorizzate': categorizzate,
+        'errori': errori,
+        'variazioni_saldo': {conto_id: in_euro(delta) for conto_id, delta in variazioni.items()}
+    }
+
+
+def leggi_csv(testo, conto_id=None):
+    """
+    Converte un CSV con intestazione in righe da importare.
+    Colonne riconosciute: data, importo, descrizione, categoria, tipo,
+    conto_id, riferimento_esterno. Se il file non ha la colonna conto_id
+    si usa quello passato come parametro.
+    """
+    righe = []
+    for record in csv.DictReader(io.StringIO(testo)):
+        riga = {chiave.strip(): (valore or '').strip() for chiave, valore in record.items() if chiave}
+        if not riga.get('conto_id') and conto_id is not None:
+            riga['conto_id'] = conto_id
+        righe.append(riga)
+    return righe
+
+
+# Blocchi <STMTTRN> di un estratto OFX e singoli campi <TAG>valore
+_OFX_TRANSAZIONE = re.compile(r'<STMTTRN>(.*?)</STMTTRN>', re.DOTALL | re.IGNORECASE)
+_OFX_CAMPO = re.compile(r'<(\w+)>([^<\r\n]*)')
+
+
+def _data_ofx(valore):
+    """Converte una data OFX (YYYYMMDD[HHMMSS][.XXX][TZ]) in formato ISO"""
+    cifre = re.match(r'\d+', valore or '')
+    cifre = cifre.group(0) if cifre else ''
+    if len(cifre) >= 14:
+        return datetime.strptime(cifre[:14], '%Y%m%d%H%M%S').isoformat()
+    if len(cifre) >= 8:
+        return datetime.strptime(cifre[:8], '%Y%m%d').date().isoformat()
+    return None
+
+
+def leggi_ofx(testo, conto_id):
+    """Converte le transazioni di un estratto OFX (anche SGML senza tag di chiusura)"""
+    righe = []
+    for blocco in _OFX_TRANSAZIONE.findall(testo):
+        campi = {tag.upper(): valore.strip() for tag, valore in _OFX_CAMPO.findall(blocco)}
+        try:
+            data = _data_ofx(campi.get('DTPOSTED'))
+        except ValueError:
+            data = None
+        # Una data non interpretabile resta com'è e viene segnalata dalla validazione
+        data = data or campi.get('DTPOSTED')
+        righe.append({
+            'conto_id': conto_id,
+            'importo': campi.get('TRNAMT', '').replace(',', '.'),
+            'data': data,
+            'descrizione': campi.get('NAME') or campi.get('MEMO') or '',
+            'riferimento_esterno': campi.get('FITID')
+        })
+    return righe
+
+
+LETTORI_FILE = {
+    'csv': leggi_csv,
+    'ofx': leggi_ofx,
+}
@@ -0,0 +1,183 @@
+"""
+Modalità multi-processo: inoltro delle scritture al processo scrittore.
+
+SQLite ammette un solo scrittore alla volta, quindi con più processi (vedi
+server.py) le scritture passano tutte da un unico processo 'scrittura',
+raggiungibile su un socket Unix. I processi 'lettura' servono le letture
+dal proprio pool e dalla propria cache e gli inoltrano le richieste che
+modificano i dati; ogni processo tiene da solo i propri cubi analitici,
+allineati leggendo il database (vedi analitica.py).
+
+Il processo scrittore pubblica anche le invalidazioni della cache come
+evento interno 'invalida': i lettori seguono il suo flusso /api/eventi,
+aggiornano la propria cache e ripubblicano gli altri eventi ai propri
+client. Il lettore che ha inoltrato una scrittura invalida subito le
+tabelle indicate nell'header della risposta, così chi ha scritto rilegge
+già i dati nuovi senza aspettare l'evento.
+"""
+import asyncio
+import contextvars
+import json
+import logging
+
+import httpx
+
+from models import codifica_json
+
+log_inoltro = logging.getLogger('financehub.inoltro')
+
+METODI_SCRITTURA = {'POST', 'PUT', 'PATCH', 'DELETE'}
+
+# Tabelle invalidate dalla richiesta, separate da virgole
+HEADER_INVALIDA = 'x-finance-invalida'
+
+# Header che riguardano la singola connessione e non vanno ricopiati
+_ESCLUSI_RICHIESTA = {b'host', b'content-length', b'connection', b'transfer-encoding'}
+_ESCLUSI_RISPOSTA = {'content-length', 'content-encoding', 'connection', 'transfer-encoding'}
+
+# Insieme delle tabelle invalidate durante la richiesta in corso (processo scrittore)
+_invalidate = contextvars.ContextVar('tabelle_invalidate', default=None)
+
+
+def client_scrittore(percorso_socket):
+    """Client HTTP verso il processo scrittore in ascolto sul socket Unix indicato"""
+    return httpx.AsyncClient(
+        transport=httpx.AsyncHTTPTransport(uds=percorso_socket),
+        base_url='http://scrittore',
+        # Un import lungo non deve scadere; la connessione invece è locale
+        timeout=httpx.Timeout(None, connect=5.0),
+    )
+
+
+def registra_invalidazione(tabelle):
+    """Annota le tabelle invalidate dalla richiesta in corso (da CacheRisposte.al_cambio)"""
+    raccolte = _invalidate.get()
+    if raccolte is not None:
+        raccolte.update(tabelle)
+
+
+class MiddlewareScrittore:
+    """
+    Middleware ASGI del processo scrittore: aggiunge alla risposta di ogni
+    scrittura l'header con le tabelle che ha invalidato.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['method'] not in METODI_SCRITTURA:
+            await self.app(scope, receive, send)
+            return
+
+        tabelle = set()
+        token = _invalidate.set(tabelle)
+
+        async def invia(messaggio):
+            if messaggio['type'] == 'http.response.start' and tabelle:
+                valore = ','.join(sorted(tabelle)).encode()
+                messaggio = {**messaggio, 'headers': [*messaggio.get('headers', []), (HEADER_INVALIDA.encode(), valore)]}
+            await send(messaggio)
+
+        try:
+            await self.app(scope, receive, invia)
+        finally:
+            _invalidate.reset(token)
+
+
+class MiddlewareInoltro:
+    """
+    Middleware ASGI dei processi di lettura: le richieste che modificano i
+    dati vengono inoltrate così come sono al processo scrittore e la sua
+    risposta restituita al client; le altre proseguono nell'applicazione.
+    """
+    def __init__(self, app, client, cache):
+        self.app = app
+        self.client = client
+        self.cache = cache
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['method'] not in METODI_SCRITTURA:
+            await self.app(scope, receive, send)
+            return
+
+        corpo = bytearray()
+        while True:
+            messaggio = await receive()
+            corpo += messaggio.get('body', b'')
+            if not messaggio.get('more_body'):
+                break
+
+        url = scope['path']
+        if scope['query_string']:
+            url += '?' + scope['query_string'].decode('latin-1')
+        headers = [
+            (nome.decode('latin-1'), valore.decode('latin-1'))
+            for nome, valore in scope['headers'] if nome not in _ESCLUSI_RICHIESTA
+        ]
+
+        try:
+            risposta = await self.client.request(scope['method'], url, headers=headers, content=bytes(corpo))
+        except httpx.TransportError as e:
+            log_inoltro.error('Processo scrittore non raggiungibile: %s', e)
+            await self._invia(send, 503, [(b'content-type', b'application/json')],
+                              codifica_json({'detail': 'Servizio di scrittura non disponibile'}))
+            return
+
+        tabelle = risposta.headers.get(HEADER_INVALIDA)
+        if tabelle:
+            self.cache.invalida(*tabelle.split(','))
+
+        headers = [
+            (nome.encode('latin-1'), valore.encode('latin-1'))
+            for nome, valore in risposta.headers.multi_items() if nome.lower() not in _ESCLUSI_RISPOSTA
+        ]
+        await self._invia(send, risposta.status_code, headers, risposta.content)
+
+    @staticmethod
+    async def _invia(send, stato, headers, corpo):
+        headers = [*headers, (b'content-length', str(len(corpo)).encode())]
+        await send({'type': 'http.response.start', 'status': stato, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': corpo})
+
+
+async def segui_eventi(client, eventi, cache, pausa=1.0):
+    """
+    Segue il flusso di eventi del processo scrittore (fino alla cancellazione):
+    'invalida' aggiorna la cache locale, 'ricarica' la svuota e la inoltra ai
+    client, gli altri eventi vengono ripubblicati con lo stesso id. Se la
+    connessione cade si riconnette con Last-Event-ID, così non perde eventi.
+    """
+    ultimo_id = None
+    riconnessione = False
+    while True:
+        try:
+            headers = {'Last-Event-ID': ultimo_id} if ultimo_id else {}
+            async with client.stream('GET', '/api/eventi', headers=headers) as risposta:
+                if riconnessione and ultimo_id is None:
+                    # Senza un id da cui riprendere non si sa cosa è cambiato nel frattempo
+                    cache.svuota()
+                    eventi.ricarica()
+                riconnessione = True
+                id_evento = tipo = dati = None
+                async for riga in risposta.aiter_lines():
+                    if riga.startswith('id: '):
+                        id_evento = riga[4:]
+                    elif riga.startswith('event: '):
+                        tipo = riga[7:]
+                    elif riga.startswith('data: '):
+                        dati = riga[6:]
+                    elif not riga and tipo:
+                        # Riga vuota: l'evento è completo
+                        if tipo == 'invalida':
+                            cache.invalida(*json.loads(dati)['tabelle'])
+                        elif tipo == 'ricarica':
+                            cache.svuota()
+                            eventi.ricarica()
+                        elif id_evento:
+                            eventi.ripubblica(id_evento, tipo, dati.encode())
+                        if id_evento:
+                            ultimo_id = id_evento
+                        id_evento = tipo = dati = None
+        except (httpx.TransportError, httpx.HTTPStatusError) as e:
+            log_inoltro.warning('Flusso eventi dello scrittore interrotto: %s', e)
+        await asyncio.sleep(pausa)
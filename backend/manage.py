@@ -0,0 +1,164 @@
+"""
+Comandi di manutenzione del database.
+
+Uso (dalla cartella backend/):
+    python manage.py migra
+    python manage.py verifica-piani
+    python manage.py verifica-riepilogo
+    python manage.py ricostruisci-riepilogo
+    python manage.py crea-checkpoint
+    python manage.py riconcilia-saldi
+    python manage.py importa-prezzi prezzi.csv
+    python manage.py ricostruisci-ricerca
+"""
+import argparse
+import re
+import sys
+
+from database import Database, RICERCA_RICOSTRUZIONE
+import queries
+import registro
+import valutazione
+
+
+def migra(db, args):
+    """Crea le tabelle e applica le migrazioni mancanti"""
+    # Le migrazioni vengono già eseguite dal costruttore di Database
+    print(f'Database {db.db_name} aggiornato')
+    return 0
+
+
+# Riga del piano che scorre tutte le transazioni
+SCANSIONE_TRANSAZIONI = re.compile(r'SCAN (transazioni|t)\b')
+
+
+def verifica_piani(db, args):
+    """
+    Controlla con EXPLAIN QUERY PLAN che le query di queries.QUERY_INDICIZZATE
+    usino un indice: una riga 'SCAN transazioni' (o 'SCAN t', l'alias della
+    ricerca) indica una scansione completa. L'indice full-text
+    'transazioni_fts' non conta.
+    """
+    errori = 0
+    for nome, (sql, params) in queries.QUERY_INDICIZZATE.items():
+        piano = db.explain(sql, params)
+        scansioni = [riga for riga in piano if SCANSIONE_TRANSAZIONI.match(riga)]
+
+        stato = 'ERRORE' if scansioni else 'OK'
+        print(f'[{stato}] {nome}')
+        for riga in piano:
+            print(f'        {riga}')
+
+        if scansioni:
+            errori += 1
+
+    return 1 if errori else 0
+
+
+def _stampa_differenze(differenze):
+    for diff in differenze:
+        print(f"  {diff['campo']}: memorizzato={diff['memorizzato']} atteso={diff['atteso']}")
+
+
+def verifica_riepilogo(db, args):
+    """Confronta i totali della dashboard con un ricalcolo completo e segnala la deriva"""
+    differenze = db.verifica_riepilogo()
+    if not differenze:
+        print('Riepilogo coerente con i dati')
+        return 0
+
+    print(f'Trovate {len(differenze)} differenze nel riepilogo (importi in centesimi):')
+    _stampa_differenze(differenze)
+    return 1
+
+
+def ricostruisci_riepilogo(db, args):
+    """Ricalcola da zero le tabelle di riepilogo della dashboard"""
+    differenze = db.ricostruisci_riepilogo()
+    print(f'Riepilogo ricostruito ({len(differenze)} differenze corrette)')
+    _stampa_differenze(differenze)
+    return 0
+
+
+def crea_checkpoint(db, args):
+    """Crea i checkpoint di fine mese mancanti nel registro dei saldi"""
+    with db.transazione() as conn:
+        creati = registro.crea_checkpoint(conn)
+    print(f'Creati {creati} checkpoint dei saldi')
+    return 0
+
+
+def riconcilia_saldi(db, args):
+    """Verifica i saldi dei conti contro il registro storico e le transazioni"""
+    with db.connection() as conn:
+        esito = registro.riconcilia(conn)
+
+    if not esito['conti'] and not esito['checkpoint']:
+        print('Saldi riconciliati con il registro')
+        return 0
+
+    print(f"Trovate {len(esito['conti'])} discrepanze nei saldi e "
+          f"{len(esito['checkpoint'])} nei checkpoint (importi in centesimi):")
+    for conto in esito['conti']:
+        print(f"  conto {conto['conto_id']} ({conto['nome']}): saldo={conto['saldo']} "
+              f"registro={conto['saldo_registro']} transazioni={conto['saldo_transazioni']}")
+    for checkpoint in esito['checkpoint']:
+        print(f"  checkpoint conto {checkpoint['conto_id']} al {checkpoint['giorno']}: "
+              f"memorizzato={checkpoint['memorizzato']} atteso={checkpoint['atteso']}")
+    return 1
+
+
+def importa_prezzi(db, args):
+    """Importa i prezzi da un CSV (simbolo,data,prezzo) e rivaluta gli investimenti quotati"""
+    if not args.file:
+        print('Indicare il file CSV dei prezzi')
+        return 2
+    with open(args.file, encoding='utf-8-sig') as f:
+        righe, errori = valutazione.leggi_prezzi_csv(f.read())
+    with db.transazione() as conn:
+        cambiati = valutazione.importa_prezzi(conn, righe)
+        rivalutati = valutazione.rivaluta(conn)
+
+    print(f'Letti {len(righe)} prezzi ({cambiati} nuovi o cambiati), '
+          f'rivalutati {len(rivalutati)} investimenti')
+    for errore in errori:
+        print(f"  riga {errore['riga']}: {errore['errore']}")
+    return 1 if errori else 0
+
+
+def ricostruisci_ricerca(db, args):
+    """Ricostruisce l'indice full-text delle transazioni dal contenuto della tabella"""
+    with db.transazione() as conn:
+        conn.execute(RICERCA_RICOSTRUZIONE)
+    print('Indice di ricerca ricostruito')
+    return 0
+
+
+COMANDI = {
+    'migra': migra,
+    'verifica-piani': verifica_piani,
+    'verifica-riepilogo': verifica_riepilogo,
+    'ricostruisci-riepilogo': ricostruisci_riepilogo,
+    'crea-checkpoint': crea_checkpoint,
+    'riconcilia-saldi': riconcilia_saldi,
+    'importa-prezzi': importa_prezzi,
+    'ricostruisci-ricerca': ricostruisci_ricerca,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Manutenzione del database FinanceHub')
+    parser.add_argument('comando', choices=COMANDI.keys())
+    parser.add_argument('file', nargs='?', help='File da importare (importa-prezzi)')
+    parser.add_argument('--db', default='finance.db', help='Percorso del file SQLite')
+    args = parser.parse_args(argv)
+
+    db = Database(args.db)
+    try:
+        return COMANDI[args.comando](db, args)
+    finally:
+        db.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,403 @@
+"""
+Profilazione delle richieste e strumentazione delle query SQLite.
+
+- MiddlewareProfilazione misura ogni richiesta HTTP e aggiunge l'header
+  Server-Timing con il tempo passato nel database, nell'attesa di una
+  connessione del pool e nella serializzazione.
+- ConnessioneTracciata avvolge una connessione del pool e registra durata e
+  righe di ogni istruzione SQL; i callback di trace e progress di sqlite3
+  contano anche le istruzioni eseguite dai trigger e i passi della VM.
+- Metriche raccoglie tutto e lo esporta nel formato testuale di Prometheus.
+
+I dati della richiesta in corso viaggiano in una ContextVar, che le code di
+esecuzione del database copiano nei loro thread.
+"""
+import contextvars
+import logging
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+
+logger_query_lente = logging.getLogger('financehub.query_lente')
+
+# Limiti superiori (secondi) dei bucket degli istogrammi
+BUCKET_HTTP = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BUCKET_SQL = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+# Ogni quante istruzioni della VM di SQLite viene chiamato il progress handler
+PASSI_PROGRESS = 10000
+
+# Lunghezza massima del testo SQL usato come etichetta
+LUNGHEZZA_ETICHETTA_SQL = 160
+
+_profilo_corrente = contextvars.ContextVar('profilo_richiesta', default=None)
+
+
+class ProfiloRichiesta:
+    """Tempi accumulati durante una singola richiesta"""
+    __slots__ = ('db', 'acquisizione', 'serializzazione', 'query', 'righe', 'istruzioni', 'passi_vm')
+
+    def __init__(self):
+        self.db = 0.0
+        self.acquisizione = 0.0
+        self.serializzazione = 0.0
+        self.query = 0
+        self.righe = 0
+        self.istruzioni = 0
+        self.passi_vm = 0
+
+    def server_timing(self, totale):
+        """Valore dell'header Server-Timing (durate in millisecondi)"""
+        return ', '.join([
+            f'db;dur={self.db * 1000:.2f};desc="SQL ({self.query} query, {self.istruzioni} istruzioni, {self.righe} righe)"',
+            f'acq;dur={self.acquisizione * 1000:.2f};desc="Attesa connessione"',
+            f'ser;dur={self.serializzazione * 1000:.2f};desc="Serializzazione"',
+            f'app;dur={totale * 1000:.2f};desc="Totale"',
+        ])
+
+
+def etichetta_sql(sql):
+    """Testo SQL compattato su una riga, usato come etichetta delle metriche"""
+    testo = re.sub(r'\s+', ' ', sql).strip()
+    if len(testo) > LUNGHEZZA_ETICHETTA_SQL:
+        testo = testo[:LUNGHEZZA_ETICHETTA_SQL - 3] + '...'
+    return testo
+
+
+class _Istogramma:
+    __slots__ = ('conteggi', 'somma', 'totale')
+
+    def __init__(self, bucket):
+        self.conteggi = [0] * (len(bucket) + 1)
+        self.somma = 0.0
+        self.totale = 0
+
+
+def _etichette(**valori):
+    coppie = []
+    for nome, valore in valori.items():
+        valore = str(valore).replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' ')
+        coppie.append(f'{nome}="{valore}"')
+    return '{' + ','.join(coppie) + '}'
+
+
+class Metriche:
+    """
+    Contatori e istogrammi in memoria, aggiornati da più thread.
+    Con attiva=False le misure di serializzazione non vengono prese e il resto
+    della strumentazione (database, middleware) non va collegato.
+    """
+
+    def __init__(self, attiva=True, soglia_query_lenta=0.2):
+        self.attiva = attiva
+        self.soglia_query_lenta = soglia_query_lenta
+        self._lock = threading.Lock()
+        self._http = defaultdict(lambda: _Istogramma(BUCKET_HTTP))
+        self._http_richieste = defaultdict(int)
+        self._sql = defaultdict(lambda: _Istogramma(BUCKET_SQL))
+        self._sql_righe = defaultdict(int)
+        self._acquisizione = _Istogramma(BUCKET_SQL)
+        self._serializzazione = _Istogramma(BUCKET_SQL)
+        self._istruzioni = 0
+        self._passi_vm = 0
+        self._query_lente = 0
+
+    @staticmethod
+    def _osserva(istogramma, bucket, valore):
+        istogramma.conteggi[bisect_left(bucket, valore)] += 1
+        istogramma.somma += valore
+        istogramma.totale += 1
+
+    def osserva_richiesta(self, metodo, percorso, stato, durata):
+        with self._lock:
+            self._osserva(self._http[(metodo, percorso)], BUCKET_HTTP, durata)
+            self._http_richieste[(metodo, percorso, stato)] += 1
+
+    def osserva_query(self, sql, durata, righe):
+        profilo = _profilo_corrente.get()
+        if profilo is not None:
+            profilo.db += durata
+            profilo.query += 1
+            profilo.righe += righe
+
+        etichetta = etichetta_sql(sql)
+        with self._lock:
+            self._osserva(self._sql[etichetta], BUCKET_SQL, durata)
+            self._sql_righe[etichetta] += righe
+            lenta = durata >= self.soglia_query_lenta
+            if lenta:
+                self._query_lente += 1
+
+        if lenta:
+            logger_query_lente.warning('Query lenta (%.1f ms, %d righe): %s', durata * 1000, righe, etichetta)
+
+    def osserva_acquisizione(self, durata):
+        profilo = _profilo_corrente.get()
+        if profilo is not None:
+            profilo.acquisizione += durata
+        with self._lock:
+            self._osserva(self._acquisizione, BUCKET_SQL, durata)
+
+    def osserva_serializzazione(self, durata):
+        profilo = _profilo_corrente.get()
+        if profilo is not None:
+            profilo.serializzazione += durata
+        with self._lock:
+            self._osserva(self._serializzazione, BUCKET_SQL, durata)
+
+    def conta_istruzione(self):
+        profilo = _profilo_corrente.get()
+        if profilo is not None:
+            profilo.istruzioni += 1
+        with self._lock:
+            self._istruzioni += 1
+
+    def conta_passi_vm(self, passi):
+        profilo = _profilo_corrente.get()
+        if profilo is not None:
+            profilo.passi_vm += passi
+        with self._lock:
+            self._passi_vm += passi
+
+    @contextmanager
+    def serializzazione(self):
+        """Misura il blocco come tempo di serializzazione della risposta"""
+        if not self.attiva:
+            yield
+            return
+        inizio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.osserva_serializzazione(time.perf_counter() - inizio)
+
+    @staticmethod
+    def _righe_istogramma(nome, istogramma, bucket, etichette):
+        righe = []
+        cumulato = 0
+        for limite, conteggio in zip(bucket, istogramma.conteggi):
+            cumulato += conteggio
+            righe.append(f'{nome}_bucket{_etichette(**etichette, le=limite)} {cumulato}')
+        righe.append(f'{nome}_bucket{_etichette(**etichette, le="+Inf")} {istogramma.totale}')
+        suffisso = _etichette(**etichette) if etichette else ''
+        righe.append(f'{nome}_sum{suffisso} {istogramma.somma}')
+        righe.append(f'{nome}_count{suffisso} {istogramma.totale}')
+        return righe
+
+    def esporta(self, valori=None):
+        """
+        Testo in formato Prometheus. 'valori' sono metriche aggiuntive lette
+        al momento da altri componenti: {nome: (tipo, descrizione, valore)}.
+        """
+        righe = []
+
+        def intestazione(nome, tipo, descrizione):
+            righe.append(f'# HELP {nome} {descrizione}')
+            righe.append(f'# TYPE {nome} {tipo}')
+
+        with self._lock:
+            intestazione('financehub_http_richieste_totale', 'counter', 'Richieste HTTP per metodo, percorso e stato')
+            for (metodo, percorso, stato), n in sorted(self._http_richieste.items()):
+                righe.append(f'financehub_http_richieste_totale{_etichette(metodo=metodo, percorso=percorso, stato=stato)} {n}')
+
+            intestazione('financehub_http_durata_secondi', 'histogram', 'Durata delle richieste HTTP')
+            for (metodo, percorso), istogramma in sorted(self._http.items()):
+                righe += self._righe_istogramma('financehub_http_durata_secondi', istogramma, BUCKET_HTTP,
+                                                {'metodo': metodo, 'percorso': percorso})
+
+            intestazione('financehub_sql_durata_secondi', 'histogram', 'Durata delle istruzioni SQL (esecuzione e lettura delle righe)')
+            for sql, istogramma in sorted(self._sql.items()):
+                righe += self._righe_istogramma('financehub_sql_durata_secondi', istogramma, BUCKET_SQL, {'query': sql})
+
+            intestazione('financehub_sql_righe_totale', 'counter', 'Righe lette o modificate per istruzione SQL')
+            for sql, n in sorted(self._sql_righe.items()):
+                righe.append(f'financehub_sql_righe_totale{_etichette(query=sql)} {n}')
+
+            intestazione('financehub_sql_istruzioni_totale', 'counter', 'Istruzioni eseguite da SQLite, inclusi i trigger')
+            righe.append(f'financehub_sql_istruzioni_totale {self._istruzioni}')
+
+            intestazione('financehub_sql_passi_vm_totale', 'counter', f'Passi della VM di SQLite (a blocchi di {PASSI_PROGRESS})')
+            righe.append(f'financehub_sql_passi_vm_totale {self._passi_vm}')
+
+            intestazione('financehub_sql_query_lente_totale', 'counter', 'Istruzioni oltre la soglia delle query lente')
+            righe.append(f'financehub_sql_query_lente_totale {self._query_lente}')
+
+            intestazione('financehub_pool_acquisizione_secondi', 'histogram', 'Attesa per ottenere una connessione dal pool')
+            righe += self._righe_istogramma('financehub_pool_acquisizione_secondi', self._acquisizione, BUCKET_SQL, {})
+
+            intestazione('financehub_serializzazione_secondi', 'histogram', 'Tempo di serializzazione delle risposte')
+            righe += self._righe_istogramma('financehub_serializzazione_secondi', self._serializzazione, BUCKET_SQL, {})
+
+        for nome, (tipo, descrizione, valore) in (valori or {}).items():
+            intestazione(nome, tipo, descrizione)
+            righe.append(f'{nome} {valore}')
+
+        return '\n'.join(righe) + '\n'
+
+
+class _CursoreTracciato:
+    """
+    Cursore che misura ogni istruzione: il tempo di execute() più quello
+    delle fetch successive, registrato quando le righe sono esaurite,
+    quando il cursore esegue un'altra istruzione o alla chiusura.
+    """
+    def __init__(self, cursore, metriche):
+        self._cursore = cursore
+        self._metriche = metriche
+        self._sql = None
+        self._durata = 0.0
+        self._righe = 0
+
+    def __getattr__(self, nome):
+        return getattr(self._cursore, nome)
+
+    def _registra(self):
+        if self._sql is not None:
+            righe = self._righe
+            # Per INSERT/UPDATE/DELETE contano le righe modificate
+            if self._cursore.rowcount > 0:
+                righe = max(righe, self._cursore.rowcount)
+            self._metriche.osserva_query(self._sql, self._durata, righe)
+            self._sql = None
+
+    def _esegui(self, metodo, sql, *args):
+        self._registra()
+        inizio = time.perf_counter()
+        getattr(self._cursore, metodo)(sql, *args)
+        self._sql = sql
+        self._durata = time.perf_counter() - inizio
+        self._righe = 0
+        return self
+
+    def execute(self, sql, parametri=()):
+        return self._esegui('execute', sql, parametri)
+
+    def executemany(self, sql, parametri):
+        return self._esegui('executemany', sql, parametri)
+
+    def executescript(self, script):
+        return self._esegui('executescript', script)
+
+    def _leggi(self, metodo, *args):
+        inizio = time.perf_counter()
+        risultato = getattr(self._cursore, metodo)(*args)
+        self._durata += time.perf_counter() - inizio
+        return risultato
+
+    def fetchone(self):
+        riga = self._leggi('fetchone')
+        if riga is None:
+            self._registra()
+        else:
+            self._righe += 1
+        return riga
+
+    def fetchmany(self, dimensione=None):
+        righe = self._leggi('fetchmany', dimensione or self._cursore.arraysize)
+        self._righe += len(righe)
+        if not righe:
+            self._registra()
+        return righe
+
+    def fetchall(self):
+        righe = self._leggi('fetchall')
+        self._righe += len(righe)
+        self._registra()
+        return righe
+
+    def __iter__(self):
+        while True:
+            riga = self.fetchone()
+            if riga is None:
+                return
+            yield riga
+
+    def close(self):
+        self._registra()
+        self._cursore.close()
+
+
+class ConnessioneTracciata:
+    """Connessione del pool con le istruzioni SQL misurate (vedi _CursoreTracciato)"""
+
+    def __init__(self, conn, metriche):
+        self.conn = conn
+        self._metriche = metriche
+        self._cursori = []
+        conn.set_trace_callback(self._traccia)
+        conn.set_progress_handler(self._progresso, PASSI_PROGRESS)
+
+    def __getattr__(self, nome):
+        return getattr(self.conn, nome)
+
+    def _traccia(self, sql):
+        self._metriche.conta_istruzione()
+
+    def _progresso(self):
+        self._metriche.conta_passi_vm(PASSI_PROGRESS)
+        # 0 = continua l'esecuzione
+        return 0
+
+    def cursor(self):
+        cursore = _CursoreTracciato(self.conn.cursor(), self._metriche)
+        self._cursori.append(cursore)
+        return cursore
+
+    def execute(self, sql, parametri=()):
+        return self.cursor().execute(sql, parametri)
+
+    def executemany(self, sql, parametri):
+        return self.cursor().executemany(sql, parametri)
+
+    def executescript(self, script):
+        return self.cursor().executescript(script)
+
+    def rilascia(self):
+        """Registra le istruzioni rimaste aperte e restituisce la connessione originale"""
+        for cursore in self._cursori:
+            cursore._registra()
+        self._cursori.clear()
+        self.conn.set_trace_callback(None)
+        self.conn.set_progress_handler(None, 0)
+        return self.conn
+
+
+class MiddlewareProfilazione:
+    """
+    Middleware ASGI: misura ogni richiesta HTTP, la etichetta con il percorso
+    della route (es. /api/conti/{conto_id}) e aggiunge l'header Server-Timing.
+    """
+    def __init__(self, app, metriche):
+        self.app = app
+        self.metriche = metriche
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        profilo = ProfiloRichiesta()
+        token = _profilo_corrente.set(profilo)
+        inizio = time.perf_counter()
+        stato = 500
+
+        async def send_con_tempi(messaggio):
+            nonlocal stato
+            if messaggio['type'] == 'http.response.start':
+                stato = messaggio['status']
+                headers = list(messaggio.get('headers', []))
+                valore = profilo.server_timing(time.perf_counter() - inizio)
+                headers.append((b'server-timing', valore.encode('latin-1')))
+                messaggio = {**messaggio, 'headers': headers}
+            await send(messaggio)
+
+        try:
+            await self.app(scope, receive, send_con_tempi)
+        finally:
+            _profilo_corrente.reset(token)
+            route = scope.get('route')
+            # Senza route (404) si usa un'etichetta fissa per non moltiplicare le serie
+            percorso = getattr(route, 'path', None) or 'non_trovato'
+            self.metriche.osserva_richiesta(scope['method'], percorso, stato, time.perf_counter() - inizio)
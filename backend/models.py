@@ -1,10 +1,67 @@
+import json
 from datetime import datetime
+from decimal import ROUND_HALF_UP, Decimal
+
+# Encoder condiviso: output compatto, UTF-8 senza escape e nessun controllo dei
+# riferimenti circolari (i dati sono sempre liste/dizionari di valori semplici)
+_encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'), check_circular=False)
+
+
+def codifica_json(dati):
+    """Codifica in JSON (bytes UTF-8) dati già pronti per il client"""
+    return _encoder.encode(dati).encode('utf-8')
+
+
+# Importo massimo in valore assoluto (centesimi): ben sotto il limite di un
+# INTEGER di SQLite (2^63 - 1), così anche saldi e somme di molti importi
+# restano interi
+MAX_CENTESIMI = 10 ** 15
+
+
+def in_centesimi(euro):
+    """
+    Converte un importo in euro (numero o stringa) in centesimi interi.
+    Passa da Decimal così 0.1 + 0.2 o '19.99' non perdono un centesimo;
+    i mezzi centesimi sono arrotondati per eccesso.
+    Solleva ValueError se il valore non è un numero o supera MAX_CENTESIMI.
+    """
+    try:
+        valore = Decimal(str(euro))
+    except ArithmeticError:
+        valore = Decimal('NaN')
+    if valore.is_nan():
+        raise ValueError(f'non è un numero: {euro!r}')
+    if valore.is_infinite() or abs(valore) * 100 > MAX_CENTESIMI:
+        raise ValueError(f'fuori dai limiti (al massimo {MAX_CENTESIMI // 100} in valore assoluto)')
+    return int(valore.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP) * 100)
+
+
+def in_euro(centesimi):
+    """Converte centesimi interi in euro per le risposte dell'API"""
+    return centesimi / 100
+
+
+def serializza_righe(righe, modello):
+    """
+    Converte direttamente le righe del database nel JSON della lista,
+    senza creare un oggetto del modello per ogni riga.
+    """
+    riga_in_dict = modello.riga_in_dict
+    return codifica_json([riga_in_dict(row) for row in righe])
+
+
+def _iso(valore):
+    return valore.isoformat() if isinstance(valore, datetime) else valore
+
 
 class Conto:
     """
     Rappresenta un conto bancario (corrente, risparmio, carta prepagata, ecc.)
+    Il saldo è in centesimi interi; to_dict lo restituisce in euro.
     """
-    def __init__(self, id=None, nome=None, tipo=None, saldo=0.0, created_at=None):
+    __slots__ = ('id', 'nome', 'tipo', 'saldo', 'created_at')
+    
+    def __init__(self, id=None, nome=None, tipo=None, saldo=0, created_at=None):
         self.id = id
         self.nome = nome
         self.tipo = tipo
@@ -17,8 +74,19 @@ class Conto:
             'id': self.id,
             'nome': self.nome,
             'tipo': self.tipo,
-            'saldo': self.saldo,
-            'created_at': self.created_at.isoformat() if isinstance(self.created_at, datetime) else self.created_at
+            'saldo': in_euro(self.saldo),
+            'created_at': _iso(self.created_at)
+        }
+    
+    @staticmethod
+    def riga_in_dict(row):
+        """Equivale a from_row(row).to_dict() senza l'oggetto intermedio"""
+        return {
+            'id': row['id'],
+            'nome': row['nome'],
+            'tipo': row['tipo'],
+            'saldo': in_euro(row['saldo']),
+            'created_at': row['created_at']
         }
     
     @staticmethod
@@ -36,10 +104,13 @@ class Conto:
 class Transazione:
     """
     Rappresenta una transazione finanziaria (entrata o uscita)
-    collegata a un conto specifico
+    collegata a un conto specifico. L'importo è in centesimi interi
+    (negativo per le uscite).
     """
+    __slots__ = ('id', 'conto_id', 'tipo', 'categoria', 'importo', 'descrizione', 'data')
+    
     def __init__(self, id=None, conto_id=None, tipo=None, categoria=None, 
-                 importo=0.0, descrizione=None, data=None):
+                 importo=0, descrizione=None, data=None):
         self.id = id
         self.conto_id = conto_id
         self.tipo = tipo
@@ -55,9 +126,22 @@ class Transazione:
             'conto_id': self.conto_id,
             'tipo': self.tipo,
             'categoria': self.categoria,
-            'importo': self.importo,
+            'importo': in_euro(self.importo),
             'descrizione': self.descrizione,
-            'data': self.data.isoformat() if isinstance(self.data, datetime) else self.data
+            'data': _iso(self.data)
+        }
+    
+    @staticmethod
+    def riga_in_dict(row):
+        """Equivale a from_row(row).to_dict() senza l'oggetto intermedio"""
+        return {
+            'id': row['id'],
+            'conto_id': row['conto_id'],
+            'tipo': row['tipo'],
+            'categoria': row['categoria'],
+            'importo': in_euro(row['importo']),
+            'descrizione': row['descrizione'],
+            'data': row['data']
         }
     
     @staticmethod
@@ -77,10 +161,15 @@ class Transazione:
 class Investimento:
     """
     Rappresenta un investimento finanziario (azioni, fondi, ETF, crypto, ecc.)
-    Tiene traccia del valore iniziale, attuale e del rendimento
+    Tiene traccia del valore iniziale, attuale e del rendimento (in centesimi).
+    Gli investimenti quotati hanno anche simbolo e quantità: il loro valore
+    attuale segue l'ultimo prezzo (vedi valutazione.py)
     """
-    def __init__(self, id=None, conto_id=None, nome=None, tipo=None, importo_iniziale=0.0,
-                valore_attuale=0.0, rendimento=0.0, data_inizio=None):
+    __slots__ = ('id', 'conto_id', 'nome', 'tipo', 'importo_iniziale',
+                 'valore_attuale', 'rendimento', 'data_inizio', 'simbolo', 'quantita')
+    
+    def __init__(self, id=None, conto_id=None, nome=None, tipo=None, importo_iniziale=0,
+                valore_attuale=0, rendimento=0, data_inizio=None, simbolo=None, quantita=None):
             self.id = id
             self.conto_id = conto_id
             self.nome = nome
@@ -89,15 +178,21 @@ class Investimento:
             self.valore_attuale = valore_attuale
             self.rendimento = rendimento
             self.data_inizio = data_inizio or datetime.now()
+            self.simbolo = simbolo
+            self.quantita = quantita
     
     def calcola_rendimento_percentuale(self):
         """
         Calcola il rendimento percentuale dell'investimento
         Formula: (rendimento / importo_iniziale) * 100
         """
-        if self.importo_iniziale == 0:
+        return Investimento._rendimento_percentuale(self.rendimento, self.importo_iniziale)
+    
+    @staticmethod
+    def _rendimento_percentuale(rendimento, importo_iniziale):
+        if importo_iniziale == 0:
             return 0
-        return (self.rendimento / self.importo_iniziale) * 100
+        return (rendimento / importo_iniziale) * 100
     
     def to_dict(self):
         """Converte l'oggetto in un dizionario includendo il rendimento percentuale"""
@@ -106,11 +201,32 @@ class Investimento:
             'conto_id': self.conto_id,
             'nome': self.nome,
             'tipo': self.tipo,
-            'importo_iniziale': self.importo_iniziale,
-            'valore_attuale': self.valore_attuale,
-            'rendimento': self.rendimento,
+            'importo_iniziale': in_euro(self.importo_iniziale),
+            'valore_attuale': in_euro(self.valore_attuale),
+            'rendimento': in_euro(self.rendimento),
             'rendimento_percentuale': round(self.calcola_rendimento_percentuale(), 2),
-            'data_inizio': self.data_inizio.isoformat() if isinstance(self.data_inizio, datetime) else self.data_inizio
+            'data_inizio': _iso(self.data_inizio),
+            'simbolo': self.simbolo,
+            'quantita': self.quantita
+        }
+    
+    @staticmethod
+    def riga_in_dict(row):
+        """Equivale a from_row(row).to_dict() senza l'oggetto intermedio"""
+        importo_iniziale = row['importo_iniziale']
+        rendimento = row['rendimento']
+        return {
+            'id': row['id'],
+            'conto_id': row['conto_id'],
+            'nome': row['nome'],
+            'tipo': row['tipo'],
+            'importo_iniziale': in_euro(importo_iniziale),
+            'valore_attuale': in_euro(row['valore_attuale']),
+            'rendimento': in_euro(rendimento),
+            'rendimento_percentuale': round(Investimento._rendimento_percentuale(rendimento, importo_iniziale), 2),
+            'data_inizio': row['data_inizio'],
+            'simbolo': row['simbolo'],
+            'quantita': row['quantita']
         }
     
     @staticmethod
@@ -124,17 +240,25 @@ class Investimento:
             importo_iniziale=row['importo_iniziale'],
             valore_attuale=row['valore_attuale'],
             rendimento=row['rendimento'],
-            data_inizio=row['data_inizio']
+            data_inizio=row['data_inizio'],
+            simbolo=row['simbolo'],
+            quantita=row['quantita']
         )
 
 
 class Obiettivo:
     """
     Rappresenta un obiettivo di risparmio con un target da raggiungere
-    Calcola automaticamente il progresso e lo stato di completamento
+    Calcola automaticamente il progresso e lo stato di completamento.
+    Se collegato a un conto o a una categoria l'importo attuale è
+    mantenuto dai trigger del database.
+    Gli importi sono in centesimi interi.
     """
-    def __init__(self, id=None, titolo=None, descrizione=None, importo_target=0.0,
-                 importo_attuale=0.0, completato=False, data_creazione=None):
+    __slots__ = ('id', 'titolo', 'descrizione', 'importo_target',
+                 'importo_attuale', 'completato', 'data_creazione', 'conto_id', 'categoria')
+    
+    def __init__(self, id=None, titolo=None, descrizione=None, importo_target=0,
+                 importo_attuale=0, completato=False, data_creazione=None, conto_id=None, categoria=None):
         self.id = id
         self.titolo = titolo
         self.descrizione = descrizione
@@ -142,15 +266,21 @@ class Obiettivo:
         self.importo_attuale = importo_attuale
         self.completato = completato
         self.data_creazione = data_creazione or datetime.now()
+        self.conto_id = conto_id
+        self.categoria = categoria
     
     def calcola_progresso(self):
         """
         Calcola la percentuale di completamento dell'obiettivo
         Il valore è limitato a max 100% anche se si supera il target
         """
-        if self.importo_target == 0:
+        return Obiettivo._progresso(self.importo_attuale, self.importo_target)
+    
+    @staticmethod
+    def _progresso(importo_attuale, importo_target):
+        if importo_target == 0:
             return 0
-        return min((self.importo_attuale / self.importo_target) * 100, 100)
+        return min((importo_attuale / importo_target) * 100, 100)
     
     def to_dict(self):
         """Converte l'oggetto in un dizionario includendo il progresso calcolato"""
@@ -158,11 +288,31 @@ class Obiettivo:
             'id': self.id,
             'titolo': self.titolo,
             'descrizione': self.descrizione,
-            'importo_target': self.importo_target,
-            'importo_attuale': self.importo_attuale,
+            'importo_target': in_euro(self.importo_target),
+            'importo_attuale': in_euro(self.importo_attuale),
             'completato': bool(self.completato),
             'progresso': round(self.calcola_progresso(), 2),
-            'data_creazione': self.data_creazione.isoformat() if isinstance(self.data_creazione, datetime) else self.data_creazione
+            'data_creazione': _iso(self.data_creazione),
+            'conto_id': self.conto_id,
+            'categoria': self.categoria
+        }
+    
+    @staticmethod
+    def riga_in_dict(row):
+        """Equivale a from_row(row).to_dict() senza l'oggetto intermedio"""
+        importo_target = row['importo_target']
+        importo_attuale = row['importo_attuale']
+        return {
+            'id': row['id'],
+            'titolo': row['titolo'],
+            'descrizione': row['descrizione'],
+            'importo_target': in_euro(importo_target),
+            'importo_attuale': in_euro(importo_attuale),
+            'completato': bool(row['completato']),
+            'progresso': round(Obiettivo._progresso(importo_attuale, importo_target), 2),
+            'data_creazione': row['data_creazione'],
+            'conto_id': row['conto_id'],
+            'categoria': row['categoria']
         }
     
     @staticmethod
@@ -175,5 +325,281 @@ class Obiettivo:
             importo_target=row['importo_target'],
             importo_attuale=row['importo_attuale'],
             completato=row['completato'],
-            data_creazione=row['data_creazione']
-        )
\ No newline at end of file
+            data_creazione=row['data_creazione'],
+            conto_id=row['conto_id'],
+            categoria=row['categoria']
+        )
+
+def _euro_opzionale(centesimi):
+    return in_euro(centesimi) if centesimi is not None else None
+
+
+class RegolaCategoria:
+    """
+    Regola della categorizzazione automatica (vedi categorizzazione.py):
+    assegna 'categoria' alle transazioni la cui descrizione contiene il
+    testo o corrisponde alla regex del 'modello', e/o il cui importo cade
+    nell'intervallo indicato. Gli importi sono in centesimi interi.
+    """
+    __slots__ = ('id', 'tipo', 'modello', 'importo_min', 'importo_max',
+                 'categoria', 'priorita', 'created_at')
+    
+    def __init__(self, id=None, tipo=None, modello=None, importo_min=None, importo_max=None,
+                 categoria=None, priorita=0, created_at=None):
+        self.id = id
+        self.tipo = tipo
+        self.modello = modello
+        self.importo_min = importo_min
+        self.importo_max = importo_max
+        self.categoria = categoria
+        self.priorita = priorita
+        self.created_at = created_at or datetime.now()
+    
+    def to_dict(self):
+        """Converte l'oggetto in un dizionario per la serializzazione JSON"""
+        return {
+            'id': self.id,
+            'tipo': self.tipo,
+            'modello': self.modello,
+            'importo_min': _euro_opzionale(self.importo_min),
+            'importo_max': _euro_opzionale(self.importo_max),
+            'categoria': self.categoria,
+            'priorita': self.priorita,
+            'created_at': _iso(self.created_at)
+        }
+    
+    @staticmethod
+    def riga_in_dict(row):
+        """Equivale a from_row(row).to_dict() senza l'oggetto intermedio"""
+        return {
+            'id': row['id'],
+            'tipo': row['tipo'],
+            'modello': row['modello'],
+            'importo_min': _euro_opzionale(row['importo_min']),
+            'importo_max': _euro_opzionale(row['importo_max']),
+            'categoria': row['categoria'],
+            'priorita': row['priorita'],
+            'created_at': row['created_at']
+        }
+    
+    @staticmethod
+    def from_row(row):
+        """Crea un oggetto RegolaCategoria da una riga del database"""
+        return RegolaCategoria(
+            id=row['id'],
+            tipo=row['tipo'],
+            modello=row['modello'],
+            importo_min=row['importo_min'],
+            importo_max=row['importo_max'],
+            categoria=row['categoria'],
+            priorita=row['priorita'],
+            created_at=row['created_at']
+        )
+
+
+class Ricorrenza:
+    """
+    Transazione ricorrente (stipendio, affitto, trasferimento mensile):
+    ogni occorrenza fino a oggi diventa una transazione (vedi ricorrenze.py).
+    'prossima' è la data della prossima occorrenza, None se la ricorrenza è finita.
+    L'importo è in centesimi interi.
+    """
+    __slots__ = ('id', 'conto_id', 'tipo', 'categoria', 'importo', 'descrizione', 'frequenza',
+                 'intervallo', 'data_inizio', 'data_fine', 'max_occorrenze', 'eseguite',
+                 'prossima', 'created_at')
+    
+    def __init__(self, id=None, conto_id=None, tipo=None, categoria=None, importo=0, descrizione='',
+                 frequenza=None, intervallo=1, data_inizio=None, data_fine=None, max_occorrenze=None,
+                 eseguite=0, prossima=None, created_at=None):
+        self.id = id
+        self.conto_id = conto_id
+        self.tipo = tipo
+        self.categoria = categoria
+        self.importo = importo
+        self.descrizione = descrizione
+        self.frequenza = frequenza
+        self.intervallo = intervallo
+        self.data_inizio = data_inizio
+        self.data_fine = data_fine
+        self.max_occorrenze = max_occorrenze
+        self.eseguite = eseguite
+        self.prossima = prossima
+        self.created_at = created_at or datetime.now()
+    
+    def to_dict(self):
+        """Converte l'oggetto in un dizionario per la serializzazione JSON"""
+        return {
+            'id': self.id,
+            'conto_id': self.conto_id,
+            'tipo': self.tipo,
+            'categoria': self.categoria,
+            'importo': in_euro(self.importo),
+            'descrizione': self.descrizione,
+            'frequenza': self.frequenza,
+            'intervallo': self.intervallo,
+            'data_inizio': self.data_inizio,
+            'data_fine': self.data_fine,
+            'max_occorrenze': self.max_occorrenze,
+            'eseguite': self.eseguite,
+            'prossima': self.prossima,
+            'created_at': _iso(self.created_at)
+        }
+    
+    @staticmethod
+    def riga_in_dict(row):
+        """Equivale a from_row(row).to_dict() senza l'oggetto intermedio"""
+        return {
+            'id': row['id'],
+            'conto_id': row['conto_id'],
+            'tipo': row['tipo'],
+            'categoria': row['categoria'],
+            'importo': in_euro(row['importo']),
+            'descrizione': row['descrizione'],
+            'frequenza': row['frequenza'],
+            'intervallo': row['intervallo'],
+            'data_inizio': row['data_inizio'],
+            'data_fine': row['data_fine'],
+            'max_occorrenze': row['max_occorrenze'],
+            'eseguite': row['eseguite'],
+            'prossima': row['prossima'],
+            'created_at': row['created_at']
+        }
+    
+    @staticmethod
+    def from_row(row):
+        """Crea un oggetto Ricorrenza da una riga del database"""
+        return Ricorrenza(
+            id=row['id'],
+            conto_id=row['conto_id'],
+            tipo=row['tipo'],
+            categoria=row['categoria'],
+            importo=row['importo'],
+            descrizione=row['descrizione'],
+            frequenza=row['frequenza'],
+            intervallo=row['intervallo'],
+            data_inizio=row['data_inizio'],
+            data_fine=row['data_fine'],
+            max_occorrenze=row['max_occorrenze'],
+            eseguite=row['eseguite'],
+            prossima=row['prossima'],
+            created_at=row['created_at']
+        )
+
+
+class Budget:
+    """
+    Limite di spesa per periodo (settimanale o mensile) su una categoria,
+    un conto o entrambi; senza né l'una né l'altro vale per tutte le uscite.
+    'soglia' è la percentuale del limite oltre la quale parte un avviso
+    (vedi budget.py). Il limite è in centesimi interi.
+    """
+    __slots__ = ('id', 'nome', 'conto_id', 'categoria', 'periodo', 'limite', 'soglia', 'created_at')
+    
+    def __init__(self, id=None, nome=None, conto_id=None, categoria=None, periodo='mensile',
+                 limite=0, soglia=80, created_at=None):
+        self.id = id
+        self.nome = nome
+        self.conto_id = conto_id
+        self.categoria = categoria
+        self.periodo = periodo
+        self.limite = limite
+        self.soglia = soglia
+        self.created_at = created_at or datetime.now()
+    
+    def to_dict(self):
+        """Converte l'oggetto in un dizionario per la serializzazione JSON"""
+        return {
+            'id': self.id,
+            'nome': self.nome,
+            'conto_id': self.conto_id,
+            'categoria': self.categoria,
+            'periodo': self.periodo,
+            'limite': in_euro(self.limite),
+            'soglia': self.soglia,
+            'created_at': _iso(self.created_at)
+        }
+    
+    @staticmethod
+    def riga_in_dict(row):
+        """Equivale a from_row(row).to_dict() senza l'oggetto intermedio"""
+        return {
+            'id': row['id'],
+            'nome': row['nome'],
+            'conto_id': row['conto_id'],
+            'categoria': row['categoria'],
+            'periodo': row['periodo'],
+            'limite': in_euro(row['limite']),
+            'soglia': row['soglia'],
+            'created_at': row['created_at']
+        }
+    
+    @staticmethod
+    def from_row(row):
+        """Crea un oggetto Budget da una riga del database"""
+        return Budget(
+            id=row['id'],
+            nome=row['nome'],
+            conto_id=row['conto_id'],
+            categoria=row['categoria'],
+            periodo=row['periodo'],
+            limite=row['limite'],
+            soglia=row['soglia'],
+            created_at=row['created_at']
+        )
+
+
+class AvvisoBudget:
+    """
+    Superamento della soglia di avviso ('soglia') o del limite ('superato')
+    di un budget nel periodo che inizia il giorno 'inizio', registrato dai
+    trigger. Spesa e limite sono quelli del momento, in centesimi interi.
+    """
+    __slots__ = ('id', 'budget_id', 'inizio', 'livello', 'speso', 'limite', 'created_at')
+    
+    def __init__(self, id=None, budget_id=None, inizio=None, livello=None, speso=0, limite=0,
+                 created_at=None):
+        self.id = id
+        self.budget_id = budget_id
+        self.inizio = inizio
+        self.livello = livello
+        self.speso = speso
+        self.limite = limite
+        self.created_at = created_at or datetime.now()
+    
+    def to_dict(self):
+        """Converte l'oggetto in un dizionario per la serializzazione JSON"""
+        return {
+            'id': self.id,
+            'budget_id': self.budget_id,
+            'inizio': self.inizio,
+            'livello': self.livello,
+            'speso': in_euro(self.speso),
+            'limite': in_euro(self.limite),
+            'created_at': _iso(self.created_at)
+        }
+    
+    @staticmethod
+    def riga_in_dict(row):
+        """Equivale a from_row(row).to_dict() senza l'oggetto intermedio"""
+        return {
+            'id': row['id'],
+            'budget_id': row['budget_id'],
+            'inizio': row['inizio'],
+            'livello': row['livello'],
+            'speso': in_euro(row['speso']),
+            'limite': in_euro(row['limite']),
+            'created_at': row['created_at']
+        }
+    
+    @staticmethod
+    def from_row(row):
+        """Crea un oggetto AvvisoBudget da una riga del database"""
+        return AvvisoBudget(
+            id=row['id'],
+            budget_id=row['budget_id'],
+            inizio=row['inizio'],
+            livello=row['livello'],
+            speso=row['speso'],
+            limite=row['limite'],
+            created_at=row['created_at']
+        )
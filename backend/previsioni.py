@@ -0,0 +1,194 @@
+"""
+Previsione del completamento degli obiettivi di risparmio (Monte Carlo).
+
+Il flusso mensile storico di ogni obiettivo viene dal cubo analitico
+(MotoreAnalitico.flussi_mensili), dagli ultimi MESI_STORICO mesi conclusi:
+- obiettivo collegato a un conto: il netto mensile del conto;
+- collegato a una categoria (ed eventualmente a un conto): i movimenti
+  della categoria in valore assoluto, come l'importo attuale derivato;
+- non collegato: il risparmio netto mensile di tutti i conti.
+
+Per ogni obiettivo si simulano PERCORSI futuri di ORIZZONTE_MESI mesi,
+ognuno estraendo a caso (con ripetizione) i mesi dello storico: tutti gli
+obiettivi di un blocco e tutti i percorsi sono un'unica matrice
+obiettivi × percorsi × mesi, cumulata lungo i mesi con una sola cumsum.
+Il mese in cui ogni percorso copre l'importo mancante dà i percentili
+della data di completamento e la probabilità di arrivarci entro
+l'orizzonte; i percentili delle somme cumulate danno le bande del valore
+previsto mese per mese. Le bande costano più di tutto il resto (un
+partizionamento per mese sui percorsi) e vengono calcolate solo per gli
+obiettivi per cui sono richieste.
+
+Il risultato di ogni obiettivo resta in memoria con i dati da cui è
+calcolato (importi, storico, mese corrente): una nuova transazione che
+cambia lo storico o l'importo di un obiettivo lo fa ricalcolare, gli
+altri obiettivi riusano la simulazione precedente.
+
+Gli importi restano in centesimi fino alla risposta.
+"""
+import threading
+
+import numpy as np
+
+from analitica import _euro
+
+MESI_STORICO = 24
+ORIZZONTE_MESI = 120
+PERCORSI = 2000
+PERCENTILI_PREVISIONE = (10, 50, 90)
+
+# Elementi al massimo della matrice di un blocco (obiettivi × percorsi × mesi)
+MAX_ELEMENTI_BLOCCO = 4_000_000
+
+
+def richiesta_flussi(obiettivo):
+    """(conto_id, categoria) con cui leggere lo storico di un obiettivo dal cubo"""
+    return obiettivo['conto_id'], obiettivo['categoria']
+
+
+def flusso_obiettivo(obiettivo, entrate, uscite):
+    """Contributo mensile all'obiettivo dalle righe di entrate e uscite del cubo"""
+    if obiettivo['categoria'] is not None:
+        return entrate - uscite
+    return entrate + uscite
+
+
+def _etichetta_mese(mese):
+    return str(np.datetime64(int(mese), 'M'))
+
+
+class MotorePrevisioni:
+    def __init__(self, percorsi=PERCORSI, orizzonte=ORIZZONTE_MESI):
+        self.percorsi = percorsi
+        self.orizzonte = orizzonte
+        self.lock = threading.Lock()
+        # id obiettivo -> (dati di partenza, risultato)
+        self._risultati = {}
+        self.simulati = 0
+        self.riusati = 0
+
+    def prevedi(self, obiettivi, flussi, mese_corrente, bande=()):
+        """
+        Previsioni per le righe degli obiettivi (con colonne id,
+        importo_target, importo_attuale, conto_id, categoria) dato lo
+        storico mensile (matrice obiettivi × mesi, in centesimi) e il mese
+        corrente (mesi dal gennaio 1970). Restituisce un dizionario
+        id -> risultato; gli obiettivi con id in 'bande' hanno anche le
+        bande mensili, in centesimi.
+        """
+        risultati = {}
+        da_simulare = []
+        with self.lock:
+            for obiettivo, storico in zip(obiettivi, flussi):
+                mancante = max(obiettivo['importo_target'] - obiettivo['importo_attuale'], 0)
+                chiave = (mancante, obiettivo['importo_attuale'], mese_corrente, storico.tobytes())
+                memorizzato = self._risultati.get(obiettivo['id'])
+                if (memorizzato is not None and memorizzato[0] == chiave
+                        and (obiettivo['id'] not in bande or 'bande' in memorizzato[1])):
+                    risultati[obiettivo['id']] = memorizzato[1]
+                    self.riusati += 1
+                else:
+                    da_simulare.append((obiettivo, storico, mancante, chiave))
+
+        # Blocchi di obiettivi tali che la matrice dei percorsi resti limitata
+        dimensione = max(1, MAX_ELEMENTI_BLOCCO // (self.percorsi * self.orizzonte))
+        for inizio in range(0, len(da_simulare), dimensione):
+            blocco = da_simulare[inizio:inizio + dimensione]
+            for (obiettivo, _, _, chiave), risultato in zip(blocco, self._simula(blocco, mese_corrente, bande)):
+                risultati[obiettivo['id']] = risultato
+                with self.lock:
+                    self._risultati[obiettivo['id']] = (chiave, risultato)
+                    self.simulati += 1
+
+        with self.lock:
+            # Gli obiettivi eliminati non restano in memoria
+            presenti = {obiettivo['id'] for obiettivo in obiettivi}
+            if len(self._risultati) > len(presenti):
+                for id in set(self._risultati) - presenti:
+                    del self._risultati[id]
+        return risultati
+
+    def _simula(self, blocco, mese_corrente, bande):
+        storici = np.array([storico for _, storico, _, _ in blocco], dtype=np.float64)
+        mancanti = np.array([mancante for _, _, mancante, _ in blocco], dtype=np.float64)
+        n, mesi_storico = storici.shape
+
+        # Percorsi generati dall'id dell'obiettivo: la previsione non cambia
+        # a ogni lettura né con gli altri obiettivi dello stesso blocco
+        estratti = np.stack([
+            np.random.default_rng(obiettivo['id']).integers(0, mesi_storico, size=(self.percorsi, self.orizzonte))
+            for obiettivo, _, _, _ in blocco
+        ])
+        cumulati = np.cumsum(storici[np.arange(n)[:, None, None], estratti], axis=2)
+
+        raggiunto = cumulati >= mancanti[:, None, None]
+        arrivati = raggiunto.any(axis=2)
+        # Mesi da oggi al completamento (1 = fine del mese corrente); oltre
+        # l'orizzonte per i percorsi che non ci arrivano
+        mesi = np.where(arrivati, raggiunto.argmax(axis=2) + 1, self.orizzonte + 1)
+        percentili_mesi = np.percentile(mesi, PERCENTILI_PREVISIONE, axis=1)
+        con_bande = [i for i, (obiettivo, _, _, _) in enumerate(blocco) if obiettivo['id'] in bande]
+        valori_bande = {}
+        if con_bande:
+            attuali = np.array([blocco[i][0]['importo_attuale'] for i in con_bande], dtype=np.float64)
+            percentili = np.percentile(cumulati[con_bande], PERCENTILI_PREVISIONE, axis=1) + attuali[None, :, None]
+            valori_bande = {i: percentili[:, j] for j, i in enumerate(con_bande)}
+        etichette = [_etichetta_mese(mese_corrente + m) for m in range(self.orizzonte)]
+
+        risultati = []
+        for i, (obiettivo, storico, mancante, _) in enumerate(blocco):
+            completamento = {}
+            for p, valore in zip(PERCENTILI_PREVISIONE, percentili_mesi[:, i]):
+                completamento[f'p{p}'] = (
+                    etichette[int(np.ceil(valore)) - 1] if valore <= self.orizzonte else None
+                )
+            if not mancante:
+                completamento = {f'p{p}': etichette[0] for p in PERCENTILI_PREVISIONE}
+            risultato = {
+                'mancante': int(mancante),
+                'flusso_medio': float(storico.mean()),
+                'flusso_deviazione': float(storico.std()),
+                'probabilita': 1.0 if not mancante else round(float(arrivati[i].mean()), 4),
+                'completamento': completamento,
+            }
+            if i in valori_bande:
+                risultato['bande'] = {
+                    'mesi': etichette,
+                    **{f'p{p}': valori_bande[i][j] for j, p in enumerate(PERCENTILI_PREVISIONE)}
+                }
+            risultati.append(risultato)
+        return risultati
+
+    @staticmethod
+    def in_risposta(obiettivo, risultato, bande=False):
+        """Risultato pronto per l'API (euro); le bande mensili solo se richieste"""
+        risposta = {
+            'obiettivo_id': obiettivo['id'],
+            'titolo': obiettivo['titolo'],
+            'importo_target': obiettivo['importo_target'] / 100,
+            'importo_attuale': obiettivo['importo_attuale'] / 100,
+            'mancante': risultato['mancante'] / 100,
+            'flusso_mensile': {
+                'media': round(risultato['flusso_medio'] / 100, 2),
+                'deviazione': round(risultato['flusso_deviazione'] / 100, 2),
+            },
+            'probabilita': risultato['probabilita'],
+            'completamento': risultato['completamento'],
+        }
+        if bande:
+            valori = risultato['bande']
+            risposta['bande'] = [
+                {'mese': mese, **{f'p{p}': v for p, v in zip(PERCENTILI_PREVISIONE, terna)}}
+                for mese, *terna in zip(valori['mesi'], *(_euro(valori[f'p{p}']) for p in PERCENTILI_PREVISIONE))
+            ]
+        return risposta
+
+    def stats(self):
+        with self.lock:
+            return {
+                'obiettivi_in_memoria': len(self._risultati),
+                'simulati': self.simulati,
+                'riusati': self.riusati,
+                'percorsi': self.percorsi,
+                'orizzonte_mesi': self.orizzonte,
+            }
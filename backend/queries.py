@@ -0,0 +1,327 @@
+"""
+Query SQL di aggregazione condivise tra gli endpoint e gli strumenti di manutenzione.
+
+I filtri sul mese corrente sono scritti come intervalli sulla colonna 'data'
+(data >= inizio mese AND data < inizio mese successivo) invece di
+strftime('%Y-%m', data) = ..., così SQLite può usare gli indici creati
+dalle migrazioni al posto di una scansione completa della tabella.
+
+Gli importi sono in centesimi interi: le somme sono esatte e la conversione
+in euro spetta a chi costruisce la risposta dell'API.
+"""
+import re
+
+# Primo giorno del mese corrente
+INIZIO_MESE = "date('now', 'start of month')"
+
+# Totali della dashboard letti dalle tabelle di riepilogo (una sola riga)
+DASHBOARD = '''
+    SELECT
+        r.saldo_totale,
+        r.investimenti_totale,
+        r.investimenti_rendimento,
+        r.obiettivi_totale,
+        r.obiettivi_completati,
+        COALESCE(m.variazione, 0) as variazione_mensile,
+        COALESCE(m.spese, 0) as spese_mensili
+    FROM riepilogo r
+    LEFT JOIN riepilogo_mensile m ON m.mese = strftime('%Y-%m', 'now')
+    WHERE r.id = 1
+'''
+
+# Totali globali ricalcolati da zero (per costruire o verificare 'riepilogo')
+RIEPILOGO_CALCOLATO = '''
+    SELECT
+        (SELECT COALESCE(SUM(saldo), 0) FROM conti) as saldo_totale,
+        (SELECT COALESCE(SUM(valore_attuale), 0) FROM investimenti) as investimenti_totale,
+        (SELECT COALESCE(SUM(rendimento), 0) FROM investimenti) as investimenti_rendimento,
+        (SELECT COUNT(*) FROM obiettivi) as obiettivi_totale,
+        (SELECT COUNT(*) FROM obiettivi WHERE completato = 1) as obiettivi_completati
+'''
+
+# Variazione e uscite per mese ricalcolate da zero (per 'riepilogo_mensile').
+# Il mese è il prefisso 'YYYY-MM' della data, coerente con i filtri a intervallo.
+RIEPILOGO_MENSILE_CALCOLATO = '''
+    SELECT
+        substr(data, 1, 7) as mese,
+        SUM(importo) as variazione,
+        SUM(CASE WHEN tipo = 'uscita' THEN importo ELSE 0 END) as spese
+    FROM transazioni
+    GROUP BY substr(data, 1, 7)
+'''
+
+# --- Motore analitico (analitica.py) ---
+
+# Giorno della transazione come numero di giorni dal 1970-01-01 (lo stesso
+# conteggio di numpy.datetime64[D]): julianday del 1970-01-01 è 2440587.5
+GIORNO_ANALISI = "CAST(julianday(substr(data, 1, 10)) - 2440587.5 AS INTEGER)"
+
+# Cubo giornaliero completo fino all'id indicato: una riga per
+# (giorno, conto, categoria, tipo) con somma e numero delle transazioni
+ANALISI_CUBO = f'''
+    SELECT {GIORNO_ANALISI} as giorno, conto_id, categoria, tipo,
+           SUM(importo) as importo, COUNT(*) as conteggio
+    FROM transazioni
+    WHERE id <= ?
+    GROUP BY 1, 2, 3, 4
+'''
+
+# Transazioni inserite dopo l'ultimo id già applicato al cubo
+ANALISI_NUOVE = f'''
+    SELECT {GIORNO_ANALISI} as giorno, conto_id, categoria, tipo,
+           importo, 1 as conteggio, id
+    FROM transazioni
+    WHERE id > ?
+    ORDER BY id
+'''
+
+# Ultimo numero di rettifica assegnato (anche se la riga è già stata
+# eliminata, da sqlite_sequence) e primo ancora presente
+ANALISI_ULTIMA_RETTIFICA = '''
+    SELECT
+        COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'rettifiche_analisi'), 0),
+        (SELECT MIN(seq) FROM rettifiche_analisi)
+'''
+
+# Eliminazioni e modifiche successive all'ultima applicata, nello stesso
+# formato delle righe nuove (importo e conteggio con il segno della rettifica),
+# limitate alle transazioni che il cubo contiene già
+ANALISI_RETTIFICHE = f'''
+    SELECT {GIORNO_ANALISI} as giorno, conto_id, categoria, tipo,
+           importo * segno as importo, segno as conteggio
+    FROM rettifiche_analisi
+    WHERE seq > ? AND id <= ?
+    ORDER BY seq
+'''
+
+# --- Valutazione degli investimenti (vedi valutazione.py) ---
+
+VALUTAZIONE_VERSIONI = 'SELECT prezzi, investimenti FROM versioni_valutazione WHERE id = 1'
+
+# Tutti i prezzi, con il giorno contato come GIORNO_ANALISI
+VALUTAZIONE_PREZZI = '''
+    SELECT simbolo, CAST(julianday(giorno) - 2440587.5 AS INTEGER) as giorno, prezzo
+    FROM prezzi
+    ORDER BY simbolo, giorno
+'''
+
+VALUTAZIONE_INVESTIMENTI = '''
+    SELECT id, tipo, simbolo, quantita, importo_iniziale, valore_attuale,
+           CAST(julianday(substr(data_inizio, 1, 10)) - 2440587.5 AS INTEGER) as giorno
+    FROM investimenti
+'''
+
+# Ultimo prezzo di ogni investimento quotato, cercato sulla chiave (simbolo, giorno)
+INVESTIMENTI_ULTIMO_PREZZO = '''
+    SELECT i.id, i.quantita, i.importo_iniziale, i.valore_attuale, p.prezzo
+    FROM investimenti i
+    JOIN prezzi p ON p.simbolo = i.simbolo
+     AND p.giorno = (SELECT MAX(giorno) FROM prezzi WHERE simbolo = i.simbolo)
+    WHERE i.quantita IS NOT NULL
+'''
+
+# Un prezzo già presente viene riscritto solo se è cambiato
+PREZZI_INSERISCI = '''
+    INSERT INTO prezzi (simbolo, giorno, prezzo) VALUES (?, ?, ?)
+    ON CONFLICT (simbolo, giorno) DO UPDATE SET prezzo = excluded.prezzo
+    WHERE prezzo != excluded.prezzo
+'''
+
+# --- Categorizzazione automatica (vedi categorizzazione.py) ---
+
+CATEGORIE_VERSIONE = 'SELECT regole FROM versioni_categorie WHERE id = 1'
+
+REGOLE_CATEGORIE = '''
+    SELECT id, tipo, modello, importo_min, importo_max, categoria, priorita, created_at
+    FROM regole_categorie
+    ORDER BY priorita DESC, id
+'''
+
+# Transazioni categorizzate non ancora lette dal modello (scansione sulla chiave primaria)
+CATEGORIE_ADDESTRAMENTO = '''
+    SELECT id, importo, descrizione, categoria
+    FROM transazioni
+    WHERE id > ? AND categoria != ? AND descrizione != ''
+    ORDER BY id
+'''
+
+# --- Transazioni ricorrenti (vedi ricorrenze.py) ---
+
+OGGI = "SELECT date('now')"
+
+# Entrambe leggono solo l'indice parziale su 'prossima'
+RICORRENZE_SCADUTE = "SELECT 1 FROM ricorrenze WHERE prossima <= date('now') LIMIT 1"
+RICORRENZE_CONTA_SCADUTE = "SELECT COUNT(*) FROM ricorrenze WHERE prossima <= date('now')"
+
+# --- Budget (vedi budget.py) ---
+
+def inizio_periodo(data):
+    """
+    Espressione SQL del primo giorno del periodo che contiene 'data' per il
+    budget della riga (colonna 'periodo'): il giorno 1 del mese, oppure il
+    lunedì della settimana
+    """
+    return (f"CASE periodo WHEN 'mensile' THEN date({data}, 'start of month') "
+            f"ELSE date({data}, '-6 days', 'weekday 1') END")
+
+# Spesa del periodo corrente di ogni budget: una lettura sulla chiave
+# primaria dei contatori per budget, qualunque sia il numero di transazioni
+BUDGET_STATO = f'''
+    SELECT b.*, COALESCE(s.speso, 0) AS speso,
+           CASE b.periodo WHEN 'mensile' THEN date(b.inizio, '+1 month', '-1 day')
+                ELSE date(b.inizio, '+6 days') END AS fine
+    FROM (SELECT *, {inizio_periodo("'now'")} AS inizio FROM budget) AS b
+    LEFT JOIN budget_spese AS s ON s.budget_id = b.id AND s.inizio = b.inizio
+'''
+
+# Contatori di un budget appena creato, dalle uscite già registrate
+BUDGET_SPESE_INIZIALI = f'''
+    INSERT INTO budget_spese (budget_id, inizio, speso)
+    SELECT budget.id, {inizio_periodo('transazioni.data')} AS inizio, -SUM(transazioni.importo)
+    FROM budget
+    JOIN transazioni ON transazioni.tipo = 'uscita'
+        AND (budget.categoria IS NULL OR transazioni.categoria = budget.categoria)
+        AND (budget.conto_id IS NULL OR transazioni.conto_id = budget.conto_id)
+    WHERE budget.id = ?
+    GROUP BY inizio
+'''
+
+ULTIMO_AVVISO_BUDGET = 'SELECT COALESCE(MAX(id), 0) FROM avvisi_budget'
+
+# Date di riferimento calcolate da SQLite, con la stessa semantica di
+# 'now' e dei modificatori usati dalle query di aggregazione qui sopra
+DATE_CORRENTI = f'''
+    SELECT
+        date('now') as oggi,
+        {INIZIO_MESE} as inizio_mese,
+        date('now', 'start of month', '+1 month', '-1 day') as fine_mese,
+        date('now', '-6 months') as sei_mesi_fa
+'''
+
+def condizioni_transazioni(filtri):
+    """
+    Traduce i filtri opzionali sulle transazioni in condizioni SQL parametrizzate.
+    'data_a' è inclusivo: comprende tutte le transazioni di quel giorno.
+    """
+    condizioni = []
+    params = []
+    
+    if filtri.get('conto_id') is not None:
+        condizioni.append('conto_id = ?')
+        params.append(filtri['conto_id'])
+    if filtri.get('data_da'):
+        condizioni.append('data >= ?')
+        params.append(filtri['data_da'])
+    if filtri.get('data_a'):
+        condizioni.append("data < date(?, '+1 day')")
+        params.append(filtri['data_a'])
+    if filtri.get('categoria'):
+        condizioni.append('categoria = ?')
+        params.append(filtri['categoria'])
+    if filtri.get('tipo'):
+        condizioni.append('tipo = ?')
+        params.append(filtri['tipo'])
+    if filtri.get('importo_min') is not None:
+        condizioni.append('importo >= ?')
+        params.append(filtri['importo_min'])
+    if filtri.get('importo_max') is not None:
+        condizioni.append('importo <= ?')
+        params.append(filtri['importo_max'])
+    
+    return condizioni, params
+
+
+def pagina_transazioni(filtri, cursore=None, limit=50):
+    """
+    Costruisce la query di una pagina di transazioni ordinate per (data, id) decrescenti.
+    Con paginazione keyset il cursore è la coppia (data, id) dell'ultima riga
+    già restituita: ogni pagina parte da lì tramite l'indice, quindi le pagine
+    profonde costano quanto la prima (nessun OFFSET da scorrere).
+    """
+    condizioni, params = condizioni_transazioni(filtri)
+    
+    if cursore is not None:
+        condizioni.append('(data, id) < (?, ?)')
+        params.extend(cursore)
+    
+    where = f"WHERE {' AND '.join(condizioni)}" if condizioni else ''
+    sql = f'SELECT * FROM transazioni {where} ORDER BY data DESC, id DESC LIMIT ?'
+    params.append(limit)
+    return sql, params
+
+
+def esporta_transazioni(filtri, colonne):
+    """Query di esportazione: le colonne indicate delle transazioni filtrate, in ordine cronologico"""
+    condizioni, params = condizioni_transazioni(filtri)
+    where = f"WHERE {' AND '.join(condizioni)}" if condizioni else ''
+    sql = f"SELECT {', '.join(colonne)} FROM transazioni {where} ORDER BY data, id"
+    return sql, params
+
+
+# Parole considerate al massimo in una ricerca full-text
+MAX_PAROLE_RICERCA = 10
+
+
+def espressione_ricerca(testo):
+    """
+    Traduce il testo cercato in un'espressione FTS5: tutte le parole devono
+    comparire in descrizione o categoria, anche solo come inizio di parola
+    ('sup' trova 'Supermercato'). Ogni parola è tra virgolette, quindi la
+    sintassi di FTS5 nel testo (AND, OR, NEAR, *, :) non ha effetto.
+    Restituisce None se il testo non contiene parole.
+    """
+    parole = re.findall(r'\w+', testo)[:MAX_PAROLE_RICERCA]
+    if not parole:
+        return None
+    # Le parole di una lettera cercano solo sé stesse: come prefisso troverebbero quasi tutto
+    return ' '.join(f'"{parola}"*' if len(parola) > 1 else f'"{parola}"' for parola in parole)
+
+
+def ricerca_transazioni(espressione, filtri, ordine='rilevanza', cursore=None, limit=50):
+    """
+    Costruisce la query di una pagina di risultati della ricerca full-text.
+    Le righe trovate dall'indice FTS5 vengono unite alle transazioni per id
+    (CROSS JOIN impone questo ordine) e filtrate con gli stessi filtri
+    dell'elenco. Con ordine 'rilevanza' le righe sono ordinate per punteggio
+    bm25 (più rilevanti prima) e il cursore è la coppia (punteggio, id);
+    con 'data' sono le più recenti prima e il cursore è (data, id).
+    """
+    condizioni, params = condizioni_transazioni(filtri)
+    params.insert(0, espressione)
+    
+    if ordine == 'rilevanza':
+        if cursore is not None:
+            condizioni.append('(f.rank, t.id) > (?, ?)')
+            params.extend(cursore)
+        ordinamento = 'rilevanza, id'
+    else:
+        if cursore is not None:
+            condizioni.append('(data, id) < (?, ?)')
+            params.extend(cursore)
+        ordinamento = 'data DESC, id DESC'
+    
+    where = f"WHERE {' AND '.join(condizioni)}" if condizioni else ''
+    sql = f'''
+        SELECT t.*, f.rank as rilevanza
+        FROM (SELECT rowid, rank FROM transazioni_fts WHERE transazioni_fts MATCH ?) f
+        CROSS JOIN transazioni t ON t.id = f.rowid
+        {where}
+        ORDER BY {ordinamento}
+        LIMIT ?
+    '''
+    params.append(limit)
+    return sql, params
+
+
+# Query eseguite dall'app che non devono mai scorrere tutta 'transazioni'
+# (verificate da manage.py): nome -> (sql, parametri di esempio).
+# Statistiche e grafico leggono il cubo di analitica.py e non sono qui
+QUERY_INDICIZZATE = {
+    'dashboard': (DASHBOARD, ()),
+    'pagina_transazioni': pagina_transazioni({}, ('2024-01-01', 1)),
+    'pagina_transazioni_conto': pagina_transazioni({'conto_id': 1}, ('2024-01-01', 1)),
+    'ricerca_transazioni': ricerca_transazioni('"spesa"*', {}),
+    'ricerca_transazioni_data': ricerca_transazioni('"spesa"*', {'conto_id': 1}, 'data', ('2024-01-01', 1)),
+    'stato_budget': (BUDGET_STATO, ()),
+    'spese_iniziali_budget': (BUDGET_SPESE_INIZIALI, (1,)),
+}
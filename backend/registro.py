@@ -0,0 +1,153 @@
+"""
+Registro storico dei saldi dei conti.
+
+Il saldo di un conto al giorno D è saldo_iniziale più la somma delle
+transazioni fino a D incluso. Per non sommare tutta la storia ad ogni
+domanda, il database mantiene (vedi database.REGISTRO_SCHEMA):
+- saldi_giornalieri: variazione netta per (conto, giorno), aggiornata dai trigger;
+- checkpoint_saldi: somma progressiva delle variazioni a fine mese, creata
+  periodicamente da crea_checkpoint e corretta dai trigger quando arriva
+  una transazione retrodatata.
+
+Una richiesta legge l'ultimo checkpoint non successivo a D (ricerca sulla
+chiave primaria) e somma le variazioni dei giorni seguenti, al più un mese
+di righe: il costo è logaritmico nel numero di transazioni.
+Gli importi sono in centesimi interi; i giorni sono stringhe 'YYYY-MM-DD'.
+"""
+import calendar
+
+# Saldo a fine giornata: saldo iniziale + checkpoint + variazioni successive
+SALDO_AL = '''
+    SELECT c.saldo_iniziale + COALESCE(cp.saldo, 0) + COALESCE((
+        SELECT SUM(g.variazione) FROM saldi_giornalieri g
+        WHERE g.conto_id = c.id AND g.giorno > COALESCE(cp.giorno, '') AND g.giorno <= :giorno
+    ), 0) as saldo
+    FROM conti c
+    LEFT JOIN checkpoint_saldi cp ON cp.conto_id = c.id AND cp.giorno = (
+        SELECT MAX(giorno) FROM checkpoint_saldi WHERE conto_id = c.id AND giorno <= :giorno
+    )
+    WHERE c.id = :conto_id
+'''
+
+VARIAZIONI_PERIODO = '''
+    SELECT giorno, variazione FROM saldi_giornalieri
+    WHERE conto_id = ? AND giorno >= ? AND giorno <= ?
+    ORDER BY giorno
+'''
+
+ULTIMO_CHECKPOINT = '''
+    SELECT giorno, saldo FROM checkpoint_saldi
+    WHERE conto_id = ? AND giorno < ?
+    ORDER BY giorno DESC LIMIT 1
+'''
+
+VARIAZIONI_MENSILI = '''
+    SELECT substr(giorno, 1, 7) as mese, SUM(variazione) as variazione
+    FROM saldi_giornalieri
+    WHERE conto_id = ? AND giorno > ? AND giorno < ?
+    GROUP BY substr(giorno, 1, 7)
+    ORDER BY mese
+'''
+
+# Saldo memorizzato, saldo secondo il registro e saldo ricalcolato dalle transazioni
+CONFRONTO_SALDI = '''
+    SELECT
+        c.id as conto_id,
+        c.nome,
+        c.saldo,
+        c.saldo_iniziale + COALESCE((
+            SELECT SUM(variazione) FROM saldi_giornalieri WHERE conto_id = c.id
+        ), 0) as saldo_registro,
+        c.saldo_iniziale + COALESCE((
+            SELECT SUM(importo) FROM transazioni WHERE conto_id = c.id
+        ), 0) as saldo_transazioni
+    FROM conti c
+    ORDER BY c.id
+'''
+
+
+def _fine_mese(mese):
+    """'YYYY-MM' -> ultimo giorno del mese 'YYYY-MM-DD'"""
+    anno, numero = int(mese[:4]), int(mese[5:7])
+    return f'{mese}-{calendar.monthrange(anno, numero)[1]:02d}'
+
+
+def saldo_al(conn, conto_id, giorno):
+    """Saldo del conto a fine giornata 'giorno' (None se il conto non esiste)"""
+    riga = conn.execute(SALDO_AL, {'conto_id': conto_id, 'giorno': giorno}).fetchone()
+    return riga['saldo'] if riga else None
+
+
+def andamento_saldo(conn, conto_id, da, a):
+    """
+    Saldo del conto tra i giorni 'da' e 'a' inclusi: restituisce il saldo alla
+    fine del giorno precedente a 'da' e la lista (giorno, variazione, saldo a
+    fine giornata) dei giorni con movimenti, oppure None se il conto non esiste
+    """
+    precedente, = conn.execute("SELECT date(?, '-1 day')", (da,)).fetchone()
+    saldo = saldo_al(conn, conto_id, precedente)
+    if saldo is None:
+        return None
+
+    iniziale = saldo
+    punti = []
+    for giorno, variazione in conn.execute(VARIAZIONI_PERIODO, (conto_id, da, a)):
+        saldo += variazione
+        punti.append((giorno, variazione, saldo))
+    return iniziale, punti
+
+
+def crea_checkpoint(conn, limite=None):
+    """
+    Crea i checkpoint di fine mese mancanti per tutti i conti, per i mesi
+    con movimenti precedenti a 'limite' (default: inizio del mese corrente,
+    così si fissano solo mesi conclusi). Restituisce il numero di checkpoint creati.
+    Va eseguita in una transazione di scrittura (Database.scrivi o Database.transazione).
+    """
+    if limite is None:
+        limite, = conn.execute("SELECT date('now', 'start of month')").fetchone()
+
+    nuovi = []
+    for (conto_id,) in conn.execute('SELECT id FROM conti').fetchall():
+        ultimo = conn.execute(ULTIMO_CHECKPOINT, (conto_id, limite)).fetchone()
+        giorno, saldo = (ultimo['giorno'], ultimo['saldo']) if ultimo else ('', 0)
+        for mese, variazione in conn.execute(VARIAZIONI_MENSILI, (conto_id, giorno, limite)).fetchall():
+            saldo += variazione
+            nuovi.append((conto_id, _fine_mese(mese), saldo))
+
+    conn.executemany(
+        'INSERT OR REPLACE INTO checkpoint_saldi (conto_id, giorno, saldo) VALUES (?, ?, ?)', nuovi
+    )
+    return len(nuovi)
+
+
+def riconcilia(conn):
+    """
+    Verifica il saldo memorizzato di ogni conto contro il registro e contro la
+    somma delle transazioni, e ogni checkpoint contro le variazioni giornaliere.
+    Restituisce le discrepanze trovate (liste vuote se tutto è coerente).
+    """
+    conti = [
+        dict(riga) for riga in conn.execute(CONFRONTO_SALDI)
+        if not riga['saldo'] == riga['saldo_registro'] == riga['saldo_transazioni']
+    ]
+
+    # Una sola scansione ordinata: somma progressiva per conto confrontata
+    # con i checkpoint nell'ordine in cui compaiono
+    checkpoint = []
+    punti = conn.execute('SELECT conto_id, giorno, saldo FROM checkpoint_saldi ORDER BY conto_id, giorno').fetchall()
+    variazioni = iter(conn.execute('SELECT conto_id, giorno, variazione FROM saldi_giornalieri ORDER BY conto_id, giorno'))
+    conto_corrente, somma = None, 0
+    riga = next(variazioni, None)
+    for conto_id, giorno, saldo in punti:
+        if conto_id != conto_corrente:
+            conto_corrente, somma = conto_id, 0
+        # Somma le variazioni del conto fino al giorno del checkpoint incluso
+        while riga is not None and (riga[0], riga[1]) <= (conto_id, giorno):
+            if riga[0] == conto_id:
+                somma += riga[2]
+            riga = next(variazioni, None)
+        if saldo != somma:
+            checkpoint.append({'conto_id': conto_id, 'giorno': giorno, 'memorizzato': saldo, 'atteso': somma})
+
+    return {'conti': conti, 'checkpoint': checkpoint}
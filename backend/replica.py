@@ -0,0 +1,165 @@
+"""
+Copia di sola lettura del database per le aggregazioni pesanti.
+
+Statistiche, grafico e /api/analytics possono leggere (tramite il motore
+analitico) da un'istantanea del database invece che dal file principale:
+caricamento e aggiornamento dei cubi, e i report di fine mese, non
+competono così con le scritture per la cache delle pagine e per i
+checkpoint del WAL del file principale.
+
+L'istantanea è creata con l'API di backup online di SQLite, che copia il
+file in una sola transazione di lettura (in WAL non blocca gli scrittori),
+ed è aggiornata ogni 'intervallo' secondi o dopo 'max_scritture' scritture.
+Anche la copia è in WAL: chi la sta leggendo continua a vedere l'istantanea
+precedente fino alla fine della propria transazione.
+
+L'istante dell'istantanea è salvato nella copia stessa (tabella
+replica_info), così anche i processi che non la aggiornano (vedi server.py)
+sanno quanto è vecchia. Se supera 'ritardo_max' secondi, per esempio perché
+l'aggiornamento non riesce, le letture tornano al database principale.
+"""
+import asyncio
+import logging
+import sqlite3
+import time
+
+from database import Database
+
+log_replica = logging.getLogger('financehub.replica')
+
+# Ogni quanto rileggere dalla copia l'istante dell'istantanea (processi che non la aggiornano)
+RILETTURA_ISTANTE = 1.0
+
+
+def _leggi_istante(conn):
+    try:
+        riga = conn.execute('SELECT istante FROM replica_info WHERE id = 1').fetchone()
+    except sqlite3.DatabaseError:
+        # Copia non ancora creata dal processo che la aggiorna
+        return None
+    return riga['istante'] if riga else None
+
+
+class Replica:
+    def __init__(self, db, percorso, intervallo=60.0, max_scritture=1000, ritardo_max=300.0,
+                 al_cambio=None):
+        self.db = db
+        self.percorso = percorso
+        self.intervallo = intervallo
+        self.max_scritture = max_scritture
+        self.ritardo_max = ritardo_max
+        # Chiamata quando cambiano i dati serviti (nuova istantanea o ritorno al
+        # database principale), per invalidare le risposte calcolate prima
+        self.al_cambio = al_cambio
+        self.copia = Database(
+            percorso, pool_size=4, thread_lettura=1, metriche=db.metriche,
+            inizializza=False, sola_lettura=True
+        )
+        self._destinazione = None
+        self._istante = None
+        self._letto_alle = 0.0
+        self._in_uso = False
+        self._scritture = 0
+
+        # Contatori per il monitoraggio
+        self.aggiornamenti = 0
+        self.durata_ultimo = 0.0
+        self.letture_copia = 0
+        self.letture_principale = 0
+
+    def _copia(self):
+        """Copia il database principale nella replica (thread di analisi)"""
+        if self._destinazione is None:
+            self._destinazione = sqlite3.connect(self.percorso, check_same_thread=False)
+            self._destinazione.execute('PRAGMA journal_mode = WAL')
+            # Il WAL della copia arriva alla dimensione del database ad ogni
+            # aggiornamento: dopo il checkpoint viene riportato a zero
+            self._destinazione.execute('PRAGMA journal_size_limit = 0')
+
+        inizio = time.perf_counter()
+        istante = time.time()
+        with self.db.connection() as sorgente:
+            sorgente.backup(self._destinazione)
+        self._destinazione.execute(
+            'CREATE TABLE IF NOT EXISTS replica_info (id INTEGER PRIMARY KEY CHECK (id = 1), istante REAL NOT NULL)'
+        )
+        self._destinazione.execute('INSERT OR REPLACE INTO replica_info (id, istante) VALUES (1, ?)', (istante,))
+        self._destinazione.commit()
+        self._destinazione.execute('PRAGMA wal_checkpoint(PASSIVE)')
+        return istante, time.perf_counter() - inizio
+
+    async def aggiorna(self):
+        """Crea una nuova istantanea del database principale"""
+        scritture = self.db.code_stats()['scrittura']['completate']
+        istante, durata = await self.db.code['analisi'].esegui(self._copia)
+        self._istante = istante
+        self._letto_alle = time.monotonic()
+        self._scritture = scritture
+        self.aggiornamenti += 1
+        self.durata_ultimo = durata
+        self._in_uso = True
+        if self.al_cambio:
+            self.al_cambio()
+
+    def da_aggiornare(self):
+        """True se l'istantanea è più vecchia di 'intervallo' o dopo 'max_scritture' scritture"""
+        if self._istante is None or time.time() - self._istante >= self.intervallo:
+            return True
+        return self.db.code_stats()['scrittura']['completate'] - self._scritture >= self.max_scritture
+
+    async def mantieni(self, pausa=1.0):
+        """Aggiorna l'istantanea quando serve, fino alla cancellazione"""
+        while True:
+            try:
+                if self.da_aggiornare():
+                    await self.aggiorna()
+            except Exception:
+                log_replica.exception('Aggiornamento della replica %s non riuscito', self.percorso)
+            await asyncio.sleep(pausa)
+
+    async def istante(self):
+        """Istante (time.time) dell'istantanea servita dalla copia, None se non esiste"""
+        if time.monotonic() - self._letto_alle >= RILETTURA_ISTANTE:
+            # La copia può essere aggiornata da un altro processo
+            self._istante = await self.copia.leggi(_leggi_istante)
+            self._letto_alle = time.monotonic()
+        return self._istante
+
+    async def sorgente(self):
+        """
+        Database da cui leggere le aggregazioni e istante dei dati: la copia,
+        se abbastanza recente, altrimenti il database principale
+        """
+        istante = await self.istante()
+        in_uso = istante is not None and time.time() - istante <= self.ritardo_max
+        if in_uso != self._in_uso:
+            self._in_uso = in_uso
+            if not in_uso:
+                log_replica.warning('Replica %s troppo vecchia: letture sul database principale', self.percorso)
+            if self.al_cambio:
+                self.al_cambio()
+        if in_uso:
+            self.letture_copia += 1
+            return self.copia, istante
+        self.letture_principale += 1
+        return self.db, time.time()
+
+    def close(self):
+        self.copia.close()
+        if self._destinazione is not None:
+            self._destinazione.close()
+
+    def stats(self):
+        return {
+            'percorso': self.percorso,
+            'istante': self._istante,
+            'ritardo_secondi': round(time.time() - self._istante, 3) if self._istante else None,
+            'ritardo_max_secondi': self.ritardo_max,
+            'intervallo_secondi': self.intervallo,
+            'max_scritture': self.max_scritture,
+            'in_uso': self._in_uso,
+            'aggiornamenti': self.aggiornamenti,
+            'durata_ultimo_ms': round(self.durata_ultimo * 1000, 2),
+            'letture_copia': self.letture_copia,
+            'letture_principale': self.letture_principale,
+        }
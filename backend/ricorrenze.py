@@ -0,0 +1,175 @@
+"""
+Transazioni ricorrenti (stipendi, affitti, trasferimenti mensili).
+
+Una ricorrenza descrive la transazione da creare e quando: frequenza
+(giornaliera, settimanale, mensile, annuale), ogni quante unità
+('intervallo'), data di inizio e, facoltativi, data di fine e numero
+massimo di occorrenze. Come una RRULE con FREQ, INTERVAL, UNTIL e COUNT.
+L'occorrenza n è calcolata sempre dalla data di inizio: una ricorrenza
+mensile del 31 cade il 30 aprile e torna il 31 maggio.
+
+La colonna 'prossima' (data della prossima occorrenza, NULL se finita) è
+indicizzata: materializza legge solo le ricorrenze scadute, a lotti, senza
+interrogare le altre. Le occorrenze arretrate (server spento per giorni)
+vengono create tutte nella stessa transazione, e passano da
+importer.importa come un estratto conto: un solo inserimento e un
+aggiornamento del saldo per conto. Il 'riferimento_esterno' di ogni
+occorrenza (ricorrenza-<id>-<data>) impedisce i doppioni anche se due
+processi eseguissero lo stesso lavoro.
+
+Con più processi esegue il lavoro solo chi detiene il lease (tabella
+'lease'): una riga con proprietario e scadenza, presa o rinnovata nella
+stessa transazione che crea le occorrenze.
+"""
+import calendar
+from datetime import date, timedelta
+
+import importer
+from models import in_euro
+
+FREQUENZE = ('giornaliera', 'settimanale', 'mensile', 'annuale')
+
+# Ricorrenze lette per ogni lotto di materializza
+DIMENSIONE_LOTTO = 500
+
+LEASE_RICORRENZE = 'ricorrenze'
+
+# Passo massimo tra due occorrenze: oltre, le date uscirebbero presto dal
+# calendario di Python
+MAX_ANNI_INTERVALLO = 100
+GIORNI_PER_UNITA = {'giornaliera': 1, 'settimanale': 7, 'mensile': 366 / 12, 'annuale': 366}
+
+
+def _aggiungi_mesi(inizio, mesi):
+    """Stessa giornata 'mesi' mesi dopo, limitata all'ultimo giorno del mese"""
+    indice = inizio.month - 1 + mesi
+    anno, mese = inizio.year + indice // 12, indice % 12 + 1
+    return date(anno, mese, min(inizio.day, calendar.monthrange(anno, mese)[1]))
+
+
+def occorrenza(inizio, frequenza, intervallo, n):
+    """Data dell'occorrenza n (da 0) di una ricorrenza che parte da 'inizio'"""
+    passi = n * intervallo
+    if frequenza == 'giornaliera':
+        return inizio + timedelta(days=passi)
+    if frequenza == 'settimanale':
+        return inizio + timedelta(weeks=passi)
+    if frequenza == 'mensile':
+        return _aggiungi_mesi(inizio, passi)
+    return _aggiungi_mesi(inizio, 12 * passi)
+
+
+def prossima(ricorrenza, eseguite):
+    """
+    Data (ISO) dell'occorrenza dopo le 'eseguite', oppure None se la
+    ricorrenza è finita. Un'occorrenza oltre l'anno 9999 la fa finire: una
+    sola riga non deve bloccare il lotto di materializza
+    """
+    if ricorrenza['max_occorrenze'] is not None and eseguite >= ricorrenza['max_occorrenze']:
+        return None
+    try:
+        data = occorrenza(date.fromisoformat(ricorrenza['data_inizio']), ricorrenza['frequenza'],
+                          ricorrenza['intervallo'], eseguite)
+    except (ValueError, OverflowError):
+        return None
+    if ricorrenza['data_fine'] is not None and data > date.fromisoformat(ricorrenza['data_fine']):
+        return None
+    return data.isoformat()
+
+
+def valida_ricorrenza(ricorrenza):
+    """
+    Normalizza i campi di una nuova ricorrenza (importo in centesimi) e
+    calcola la prima occorrenza. Solleva ValueError con il messaggio per il client.
+    """
+    if ricorrenza['tipo'] not in importer.TIPI_VALIDI:
+        raise ValueError(f"tipo non valido: '{ricorrenza['tipo']}'")
+    if ricorrenza['frequenza'] not in FREQUENZE:
+        raise ValueError(f"frequenza non valida: '{ricorrenza['frequenza']}' (ammesse: {', '.join(FREQUENZE)})")
+    if ricorrenza['intervallo'] < 1:
+        raise ValueError('intervallo deve essere almeno 1')
+    if ricorrenza['intervallo'] * GIORNI_PER_UNITA[ricorrenza['frequenza']] > MAX_ANNI_INTERVALLO * 366:
+        raise ValueError(f'intervallo troppo grande (al massimo {MAX_ANNI_INTERVALLO} anni tra due occorrenze)')
+    if ricorrenza['max_occorrenze'] is not None and ricorrenza['max_occorrenze'] < 1:
+        raise ValueError('max_occorrenze deve essere almeno 1')
+    for campo in ('data_inizio', 'data_fine'):
+        if ricorrenza[campo] is not None:
+            try:
+                ricorrenza[campo] = date.fromisoformat(ricorrenza[campo][:10]).isoformat()
+            except ValueError:
+                raise ValueError(f"{campo} non valida: '{ricorrenza[campo]}' (formato YYYY-MM-DD)")
+    if ricorrenza['data_fine'] is not None and ricorrenza['data_fine'] < ricorrenza['data_inizio']:
+        raise ValueError('data_fine precede data_inizio')
+
+    # Come per le transazioni, le uscite hanno importo negativo
+    if ricorrenza['tipo'] == 'uscita' and ricorrenza['importo'] > 0:
+        ricorrenza['importo'] = -ricorrenza['importo']
+    ricorrenza['prossima'] = prossima(ricorrenza, 0)
+    return ricorrenza
+
+
+def acquisisci_lease(conn, nome, proprietario, durata, adesso):
+    """
+    Prende o rinnova il lease 'nome' per 'durata' secondi se è libero,
+    scaduto o già di 'proprietario'. Va chiamata dentro una transazione di
+    scrittura: il lease vale per il lavoro fatto nella stessa transazione.
+    """
+    conn.execute('''
+        INSERT INTO lease (nome, proprietario, scadenza) VALUES (:nome, :proprietario, :scadenza)
+        ON CONFLICT (nome) DO UPDATE SET proprietario = excluded.proprietario, scadenza = excluded.scadenza
+        WHERE lease.proprietario = excluded.proprietario OR lease.scadenza < :adesso
+    ''', {'nome': nome, 'proprietario': proprietario, 'scadenza': adesso + durata, 'adesso': adesso})
+    detentore, = conn.execute('SELECT proprietario FROM lease WHERE nome = ?', (nome,)).fetchone()
+    return detentore == proprietario
+
+
+def materializza(conn, oggi, categorizza=None, lotto=DIMENSIONE_LOTTO):
+    """
+    Crea tutte le occorrenze scadute fino a 'oggi' (ISO) compreso e porta
+    avanti 'prossima' ed 'eseguite' di ogni ricorrenza.
+    Va eseguita dentro una transazione di scrittura. Restituisce il
+    riepilogo di importer.importa sommato sui lotti, più il numero di
+    ricorrenze elaborate.
+    """
+    totale = {'ricorrenze': 0, 'importate': 0, 'duplicate': 0, 'errori': [], 'variazioni_saldo': {}}
+    while True:
+        # Dopo l'aggiornamento le ricorrenze elaborate hanno 'prossima' nel
+        # futuro (o NULL) e non rientrano nel lotto successivo
+        ricorrenze = conn.execute('''
+            SELECT * FROM ricorrenze
+            WHERE prossima IS NOT NULL AND prossima <= ?
+            ORDER BY prossima
+            LIMIT ?
+        ''', (oggi, lotto)).fetchall()
+        if not ricorrenze:
+            return totale
+
+        righe = []
+        avanzamenti = []
+        for ricorrenza in ricorrenze:
+            eseguite = ricorrenza['eseguite']
+            data = ricorrenza['prossima']
+            while data is not None and data <= oggi:
+                righe.append({
+                    'conto_id': ricorrenza['conto_id'],
+                    'tipo': ricorrenza['tipo'],
+                    'categoria': ricorrenza['categoria'],
+                    # importa riceve gli importi in euro, come da un file
+                    'importo': in_euro(ricorrenza['importo']),
+                    'descrizione': ricorrenza['descrizione'],
+                    'data': data,
+                    'riferimento_esterno': f"ricorrenza-{ricorrenza['id']}-{data}",
+                })
+                eseguite += 1
+                data = prossima(ricorrenza, eseguite)
+            avanzamenti.append((eseguite, data, ricorrenza['id']))
+
+        esito = importer.importa(conn, righe, categorizza=categorizza)
+        conn.executemany('UPDATE ricorrenze SET eseguite = ?, prossima = ? WHERE id = ?', avanzamenti)
+
+        totale['ricorrenze'] += len(ricorrenze)
+        totale['importate'] += esito['importate']
+        totale['duplicate'] += esito['duplicate']
+        totale['errori'].extend(esito['errori'])
+        for conto_id, delta in esito['variazioni_saldo'].items():
+            totale['variazioni_saldo'][conto_id] = round(totale['variazioni_saldo'].get(conto_id, 0) + delta, 2)
@@ -0,0 +1,138 @@
+"""
+Avvio del server con uno o più processi.
+
+Con un solo processo equivale a 'python app.py'. Con più processi SQLite
+resta con un solo scrittore: server.py applica le migrazioni una volta,
+avvia un processo 'scrittura' in ascolto su un socket Unix privato e N
+processi 'lettura' (uvicorn --workers) sulla porta pubblica, che servono
+le letture in parallelo sui core disponibili e inoltrano le scritture
+allo scrittore (vedi inoltro.py). Se un processo termina vengono fermati
+tutti, così un supervisore (systemd, container) può riavviare il servizio.
+
+Uso (dalla cartella backend/):
+    python server.py                      # un processo per core
+    python server.py --workers 1          # un solo processo
+    python server.py --workers 4 --porta 8000 --db /dati/finance.db
+"""
+import argparse
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from database import Database
+
+# I flussi di /api/eventi restano aperti: allo spegnimento non si aspettano oltre 5 secondi
+ATTESA_SPEGNIMENTO = 5
+
+
+def numero_core():
+    """Core utilizzabili da questo processo (rispetta affinità e cgroup cpuset)"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def attendi_scrittore(processo, percorso_socket, timeout=30.0):
+    """Aspetta che il processo scrittore risponda sul socket (False se termina prima)"""
+    scadenza = time.monotonic() + timeout
+    with httpx.Client(transport=httpx.HTTPTransport(uds=percorso_socket), base_url='http://scrittore') as client:
+        while time.monotonic() < scadenza:
+            if processo.poll() is not None:
+                return False
+            try:
+                client.get('/api/sistema/eventi', timeout=1.0)
+                return True
+            except httpx.TransportError:
+                time.sleep(0.1)
+    return False
+
+
+def _comando_uvicorn(*argomenti):
+    return [sys.executable, '-m', 'uvicorn', 'app:app',
+            '--timeout-graceful-shutdown', str(ATTESA_SPEGNIMENTO), *argomenti]
+
+
+def avvia_processi(args, workers):
+    """Avvia scrittore e lettori e resta in attesa finché uno dei due non termina"""
+    cartella = tempfile.mkdtemp(prefix='financehub-')
+    percorso_socket = os.path.join(cartella, 'scrittore.sock')
+    ambiente = {**os.environ, 'FINANCE_DB': os.path.abspath(args.db)}
+    processi = []
+    richiesto = []
+
+    def ferma(*_):
+        for processo in processi:
+            if processo.poll() is None:
+                processo.send_signal(signal.SIGTERM)
+
+    def segnale(*_):
+        richiesto.append(True)
+        ferma()
+
+    signal.signal(signal.SIGTERM, segnale)
+    signal.signal(signal.SIGINT, segnale)
+    try:
+        scrittore = subprocess.Popen(
+            _comando_uvicorn('--uds', percorso_socket),
+            env={**ambiente, 'FINANCE_RUOLO': 'scrittura'}
+        )
+        processi.append(scrittore)
+        if not attendi_scrittore(scrittore, percorso_socket):
+            print('Il processo di scrittura non si è avviato', file=sys.stderr)
+            return 1
+
+        lettori = subprocess.Popen(
+            _comando_uvicorn('--host', args.host, '--port', str(args.porta), '--workers', str(workers)),
+            env={**ambiente, 'FINANCE_RUOLO': 'lettura', 'FINANCE_SCRITTORE': percorso_socket}
+        )
+        processi.append(lettori)
+        print(f'Server FastAPI avviato su http://{args.host}:{args.porta} '
+              f'({workers} processi di lettura e 1 di scrittura)')
+
+        # Basta che un processo termini (errore o segnale) per fermare tutto
+        while all(processo.poll() is None for processo in processi):
+            time.sleep(0.5)
+        # Uscita regolare solo se lo spegnimento è stato richiesto con un segnale
+        return 0 if richiesto else 1
+    finally:
+        ferma()
+        for processo in processi:
+            processo.wait()
+        shutil.rmtree(cartella, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Avvia il server FinanceHub')
+    parser.add_argument('--workers', default='auto',
+                        help="Processi di lettura, oppure 'auto' per uno per core (default)")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--porta', type=int, default=5000)
+    parser.add_argument('--db', default=os.environ.get('FINANCE_DB', 'finance.db'), help='Percorso del file SQLite')
+    args = parser.parse_args(argv)
+
+    workers = numero_core() if args.workers == 'auto' else int(args.workers)
+    if workers < 1:
+        parser.error('--workers deve essere almeno 1')
+
+    # Schema e migrazioni una sola volta, prima che i processi aprano il file
+    Database(args.db).close()
+
+    if workers == 1:
+        import uvicorn
+        os.environ['FINANCE_DB'] = args.db
+        print(f'Server FastAPI avviato su http://{args.host}:{args.porta}')
+        uvicorn.run('app:app', host=args.host, port=args.porta, timeout_graceful_shutdown=ATTESA_SPEGNIMENTO)
+        return 0
+
+    return avvia_processi(args, workers)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,456 @@
+"""
+Valutazione degli investimenti sullo storico dei prezzi.
+
+Un investimento con 'simbolo' e 'quantita' vale quantità × prezzo di
+chiusura, preso dalla tabella 'prezzi' (alimentata da un file CSV, vedi
+FornitorePrezziCSV e 'manage.py importa-prezzi'). Gli altri non hanno una
+quotazione: il loro valore va in linea retta dall'importo iniziale, alla
+data di acquisto, al valore attuale memorizzato, oggi.
+
+Il motore tiene in memoria una matrice NumPy simboli × giorni dei prezzi,
+con l'ultimo prezzo noto riportato sui giorni senza quotazione. Da questa
+ricava per tutte le posizioni insieme, con poche operazioni vettoriali:
+- la serie giornaliera del valore del portafoglio (quantità detenute
+  giorno per giorno per prezzi, sommate per colonna);
+- la serie dei versamenti (gli importi iniziali alla data di acquisto);
+- su un intervallo qualsiasi, rendimento ponderato per il tempo (TWR),
+  tasso interno di rendimento annuo (IRR) e ripartizione per tipo.
+Matrice e serie vengono ricalcolate solo quando cambiano i prezzi o gli
+investimenti (contatori in 'versioni_valutazione') o il giorno corrente:
+le interrogazioni leggono soltanto fette delle serie già pronte.
+
+La rivalutazione (rivaluta) aggiorna valore_attuale e rendimento di tutti
+gli investimenti quotati all'ultimo prezzo con una sola executemany, così
+i trigger del riepilogo tengono allineata la dashboard.
+
+Gli importi restano in centesimi (float nelle serie) fino alla risposta.
+"""
+import csv
+import io
+import os
+import threading
+from datetime import date
+
+import numpy as np
+
+import queries
+from analitica import MAX_PERIODI, PERIODI, _etichette, _euro, _mesi, _periodi, giorno_da_data
+
+# Limiti della ricerca dell'IRR (tasso annuo): da -99% a +10000%
+IRR_MINIMO = -0.99
+IRR_MASSIMO = 100.0
+
+# Oltre questo numero di investimenti rivalutati l'evento non contiene le righe
+MAX_RIGHE_EVENTO = 500
+
+
+def valida_prezzo(riga):
+    """
+    Valida e normalizza una riga di prezzo (simbolo, data, prezzo in euro).
+    Restituisce ((simbolo, giorno, prezzo), None) oppure (None, messaggio di errore).
+    """
+    simbolo = (riga.get('simbolo') or '').strip().upper()
+    if not simbolo:
+        return None, 'simbolo mancante'
+    try:
+        giorno = date.fromisoformat((riga.get('data') or '').strip()[:10]).isoformat()
+    except ValueError:
+        return None, f"data non valida: '{riga.get('data')}'"
+    testo = str(riga.get('prezzo') or '').strip()
+    if '.' not in testo:
+        # Virgola decimale (CSV all'italiana, separati da ';')
+        testo = testo.replace(',', '.')
+    try:
+        prezzo = float(testo)
+    except ValueError:
+        return None, 'prezzo mancante o non valido'
+    if not prezzo > 0 or prezzo == float('inf'):
+        return None, f'prezzo non valido: {prezzo}'
+    return (simbolo, giorno, prezzo), None
+
+
+def leggi_prezzi_csv(testo):
+    """
+    Legge un CSV con intestazione simbolo,data,prezzo (separatore ',' o ';').
+    Restituisce (righe valide, errori) con gli errori come {'riga', 'errore'}.
+    """
+    campione = testo[:4096]
+    separatore = ';' if campione.count(';') > campione.count(',') else ','
+    lettore = csv.DictReader(io.StringIO(testo), delimiter=separatore)
+    if lettore.fieldnames:
+        lettore.fieldnames = [nome.strip().lower() for nome in lettore.fieldnames]
+
+    righe = []
+    errori = []
+    # La riga 1 è l'intestazione
+    for numero, riga in enumerate(lettore, start=2):
+        prezzo, errore = valida_prezzo(riga)
+        if errore:
+            errori.append({'riga': numero, 'errore': errore})
+        else:
+            righe.append(prezzo)
+    return righe, errori
+
+
+class FornitorePrezziCSV:
+    """
+    Fornitore dei prezzi da un file CSV locale, per esempio scaricato ogni
+    sera da un servizio esterno: il file viene riletto solo se è cambiato
+    (data di modifica o dimensione) dall'ultima lettura.
+    """
+    def __init__(self, percorso):
+        self.percorso = percorso
+        self._firma = None
+
+    def leggi(self):
+        """(righe valide, errori) se il file è cambiato, altrimenti None"""
+        stato = os.stat(self.percorso)
+        firma = (stato.st_mtime_ns, stato.st_size)
+        if firma == self._firma:
+            return None
+        with open(self.percorso, encoding='utf-8-sig') as f:
+            risultato = leggi_prezzi_csv(f.read())
+        self._firma = firma
+        return risultato
+
+
+def importa_prezzi(conn, righe):
+    """
+    Inserisce o aggiorna i prezzi (simbolo, giorno, prezzo) nella transazione
+    di conn. I prezzi invariati non vengono riscritti, quindi reimportare lo
+    stesso file non cambia nulla. Restituisce il numero di prezzi cambiati.
+    """
+    prima = conn.total_changes
+    conn.executemany(queries.PREZZI_INSERISCI, righe)
+    cambiati = conn.total_changes - prima
+    if cambiati:
+        # Un contatore per import invece di un trigger per riga: i file possono
+        # contenere anni di prezzi giornalieri
+        conn.execute('UPDATE versioni_valutazione SET prezzi = prezzi + 1 WHERE id = 1')
+    return cambiati
+
+
+def rivaluta(conn):
+    """
+    Porta valore_attuale e rendimento degli investimenti quotati all'ultimo
+    prezzo del loro simbolo. Restituisce gli id degli investimenti cambiati.
+    """
+    righe = conn.execute(queries.INVESTIMENTI_ULTIMO_PREZZO).fetchall()
+    if not righe:
+        return []
+
+    n = len(righe)
+    ids = np.fromiter((r['id'] for r in righe), np.int64, n)
+    quantita = np.fromiter((r['quantita'] for r in righe), np.float64, n)
+    prezzi = np.fromiter((r['prezzo'] for r in righe), np.float64, n)
+    iniziali = np.fromiter((r['importo_iniziale'] for r in righe), np.int64, n)
+    attuali = np.fromiter((r['valore_attuale'] for r in righe), np.int64, n)
+
+    valori = np.rint(quantita * prezzi * 100).astype(np.int64)
+    cambiati = np.flatnonzero(valori != attuali)
+    conn.executemany(
+        'UPDATE investimenti SET valore_attuale = ?, rendimento = ? WHERE id = ?',
+        zip(valori[cambiati].tolist(), (valori - iniziali)[cambiati].tolist(), ids[cambiati].tolist())
+    )
+    return ids[cambiati].tolist()
+
+
+def ultimo_prezzo(conn, simbolo):
+    """Ultimo prezzo noto del simbolo (None se non ce ne sono)"""
+    riga = conn.execute(
+        'SELECT prezzo FROM prezzi WHERE simbolo = ? ORDER BY giorno DESC LIMIT 1', (simbolo,)
+    ).fetchone()
+    return riga['prezzo'] if riga else None
+
+
+def _crescita(valori, versamenti, precedente):
+    """
+    Fattori di crescita giornalieri: i versamenti si considerano fatti
+    all'inizio del giorno, quindi crescita = valore / (valore del giorno
+    prima + versamenti). Giorni senza capitale investito contano 1.
+    """
+    base = np.concatenate(([precedente], valori[:-1])) + versamenti
+    positiva = base > 0
+    return np.divide(valori, base, out=np.ones_like(valori), where=positiva)
+
+
+def _irr(flussi, anni):
+    """
+    Tasso annuo che azzera il valore attuale dei flussi (negativi i
+    versamenti, positivo il valore finale), per bisezione. None se i flussi
+    non cambiano segno o il tasso è fuori dai limiti.
+    """
+    def valore_attuale(tasso):
+        return float(np.sum(flussi * np.power(1 + tasso, -anni)))
+
+    basso, alto = IRR_MINIMO, IRR_MASSIMO
+    va_basso, va_alto = valore_attuale(basso), valore_attuale(alto)
+    if np.sign(va_basso) == np.sign(va_alto):
+        return None
+    for _ in range(100):
+        medio = (basso + alto) / 2
+        va_medio = valore_attuale(medio)
+        if np.sign(va_medio) == np.sign(va_basso):
+            basso, va_basso = medio, va_medio
+        else:
+            alto = medio
+        if alto - basso < 1e-9:
+            break
+    return (basso + alto) / 2
+
+
+class MotoreValutazione:
+    def __init__(self):
+        self.lock = threading.Lock()
+        # Matrice dei prezzi: righe per simbolo, colonne dal giorno _primo
+        self._versione_prezzi = None
+        self._simboli = {}
+        self._primo = 0
+        self._prezzi = np.zeros((0, 0))
+        # Serie del portafoglio, per versione degli investimenti e giorno corrente
+        self._chiave_serie = None
+        self._serie = None
+        self.calcoli = 0
+
+    def sincronizza(self, conn):
+        """Ricarica prezzi e serie se sono cambiati dall'ultima lettura"""
+        with self.lock:
+            propria = not conn.in_transaction
+            if propria:
+                conn.execute('BEGIN')
+            try:
+                versioni = conn.execute(queries.VALUTAZIONE_VERSIONI).fetchone()
+                oggi = giorno_da_data(date.fromisoformat(conn.execute(queries.DATE_CORRENTI).fetchone()['oggi']))
+                if versioni['prezzi'] != self._versione_prezzi:
+                    self._carica_prezzi(conn)
+                    self._versione_prezzi = versioni['prezzi']
+                    self._chiave_serie = None
+                chiave = (versioni['investimenti'], oggi)
+                if chiave != self._chiave_serie:
+                    self._calcola_serie(conn, oggi)
+                    self._chiave_serie = chiave
+                return self._serie
+            finally:
+                if propria:
+                    conn.rollback()
+
+    def _carica_prezzi(self, conn):
+        righe = conn.execute(queries.VALUTAZIONE_PREZZI).fetchall()
+        self._simboli = {}
+        if not righe:
+            self._prezzi = np.zeros((0, 0))
+            return
+
+        n = len(righe)
+        codici = np.fromiter((self._simboli.setdefault(r[0], len(self._simboli)) for r in righe), np.int64, n)
+        giorni = np.fromiter((r[1] for r in righe), np.int64, n)
+        valori = np.fromiter((r[2] for r in righe), np.float64, n)
+
+        self._primo = int(giorni.min())
+        prezzi = np.full((len(self._simboli), int(giorni.max()) - self._primo + 1), np.nan)
+        prezzi[codici, giorni - self._primo] = valori
+
+        # Prima della prima quotazione vale la prima disponibile, poi
+        # ogni giorno senza quotazione riporta l'ultimo prezzo noto
+        righe_matrice = np.arange(prezzi.shape[0])
+        noti = ~np.isnan(prezzi)
+        primi = noti.argmax(axis=1)
+        colonne = np.where(noti, np.arange(prezzi.shape[1]), 0)
+        np.maximum.accumulate(colonne, axis=1, out=colonne)
+        colonne = np.maximum(colonne, primi[:, None])
+        self._prezzi = prezzi[righe_matrice[:, None], colonne]
+
+    def _calcola_serie(self, conn, oggi):
+        righe = conn.execute(queries.VALUTAZIONE_INVESTIMENTI).fetchall()
+        self.calcoli += 1
+        if not righe:
+            self._serie = None
+            return
+
+        n = len(righe)
+        codici_tipo = {}
+        tipo = np.fromiter((codici_tipo.setdefault(r['tipo'], len(codici_tipo)) for r in righe), np.int64, n)
+        tipi = list(codici_tipo)
+        simbolo = np.fromiter(
+            (self._simboli.get(r['simbolo'], -1) if r['quantita'] is not None else -1 for r in righe), np.int64, n
+        )
+        quantita = np.fromiter((r['quantita'] or 0 for r in righe), np.float64, n)
+        iniziale = np.fromiter((r['importo_iniziale'] for r in righe), np.float64, n)
+        attuale = np.fromiter((r['valore_attuale'] for r in righe), np.float64, n)
+        # Senza data di acquisto leggibile l'investimento conta da oggi
+        acquisto = np.fromiter((oggi if r['giorno'] is None else min(r['giorno'], oggi) for r in righe), np.int64, n)
+
+        inizio = int(acquisto.min())
+        lunghezza = oggi - inizio + 1
+        posizione = acquisto - inizio
+        quotato = simbolo >= 0
+
+        # Quotati: quantità detenute giorno per giorno per i prezzi, solo sui simboli in portafoglio
+        valore = np.zeros(lunghezza)
+        if quotato.any():
+            usati, riga_simbolo = np.unique(simbolo[quotato], return_inverse=True)
+            detenute = np.zeros((len(usati), lunghezza))
+            np.add.at(detenute, (riga_simbolo, posizione[quotato]), quantita[quotato])
+            np.cumsum(detenute, axis=1, out=detenute)
+            colonne = np.clip(np.arange(inizio, oggi + 1) - self._primo, 0, self._prezzi.shape[1] - 1)
+            prezzi = self._prezzi[usati][:, colonne]
+            valore += np.einsum('ij,ij->j', detenute, prezzi) * 100
+
+        # Non quotati: retta dall'importo iniziale al valore attuale. La somma
+        # delle rette attive in t è A(t) + B(t)·t - C(t), con A, B, C somme
+        # cumulate per giorno di acquisto di partenza, pendenza e pendenza × acquisto
+        statico = ~quotato
+        durata = oggi - acquisto[statico]
+        pendenza = np.divide(attuale[statico] - iniziale[statico], durata,
+                             out=np.zeros(durata.shape), where=durata > 0)
+        partenza = np.where(durata > 0, iniziale[statico], attuale[statico])
+        giorni = np.arange(lunghezza)
+        a = np.cumsum(np.bincount(posizione[statico], weights=partenza, minlength=lunghezza))
+        b = np.cumsum(np.bincount(posizione[statico], weights=pendenza, minlength=lunghezza))
+        c = np.cumsum(np.bincount(posizione[statico], weights=pendenza * posizione[statico], minlength=lunghezza))
+        valore += a + b * giorni - c
+
+        self._serie = {
+            'inizio': inizio,
+            # Matrice da cui è stata calcolata (un ricaricamento ne crea una nuova)
+            'prezzi': self._prezzi,
+            'primo': self._primo,
+            'valore': valore,
+            'versamenti': np.bincount(posizione, weights=iniziale, minlength=lunghezza),
+            # Per la ripartizione a una data qualsiasi
+            'tipi': tipi,
+            'tipo': tipo,
+            'simbolo': simbolo,
+            'quantita': quantita,
+            'iniziale': iniziale,
+            'attuale': attuale,
+            'acquisto': acquisto,
+        }
+
+    @staticmethod
+    def _valori_al(serie, giorno):
+        """Valore di ogni investimento nel giorno indicato (0 se acquistato dopo)"""
+        quotato = serie['simbolo'] >= 0
+        valori = np.zeros(len(quotato))
+        if quotato.any():
+            colonna = min(max(giorno - serie['primo'], 0), serie['prezzi'].shape[1] - 1)
+            valori[quotato] = serie['quantita'][quotato] * serie['prezzi'][serie['simbolo'][quotato], colonna] * 100
+        statico = ~quotato
+        oggi = serie['inizio'] + len(serie['valore']) - 1
+        durata = oggi - serie['acquisto'][statico]
+        frazione = np.divide(giorno - serie['acquisto'][statico], durata,
+                             out=np.ones(durata.shape), where=durata > 0)
+        valori[statico] = serie['iniziale'][statico] + (serie['attuale'][statico] - serie['iniziale'][statico]) * frazione
+        valori[serie['acquisto'] > giorno] = 0
+        return valori
+
+    @staticmethod
+    def _intervallo(serie, da, a):
+        """
+        Indici (inclusi) delle serie tra le date da e a, limitati ai giorni
+        disponibili: senza da si parte dal primo acquisto, senza a si arriva a oggi
+        """
+        if da and a and da > a:
+            raise ValueError('data_da successiva a data_a')
+        ultimo = len(serie['valore']) - 1
+        i = 0 if da is None else min(max(giorno_da_data(da) - serie['inizio'], 0), ultimo + 1)
+        j = ultimo if a is None else min(giorno_da_data(a) - serie['inizio'], ultimo)
+        return i, j
+
+    def performance(self, da=None, a=None):
+        """
+        Rendimento del portafoglio tra le date da e a (incluse): valori
+        iniziale (alla vigilia di da) e finale, versamenti, guadagno, TWR del
+        periodo, IRR annuo e ripartizione per tipo alla data finale.
+        Solleva ValueError su parametri non validi.
+        """
+        serie = self._serie
+        risposta = {
+            'data_da': da.isoformat() if da else None,
+            'data_a': a.isoformat() if a else None,
+            'valore_iniziale': 0.0, 'valore_finale': 0.0, 'versamenti': 0.0, 'guadagno': 0.0,
+            'twr': None, 'irr': None, 'allocazione': [],
+        }
+        if serie is None:
+            return risposta
+        i, j = self._intervallo(serie, da, a)
+        if j < 0 or i > j:
+            return risposta
+
+        precedente = serie['valore'][i - 1] if i > 0 else 0.0
+        valori = serie['valore'][i:j + 1]
+        versamenti = serie['versamenti'][i:j + 1]
+        twr = float(np.prod(_crescita(valori, versamenti, precedente))) - 1
+
+        # Flussi dal punto di vista dell'investitore: escono il valore di
+        # partenza e i versamenti, rientra il valore finale
+        giorni = np.flatnonzero(versamenti)
+        flussi = np.concatenate(([-precedente], -versamenti[giorni], [valori[-1]]))
+        anni = np.concatenate(([0], giorni, [j - i + 1])) / 365.25
+        irr = _irr(flussi, anni)
+
+        valori_tipo = np.bincount(serie['tipo'], weights=self._valori_al(serie, serie['inizio'] + j),
+                                  minlength=len(serie['tipi']))
+        totale = valori_tipo.sum()
+        ordine = [k for k in np.argsort(-valori_tipo, kind='stable').tolist() if valori_tipo[k] > 0]
+
+        iniziale, finale, versato = _euro([precedente, valori[-1], versamenti.sum()])
+        return {
+            **risposta,
+            'data_da': _etichette(serie['inizio'] + i, serie['inizio'] + i, 'giorno')[0],
+            'data_a': _etichette(serie['inizio'] + j, serie['inizio'] + j, 'giorno')[0],
+            'valore_iniziale': iniziale,
+            'valore_finale': finale,
+            'versamenti': versato,
+            'guadagno': round(finale - iniziale - versato, 2),
+            'twr': round(twr * 100, 2),
+            'irr': round(irr * 100, 2) if irr is not None else None,
+            'allocazione': [
+                {'tipo': serie['tipi'][k], 'valore': valore, 'percentuale': round(valori_tipo[k] / totale * 100, 2)}
+                for k, valore in zip(ordine, _euro(valori_tipo[ordine]))
+            ],
+        }
+
+    def serie(self, da=None, a=None, periodo='giorno'):
+        """
+        Valore del portafoglio e capitale versato alla fine di ogni periodo tra
+        le date da e a (incluse). Solleva ValueError su parametri non validi.
+        """
+        if periodo not in PERIODI:
+            raise ValueError(f'Periodo non valido: {periodo}')
+        serie = self._serie
+        risposta = {'periodo': periodo, 'serie': []}
+        if serie is None:
+            return risposta
+        i, j = self._intervallo(serie, da, a)
+        if j < 0 or i > j:
+            return risposta
+
+        giorni = np.arange(serie['inizio'] + i, serie['inizio'] + j + 1)
+        periodi = _periodi(giorni, _mesi(giorni), periodo)
+        lunghezza = int(periodi[-1] - periodi[0]) + 1
+        if lunghezza > MAX_PERIODI:
+            raise ValueError(f'Troppi periodi richiesti ({lunghezza}, massimo {MAX_PERIODI})')
+        # Ultimo giorno di ogni periodo: i giorni sono consecutivi, quindi ogni periodo è presente
+        fine = np.flatnonzero(np.diff(periodi, append=periodi[-1] + 1)) + i
+        investito = np.cumsum(serie['versamenti'])[fine]
+        return {
+            'periodo': periodo,
+            'serie': [
+                {'periodo': etichetta, 'valore': valore, 'investito': versato}
+                for etichetta, valore, versato in zip(
+                    _etichette(int(periodi[0]), int(periodi[-1]), periodo),
+                    _euro(serie['valore'][fine]), _euro(investito)
+                )
+            ],
+        }
+
+    def stats(self):
+        serie = self._serie
+        return {
+            'simboli': len(self._simboli),
+            'giorni_prezzi': self._prezzi.shape[1],
+            'investimenti': 0 if serie is None else len(serie['tipo']),
+            'giorni_serie': 0 if serie is None else len(serie['valore']),
+            'calcoli': self.calcoli,
+        }
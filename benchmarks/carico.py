@@ -0,0 +1,197 @@
+"""
+Generatore di carico concorrente per il backend via HTTP.
+
+Un numero fisso di client virtuali invia richieste in ciclo per --durata
+secondi, scegliendo l'endpoint secondo i pesi del mix. Alla fine riporta
+throughput e latenze p50/p95/p99 complessive e per endpoint, in JSON.
+
+Il server può essere già avviato (--url) oppure avviato dallo script con
+uvicorn su una copia del database indicato (--database), così le scritture
+del test non modificano il file originale.
+
+Uso (dalla radice del progetto):
+    python benchmarks/carico.py --database bench.db --concorrenza 32 --durata 30
+    python benchmarks/carico.py --url http://localhost:5000 --output carico.json
+    python benchmarks/carico.py --database bench.db --scritture 100   # solo scritture
+"""
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+import httpx
+
+import comune
+from endpoint import _copia_database
+
+# (peso, nome, metodo, percorso, corpo JSON): le letture dominano come nell'uso reale
+MIX_LETTURA = [
+    (20, 'dashboard', 'GET', '/api/dashboard', None),
+    (15, 'conti', 'GET', '/api/conti', None),
+    (15, 'conto', 'GET', '/api/conti/{conto_id}', None),
+    (20, 'transazioni', 'GET', '/api/transazioni', None),
+    (10, 'transazioni_conto', 'GET', '/api/transazioni/conto/{conto_id}', None),
+    (8, 'stats', 'GET', '/api/transazioni/stats', None),
+    (8, 'chart', 'GET', '/api/transazioni/chart', None),
+    (2, 'investimenti', 'GET', '/api/investimenti', None),
+    (2, 'obiettivi', 'GET', '/api/obiettivi', None),
+]
+
+# Scritture che modificano il saldo del conto, con i loro pesi relativi
+MIX_SCRITTURA = [
+    (8, 'crea_transazione', 'POST', '/api/transazioni', {
+        'conto_id': '{conto_id}', 'tipo': 'uscita', 'categoria': 'Carico', 'importo': -1.0
+    }),
+    (2, 'crea_investimento', 'POST', '/api/investimenti', {
+        'conto_id': '{conto_id}', 'nome': 'Carico', 'tipo': 'Azioni', 'importo_iniziale': 1.0, 'valore_attuale': 1.0
+    }),
+]
+
+
+def _porta_libera():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def avvia_server(percorso_db, porta):
+    """Avvia uvicorn con l'app del backend sul database indicato"""
+    ambiente = {**os.environ, 'FINANCE_DB': percorso_db}
+    processo = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'app:app', '--port', str(porta), '--log-level', 'warning'],
+        cwd=comune.CARTELLA_BACKEND, env=ambiente
+    )
+    url = f'http://127.0.0.1:{porta}'
+    # All'avvio vengono applicate le migrazioni: su database grandi serve qualche secondo
+    scadenza = time.monotonic() + 300
+    while time.monotonic() < scadenza:
+        if processo.poll() is not None:
+            raise RuntimeError('Il server si è chiuso durante l\'avvio')
+        try:
+            if httpx.get(url + '/api/sistema/pool', timeout=1).status_code == 200:
+                return processo, url
+        except httpx.TransportError:
+            pass
+        time.sleep(0.25)
+    processo.terminate()
+    raise RuntimeError('Il server non ha risposto entro il tempo massimo')
+
+
+def _sostituisci(valore, parametri):
+    if isinstance(valore, str):
+        testo = valore.format(**parametri)
+        return int(testo) if valore.startswith('{') and testo.isdigit() else testo
+    if isinstance(valore, dict):
+        return {k: _sostituisci(v, parametri) for k, v in valore.items()}
+    return valore
+
+
+async def esegui_carico(url, concorrenza, durata, percentuale_scritture, seed):
+    async with httpx.AsyncClient(
+        base_url=url, timeout=60,
+        limits=httpx.Limits(max_connections=concorrenza, max_keepalive_connections=concorrenza)
+    ) as client:
+        conti = (await client.get('/api/conti')).json()
+        parametri = {'conto_id': max(conti, key=lambda c: c['saldo'])['id']}
+
+        # I pesi delle scritture sono scalati perché siano la percentuale richiesta del totale
+        quota_lettura = (100 - percentuale_scritture) / sum(peso for peso, *_ in MIX_LETTURA)
+        quota_scrittura = percentuale_scritture / sum(peso for peso, *_ in MIX_SCRITTURA)
+        mix, pesi = [], []
+        for richieste, quota in ((MIX_LETTURA, quota_lettura), (MIX_SCRITTURA, quota_scrittura)):
+            for peso, nome, metodo, percorso, corpo in richieste:
+                if quota:
+                    mix.append((nome, metodo, percorso, corpo))
+                    pesi.append(peso * quota)
+        richieste = [
+            (nome, metodo, _sostituisci(percorso, parametri), _sostituisci(corpo, parametri))
+            for nome, metodo, percorso, corpo in mix
+        ]
+
+        latenze = defaultdict(list)
+        errori = defaultdict(int)
+        fine = time.perf_counter() + durata
+
+        async def client_virtuale(numero):
+            rng = random.Random(seed + numero)
+            while time.perf_counter() < fine:
+                nome, metodo, percorso, corpo = rng.choices(richieste, weights=pesi)[0]
+                inizio = time.perf_counter()
+                try:
+                    risposta = await client.request(metodo, percorso, json=corpo)
+                    ok = risposta.status_code < 400
+                except httpx.HTTPError:
+                    ok = False
+                latenze[nome].append(time.perf_counter() - inizio)
+                if not ok:
+                    errori[nome] += 1
+
+        inizio = time.perf_counter()
+        await asyncio.gather(*(client_virtuale(n) for n in range(concorrenza)))
+        durata_effettiva = time.perf_counter() - inizio
+
+    tutte = [valore for valori in latenze.values() for valore in valori]
+    return {
+        'durata_s': round(durata_effettiva, 2),
+        'totale': {**comune.statistiche_latenze(tutte, durata_effettiva), 'errori': sum(errori.values())},
+        'endpoint': {
+            nome: {**comune.statistiche_latenze(valori, durata_effettiva), 'errori': errori[nome]}
+            for nome, valori in sorted(latenze.items())
+        },
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Test di carico concorrente del backend')
+    destinazione = parser.add_mutually_exclusive_group(required=True)
+    destinazione.add_argument('--url', help='Server già avviato (es. http://localhost:5000)')
+    destinazione.add_argument('--database', help='Avvia un server su una copia di questo database')
+    parser.add_argument('--concorrenza', type=int, default=32, help='Client virtuali in parallelo')
+    parser.add_argument('--durata', type=float, default=20, help='Durata del test in secondi')
+    parser.add_argument('--scritture', type=float, default=0,
+                        help='Percentuale di richieste di scrittura (POST transazioni e investimenti, 100 = solo scritture)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', default='-', help="File JSON dei risultati ('-' = stdout)")
+    args = parser.parse_args(argv)
+
+    if not 0 <= args.scritture <= 100:
+        parser.error('--scritture deve essere tra 0 e 100')
+
+    processo = None
+    cartella = None
+    try:
+        url = args.url
+        if args.database:
+            cartella = tempfile.mkdtemp(prefix='finance-carico-')
+            copia = os.path.join(cartella, 'finance.db')
+            _copia_database(args.database, copia)
+            processo, url = avvia_server(copia, _porta_libera())
+
+        risultati = asyncio.run(esegui_carico(url, args.concorrenza, args.durata, args.scritture, args.seed))
+    finally:
+        if processo:
+            processo.terminate()
+            processo.wait()
+        if cartella:
+            shutil.rmtree(cartella, ignore_errors=True)
+
+    totale = risultati['totale']
+    print(f"{totale['richieste']} richieste in {risultati['durata_s']}s: "
+          f"{totale['richieste_al_secondo']} req/s, p50 {totale['p50_ms']} ms, "
+          f"p95 {totale['p95_ms']} ms, p99 {totale['p99_ms']} ms, errori {totale['errori']}",
+          file=sys.stderr)
+
+    parametri = {k: v for k, v in vars(args).items() if k != 'output'}
+    comune.scrivi_risultati({**comune.intestazione('carico', parametri), **risultati}, args.output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
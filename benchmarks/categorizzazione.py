@@ -0,0 +1,185 @@
+"""
+Benchmark della categorizzazione automatica (categorizzazione.py).
+
+Crea un database temporaneo con --regole regole di testo (nomi di
+esercenti) più alcune regex e regole di importo, e --storico transazioni
+già categorizzate da cui il modello impara. Poi classifica un lotto di
+--righe descrizioni in tre modi:
+  - indice: IndiceRegole compilato (trie dei testi + filtro delle regex);
+  - ingenuo: ogni regola provata su ogni riga, nell'ordine di priorità;
+  - completo: Categorizzatore.classifica (regole, poi modello appreso).
+Verifica che indice e ingenuo scelgano le stesse regole e riporta righe
+al secondo per ciascun numero di regole.
+
+Uso (dalla radice del progetto):
+    python benchmarks/categorizzazione.py
+    python benchmarks/categorizzazione.py --regole 100 1000 5000 --righe 100000 --output categorie.json
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+
+import comune
+from categorizzazione import Categorizzatore, IndiceRegole
+from database import Database
+
+SILLABE = ('ba', 'co', 'di', 'fe', 'ga', 'lu', 'ma', 'ne', 'po', 'ri', 'sa', 'to', 'vi', 'zu')
+PAROLE_COMUNI = ('pagamento', 'carta', 'pos', 'bonifico', 'addebito', 'sepa', 'presso')
+CATEGORIE = ('Spesa', 'Trasporti', 'Ristoranti', 'Bollette', 'Shopping', 'Salute', 'Svago')
+
+
+def esercente(rng):
+    return ''.join(rng.choice(SILLABE) for _ in range(rng.randint(3, 5)))
+
+
+def descrizione(rng, esercenti):
+    parole = [rng.choice(PAROLE_COMUNI), rng.choice(esercenti).upper(), str(rng.randint(1000, 99999))]
+    rng.shuffle(parole)
+    return ' '.join(parole)
+
+
+def crea_regole(rng, numero, esercenti):
+    regole = [
+        {'tipo': 'testo', 'modello': nome, 'categoria': rng.choice(CATEGORIE),
+         'importo_min': None, 'importo_max': None, 'priorita': rng.randint(0, 3)}
+        for nome in esercenti[:numero]
+    ]
+    regole += [
+        {'tipo': 'regex', 'modello': r'\bbonifico\b.*\bstipendio\b', 'categoria': 'Stipendio',
+         'importo_min': 0, 'importo_max': None, 'priorita': 5},
+        {'tipo': 'regex', 'modello': r'^addebito sepa \w+ 9\d{3}$', 'categoria': 'Bollette',
+         'importo_min': None, 'importo_max': 0, 'priorita': 1},
+        {'tipo': 'importo', 'modello': None, 'categoria': 'Piccole spese',
+         'importo_min': -500, 'importo_max': -1, 'priorita': -1},
+    ]
+    return regole
+
+
+def ingenuo(regole, righe):
+    """Ogni regola su ogni riga, dalla priorità più alta: il costo cresce con regole × righe"""
+    ordinate = sorted(regole, key=lambda r: (-r['priorita'], r['id']))
+    compilate = [
+        (r, r['modello'].casefold() if r['tipo'] == 'testo'
+         else re.compile(r['modello'], re.IGNORECASE) if r['tipo'] == 'regex' else None)
+        for r in ordinate
+    ]
+    risultati = []
+    for testo, importo in righe:
+        minuscolo = testo.casefold()
+        trovata = None
+        for regola, modello in compilate:
+            if regola['importo_min'] is not None and importo < regola['importo_min']:
+                continue
+            if regola['importo_max'] is not None and importo > regola['importo_max']:
+                continue
+            if (regola['tipo'] == 'importo'
+                    or (regola['tipo'] == 'testo' and modello in minuscolo)
+                    or (regola['tipo'] == 'regex' and modello.search(testo))):
+                trovata = regola['id']
+                break
+        risultati.append(trovata)
+    return risultati
+
+
+def misura(funzione, ripetizioni):
+    """Tempo migliore in secondi e risultato dell'ultima esecuzione"""
+    migliore = None
+    for _ in range(ripetizioni):
+        inizio = time.perf_counter()
+        risultato = funzione()
+        durata = time.perf_counter() - inizio
+        migliore = durata if migliore is None else min(migliore, durata)
+    return migliore, risultato
+
+
+def esegui(numero_regole, args, cartella):
+    rng = random.Random(numero_regole)
+    esercenti = list({esercente(rng) for _ in range(numero_regole * 3)})
+    rng.shuffle(esercenti)
+
+    db = Database(os.path.join(cartella, f'categorie-{numero_regole}.db'))
+    with db.connection() as conn:
+        conn.execute("INSERT INTO conti (nome, tipo) VALUES ('Benchmark', 'corrente')")
+        conn.executemany('''
+            INSERT INTO regole_categorie (tipo, modello, importo_min, importo_max, categoria, priorita)
+            VALUES (:tipo, :modello, :importo_min, :importo_max, :categoria, :priorita)
+        ''', crea_regole(rng, numero_regole, esercenti))
+        # Lo storico usa gli esercenti senza regola: li riconosce solo il modello
+        senza_regola = esercenti[numero_regole:] or esercenti
+        categoria_di = {nome: rng.choice(CATEGORIE) for nome in senza_regola}
+        storico = []
+        for i in range(args.storico):
+            nome = rng.choice(senza_regola)
+            storico.append((categoria_di[nome], -rng.randint(100, 20000), f'pagamento {nome} {i}'))
+        conn.executemany(
+            "INSERT INTO transazioni (conto_id, tipo, categoria, importo, descrizione, data) "
+            "VALUES (1, 'uscita', ?, ?, ?, '2024-01-01')", storico
+        )
+        conn.commit()
+
+        categorie = Categorizzatore()
+        inizio = time.perf_counter()
+        categorie.sincronizza(conn)
+        addestramento = time.perf_counter() - inizio
+        regole = [dict(r) for r in conn.execute('SELECT * FROM regole_categorie')]
+    db.close()
+
+    righe = [(descrizione(rng, esercenti), -rng.randint(100, 20000)) for _ in range(args.righe)]
+
+    inizio = time.perf_counter()
+    indice = IndiceRegole(regole)
+    compilazione = time.perf_counter() - inizio
+
+    t_indice, ranghi = misura(lambda: [indice.applica(testo, importo) for testo, importo in righe], args.ripetizioni)
+    scelte = [indice.regole[r]['id'] if r is not None else None for r in ranghi]
+    t_completo, esiti = misura(lambda: categorie.classifica(righe), args.ripetizioni)
+    # L'ingenuo cresce con il numero di regole: basta una parte delle righe
+    campione = righe[:max(1000, args.righe * 100 // max(numero_regole, 100))]
+    t_ingenuo, attese = misura(lambda: ingenuo(regole, campione), 1)
+    assert scelte[:len(campione)] == attese, 'indice e scansione ingenua scelgono regole diverse'
+
+    return {
+        'regole': len(regole),
+        'righe': args.righe,
+        'compilazione_ms': round(compilazione * 1000, 3),
+        'addestramento_ms': round(addestramento * 1000, 3),
+        'parole_modello': categorie.stats()['parole_modello'],
+        'indice_righe_al_secondo': round(args.righe / t_indice),
+        'completo_righe_al_secondo': round(args.righe / t_completo),
+        'ingenuo_righe_al_secondo': round(len(campione) / t_ingenuo),
+        'con_regola': sum(1 for s in scelte if s is not None),
+        'dal_modello': sum(1 for categoria, regola, _ in esiti if categoria and regola is None),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark della categorizzazione automatica')
+    parser.add_argument('--regole', type=int, nargs='+', default=[10, 100, 1000, 5000])
+    parser.add_argument('--righe', type=int, default=100000, help='Righe da classificare per ogni misura')
+    parser.add_argument('--storico', type=int, default=50000, help='Transazioni categorizzate per il modello')
+    parser.add_argument('--ripetizioni', type=int, default=3)
+    parser.add_argument('--output', default='-', help="File JSON dei risultati ('-' per stdout)")
+    args = parser.parse_args(argv)
+
+    risultati = comune.intestazione('categorizzazione', {
+        'regole': args.regole, 'righe': args.righe, 'storico': args.storico, 'ripetizioni': args.ripetizioni
+    })
+    risultati['misure'] = []
+    with tempfile.TemporaryDirectory(prefix='financehub-categorie-') as cartella:
+        for numero in args.regole:
+            misura_regole = esegui(numero, args, cartella)
+            risultati['misure'].append(misura_regole)
+            print(f"{misura_regole['regole']:>6} regole: indice {misura_regole['indice_righe_al_secondo']:>9} righe/s  "
+                  f"completo {misura_regole['completo_righe_al_secondo']:>9} righe/s  "
+                  f"ingenuo {misura_regole['ingenuo_righe_al_secondo']:>9} righe/s", file=sys.stderr)
+
+    comune.scrivi_risultati(risultati, args.output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
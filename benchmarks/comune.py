@@ -0,0 +1,77 @@
+"""
+Funzioni condivise dagli script di benchmark: percorso del backend,
+statistiche sulle latenze e scrittura dei risultati in JSON.
+"""
+import json
+import os
+import platform
+import subprocess
+import sys
+from datetime import datetime
+
+CARTELLA_PROGETTO = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+CARTELLA_BACKEND = os.path.join(CARTELLA_PROGETTO, 'backend')
+
+# I moduli del backend si importano come fa app.py (import database, import queries...)
+if CARTELLA_BACKEND not in sys.path:
+    sys.path.insert(0, CARTELLA_BACKEND)
+
+
+def percentile(valori_ordinati, p):
+    """Percentile p (0-100) di una lista già ordinata, con il metodo nearest-rank"""
+    if not valori_ordinati:
+        return 0.0
+    indice = max(0, min(len(valori_ordinati) - 1, round(p / 100 * len(valori_ordinati)) - 1))
+    return valori_ordinati[indice]
+
+
+def statistiche_latenze(latenze, durata=None):
+    """
+    Riassume una lista di latenze in secondi: numero di richieste, media e
+    percentili in millisecondi, e throughput se è nota la durata totale.
+    """
+    ordinate = sorted(latenze)
+    risultato = {
+        'richieste': len(ordinate),
+        'media_ms': round(sum(ordinate) / len(ordinate) * 1000, 3) if ordinate else 0.0,
+        'p50_ms': round(percentile(ordinate, 50) * 1000, 3),
+        'p95_ms': round(percentile(ordinate, 95) * 1000, 3),
+        'p99_ms': round(percentile(ordinate, 99) * 1000, 3),
+        'max_ms': round(ordinate[-1] * 1000, 3) if ordinate else 0.0,
+    }
+    if durata:
+        risultato['richieste_al_secondo'] = round(len(ordinate) / durata, 1)
+    return risultato
+
+
+def _commit_corrente():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=CARTELLA_PROGETTO,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def intestazione(nome, parametri):
+    """Metadati comuni a tutti i risultati, per confrontare esecuzioni su commit diversi"""
+    return {
+        'benchmark': nome,
+        'commit': _commit_corrente(),
+        'eseguito_il': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'piattaforma': platform.platform(),
+        'parametri': parametri,
+    }
+
+
+def scrivi_risultati(risultati, percorso):
+    """Scrive i risultati in JSON sul file indicato, oppure su stdout con '-'"""
+    testo = json.dumps(risultati, indent=2, ensure_ascii=False)
+    if percorso == '-':
+        print(testo)
+    else:
+        with open(percorso, 'w', encoding='utf-8') as f:
+            f.write(testo + '\n')
+        print(f'Risultati scritti in {percorso}')
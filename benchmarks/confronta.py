@@ -0,0 +1,71 @@
+"""
+Confronta due file di risultati (endpoint.py o carico.py) e segnala le regressioni.
+
+Per ogni caso presente in entrambi i file confronta le latenze p50/p95/p99:
+un peggioramento oltre --soglia percento è una regressione e il comando
+termina con codice 1 (utile in CI o prima di un merge).
+
+Uso (dalla radice del progetto):
+    python benchmarks/confronta.py prima.json dopo.json --soglia 15
+"""
+import argparse
+import json
+import sys
+
+METRICHE = ('p50_ms', 'p95_ms', 'p99_ms')
+
+
+def _casi(risultati):
+    """Estrae {nome caso: statistiche} da un file di endpoint.py o di carico.py"""
+    if 'casi' in risultati:
+        return risultati['casi']
+    return {'totale': risultati['totale'], **risultati.get('endpoint', {})}
+
+
+def confronta(prima, dopo, soglia):
+    """Restituisce le righe del confronto e il numero di regressioni"""
+    casi_prima = _casi(prima)
+    casi_dopo = _casi(dopo)
+    righe = []
+    regressioni = 0
+    for nome in casi_prima:
+        if nome not in casi_dopo:
+            continue
+        for metrica in METRICHE:
+            a = casi_prima[nome][metrica]
+            b = casi_dopo[nome][metrica]
+            variazione = (b - a) / a * 100 if a else 0.0
+            regressione = variazione > soglia
+            regressioni += regressione
+            righe.append((nome, metrica, a, b, variazione, regressione))
+    return righe, regressioni
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Confronta due esecuzioni dei benchmark')
+    parser.add_argument('prima', help='Risultati di riferimento (JSON)')
+    parser.add_argument('dopo', help='Risultati da verificare (JSON)')
+    parser.add_argument('--soglia', type=float, default=10.0,
+                        help='Peggioramento percentuale oltre il quale segnalare una regressione')
+    args = parser.parse_args(argv)
+
+    with open(args.prima, encoding='utf-8') as f:
+        prima = json.load(f)
+    with open(args.dopo, encoding='utf-8') as f:
+        dopo = json.load(f)
+
+    if prima.get('benchmark') != dopo.get('benchmark'):
+        parser.error('I due file provengono da benchmark diversi')
+
+    print(f"Confronto {prima.get('commit')} -> {dopo.get('commit')} (soglia {args.soglia}%)")
+    righe, regressioni = confronta(prima, dopo, args.soglia)
+    for nome, metrica, a, b, variazione, regressione in righe:
+        segno = 'REGRESSIONE' if regressione else ''
+        print(f'{nome:<55} {metrica:<7} {a:10.3f} -> {b:10.3f} ms  {variazione:+7.1f}%  {segno}')
+
+    print(f'{regressioni} regressioni')
+    return 1 if regressioni else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,272 @@
+"""
+Micro-benchmark di tutti gli endpoint di backend/app.py, eseguiti in-process
+tramite un client ASGI (nessun server HTTP né rete di mezzo).
+
+Il database indicato viene prima copiato in una cartella temporanea, perché
+i casi di scrittura creano ed eliminano righe. Ogni caso viene eseguito in
+sequenza per --iterazioni volte dopo un breve riscaldamento; le operazioni
+preparatorie (es. creare la riga da eliminare) non sono cronometrate.
+
+Uso (dalla radice del progetto):
+    python benchmarks/popola.py bench.db --transazioni 1000000
+    python benchmarks/endpoint.py bench.db --output risultati_endpoint.json
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+import httpx
+
+import comune
+
+RIGHE_IMPORT = 100
+
+
+def _copia_database(sorgente, destinazione):
+    """Copia consistente del database (anche con un WAL non ancora integrato)"""
+    with sqlite3.connect(sorgente) as src, sqlite3.connect(destinazione) as dst:
+        src.backup(dst)
+
+
+async def _id_creato(risposta):
+    assert risposta.status_code == 201, risposta.text
+    return risposta.json()['id']
+
+
+def crea_casi(contesto):
+    """
+    Elenco dei casi: (nome, esegui, prepara). 'prepara(client, i)' è opzionale
+    e il suo risultato viene passato a 'esegui(client, i, preparato)'.
+    """
+    conto_id = contesto['conto_id']
+    cursore_profondo = contesto['cursore_profondo']
+    mese = contesto['mese']
+
+    async def crea_conto_vuoto(c, i):
+        return await _id_creato(await c.post('/api/conti', json={'nome': f'Bench {i}', 'tipo': 'Conto Corrente'}))
+
+    async def crea_transazione(c, i):
+        return await _id_creato(await c.post('/api/transazioni', json={
+            'conto_id': conto_id, 'tipo': 'uscita', 'categoria': 'Benchmark', 'importo': -1.0
+        }))
+
+    async def crea_investimento(c, i):
+        return await _id_creato(await c.post('/api/investimenti', json={
+            'conto_id': conto_id, 'nome': f'Bench {i}', 'tipo': 'ETF',
+            'importo_iniziale': 0.01, 'valore_attuale': 0.01
+        }))
+
+    async def crea_obiettivo(c, i):
+        return await _id_creato(await c.post('/api/obiettivi', json={
+            'titolo': f'Bench {i}', 'importo_target': 1000.0
+        }))
+
+    async def crea_ricorrenza(c, i):
+        return await _id_creato(await c.post('/api/ricorrenze', json=ricorrenza(i)))
+
+    async def crea_budget(c, i):
+        return await _id_creato(await c.post('/api/budget', json={
+            'nome': f'Bench {i}', 'categoria': 'Benchmark', 'limite': 100.0
+        }))
+
+    async def crea_regola(c, i):
+        return await _id_creato(await c.post('/api/regole', json=regola(i)))
+
+    def ricorrenza(i):
+        # Prima occorrenza nel futuro: la creazione non genera transazioni
+        return {'conto_id': conto_id, 'tipo': 'uscita', 'categoria': 'Benchmark', 'importo': -1.0,
+                'descrizione': f'Bench {i}', 'frequenza': 'mensile', 'data_inizio': '2099-01-01'}
+
+    def regola(i):
+        return {'tipo': 'testo', 'categoria': 'Benchmark', 'modello': f'bench-{i}', 'priorita': -1}
+
+    def righe_prova():
+        return [{'descrizione': f'Spesa #{n}', 'importo': -12.5} for n in range(RIGHE_IMPORT)]
+
+    def righe_import(i):
+        return [
+            {'conto_id': conto_id, 'importo': -1.5, 'categoria': 'Benchmark',
+             'data': f'{mese}-15T12:00:00', 'riferimento_esterno': f'bench-{i}-{n}'}
+            for n in range(RIGHE_IMPORT)
+        ]
+
+    def csv_import(i):
+        righe = ['data,importo,descrizione,riferimento_esterno']
+        righe += [f'{mese}-15,-2.50,Benchmark,bench-csv-{i}-{n}' for n in range(RIGHE_IMPORT)]
+        return '\n'.join(righe)
+
+    return [
+        ('GET /api/dashboard', lambda c, i, p: c.get('/api/dashboard'), None),
+        ('GET /api/bootstrap', lambda c, i, p: c.get('/api/bootstrap'), None),
+        ('GET /api/bootstrap (dashboard del frontend)', lambda c, i, p: c.get('/api/bootstrap', params={
+            'sezioni': 'conti,transazioni,investimenti,obiettivi',
+            'campi': 'transazioni.tipo,transazioni.categoria,transazioni.importo,transazioni.descrizione,transazioni.data'}), None),
+        ('GET /api/conti', lambda c, i, p: c.get('/api/conti'), None),
+        ('GET /api/conti/{id}', lambda c, i, p: c.get(f'/api/conti/{conto_id}'), None),
+        ('POST /api/conti', lambda c, i, p: c.post('/api/conti', json={'nome': f'Bench {i}', 'tipo': 'Conto Corrente'}), None),
+        ('DELETE /api/conti/{id}', lambda c, i, p: c.delete(f'/api/conti/{p}'), crea_conto_vuoto),
+        ('GET /api/conti/{id}/saldi', lambda c, i, p: c.get(f'/api/conti/{conto_id}/saldi'), None),
+        ('GET /api/conti/{id}/saldi (1 anno)',
+         lambda c, i, p: c.get(f'/api/conti/{conto_id}/saldi', params={
+             'data_da': f'{int(mese[:4]) - 1}{mese[4:]}-01', 'data_a': f'{mese}-28'}), None),
+        ('GET /api/transazioni', lambda c, i, p: c.get('/api/transazioni'), None),
+        ('GET /api/transazioni (pagina profonda)',
+         lambda c, i, p: c.get('/api/transazioni', params={'cursor': cursore_profondo}), None),
+        ('GET /api/transazioni (filtri)',
+         lambda c, i, p: c.get('/api/transazioni', params={'tipo': 'uscita', 'data_da': f'{mese}-01', 'importo_max': -100}), None),
+        ('GET /api/transazioni/search', lambda c, i, p: c.get('/api/transazioni/search', params={'q': 'spesa'}), None),
+        ('GET /api/transazioni/search (per data, pagina profonda)',
+         lambda c, i, p: c.get('/api/transazioni/search', params={
+             'q': 'spesa', 'ordine': 'data', 'cursor': cursore_profondo}), None),
+        ('GET /api/transazioni/search (selettiva, filtri)',
+         lambda c, i, p: c.get('/api/transazioni/search', params={
+             'q': 'viaggi 12', 'conto_id': conto_id, 'tipo': 'uscita'}), None),
+        ('GET /api/transazioni/conto/{id}', lambda c, i, p: c.get(f'/api/transazioni/conto/{conto_id}'), None),
+        ('GET /api/transazioni/export (1 mese, ndjson)',
+         lambda c, i, p: c.get('/api/transazioni/export', params={'data_da': f'{mese}-01', 'data_a': f'{mese}-28'}), None),
+        ('GET /api/transazioni/export (1 mese, csv gzip)',
+         lambda c, i, p: c.get('/api/transazioni/export', params={'formato': 'csv', 'gzip': 'true', 'data_da': f'{mese}-01', 'data_a': f'{mese}-28'}), None),
+        ('POST /api/transazioni', lambda c, i, p: c.post('/api/transazioni', json={
+            'conto_id': conto_id, 'tipo': 'uscita', 'categoria': 'Benchmark', 'importo': -1.0}), None),
+        (f'POST /api/transazioni/import ({RIGHE_IMPORT} righe)',
+         lambda c, i, p: c.post('/api/transazioni/import', json=righe_import(i)), None),
+        (f'POST /api/transazioni/import/file ({RIGHE_IMPORT} righe csv)',
+         lambda c, i, p: c.post('/api/transazioni/import/file', params={'formato': 'csv', 'conto_id': conto_id},
+                                content=csv_import(i)), None),
+        ('DELETE /api/transazioni/{id}', lambda c, i, p: c.delete(f'/api/transazioni/{p}'), crea_transazione),
+        ('GET /api/transazioni/stats', lambda c, i, p: c.get('/api/transazioni/stats'), None),
+        ('GET /api/transazioni/chart', lambda c, i, p: c.get('/api/transazioni/chart'), None),
+        ('GET /api/analytics', lambda c, i, p: c.get('/api/analytics'), None),
+        ('GET /api/analytics (giorno, 1 anno, categoria)',
+         lambda c, i, p: c.get('/api/analytics', params={
+             'periodo': 'giorno', 'data_a': f'{mese}-28', 'data_da': f'{int(mese[:4]) - 1}{mese[4:]}-28',
+             'categoria': 'Cibo'}), None),
+        ('GET /api/investimenti', lambda c, i, p: c.get('/api/investimenti'), None),
+        ('POST /api/investimenti', lambda c, i, p: c.post('/api/investimenti', json={
+            'conto_id': conto_id, 'nome': f'Bench {i}', 'tipo': 'ETF',
+            'importo_iniziale': 0.01, 'valore_attuale': 0.01}), None),
+        ('DELETE /api/investimenti/{id}', lambda c, i, p: c.delete(f'/api/investimenti/{p}'), crea_investimento),
+        ('GET /api/investimenti/performance', lambda c, i, p: c.get('/api/investimenti/performance'), None),
+        ('GET /api/investimenti/performance/serie', lambda c, i, p: c.get('/api/investimenti/performance/serie'), None),
+        ('GET /api/investimenti/performance/serie (mese)',
+         lambda c, i, p: c.get('/api/investimenti/performance/serie', params={'periodo': 'mese'}), None),
+        ('GET /api/obiettivi', lambda c, i, p: c.get('/api/obiettivi'), None),
+        ('POST /api/obiettivi', lambda c, i, p: c.post('/api/obiettivi', json={
+            'titolo': f'Bench {i}', 'importo_target': 1000.0}), None),
+        ('PUT /api/obiettivi/{id}', lambda c, i, p: c.put(f'/api/obiettivi/{p}', json={'importo_attuale': 10.0 + i}),
+         crea_obiettivo),
+        ('DELETE /api/obiettivi/{id}', lambda c, i, p: c.delete(f'/api/obiettivi/{p}'), crea_obiettivo),
+        ('GET /api/obiettivi/previsioni', lambda c, i, p: c.get('/api/obiettivi/previsioni'), None),
+        ('GET /api/obiettivi/{id}/previsione', lambda c, i, p: c.get(f'/api/obiettivi/{p}/previsione'), crea_obiettivo),
+        ('GET /api/ricorrenze', lambda c, i, p: c.get('/api/ricorrenze'), None),
+        ('POST /api/ricorrenze', lambda c, i, p: c.post('/api/ricorrenze', json=ricorrenza(i)), None),
+        ('DELETE /api/ricorrenze/{id}', lambda c, i, p: c.delete(f'/api/ricorrenze/{p}'), crea_ricorrenza),
+        ('GET /api/budget', lambda c, i, p: c.get('/api/budget'), None),
+        ('GET /api/budget/{id}', lambda c, i, p: c.get(f'/api/budget/{p}'), crea_budget),
+        ('GET /api/budget/avvisi', lambda c, i, p: c.get('/api/budget/avvisi'), None),
+        ('POST /api/budget', lambda c, i, p: c.post('/api/budget', json={
+            'nome': f'Bench {i}', 'categoria': 'Spesa', 'limite': 500.0}), None),
+        ('PUT /api/budget/{id}', lambda c, i, p: c.put(f'/api/budget/{p}', json={'limite': 50.0 + i}), crea_budget),
+        ('DELETE /api/budget/{id}', lambda c, i, p: c.delete(f'/api/budget/{p}'), crea_budget),
+        ('GET /api/regole', lambda c, i, p: c.get('/api/regole'), None),
+        ('POST /api/regole', lambda c, i, p: c.post('/api/regole', json=regola(i)), None),
+        ('PUT /api/regole/{id}', lambda c, i, p: c.put(f'/api/regole/{p}', json=regola(i)), crea_regola),
+        ('DELETE /api/regole/{id}', lambda c, i, p: c.delete(f'/api/regole/{p}'), crea_regola),
+        (f'POST /api/regole/prova ({RIGHE_IMPORT} righe)',
+         lambda c, i, p: c.post('/api/regole/prova', json={'transazioni': righe_prova()}), None),
+        ('GET /api/sistema/pool', lambda c, i, p: c.get('/api/sistema/pool'), None),
+        ('GET /api/sistema/cache', lambda c, i, p: c.get('/api/sistema/cache'), None),
+    ]
+
+
+def _contesto(percorso):
+    """Valori presi dal database per rendere realistici i parametri dei casi"""
+    conn = sqlite3.connect(percorso)
+    try:
+        conto_id, = conn.execute('SELECT conto_id FROM transazioni GROUP BY conto_id ORDER BY COUNT(*) DESC LIMIT 1').fetchone()
+        totale, = conn.execute('SELECT COUNT(*) FROM transazioni').fetchone()
+        data, id_ = conn.execute(
+            'SELECT data, id FROM transazioni ORDER BY data DESC, id DESC LIMIT 1 OFFSET ?', (totale // 2,)
+        ).fetchone()
+        mese, = conn.execute("SELECT substr(MAX(data), 1, 7) FROM transazioni").fetchone()
+    finally:
+        conn.close()
+    return {'conto_id': conto_id, 'posizione_profonda': (data, id_), 'mese': mese}
+
+
+async def esegui_casi(app_modulo, casi, iterazioni, riscaldamento, filtro):
+    risultati = {}
+    transport = httpx.ASGITransport(app=app_modulo.app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+        for nome, esegui, prepara in casi:
+            if filtro and filtro not in nome:
+                continue
+
+            latenze = []
+            errori = 0
+            for i in range(riscaldamento + iterazioni):
+                preparato = await prepara(client, i) if prepara else None
+                inizio = time.perf_counter()
+                risposta = await esegui(client, i, preparato)
+                # Il corpo fa parte della risposta: per gli export va letto tutto
+                await risposta.aread()
+                durata = time.perf_counter() - inizio
+                if risposta.status_code >= 400:
+                    errori += 1
+                if i >= riscaldamento:
+                    latenze.append(durata)
+
+            risultati[nome] = {**comune.statistiche_latenze(latenze), 'errori': errori}
+            r = risultati[nome]
+            print(f"{nome:<55} p50 {r['p50_ms']:9.3f} ms  p95 {r['p95_ms']:9.3f} ms  "
+                  f"p99 {r['p99_ms']:9.3f} ms  errori {errori}")
+    return risultati
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Micro-benchmark in-process degli endpoint')
+    parser.add_argument('database', help='Database creato con popola.py (non viene modificato)')
+    parser.add_argument('--iterazioni', type=int, default=200)
+    parser.add_argument('--riscaldamento', type=int, default=10)
+    parser.add_argument('--senza-cache', action='store_true', help='Disattiva la cache delle risposte')
+    parser.add_argument('--solo', help='Esegue solo i casi il cui nome contiene questo testo')
+    parser.add_argument('--output', default='-', help="File JSON dei risultati ('-' = stdout)")
+    args = parser.parse_args(argv)
+
+    cartella = tempfile.mkdtemp(prefix='finance-bench-')
+    try:
+        copia = os.path.join(cartella, 'finance.db')
+        _copia_database(args.database, copia)
+        contesto = _contesto(copia)
+
+        # app.py legge il percorso del database all'import: va impostato prima.
+        # ASGITransport non esegue gli eventi di avvio, lo schema si prepara qui
+        os.environ['FINANCE_DB'] = copia
+        import app as app_modulo
+        app_modulo.db.init_db()
+
+        if args.senza_cache:
+            app_modulo.cache.ttl = 0
+        contesto['cursore_profondo'] = app_modulo.codifica_cursore(*contesto['posizione_profonda'])
+
+        try:
+            risultati = asyncio.run(esegui_casi(
+                app_modulo, crea_casi(contesto), args.iterazioni, args.riscaldamento, args.solo
+            ))
+        finally:
+            app_modulo.db.close()
+    finally:
+        shutil.rmtree(cartella, ignore_errors=True)
+
+    parametri = {k: v for k, v in vars(args).items() if k != 'output'}
+    comune.scrivi_risultati({**comune.intestazione('endpoint', parametri), 'casi': risultati}, args.output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,153 @@
+"""
+Benchmark della diffusione degli eventi (GET /api/eventi) a molti client.
+
+Apre --client connessioni Server-Sent Events verso un server avviato su
+una copia del database, poi crea --scritture transazioni una alla volta
+con POST /api/transazioni. Per ogni evento misura il ritardo tra l'invio
+della POST e l'arrivo dell'evento a ciascun client, e alla fine verifica
+che ogni client abbia ricevuto tutti gli eventi. Riporta anche memoria e
+CPU del processo server con i client collegati.
+
+Client e server girano sulla stessa macchina: su pochi core il ritardo
+comprende anche il tempo in cui i client leggono i propri socket.
+
+Uso (dalla radice del progetto):
+    python benchmarks/eventi.py --database bench.db --client 1000
+    python benchmarks/eventi.py --database bench.db --client 100 1000 3000 --output eventi.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import httpx
+
+import comune
+from carico import _porta_libera, avvia_server
+from endpoint import _copia_database
+
+
+def memoria_processo(pid):
+    """Memoria residente del processo in MB (None fuori da Linux)"""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for riga in f:
+                if riga.startswith('VmRSS:'):
+                    return round(int(riga.split()[1]) / 1024, 1)
+    except OSError:
+        return None
+
+
+def cpu_processo(pid):
+    """Secondi di CPU (utente più sistema) usati finora dal processo (None fuori da Linux)"""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            campi = f.read().rsplit(')', 1)[1].split()
+        return (int(campi[11]) + int(campi[12])) / os.sysconf('SC_CLK_TCK')
+    except OSError:
+        return None
+
+
+async def ascolta(client, url, ricevuti, attesi, pronti):
+    """Legge il flusso e annota, per ogni transazione creata, quando è arrivato l'evento"""
+    async with client.stream('GET', url + '/api/eventi') as risposta:
+        pronti.release()
+        tipo = None
+        async for riga in risposta.aiter_lines():
+            if riga.startswith('event: '):
+                tipo = riga[7:]
+            elif riga.startswith('data: ') and tipo == 'transazione_creata':
+                ricevuti.append((json.loads(riga[6:])['transazione']['id'], time.perf_counter()))
+                if len(ricevuti) == attesi:
+                    return
+
+
+async def esegui(url, pid, numero_client, scritture, pausa):
+    limiti = httpx.Limits(max_connections=numero_client + 1, max_keepalive_connections=numero_client + 1)
+    async with httpx.AsyncClient(timeout=None, limits=limiti) as client:
+        conto_id = (await client.get(url + '/api/conti')).json()[0]['id']
+
+        pronti = asyncio.Semaphore(0)
+        ricevuti = [[] for _ in range(numero_client)]
+        ascoltatori = [
+            asyncio.create_task(ascolta(client, url, ricevuti[i], scritture, pronti))
+            for i in range(numero_client)
+        ]
+        for _ in range(numero_client):
+            await pronti.acquire()
+        # La risposta arriva prima che il server registri l'abbonamento: si aspetta che ci siano tutti
+        while (await client.get(url + '/api/sistema/eventi')).json()['abbonati'] < numero_client:
+            await asyncio.sleep(0.05)
+
+        inviate = {}
+        corpo = {'conto_id': conto_id, 'tipo': 'uscita', 'categoria': 'Benchmark', 'importo': -1.0}
+        inizio = time.perf_counter()
+        cpu_iniziale = cpu_processo(pid)
+        for _ in range(scritture):
+            partenza = time.perf_counter()
+            risposta = await client.post(url + '/api/transazioni', json=corpo)
+            inviate[risposta.json()['id']] = partenza
+            await asyncio.sleep(pausa)
+
+        try:
+            await asyncio.wait_for(asyncio.gather(*ascoltatori), timeout=60)
+        except asyncio.TimeoutError:
+            for ascoltatore in ascoltatori:
+                ascoltatore.cancel()
+        durata = time.perf_counter() - inizio
+        memoria = memoria_processo(pid)
+        cpu = cpu_processo(pid)
+
+    ritardi = [arrivo - inviate[id] for eventi in ricevuti for id, arrivo in eventi if id in inviate]
+    return {
+        **comune.statistiche_latenze(ritardi),
+        'eventi_consegnati_al_secondo': round(len(ritardi) / durata, 1),
+        'client_completi': sum(len(eventi) == scritture for eventi in ricevuti),
+        'memoria_server_mb': memoria,
+        # CPU del server per evento: scrittura, pubblicazione e invio a tutti i client
+        'cpu_server_ms_per_evento': round((cpu - cpu_iniziale) / scritture * 1000, 2) if cpu is not None else None,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark del flusso di eventi con molti client')
+    parser.add_argument('--database', required=True, help='Database di partenza (viene copiato)')
+    parser.add_argument('--client', type=int, nargs='+', default=[100, 1000], help='Client collegati da provare')
+    parser.add_argument('--scritture', type=int, default=50, help='Transazioni create per configurazione')
+    parser.add_argument('--pausa', type=float, default=0.02, help='Secondi tra una scrittura e la successiva')
+    parser.add_argument('--output', default='-', help="File JSON dei risultati ('-' = stdout)")
+    args = parser.parse_args(argv)
+
+    risultati = {}
+    cartella = tempfile.mkdtemp(prefix='finance-eventi-')
+    try:
+        for numero_client in args.client:
+            copia = os.path.join(cartella, f'finance-{numero_client}.db')
+            _copia_database(args.database, copia)
+            processo, url = avvia_server(copia, _porta_libera())
+            try:
+                memoria_iniziale = memoria_processo(processo.pid)
+                r = asyncio.run(esegui(url, processo.pid, numero_client, args.scritture, args.pausa))
+                r['memoria_server_iniziale_mb'] = memoria_iniziale
+            finally:
+                processo.terminate()
+                processo.wait()
+            nome = f'{numero_client} client'
+            risultati[nome] = r
+            print(f"{nome:>12}: p50 {r['p50_ms']:7.2f} ms  p99 {r['p99_ms']:7.2f} ms  "
+                  f"{r['eventi_consegnati_al_secondo']:9.1f} eventi/s  server {r['cpu_server_ms_per_evento']} ms CPU/evento  "
+                  f"completi {r['client_completi']}/{numero_client}", file=sys.stderr)
+    finally:
+        shutil.rmtree(cartella, ignore_errors=True)
+
+    parametri = {k: v for k, v in vars(args).items() if k != 'output'}
+    comune.scrivi_risultati({**comune.intestazione('eventi', parametri), 'casi': risultati}, args.output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
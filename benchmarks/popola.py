@@ -0,0 +1,169 @@
+"""
+Crea un database sintetico per i benchmark, alla scala richiesta.
+
+Parte dai dati di esempio di Database._insert_sample_rows e aggiunge conti,
+transazioni, investimenti e obiettivi generati in modo deterministico (a parità
+di --seed il file è identico). I saldi dei conti sono riallineati alla somma
+delle loro transazioni, così i totali della dashboard restano coerenti.
+
+Uso (dalla radice del progetto):
+    python benchmarks/popola.py bench.db --transazioni 1000000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+import comune  # noqa: F401 (aggiunge backend/ al percorso di import)
+from database import Database
+
+CATEGORIE_USCITA = ('Spesa', 'Trasporti', 'Ristoranti', 'Bollette', 'Shopping',
+                    'Salute', 'Svago', 'Casa', 'Viaggi', 'Abbonamenti')
+CATEGORIE_ENTRATA = ('Stipendio', 'Rimborso', 'Regalo', 'Interessi')
+TIPI_CONTO = ('Conto Corrente', 'Conto Risparmio', 'Carta Prepagata', 'Conto Deposito')
+TIPI_INVESTIMENTO = ('Azioni', 'ETF', 'Obbligazioni', 'Fondo', 'Crypto')
+
+# Righe inserite per ogni executemany/commit
+DIMENSIONE_LOTTO = 50000
+
+
+def _centesimi(euro):
+    return int(round(euro * 100))
+
+
+def _transazioni(rng, n, conti_ids, inizio, giorni):
+    # Importi in centesimi interi, come nel database
+    for i in range(n):
+        # Circa un movimento su sei è un'entrata
+        if rng.random() < 0.16:
+            tipo = 'entrata'
+            categoria = rng.choice(CATEGORIE_ENTRATA)
+            importo = _centesimi(rng.uniform(50, 3000))
+        else:
+            tipo = 'uscita'
+            categoria = rng.choice(CATEGORIE_USCITA)
+            importo = -_centesimi(rng.expovariate(1 / 60))
+        data = inizio + timedelta(days=rng.random() * giorni)
+        yield (rng.choice(conti_ids), tipo, categoria, importo,
+               f'{categoria} #{i}', data.strftime('%Y-%m-%d %H:%M:%S'))
+
+
+def popola(percorso, conti=20, transazioni=100000, investimenti=200, obiettivi=50,
+           giorni=730, seed=42):
+    """Crea (o completa) il database in 'percorso' e restituisce i conteggi finali"""
+    rng = random.Random(seed)
+    db = Database(percorso)
+    try:
+        with db.connection() as conn:
+            db._insert_sample_rows(conn)
+
+            conn.executemany(
+                'INSERT INTO conti (nome, tipo, saldo) VALUES (?, ?, 0)',
+                [(f'Conto {i}', rng.choice(TIPI_CONTO)) for i in range(1, conti + 1)]
+            )
+            # I movimenti sintetici vanno solo sui conti generati, non su quelli di esempio
+            conti_ids = [row[0] for row in conn.execute('SELECT id FROM conti ORDER BY id DESC LIMIT ?', (conti,))]
+            conn.commit()
+
+            inizio = datetime.now() - timedelta(days=giorni)
+            generatore = _transazioni(rng, transazioni, conti_ids, inizio, giorni)
+            while True:
+                lotto = [riga for _, riga in zip(range(DIMENSIONE_LOTTO), generatore)]
+                if not lotto:
+                    break
+                conn.executemany(
+                    'INSERT INTO transazioni (conto_id, tipo, categoria, importo, descrizione, data) '
+                    'VALUES (?, ?, ?, ?, ?, ?)',
+                    lotto
+                )
+                conn.commit()
+
+            righe_investimenti = []
+            for i in range(investimenti):
+                iniziale = _centesimi(rng.uniform(500, 50000))
+                attuale = int(iniziale * rng.uniform(0.7, 1.6))
+                data = inizio + timedelta(days=rng.random() * giorni)
+                righe_investimenti.append((
+                    rng.choice(conti_ids), f'Investimento {i}', rng.choice(TIPI_INVESTIMENTO),
+                    iniziale, attuale, attuale - iniziale, data.strftime('%Y-%m-%d %H:%M:%S')
+                ))
+            conn.executemany(
+                'INSERT INTO investimenti (conto_id, nome, tipo, importo_iniziale, valore_attuale, rendimento, data_inizio) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                righe_investimenti
+            )
+
+            righe_obiettivi = []
+            for i in range(obiettivi):
+                target = _centesimi(rng.uniform(500, 20000))
+                attuale = int(target * rng.uniform(0, 1.1))
+                righe_obiettivi.append((f'Obiettivo {i}', f'Obiettivo sintetico {i}',
+                                        target, attuale, int(attuale >= target)))
+            conn.executemany(
+                'INSERT INTO obiettivi (titolo, descrizione, importo_target, importo_attuale, completato) '
+                'VALUES (?, ?, ?, ?, ?)',
+                righe_obiettivi
+            )
+
+            # Un versamento iniziale per conto evita saldi negativi (le uscite
+            # generate superano le entrate) e lascia fondi per gli investimenti
+            conn.execute('''
+                INSERT INTO transazioni (conto_id, tipo, categoria, importo, descrizione, data)
+                SELECT c.id, 'entrata', 'Saldo iniziale',
+                       MAX(0, -COALESCE(SUM(t.importo), 0)) + 1000000, 'Saldo iniziale', ?
+                FROM conti c LEFT JOIN transazioni t ON t.conto_id = c.id
+                WHERE c.id IN (SELECT id FROM conti ORDER BY id DESC LIMIT ?)
+                GROUP BY c.id
+            ''', (inizio.strftime('%Y-%m-%d %H:%M:%S'), conti))
+
+            # Il saldo di ogni conto generato è la somma dei suoi movimenti
+            conn.execute('''
+                UPDATE conti SET saldo = (
+                    SELECT COALESCE(SUM(importo), 0) FROM transazioni t WHERE t.conto_id = conti.id
+                )
+                WHERE id IN (SELECT id FROM conti ORDER BY id DESC LIMIT ?)
+            ''', (conti,))
+            conn.commit()
+
+            conn.execute('PRAGMA optimize')
+            return {
+                tabella: conn.execute(f'SELECT COUNT(*) FROM {tabella}').fetchone()[0]
+                for tabella in ('conti', 'transazioni', 'investimenti', 'obiettivi')
+            }
+    finally:
+        db.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Crea un database sintetico per i benchmark')
+    parser.add_argument('percorso', help='File SQLite da creare')
+    parser.add_argument('--conti', type=int, default=20)
+    parser.add_argument('--transazioni', type=int, default=100000)
+    parser.add_argument('--investimenti', type=int, default=200)
+    parser.add_argument('--obiettivi', type=int, default=50)
+    parser.add_argument('--giorni', type=int, default=730, help='Ampiezza dello storico in giorni')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--sovrascrivi', action='store_true', help='Elimina il file se esiste già')
+    args = parser.parse_args(argv)
+
+    if os.path.exists(args.percorso):
+        if not args.sovrascrivi:
+            parser.error(f'{args.percorso} esiste già (usa --sovrascrivi)')
+        for suffisso in ('', '-wal', '-shm'):
+            if os.path.exists(args.percorso + suffisso):
+                os.remove(args.percorso + suffisso)
+
+    inizio = time.perf_counter()
+    conteggi = popola(args.percorso, args.conti, args.transazioni, args.investimenti,
+                      args.obiettivi, args.giorni, args.seed)
+    durata = time.perf_counter() - inizio
+
+    print(f'{args.percorso} creato in {durata:.1f}s: ' +
+          ', '.join(f'{n} {tabella}' for tabella, n in conteggi.items()))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
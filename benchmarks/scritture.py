@@ -0,0 +1,110 @@
+"""
+Benchmark del percorso di scrittura (coda di scrittura con commit di gruppo).
+
+Esegue --scritture movimenti sullo stesso conto tramite Database.scrivi, con
+le stesse istruzioni di POST /api/transazioni (INSERT più UPDATE del saldo,
+trigger compresi), da un numero crescente di chiamanti concorrenti. Ogni
+configurazione viene misurata con il commit di gruppo disattivato
+(--gruppo 1, un COMMIT per scrittura) e attivo, su una copia del database.
+Alla fine verifica che il saldo del conto corrisponda alle scritture fatte.
+
+Uso (dalla radice del progetto):
+    python benchmarks/scritture.py --database bench.db
+    python benchmarks/scritture.py --database bench.db --concorrenza 1 8 64 --output scritture.json
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import comune
+from endpoint import _copia_database
+
+from database import Database
+
+
+def crea_movimento(conn, conto_id, importo):
+    """Le istruzioni di POST /api/transazioni"""
+    cursor = conn.execute('''
+        INSERT INTO transazioni (conto_id, tipo, categoria, importo, descrizione, data)
+        VALUES (?, 'uscita', 'Benchmark', ?, '', datetime('now'))
+    ''', (conto_id, importo))
+    conn.execute('UPDATE conti SET saldo = saldo + ? WHERE id = ?', (importo, conto_id))
+    return cursor.lastrowid
+
+
+async def esegui_scritture(db, conto_id, scritture, concorrenza):
+    latenze = []
+    da_fare = iter(range(scritture))
+
+    async def chiamante():
+        for _ in da_fare:
+            inizio = time.perf_counter()
+            await db.scrivi(crea_movimento, conto_id, -1)
+            latenze.append(time.perf_counter() - inizio)
+
+    inizio = time.perf_counter()
+    await asyncio.gather(*(chiamante() for _ in range(concorrenza)))
+    return latenze, time.perf_counter() - inizio
+
+
+def misura(percorso, scritture, concorrenza, max_gruppo):
+    db = Database(percorso, max_gruppo_scrittura=max_gruppo)
+    try:
+        with db.connection() as conn:
+            conto_id, saldo_prima = conn.execute('SELECT id, saldo FROM conti ORDER BY id LIMIT 1').fetchone()
+
+        latenze, durata = asyncio.run(esegui_scritture(db, conto_id, scritture, concorrenza))
+        coda = db.code_stats()['scrittura']
+
+        with db.connection() as conn:
+            saldo_dopo, = conn.execute('SELECT saldo FROM conti WHERE id = ?', (conto_id,)).fetchone()
+        assert saldo_dopo == saldo_prima - scritture, 'saldo non coerente con le scritture eseguite'
+    finally:
+        db.close()
+
+    return {
+        **comune.statistiche_latenze(latenze, durata),
+        'commit': coda['gruppi'],
+        'scritture_per_commit': coda['scritture_per_gruppo'],
+        'ritentativi': coda['ritentativi'],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark della coda di scrittura')
+    parser.add_argument('--database', required=True, help='Database di partenza (viene copiato)')
+    parser.add_argument('--scritture', type=int, default=5000, help='Scritture per configurazione')
+    parser.add_argument('--concorrenza', type=int, nargs='+', default=[1, 8, 32, 128],
+                        help='Numero di chiamanti concorrenti da provare')
+    parser.add_argument('--gruppo', type=int, default=64, help='Scritture massime per commit di gruppo')
+    parser.add_argument('--output', default='-', help="File JSON dei risultati ('-' = stdout)")
+    args = parser.parse_args(argv)
+
+    risultati = {}
+    cartella = tempfile.mkdtemp(prefix='finance-scritture-')
+    try:
+        for concorrenza in args.concorrenza:
+            for max_gruppo in (1, args.gruppo):
+                # Ogni misura parte dallo stesso database, così le dimensioni coincidono
+                copia = os.path.join(cartella, f'finance-{concorrenza}-{max_gruppo}.db')
+                _copia_database(args.database, copia)
+                nome = f'concorrenza {concorrenza}, gruppo {max_gruppo}'
+                risultati[nome] = misura(copia, args.scritture, concorrenza, max_gruppo)
+                r = risultati[nome]
+                print(f"{nome:>28}: {r['richieste_al_secondo']:8.1f} scritture/s  "
+                      f"p50 {r['p50_ms']:7.3f} ms  p99 {r['p99_ms']:7.3f} ms  "
+                      f"{r['scritture_per_commit']:6.2f} scritture/commit", file=sys.stderr)
+    finally:
+        shutil.rmtree(cartella, ignore_errors=True)
+
+    parametri = {k: v for k, v in vars(args).items() if k != 'output'}
+    comune.scrivi_risultati({**comune.intestazione('scritture', parametri), 'casi': risultati}, args.output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,101 @@
+"""
+Micro-benchmark della serializzazione delle liste di transazioni.
+
+Confronta, su N righe lette da SQLite:
+  - prima: Row -> Transazione -> dict -> jsonable_encoder -> json.dumps
+    (il percorso di FastAPI quando l'endpoint restituisce una lista di dict)
+  - dopo:  Row -> dict -> JSON con serializza_righe (nessun oggetto del modello)
+
+Uso (dalla radice del progetto):
+    python benchmarks/serializzazione.py [--righe 100000] [--ripetizioni 5]
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+from fastapi.encoders import jsonable_encoder
+
+from models import Transazione, serializza_righe
+
+CATEGORIE = ('Spesa', 'Trasporti', 'Ristoranti', 'Bollette', 'Stipendio', 'Svago')
+
+
+def crea_righe(n):
+    """Crea n transazioni in un database in memoria e le rilegge come sqlite3.Row"""
+    conn = sqlite3.connect(':memory:')
+    conn.row_factory = sqlite3.Row
+    conn.execute('''
+        CREATE TABLE transazioni (
+            id INTEGER PRIMARY KEY, conto_id INTEGER, tipo TEXT, categoria TEXT,
+            importo INTEGER, descrizione TEXT, data TEXT
+        )
+    ''')
+    conn.executemany(
+        'INSERT INTO transazioni (conto_id, tipo, categoria, importo, descrizione, data) '
+        'VALUES (?, ?, ?, ?, ?, ?)',
+        (
+            (i % 5 + 1, 'uscita', CATEGORIE[i % len(CATEGORIE)], -(i % 997) * 113,
+             f'Movimento {i}', f'2024-{i % 12 + 1:02d}-{i % 28 + 1:02d}T12:00:00')
+            for i in range(n)
+        )
+    )
+    righe = conn.execute('SELECT * FROM transazioni').fetchall()
+    conn.close()
+    return righe
+
+
+def prima(righe):
+    dati = jsonable_encoder([Transazione.from_row(row).to_dict() for row in righe])
+    return json.dumps(dati, ensure_ascii=False, allow_nan=False, separators=(',', ':')).encode('utf-8')
+
+
+def dopo(righe):
+    return serializza_righe(righe, Transazione)
+
+
+def misura(funzione, righe, ripetizioni):
+    """Restituisce (tempo migliore in ms, picco di memoria allocata in KiB, byte prodotti)"""
+    tempi = []
+    for _ in range(ripetizioni):
+        inizio = time.perf_counter()
+        corpo = funzione(righe)
+        tempi.append(time.perf_counter() - inizio)
+
+    # Le allocazioni si misurano a parte: tracemalloc rallenta l'esecuzione
+    tracemalloc.start()
+    funzione(righe)
+    _, picco = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return min(tempi) * 1000, picco / 1024, len(corpo)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark della serializzazione dei modelli')
+    parser.add_argument('--righe', type=int, default=100000)
+    parser.add_argument('--ripetizioni', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    righe = crea_righe(args.righe)
+    # Le due strade devono produrre lo stesso JSON
+    assert json.loads(prima(righe[:100])) == json.loads(dopo(righe[:100]))
+
+    risultati = {}
+    for nome, funzione in (('prima', prima), ('dopo', dopo)):
+        tempo_ms, picco_kib, dimensione = misura(funzione, righe, args.ripetizioni)
+        risultati[nome] = tempo_ms
+        print(f'{nome:>6}: {tempo_ms:9.1f} ms  picco {picco_kib:10.0f} KiB  '
+              f'{dimensione / 1024:8.0f} KiB di JSON  ({args.righe} righe)')
+
+    print(f'speedup: {risultati["prima"] / risultati["dopo"]:.1f}x')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -7,17 +7,20 @@ let transazioniData = [];
 let investimentiData = [];
 let obiettiviData = [];
 
+// Previsione di completamento degli obiettivi, per id (GET /api/obiettivi/previsioni)
+let previsioniObiettivi = {};
+
+// Totali della dashboard calcolati dal server (bootstrap ed eventi)
+let dashboardData = null;
+
 // Traccia la pagina corrente per non perdere il contesto dopo operazioni nei modal
 let currentPage = 'dashboard';
 
-// Stato per l'animazione in tempo reale degli investimenti
-let investimentiAnimationData = {
-    totale: 0,
-    rendimento: 0,
-    intervalId: null
-};
+// Testo cercato nella pagina delle transazioni ('' = ultime transazioni)
+let ricercaTransazioni = '';
+let timerRicerca = null;
 
-// Dati storici per disegnare il grafico degli investimenti
+// Valori del totale investimenti ricevuti dal server, per il grafico
 let investimentiHistory = {
     values: [],
     maxPoints: 20,
@@ -72,7 +75,13 @@ function showPage(pageName) {
         }
     });
     
-    // Carica i dati specifici della pagina
+    caricaPagina(pageName);
+
+    localStorage.setItem('currentPage', pageName);
+}
+
+// Carica dal server i dati della pagina e la disegna
+function caricaPagina(pageName) {
     switch(pageName) {
         case 'dashboard':
             loadDashboard();
@@ -90,8 +99,27 @@ function showPage(pageName) {
             loadObiettivi();
             break;
     }
+}
 
-    localStorage.setItem('currentPage', pageName);
+// Ridisegna la pagina corrente con i dati già in memoria, senza richieste
+function displayPagina() {
+    switch(currentPage) {
+        case 'dashboard':
+            if (dashboardData) displayDashboard();
+            break;
+        case 'conti':
+            displayConti();
+            break;
+        case 'transazioni':
+            displayTransazioni();
+            break;
+        case 'investimenti':
+            displayInvestimenti();
+            break;
+        case 'obiettivi':
+            displayObiettivi();
+            break;
+    }
 }
 
 // Apre un modal specifico
@@ -144,76 +172,15 @@ function populateContiSelectInvestimento() {
 }
 
 // ========================================
-// ANIMAZIONE INVESTIMENTI
+// ANDAMENTO INVESTIMENTI
 // ========================================
 
-// Avvia l'animazione che simula variazioni in tempo reale degli investimenti
-function startInvestimentiAnimation(totaleIniziale, rendimentoIniziale) {
-    // Se non ci sono investimenti, non avviare l'animazione
-    if (totaleIniziale === 0 || totaleIniziale === null) {
-        console.log('Nessun investimento presente, animazione non avviata');
-        stopInvestimentiAnimation();
-        return;
-    }
-    
-    investimentiAnimationData.totale = totaleIniziale;
-    investimentiAnimationData.rendimento = rendimentoIniziale;
-    
-    // Pulisci eventuali animazioni precedenti
-    if (investimentiAnimationData.intervalId) {
-        clearInterval(investimentiAnimationData.intervalId);
-    }
-    
-    // Avvia l'animazione ogni 4 secondi
-    investimentiAnimationData.intervalId = setInterval(() => {
-        animateInvestimentiValue();
-    }, 4000);
-    
-    console.log('Animazione investimenti avviata');
-}
-
-// Ferma l'animazione degli investimenti
-function stopInvestimentiAnimation() {
-    if (investimentiAnimationData.intervalId) {
-        clearInterval(investimentiAnimationData.intervalId);
-        investimentiAnimationData.intervalId = null;
-    }
-}
-
-// Simula una variazione casuale del valore degli investimenti
-function animateInvestimentiValue() {
-    // Genera variazione casuale tra -2% e +2%
-    const variazione = (Math.random() - 0.5) * 0.04;
-    
-    const deltaRendimento = investimentiAnimationData.totale * variazione;
-    const nuovoRendimento = investimentiAnimationData.rendimento + deltaRendimento;
-    const nuovoTotale = investimentiAnimationData.totale + deltaRendimento;
-    
-    investimentiAnimationData.totale = nuovoTotale;
-    investimentiAnimationData.rendimento = nuovoRendimento;
-    
-    updateInvestimentiCard(nuovoTotale, deltaRendimento);
-}
-
-// Aggiorna la card degli investimenti con i nuovi valori animati
-function updateInvestimentiCard(nuovoTotale, deltaRendimento) {
+// Evidenzia la card degli investimenti quando il totale cambia e aggiunge il punto al grafico
+function evidenziaInvestimenti(nuovoTotale) {
     const totaleElement = document.getElementById('investimenti-totale');
-    const rendimentoElement = document.getElementById('investimenti-rendimento');
-    
-    if (!totaleElement || !rendimentoElement) return;
+    if (!totaleElement) return;
     
     totaleElement.style.transition = 'all 0.5s ease';
-    totaleElement.textContent = formatCurrency(nuovoTotale);
-    
-    const isPositivo = deltaRendimento >= 0;
-    const arrow = isPositivo ? '↑' : '↓';
-    const classe = isPositivo ? 'positive' : 'negative';
-    
-    rendimentoElement.className = `card-change ${classe}`;
-    rendimentoElement.innerHTML = `
-        <span class="arrow">${arrow}</span>
-        ${isPositivo ? '+' : ''}${formatCurrency(deltaRendimento)}
-    `;
     
     // Effetto pulsazione per attirare l'attenzione
     totaleElement.style.transform = 'scale(1.05)';
@@ -344,55 +311,52 @@ function drawInvestmentsChart() {
 // CARICAMENTO DASHBOARD
 // ========================================
 
+// Sezioni e campi richiesti a /bootstrap: delle transazioni servono solo
+// i campi usati da card, grafico e lista delle più recenti
+// (l'id serve per togliere quelle eliminate quando arriva l'evento)
+const BOOTSTRAP_DASHBOARD = new URLSearchParams({
+    sezioni: 'dashboard,conti,transazioni,investimenti,obiettivi',
+    campi: ['id', 'tipo', 'categoria', 'importo', 'descrizione', 'data'].map(campo => `transazioni.${campo}`).join(',')
+});
+
 async function loadDashboard() {
     try {
-        // Carica tutti i dati in parallelo
-        await Promise.all([
-            fetch(`${API_BASE}/conti`).then(r => r.json()).then(data => contiData = data),
-            fetch(`${API_BASE}/transazioni`).then(r => r.json()).then(data => transazioniData = data),
-            fetch(`${API_BASE}/investimenti`).then(r => r.json()).then(data => investimentiData = data),
-            fetch(`${API_BASE}/obiettivi`).then(r => r.json()).then(data => obiettiviData = data)
-        ]);
+        // Carica tutti i dati con una sola richiesta (una connessione, dati coerenti tra loro)
+        const response = await fetch(`${API_BASE}/bootstrap?${BOOTSTRAP_DASHBOARD}`);
+        const data = await response.json();
+        dashboardData = data.dashboard;
+        contiData = data.conti;
+        transazioniData = data.transazioni.transazioni;
+        investimentiData = data.investimenti;
+        obiettiviData = data.obiettivi;
         
-        updateDashboardStats();
-        displayContiList();
-        displayRecentTransactions();
-        drawFinancialChart();
-        displayCategoryExpenses();
+        displayDashboard();
         
-        // Avvia l'animazione degli investimenti
-        const totaleInvestimenti = investimentiData.reduce((sum, inv) => sum + inv.valore_attuale, 0);
-        const totaleIniziale = investimentiData.reduce((sum, inv) => sum + inv.importo_iniziale, 0);
-        const rendimento = totaleInvestimenti - totaleIniziale;
-        startInvestimentiAnimation(totaleInvestimenti, rendimento);
+        // Primo punto del grafico degli investimenti; i successivi arrivano con gli eventi
+        if (investimentiHistory.values.length === 0) {
+            addInvestmentDataPoint(dashboardData.investimenti.totale);
+        }
         
     } catch (error) {
         console.error('Errore caricamento dashboard:', error);
     }
 }
 
-// Aggiorna le statistiche mostrate nelle card principali
+// Disegna tutta la dashboard con i dati già caricati
+function displayDashboard() {
+    updateDashboardStats();
+    displayContiList();
+    displayRecentTransactions();
+    drawFinancialChart();
+    displayCategoryExpenses();
+}
+
+// Aggiorna le card principali con i totali calcolati dal server
 function updateDashboardStats() {
-    // Calcola saldo totale
-    const saldoTotale = contiData.reduce((sum, conto) => sum + conto.saldo, 0);
-    document.getElementById('saldo-totale').textContent = formatCurrency(saldoTotale);
-    
-    // Calcola variazione mensile (differenza tra entrate e uscite del mese)
-    const now = new Date();
-    const meseCorrente = now.getMonth();
-    const annoCorrente = now.getFullYear();
+    document.getElementById('saldo-totale').textContent = formatCurrency(dashboardData.saldo_totale);
     
-    const transazioniMese = transazioniData.filter(t => {
-        const data = new Date(t.data);
-        return data.getMonth() === meseCorrente && data.getFullYear() === annoCorrente;
-    });
-    
-    const entrate = transazioniMese.filter(t => t.tipo === 'entrata')
-        .reduce((sum, t) => sum + t.importo, 0);
-    const uscite = transazioniMese.filter(t => t.tipo === 'uscita')
-        .reduce((sum, t) => sum + Math.abs(t.importo), 0);
-    
-    const variazione = entrate - uscite;
+    // Variazione mensile (differenza tra entrate e uscite del mese)
+    const variazione = dashboardData.variazione_mensile;
     const variazioneElement = document.getElementById('variazione-mensile');
     
     if (variazione >= 0) {
@@ -403,13 +367,10 @@ function updateDashboardStats() {
         variazioneElement.innerHTML = `<span class="arrow">↓</span> ${formatCurrency(variazione)}`;
     }
     
-    // Calcola totale investimenti
-    const totaleInvestimenti = investimentiData.reduce((sum, inv) => sum + inv.valore_attuale, 0);
-    document.getElementById('investimenti-totale').textContent = formatCurrency(totaleInvestimenti);
-    
-    const totaleIniziale = investimentiData.reduce((sum, inv) => sum + inv.importo_iniziale, 0);
-    const rendimento = totaleInvestimenti - totaleIniziale;
+    // Totale e rendimento degli investimenti
+    document.getElementById('investimenti-totale').textContent = formatCurrency(dashboardData.investimenti.totale);
     
+    const rendimento = dashboardData.investimenti.rendimento;
     const rendimentoElement = document.getElementById('investimenti-rendimento');
     if (rendimento >= 0) {
         rendimentoElement.className = 'card-change positive';
@@ -420,14 +381,12 @@ function updateDashboardStats() {
     }
     
     // Spese mensili
-    document.getElementById('spese-mensili').textContent = formatCurrency(uscite);
+    document.getElementById('spese-mensili').textContent = formatCurrency(dashboardData.spese_mensili);
     
     // Obiettivi
-    const obiettiviAttivi = obiettiviData.filter(obj => !obj.completato);
-    const obiettiviCompletati = obiettiviData.filter(obj => obj.completato);
-    
-    document.getElementById('obiettivi-numero').textContent = obiettiviAttivi.length;
-    document.getElementById('obiettivi-completati').textContent = `${obiettiviCompletati.length} completati`;
+    const { totale, completati } = dashboardData.obiettivi;
+    document.getElementById('obiettivi-numero').textContent = totale - completati;
+    document.getElementById('obiettivi-completati').textContent = `${completati} completati`;
 }
 
 // Mostra la lista dei conti nella dashboard
@@ -658,43 +617,46 @@ async function loadConti() {
     try {
         const response = await fetch(`${API_BASE}/conti`);
         contiData = await response.json();
-        
-        const contiGrid = document.getElementById('conti-grid');
-        
-        if (contiData.length === 0) {
-            contiGrid.innerHTML = `
-                <div style="text-align: center; padding: 3rem; color: var(--text-secondary);">
-                    <div style="font-size: 3rem; margin-bottom: 1rem;">💳</div>
-                    <p>Nessun conto disponibile. Creane uno nuovo!</p>
-                </div>
-            `;
-            return;
-        }
-        
-        contiGrid.innerHTML = contiData.map(conto => `
-            <div class="list-item">
-                <div class="list-item-icon blue">💳</div>
-                <div class="list-item-content">
-                    <div class="list-item-title">${conto.nome}</div>
-                    <div class="list-item-subtitle">${conto.tipo}</div>
-                </div>
-                <div style="display: flex; align-items: center; gap: 1rem;">
-                    <div class="list-item-amount">${formatCurrency(conto.saldo)}</div>
-                    <button class="btn-delete" data-delete-conto="${conto.id}" title="Elimina conto">🗑️</button>
-                </div>
-            </div>
-        `).join('');
-        
-        // Aggiungi event listener ai pulsanti elimina
-        document.querySelectorAll('[data-delete-conto]').forEach(btn => {
-            btn.addEventListener('click', () => deleteConto(btn.dataset.deleteConto));
-        });
-        
+        displayConti();
     } catch (error) {
         console.error('Errore caricamento conti:', error);
     }
 }
 
+// Mostra la pagina dei conti con i dati già caricati
+function displayConti() {
+    const contiGrid = document.getElementById('conti-grid');
+    
+    if (contiData.length === 0) {
+        contiGrid.innerHTML = `
+            <div style="text-align: center; padding: 3rem; color: var(--text-secondary);">
+                <div style="font-size: 3rem; margin-bottom: 1rem;">💳</div>
+                <p>Nessun conto disponibile. Creane uno nuovo!</p>
+            </div>
+        `;
+        return;
+    }
+    
+    contiGrid.innerHTML = contiData.map(conto => `
+        <div class="list-item">
+            <div class="list-item-icon blue">💳</div>
+            <div class="list-item-content">
+                <div class="list-item-title">${conto.nome}</div>
+                <div class="list-item-subtitle">${conto.tipo}</div>
+            </div>
+            <div style="display: flex; align-items: center; gap: 1rem;">
+                <div class="list-item-amount">${formatCurrency(conto.saldo)}</div>
+                <button class="btn-delete" data-delete-conto="${conto.id}" title="Elimina conto">🗑️</button>
+            </div>
+        </div>
+    `).join('');
+    
+    // Aggiungi event listener ai pulsanti elimina
+    document.querySelectorAll('[data-delete-conto]').forEach(btn => {
+        btn.addEventListener('click', () => deleteConto(btn.dataset.deleteConto));
+    });
+}
+
 async function addConto(event) {
     event.preventDefault();
     const formData = new FormData(event.target);
@@ -716,12 +678,7 @@ async function addConto(event) {
             closeModal('modal-conto');
             event.target.reset();
             
-            // Aggiorna la pagina corrente
-            if (currentPage === 'conti') {
-                await loadConti();
-            } else if (currentPage === 'dashboard') {
-                await loadDashboard();
-            }
+            // I dati mostrati si aggiornano con l'evento inviato dal server (vedi applicaEvento)
             
             showNotification('Conto creato con successo!');
         }
@@ -742,12 +699,7 @@ async function deleteConto(id) {
         });
         
         if (response.ok) {
-            // Aggiorna la pagina corrente
-            if (currentPage === 'conti') {
-                await loadConti();
-            } else if (currentPage === 'dashboard') {
-                await loadDashboard();
-            }
+            // I dati mostrati si aggiornano con l'evento inviato dal server (vedi applicaEvento)
             
             showNotification('Conto eliminato con successo!');
         }
@@ -763,59 +715,76 @@ async function deleteConto(id) {
 
 async function loadTransazioni() {
     try {
-        const response = await fetch(`${API_BASE}/transazioni`);
-        transazioniData = await response.json();
+        // L'API restituisce una pagina alla volta: { transazioni, next_cursor }.
+        // La ricerca avviene sul server, su tutto lo storico
+        const url = ricercaTransazioni
+            ? `${API_BASE}/transazioni/search?ordine=data&q=${encodeURIComponent(ricercaTransazioni)}`
+            : `${API_BASE}/transazioni`;
+        const response = await fetch(url);
+        transazioniData = (await response.json()).transazioni;
+        displayTransazioni();
+    } catch (error) {
+        console.error('Errore caricamento transazioni:', error);
+    }
+}
+
+// Cerca mentre si scrive, dopo una breve pausa
+function cercaTransazioni(event) {
+    clearTimeout(timerRicerca);
+    timerRicerca = setTimeout(() => {
+        ricercaTransazioni = event.target.value.trim();
+        loadTransazioni();
+    }, 250);
+}
+
+// Mostra la pagina delle transazioni con i dati già caricati
+function displayTransazioni() {
+    const transazioniList = document.getElementById('transazioni-list');
+    
+    if (transazioniData.length === 0) {
+        transazioniList.innerHTML = `
+            <div style="text-align: center; padding: 3rem; color: var(--text-secondary);">
+                <div style="font-size: 3rem; margin-bottom: 1rem;">📝</div>
+                <p>${ricercaTransazioni ? 'Nessuna transazione trovata.' : 'Nessuna transazione registrata. Aggiungine una!'}</p>
+            </div>
+        `;
+        return;
+    }
+    
+    // Ordina per data decrescente
+    const sorted = [...transazioniData].sort((a, b) => new Date(b.data) - new Date(a.data));
+    
+    transazioniList.innerHTML = sorted.map(trans => {
+        const isPositive = trans.tipo === 'entrata';
+        const colorClass = isPositive ? 'positive' : 'negative';
+        const iconClass = isPositive ? 'green' : 'red';
+        const icon = isPositive ? '💰' : '💸';
         
-        const transazioniList = document.getElementById('transazioni-list');
+        // Trova il nome del conto
+        const conto = contiData.find(c => c.id === trans.conto_id);
+        const contoNome = conto ? conto.nome : 'Conto sconosciuto';
         
-        if (transazioniData.length === 0) {
-            transazioniList.innerHTML = `
-                <div style="text-align: center; padding: 3rem; color: var(--text-secondary);">
-                    <div style="font-size: 3rem; margin-bottom: 1rem;">📝</div>
-                    <p>Nessuna transazione registrata. Aggiungine una!</p>
+        return `
+            <div class="list-item">
+                <div class="list-item-icon ${iconClass}">${icon}</div>
+                <div class="list-item-content">
+                    <div class="list-item-title">${trans.descrizione || trans.categoria}</div>
+                    <div class="list-item-subtitle">${formatDate(trans.data)} • ${contoNome} • ${trans.categoria}</div>
                 </div>
-            `;
-            return;
-        }
-        
-        // Ordina per data decrescente
-        const sorted = [...transazioniData].sort((a, b) => new Date(b.data) - new Date(a.data));
-        
-        transazioniList.innerHTML = sorted.map(trans => {
-            const isPositive = trans.tipo === 'entrata';
-            const colorClass = isPositive ? 'positive' : 'negative';
-            const iconClass = isPositive ? 'green' : 'red';
-            const icon = isPositive ? '💰' : '💸';
-            
-            // Trova il nome del conto
-            const conto = contiData.find(c => c.id === trans.conto_id);
-            const contoNome = conto ? conto.nome : 'Conto sconosciuto';
-            
-            return `
-                <div class="list-item">
-                    <div class="list-item-icon ${iconClass}">${icon}</div>
-                    <div class="list-item-content">
-                        <div class="list-item-title">${trans.descrizione || trans.categoria}</div>
-                        <div class="list-item-subtitle">${formatDate(trans.data)} • ${contoNome} • ${trans.categoria}</div>
-                    </div>
-                    <div style="display: flex; align-items: center; gap: 1rem;">
-                        <div class="list-item-amount ${colorClass}">
-                            ${isPositive ? '+' : ''}${formatCurrency(trans.importo)}
-                        </div>
-                        <button class="btn-delete" data-delete-transazione="${trans.id}" title="Elimina transazione">🗑️</button>
+                <div style="display: flex; align-items: center; gap: 1rem;">
+                    <div class="list-item-amount ${colorClass}">
+                        ${isPositive ? '+' : ''}${formatCurrency(trans.importo)}
                     </div>
+                    <button class="btn-delete" data-delete-transazione="${trans.id}" title="Elimina transazione">🗑️</button>
                 </div>
-            `;
-        }).join('');
-        
-        // Aggiungi event listener ai pulsanti elimina
-        document.querySelectorAll('[data-delete-transazione]').forEach(btn => {
-            btn.addEventListener('click', () => deleteTransazione(btn.dataset.deleteTransazione));
-        });
-        
-    } catch (error) {
-        console.error('Errore caricamento transazioni:', error);
-    }
+            </div>
+        `;
+    }).join('');
+    
+    // Aggiungi event listener ai pulsanti elimina
+    document.querySelectorAll('[data-delete-transazione]').forEach(btn => {
+        btn.addEventListener('click', () => deleteTransazione(btn.dataset.deleteTransazione));
+    });
 }
 
 async function addTransazione(event) {
@@ -833,7 +802,8 @@ async function addTransazione(event) {
     const data = {
         conto_id: parseInt(formData.get('conto_id')),
         tipo: tipo,
-        categoria: formData.get('categoria'),
+        // Vuota: la categoria viene proposta dalle regole del server
+        categoria: formData.get('categoria') || null,
         importo: importo,
         descrizione: formData.get('descrizione'),
         data: new Date().toISOString().split('T')[0]
@@ -850,12 +820,7 @@ async function addTransazione(event) {
             closeModal('modal-transazione');
             event.target.reset();
             
-            // Aggiorna la pagina corrente
-            if (currentPage === 'transazioni') {
-                await loadTransazioni();
-            } else if (currentPage === 'dashboard') {
-                await loadDashboard();
-            }
+            // I dati mostrati si aggiornano con l'evento inviato dal server (vedi applicaEvento)
             
             showNotification('Transazione aggiunta con successo!');
         }
@@ -876,12 +841,7 @@ async function deleteTransazione(id) {
         });
         
         if (response.ok) {
-            // Aggiorna la pagina corrente
-            if (currentPage === 'transazioni') {
-                await loadTransazioni();
-            } else if (currentPage === 'dashboard') {
-                await loadDashboard();
-            }
+            // I dati mostrati si aggiornano con l'evento inviato dal server (vedi applicaEvento)
             
             showNotification('Transazione eliminata con successo!');
         }
@@ -899,57 +859,60 @@ async function loadInvestimenti() {
     try {
         const response = await fetch(`${API_BASE}/investimenti`);
         investimentiData = await response.json();
+        displayInvestimenti();
+    } catch (error) {
+        console.error('Errore caricamento investimenti:', error);
+    }
+}
+
+// Mostra la pagina degli investimenti con i dati già caricati
+function displayInvestimenti() {
+    const investimentiGrid = document.getElementById('investimenti-grid');
+    
+    if (investimentiData.length === 0) {
+        investimentiGrid.innerHTML = `
+            <div style="text-align: center; padding: 3rem; color: var(--text-secondary); grid-column: 1 / -1;">
+                <div style="font-size: 3rem; margin-bottom: 1rem;">📈</div>
+                <p>Nessun investimento registrato. Creane uno!</p>
+            </div>
+        `;
+        return;
+    }
+    
+    investimentiGrid.innerHTML = investimentiData.map(inv => {
+        const rendimento = inv.valore_attuale - inv.importo_iniziale;
+        const percentuale = ((rendimento / inv.importo_iniziale) * 100).toFixed(2);
+        const isPositivo = rendimento >= 0;
+        const colorClass = isPositivo ? 'positive' : 'negative';
         
-        const investimentiGrid = document.getElementById('investimenti-grid');
-        
-        if (investimentiData.length === 0) {
-            investimentiGrid.innerHTML = `
-                <div style="text-align: center; padding: 3rem; color: var(--text-secondary); grid-column: 1 / -1;">
-                    <div style="font-size: 3rem; margin-bottom: 1rem;">📈</div>
-                    <p>Nessun investimento registrato. Creane uno!</p>
+        return `
+            <div class="card" style="position: relative;">
+                <div class="card-header">
+                    <span>${inv.tipo}</span>
+                    <span class="card-icon">📊</span>
                 </div>
-            `;
-            return;
-        }
-        
-        investimentiGrid.innerHTML = investimentiData.map(inv => {
-            const rendimento = inv.valore_attuale - inv.importo_iniziale;
-            const percentuale = ((rendimento / inv.importo_iniziale) * 100).toFixed(2);
-            const isPositivo = rendimento >= 0;
-            const colorClass = isPositivo ? 'positive' : 'negative';
-            
-            return `
-                <div class="card" style="position: relative;">
-                    <div class="card-header">
-                        <span>${inv.tipo}</span>
-                        <span class="card-icon">📊</span>
-                    </div>
-                    <div class="card-amount" style="font-size: 1.5rem;">${inv.nome}</div>
-                    <div style="margin: 1rem 0;">
-                        <div style="font-size: 0.875rem; color: var(--text-secondary); margin-bottom: 0.25rem;">
-                            Valore attuale
-                        </div>
-                        <div style="font-size: 1.75rem; font-weight: 700;">
-                            ${formatCurrency(inv.valore_attuale)}
-                        </div>
+                <div class="card-amount" style="font-size: 1.5rem;">${inv.nome}</div>
+                <div style="margin: 1rem 0;">
+                    <div style="font-size: 0.875rem; color: var(--text-secondary); margin-bottom: 0.25rem;">
+                        Valore attuale
                     </div>
-                    <div class="card-change ${colorClass}">
-                        <span class="arrow">${isPositivo ? '↑' : '↓'}</span>
-                        ${isPositivo ? '+' : ''}${formatCurrency(rendimento)} (${percentuale}%)
+                    <div style="font-size: 1.75rem; font-weight: 700;">
+                        ${formatCurrency(inv.valore_attuale)}
                     </div>
-                    <button class="btn-delete-card" data-delete-investimento="${inv.id}" title="Elimina investimento">🗑️</button>
                 </div>
-            `;
-        }).join('');
-        
-        // Aggiungi event listener ai pulsanti elimina
-        document.querySelectorAll('[data-delete-investimento]').forEach(btn => {
-            btn.addEventListener('click', () => deleteInvestimento(btn.dataset.deleteInvestimento));
-        });
-        
-    } catch (error) {
-        console.error('Errore caricamento investimenti:', error);
-    }
+                <div class="card-change ${colorClass}">
+                    <span class="arrow">${isPositivo ? '↑' : '↓'}</span>
+                    ${isPositivo ? '+' : ''}${formatCurrency(rendimento)} (${percentuale}%)
+                </div>
+                <button class="btn-delete-card" data-delete-investimento="${inv.id}" title="Elimina investimento">🗑️</button>
+            </div>
+        `;
+    }).join('');
+    
+    // Aggiungi event listener ai pulsanti elimina
+    document.querySelectorAll('[data-delete-investimento]').forEach(btn => {
+        btn.addEventListener('click', () => deleteInvestimento(btn.dataset.deleteInvestimento));
+    });
 }
 
 async function addInvestimento(event) {
@@ -975,12 +938,7 @@ async function addInvestimento(event) {
             closeModal('modal-investimento');
             event.target.reset();
             
-            // Aggiorna la pagina corrente
-            if (currentPage === 'investimenti') {
-                await loadInvestimenti();
-            } else if (currentPage === 'dashboard') {
-                await loadDashboard();
-            }
+            // I dati mostrati si aggiornano con l'evento inviato dal server (vedi applicaEvento)
             
             showNotification('Investimento creato e fondi prelevati dal conto!');
         } else {
@@ -1004,12 +962,7 @@ async function deleteInvestimento(id) {
         });
         
         if (response.ok) {
-            // Aggiorna la pagina corrente
-            if (currentPage === 'investimenti') {
-                await loadInvestimenti();
-            } else if (currentPage === 'dashboard') {
-                await loadDashboard();
-            }
+            // I dati mostrati si aggiornano con l'evento inviato dal server (vedi applicaEvento)
             
             showNotification('Investimento eliminato con successo!');
         }
@@ -1025,69 +978,93 @@ async function deleteInvestimento(id) {
 
 async function loadObiettivi() {
     try {
-        const response = await fetch(`${API_BASE}/obiettivi`);
+        const [response, rispostaPrevisioni] = await Promise.all([
+            fetch(`${API_BASE}/obiettivi`),
+            fetch(`${API_BASE}/obiettivi/previsioni`)
+        ]);
         obiettiviData = await response.json();
-        
-        // Mostra solo gli obiettivi non completati
-        const obiettiviAttivi = obiettiviData.filter(obj => !obj.completato);
-        
-        const obiettiviList = document.getElementById('obiettivi-list');
-        
-        if (obiettiviAttivi.length === 0) {
-            obiettiviList.innerHTML = `
-                <div style="text-align: center; padding: 3rem; color: var(--text-secondary);">
-                    <div style="font-size: 3rem; margin-bottom: 1rem;">🎯</div>
-                    <p>Nessun obiettivo attivo. Creane uno nuovo!</p>
-                </div>
-            `;
-            return;
+        previsioniObiettivi = {};
+        if (rispostaPrevisioni.ok) {
+            (await rispostaPrevisioni.json()).forEach(p => { previsioniObiettivi[p.obiettivo_id] = p; });
         }
+        displayObiettivi();
+    } catch (error) {
+        console.error('Errore caricamento obiettivi:', error);
+    }
+}
+
+// Data prevista (mediana) e probabilità di arrivarci entro l'orizzonte della simulazione
+function testoPrevisione(obiettivoId) {
+    const previsione = previsioniObiettivi[obiettivoId];
+    if (!previsione) return '';
+    const probabilita = Math.round(previsione.probabilita * 100);
+    if (!previsione.completamento.p50) {
+        return `Completamento previsto: oltre 10 anni (${probabilita}%)`;
+    }
+    return `Completamento previsto: ${previsione.completamento.p50} (${probabilita}% entro 10 anni)`;
+}
+
+// Mostra la pagina degli obiettivi con i dati già caricati
+function displayObiettivi() {
+    // Mostra solo gli obiettivi non completati
+    const obiettiviAttivi = obiettiviData.filter(obj => !obj.completato);
+    
+    const obiettiviList = document.getElementById('obiettivi-list');
+    
+    if (obiettiviAttivi.length === 0) {
+        obiettiviList.innerHTML = `
+            <div style="text-align: center; padding: 3rem; color: var(--text-secondary);">
+                <div style="font-size: 3rem; margin-bottom: 1rem;">🎯</div>
+                <p>Nessun obiettivo attivo. Creane uno nuovo!</p>
+            </div>
+        `;
+        return;
+    }
+    
+    obiettiviList.innerHTML = obiettiviAttivi.map(obj => {
+        const completato = obj.completato ? 'completed' : '';
+        // Gli obiettivi collegati a un conto o a una categoria si aggiornano da soli
+        const collegato = obj.conto_id !== null || obj.categoria !== null;
         
-        obiettiviList.innerHTML = obiettiviAttivi.map(obj => {
-            const completato = obj.completato ? 'completed' : '';
-            
-            return `
-                <div class="list-item">
-                    <div style="flex: 1;">
-                        <div style="display: flex; align-items: center; margin-bottom: 0.5rem;">
-                            <div class="list-item-icon purple">🎯</div>
-                            <div class="list-item-content">
-                                <div class="list-item-title">${obj.titolo}</div>
-                                <div class="list-item-subtitle">${obj.descrizione || 'Nessuna descrizione'}</div>
-                            </div>
-                        </div>
-                        <div style="margin-left: 64px;">
-                            <div style="display: flex; justify-content: space-between; margin-bottom: 0.5rem; font-size: 0.875rem;">
-                                <span>${formatCurrency(obj.importo_attuale)} di ${formatCurrency(obj.importo_target)}</span>
-                                <span style="font-weight: 600;">${obj.progresso}%</span>
-                            </div>
-                            <div class="progress-bar">
-                                <div class="progress-fill ${completato}" style="width: ${obj.progresso}%"></div>
-                            </div>
+        return `
+            <div class="list-item">
+                <div style="flex: 1;">
+                    <div style="display: flex; align-items: center; margin-bottom: 0.5rem;">
+                        <div class="list-item-icon purple">🎯</div>
+                        <div class="list-item-content">
+                            <div class="list-item-title">${obj.titolo}</div>
+                            <div class="list-item-subtitle">${obj.descrizione || 'Nessuna descrizione'}</div>
                         </div>
                     </div>
-                    <div style="display: flex; gap: 0.5rem;">
-                        <button class="btn-add-funds" data-add-funds="${obj.id}" data-importo-attuale="${obj.importo_attuale}" title="Aggiungi fondi">💰</button>
-                        <button class="btn-delete" data-delete-obiettivo="${obj.id}" title="Elimina obiettivo">🗑️</button>
+                    <div style="margin-left: 64px;">
+                        <div style="display: flex; justify-content: space-between; margin-bottom: 0.5rem; font-size: 0.875rem;">
+                            <span>${formatCurrency(obj.importo_attuale)} di ${formatCurrency(obj.importo_target)}</span>
+                            <span style="font-weight: 600;">${obj.progresso}%</span>
+                        </div>
+                        <div class="progress-bar">
+                            <div class="progress-fill ${completato}" style="width: ${obj.progresso}%"></div>
+                        </div>
+                        <div class="list-item-subtitle" style="margin-top: 0.5rem;">${testoPrevisione(obj.id)}</div>
                     </div>
                 </div>
-            `;
-        }).join('');
-        
-        // Aggiungi event listener
-        document.querySelectorAll('[data-add-funds]').forEach(btn => {
-            btn.addEventListener('click', () => {
-                aggiungiFondi(btn.dataset.addFunds, parseFloat(btn.dataset.importoAttuale));
-            });
-        });
-        
-        document.querySelectorAll('[data-delete-obiettivo]').forEach(btn => {
-            btn.addEventListener('click', () => deleteObiettivo(btn.dataset.deleteObiettivo));
+                <div style="display: flex; gap: 0.5rem;">
+                    ${collegato ? '' : `<button class="btn-add-funds" data-add-funds="${obj.id}" data-importo-attuale="${obj.importo_attuale}" title="Aggiungi fondi">💰</button>`}
+                    <button class="btn-delete" data-delete-obiettivo="${obj.id}" title="Elimina obiettivo">🗑️</button>
+                </div>
+            </div>
+        `;
+    }).join('');
+    
+    // Aggiungi event listener
+    document.querySelectorAll('[data-add-funds]').forEach(btn => {
+        btn.addEventListener('click', () => {
+            aggiungiFondi(btn.dataset.addFunds, parseFloat(btn.dataset.importoAttuale));
         });
-        
-    } catch (error) {
-        console.error('Errore caricamento obiettivi:', error);
-    }
+    });
+    
+    document.querySelectorAll('[data-delete-obiettivo]').forEach(btn => {
+        btn.addEventListener('click', () => deleteObiettivo(btn.dataset.deleteObiettivo));
+    });
 }
 
 async function aggiungiFondi(obiettivoId, importoAttuale) {
@@ -1114,12 +1091,7 @@ async function aggiungiFondi(obiettivoId, importoAttuale) {
         });
         
         if (response.ok) {
-            // Aggiorna la pagina corrente
-            if (currentPage === 'obiettivi') {
-                await loadObiettivi();
-            } else if (currentPage === 'dashboard') {
-                await loadDashboard();
-            }
+            // I dati mostrati si aggiornano con l'evento inviato dal server (vedi applicaEvento)
             
             showNotification(`Aggiunti ${formatCurrency(importo)} all'obiettivo!`);
         } else {
@@ -1153,12 +1125,7 @@ async function addObiettivo(event) {
             closeModal('modal-obiettivo');
             event.target.reset();
             
-            // Aggiorna la pagina corrente
-            if (currentPage === 'obiettivi') {
-                await loadObiettivi();
-            } else if (currentPage === 'dashboard') {
-                await loadDashboard();
-            }
+            // I dati mostrati si aggiornano con l'evento inviato dal server (vedi applicaEvento)
             
             showNotification('Obiettivo creato con successo!');
         }
@@ -1179,12 +1146,7 @@ async function deleteObiettivo(id) {
         });
         
         if (response.ok) {
-            // Aggiorna la pagina corrente
-            if (currentPage === 'obiettivi') {
-                await loadObiettivi();
-            } else if (currentPage === 'dashboard') {
-                await loadDashboard();
-            }
+            // I dati mostrati si aggiornano con l'evento inviato dal server (vedi applicaEvento)
             
             showNotification('Obiettivo eliminato con successo!');
         } else {
@@ -1196,6 +1158,75 @@ async function deleteObiettivo(id) {
     }
 }
 
+// ========================================
+// AGGIORNAMENTI DAL SERVER (EVENTI)
+// ========================================
+
+// Come ogni evento modifica i dati in memoria. Dopo il gestore vengono
+// applicati i saldi dei conti e i totali della dashboard inclusi nell'evento
+const GESTORI_EVENTI = {
+    conto_creato: dati => { contiData.unshift(dati.conto); },
+    conto_eliminato: dati => { contiData = contiData.filter(c => c.id !== dati.id); },
+    transazione_creata: dati => { transazioniData.unshift(dati.transazione); },
+    transazione_eliminata: dati => { transazioniData = transazioniData.filter(t => t.id !== dati.id); },
+    // Le righe importate non sono nell'evento: si rilegge la pagina
+    transazioni_importate: () => caricaPagina(currentPage),
+    investimento_creato: dati => {
+        investimentiData.unshift(dati.investimento);
+        transazioniData.unshift(dati.transazione);
+    },
+    investimento_eliminato: dati => { investimentiData = investimentiData.filter(i => i.id !== dati.id); },
+    // Nuovi prezzi: con troppi investimenti rivalutati le righe non sono nell'evento
+    investimenti_rivalutati: dati => {
+        if (!dati.investimenti) return loadInvestimenti();
+        const rivalutati = new Map(dati.investimenti.map(i => [i.id, i]));
+        investimentiData = investimentiData.map(i => rivalutati.get(i.id) || i);
+    },
+    obiettivo_creato: dati => { obiettiviData.unshift(dati.obiettivo); },
+    obiettivo_aggiornato: dati => {
+        obiettiviData = obiettiviData.map(o => o.id === dati.obiettivo.id ? dati.obiettivo : o);
+    },
+    obiettivo_eliminato: dati => { obiettiviData = obiettiviData.filter(o => o.id !== dati.id); }
+};
+
+function applicaEvento(tipo, dati) {
+    GESTORI_EVENTI[tipo](dati);
+    
+    dati.conti.forEach(({ id, saldo }) => {
+        const conto = contiData.find(c => c.id === id);
+        if (conto) conto.saldo = saldo;
+    });
+    
+    const totalePrecedente = dashboardData && dashboardData.investimenti.totale;
+    dashboardData = dati.dashboard;
+    
+    displayPagina();
+    if (currentPage === 'dashboard' && totalePrecedente !== dati.dashboard.investimenti.totale) {
+        evidenziaInvestimenti(dati.dashboard.investimenti.totale);
+    }
+}
+
+// Apre il flusso /eventi: il browser si riconnette da solo e, con
+// Last-Event-ID, riceve gli eventi persi oppure 'ricarica'
+function collegaEventi() {
+    const sorgente = new EventSource(`${API_BASE}/eventi`);
+    
+    Object.keys(GESTORI_EVENTI).forEach(tipo => {
+        sorgente.addEventListener(tipo, event => applicaEvento(tipo, JSON.parse(event.data)));
+    });
+    
+    // Il server non può garantire che i dati in memoria siano completi
+    sorgente.addEventListener('ricarica', () => caricaPagina(currentPage));
+    
+    // Soglia o limite di un budget superati: solo una notifica
+    sorgente.addEventListener('avviso_budget', event => {
+        const avviso = JSON.parse(event.data);
+        const testo = avviso.livello === 'superato' ? 'superato' : 'vicino al limite';
+        showNotification(`Budget "${avviso.nome}" ${testo}: ${formatCurrency(avviso.speso)} di ${formatCurrency(avviso.limite)}`,
+                         avviso.livello === 'superato' ? 'error' : 'success');
+    });
+}
+
 // ========================================
 // NOTIFICHE
 // ========================================
@@ -1234,6 +1265,9 @@ document.addEventListener('DOMContentLoaded', () => {
     const savedPage = localStorage.getItem('currentPage') || 'dashboard';
     showPage(savedPage);
     
+    // Riceve le modifiche (anche quelle fatte da altri client) senza rileggere le liste
+    collegaEventi();
+    
     // Event listener per la navigazione tra le pagine
     document.querySelectorAll('[data-page]').forEach(item => {
         item.addEventListener('click', () => showPage(item.dataset.page));
@@ -1268,4 +1302,6 @@ document.addEventListener('DOMContentLoaded', () => {
     document.getElementById('form-transazione').addEventListener('submit', addTransazione);
     document.getElementById('form-investimento').addEventListener('submit', addInvestimento);
     document.getElementById('form-obiettivo').addEventListener('submit', addObiettivo);
+    
+    document.getElementById('ricerca-transazioni').addEventListener('input', cercaTransazioni);
 });
\ No newline at end of file